@@ -0,0 +1,241 @@
+"""
+Watchlist target-price alerts for the Portfolio Management System
+
+Watchlist targets are loaded into TriggerIndex, which keeps two sorted
+threshold arrays per asset:
+
+    above   targets over the price at load time; fire when price >= target
+    below   targets under the price at load time; fire when price <= target
+
+A price update finds the targets it crossed with one binary search, so
+checking a tick costs O(log n + hits) however many watchlist rows exist.
+Fired targets leave the index; AlertEngine also suppresses repeats of
+the same alert within dedupe_window, e.g. after a reload.
+
+Alerts are passed in batches to sinks: the GUI, log_sink and SmtpSink.
+The price service (prices.py --alerts) watches every user's targets; the
+GUI watches the logged-in user's.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from email.message import EmailMessage
+
+import queries
+from database import DatabaseConnection
+from fx import money
+
+logger = logging.getLogger('portfolio.alerts')
+
+DEDUPE_WINDOW = 24 * 3600   # Seconds before the same alert may fire again
+
+Alert = namedtuple('Alert',
+                   'watchlist_id user_id asset_id symbol direction target price currency')
+
+
+class _Thresholds:
+    """Sorted targets of one asset and side, with their owners, as flat arrays"""
+
+    __slots__ = ('targets', 'ids', 'users')
+
+    def __init__(self):
+        self.targets = array('d')
+        self.ids = array('q')
+        self.users = array('q')
+
+    def add(self, target, watchlist_id, user_id):
+        pos = bisect_right(self.targets, target)
+        self.targets.insert(pos, target)
+        self.ids.insert(pos, watchlist_id)
+        self.users.insert(pos, user_id)
+
+    def take(self, start, stop):
+        """Remove and return the (target, watchlist_id, user_id) entries in [start, stop)"""
+        taken = list(zip(self.targets[start:stop], self.ids[start:stop],
+                         self.users[start:stop]))
+        del self.targets[start:stop]
+        del self.ids[start:stop]
+        del self.users[start:stop]
+        return taken
+
+    def remove(self, target, watchlist_id):
+        pos = bisect_left(self.targets, target)
+        while pos < len(self.targets) and self.targets[pos] == target:
+            if self.ids[pos] == watchlist_id:
+                self.take(pos, pos + 1)
+                return True
+            pos += 1
+        return False
+
+    def __len__(self):
+        return len(self.targets)
+
+
+class TriggerIndex:
+    """Per-asset sorted above/below target thresholds"""
+
+    def __init__(self):
+        self._above = {}    # asset_id -> _Thresholds
+        self._below = {}
+        self._size = 0
+
+    def add(self, watchlist_id, user_id, asset_id, target, current_price):
+        """Arm a target on the side of the current price it lies on"""
+        target = float(target)
+        if current_price is None or target > float(current_price):
+            sides = self._above
+        elif target < float(current_price):
+            sides = self._below
+        else:
+            return False    # Already at the target: nothing left to cross
+        side = sides.get(asset_id)
+        if side is None:
+            side = sides[asset_id] = _Thresholds()
+        side.add(target, watchlist_id, user_id)
+        self._size += 1
+        return True
+
+    def remove(self, watchlist_id, asset_id, target):
+        target = float(target)
+        for sides in (self._above, self._below):
+            side = sides.get(asset_id)
+            if side is not None and side.remove(target, watchlist_id):
+                self._size -= 1
+                return True
+        return False
+
+    def crossed(self, asset_id, price):
+        """Remove and return (direction, target, watchlist_id, user_id) hit by price"""
+        price = float(price)
+        hits = []
+        above = self._above.get(asset_id)
+        if above is not None:
+            stop = bisect_right(above.targets, price)
+            if stop:
+                hits.extend(('above',) + entry for entry in above.take(0, stop))
+        below = self._below.get(asset_id)
+        if below is not None:
+            start = bisect_left(below.targets, price)
+            if start < len(below):
+                hits.extend(('below',) + entry for entry in below.take(start, len(below)))
+        self._size -= len(hits)
+        return hits
+
+    def clear(self):
+        self._above.clear()
+        self._below.clear()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+
+class AlertEngine:
+    """Check prices against watchlist targets and dispatch alerts to sinks"""
+
+    def __init__(self, dedupe_window=DEDUPE_WINDOW):
+        self.dedupe_window = dedupe_window
+        self.index = TriggerIndex()
+        self.symbols = {}
+        self.currencies = {}    # asset_id -> currency its price is in
+        self._sinks = []
+        self._recent = {}       # (watchlist_id, direction) -> time fired
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        """Call sink(alerts) with each non-empty batch of new alerts"""
+        self._sinks.append(sink)
+
+    def load(self, user_id=None):
+        """(Re)arm every watchlist target, or one user's; returns how many"""
+        symbols = {row['asset_id']: row['asset_symbol']
+                   for row in DatabaseConnection.run_query(queries.ASSET_SYMBOLS)}
+        index = TriggerIndex()
+        currencies = {}
+        # Rows arrive sorted by asset and target, so every insert appends
+        for row in DatabaseConnection.stream(*queries.watchlist_targets(user_id)):
+            index.add(row['watchlist_id'], row['user_id'], row['asset_id'],
+                      row['target_price'], row['current_price'])
+            currencies[row['asset_id']] = row['currency']
+        with self._lock:
+            self.index, self.symbols, self.currencies = index, symbols, currencies
+        return len(index)
+
+    def check(self, asset_id, price):
+        return self.check_prices({asset_id: price})
+
+    def check_prices(self, prices):
+        """Check {asset_id: price}; returns the alerts that fired"""
+        now = time.monotonic()
+        alerts = []
+        with self._lock:
+            if now - self._pruned > 60:
+                self._recent = {key: fired for key, fired in self._recent.items()
+                                if now - fired < self.dedupe_window}
+                self._pruned = now
+            for asset_id, price in prices.items():
+                for direction, target, watchlist_id, user_id in \
+                        self.index.crossed(asset_id, price):
+                    key = (watchlist_id, direction)
+                    fired = self._recent.get(key)
+                    if fired is not None and now - fired < self.dedupe_window:
+                        continue
+                    self._recent[key] = now
+                    alerts.append(Alert(watchlist_id, user_id, asset_id,
+                                        self.symbols.get(asset_id, str(asset_id)),
+                                        direction, target, float(price),
+                                        self.currencies.get(asset_id, 'USD')))
+        if alerts:
+            for sink in self._sinks:
+                try:
+                    sink(alerts)
+                except Exception:
+                    logger.exception("Alert sink %r failed", sink)
+        return alerts
+
+
+def describe(alert):
+    verb = "rose to" if alert.direction == 'above' else "fell to"
+    return (f"{alert.symbol} {verb} {money(alert.price, alert.currency)} "
+            f"(target {money(alert.target, alert.currency)})")
+
+
+def log_sink(alerts):
+    for alert in alerts:
+        logger.info("user %d: %s", alert.user_id, describe(alert))
+
+
+class SmtpSink:
+    """Email alerts through an SMTP server, e.g. a local debugging server:
+
+        python -m aiosmtpd -n -l localhost:1025
+    """
+
+    def __init__(self, host='localhost', port=1025, sender='alerts@portfolio.local'):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def __call__(self, alerts):
+        by_user = {}
+        for alert in alerts:
+            by_user.setdefault(alert.user_id, []).append(alert)
+        users = DatabaseConnection.run_query(*queries.user_contacts(sorted(by_user)))
+
+        # One message per user and batch
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            for user in users:
+                user_alerts = by_user[user['user_id']]
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = user['email']
+                message['Subject'] = f"Watchlist alert: {', '.join(a.symbol for a in user_alerts)}"
+                message.set_content(f"Hello {user['first_name']},\n\n" + "\n".join(
+                    describe(alert) for alert in user_alerts))
+                smtp.send_message(message)
@@ -0,0 +1,328 @@
+"""
+Portfolio risk analytics for the Portfolio Management System
+
+Loads a user's history in bulk (one query per table) and computes risk
+metrics with NumPy array operations:
+
+    - daily returns, net of deposits and withdrawals
+    - annualized return and volatility
+    - Sharpe and Sortino ratios
+    - maximum drawdown
+    - beta against the benchmark asset (snapshots.BENCHMARK)
+    - covariance and correlation of the held assets
+
+Portfolios with a Performance_Metrics history of at least MIN_OBSERVATIONS
+daily returns are measured on it, against the benchmark returns the
+snapshots recorded. The others are measured on the price history of
+their current holdings (migrations/003_asset_price_history.sql), against
+the benchmark's price history; a series shorter than that gets no
+figures at all.
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+import columnar
+import fx
+import queries
+from columnar import DAY
+from database import DatabaseConnection
+from instrumentation import timings
+from snapshots import BENCHMARK
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.0    # Annual, as a fraction
+HISTORY_YEARS = 10
+
+# Daily returns needed before a series is measured: annualizing fewer
+# reports noise (two good days make a 500% annual return)
+MIN_OBSERVATIONS = 20
+
+# Columns of queries.price_history() as columnar.fetch() types
+PRICE_TYPES = {'asset_id': np.int64, 'price_date': DAY, 'close_price': float}
+
+
+def _column(rows, name, dtype=float):
+    """One column of dict rows as an array; NULL becomes NaN"""
+    if dtype is float:
+        values = (np.nan if row[name] is None else row[name] for row in rows)
+    else:
+        values = (row[name] for row in rows)
+    return np.fromiter(values, dtype=dtype, count=len(rows))
+
+
+def _portfolio_currency(row):
+    return row['portfolio_currency']
+
+
+def _converted(amounts, days, currencies, targets):
+    """amounts converted from currencies into targets at the rates of days
+    (ordinals): one series of rates per currency pair, not a lookup per row"""
+    amounts = amounts.copy()
+    for base, quote in set(zip(currencies, targets)):
+        if base == quote:
+            continue
+        rows = (currencies == base) & (targets == quote)
+        first = int(days[rows].min())
+        rates = np.array(fx.RATES.series(base, quote, first, int(days[rows].max()) - first + 1))
+        amounts[rows] *= rates[days[rows] - first]
+    return amounts
+
+
+def load(user_id, since=None):
+    """Fetch everything the analytics need; called on a worker thread.
+
+    The long histories are fetched as columns (columnar.py), never as
+    rows of Python objects.
+    """
+    if since is None:
+        since = date.today() - timedelta(days=365 * HISTORY_YEARS)
+
+    performance = columnar.fetch(queries.PERFORMANCE_HISTORY, (user_id, since), report=True,
+                                 types={'portfolio_id': np.int64, 'metric_date': DAY,
+                                        'total_value': float, 'benchmark_return': float})
+    # Snapshots are in the portfolio's currency; flows and holdings come
+    # in their assets' currencies
+    flows = columnar.fetch(queries.TRANSACTION_FLOWS, (user_id, since), report=True,
+                           types={'portfolio_id': np.int64, 'flow_date': DAY,
+                                  'currency': object, 'portfolio_currency': object,
+                                  'net_flow': float})
+    holdings = fx.RATES.convert(DatabaseConnection.run_report(queries.USER_HOLDINGS, (user_id,)),
+                                ['market_value'], _portfolio_currency)
+
+    asset_ids = sorted({row['asset_id'] for row in holdings})
+    prices = (columnar.fetch(*queries.price_history(asset_ids, since), types=PRICE_TYPES,
+                             report=True)
+              if asset_ids else columnar.empty(PRICE_TYPES))
+    benchmark = columnar.fetch(queries.BENCHMARK_HISTORY, (BENCHMARK, since, date.today()),
+                               types={'price_date': DAY, 'close_price': float}, report=True)
+
+    return {
+        'performance': {
+            'portfolio_id': performance['portfolio_id'],
+            'day': performance['metric_date'],
+            'value': performance['total_value'],
+            'benchmark': performance['benchmark_return'] / 100
+        },
+        'flows': {
+            'portfolio_id': flows['portfolio_id'],
+            'day': flows['flow_date'],
+            'amount': _converted(flows['net_flow'], flows['flow_date'], flows['currency'],
+                                 flows['portfolio_currency'])
+        },
+        'holdings': {
+            'portfolio_id': _column(holdings, 'portfolio_id', np.int64),
+            'asset_id': _column(holdings, 'asset_id', np.int64),
+            'symbol': {row['asset_id']: row['asset_symbol'] for row in holdings},
+            'value': _column(holdings, 'market_value')
+        },
+        'prices': {
+            'asset_id': prices['asset_id'],
+            'day': prices['price_date'],
+            'close': prices['close_price']
+        },
+        'benchmark': {
+            'day': benchmark['price_date'],
+            'close': benchmark['close_price']
+        }
+    }
+
+
+# Building blocks
+
+def forward_fill(matrix):
+    """Carry the last known value down each column over NaN gaps"""
+    rows = np.arange(matrix.shape[0])[:, None]
+    last = np.where(np.isnan(matrix), 0, rows)
+    np.maximum.accumulate(last, axis=0, out=last)
+    return matrix[last, np.arange(matrix.shape[1])]
+
+
+def price_matrix(asset_ids, days, closes):
+    """Pivot (asset, day, close) rows into a days x assets matrix of closes"""
+    assets, asset_index = np.unique(asset_ids, return_inverse=True)
+    all_days, day_index = np.unique(days, return_inverse=True)
+    matrix = np.full((len(all_days), len(assets)), np.nan)
+    matrix[day_index, asset_index] = closes
+    return assets, all_days, forward_fill(matrix)
+
+
+def flow_adjusted_returns(values, days, flow_days, flow_amounts):
+    """Daily returns of a value series, net of the money added or withdrawn.
+
+    A flow counts towards the first valuation on or after its date.
+    """
+    flows = np.zeros(len(values))
+    slot = np.searchsorted(days, flow_days, side='left')
+    inside = slot < len(values)
+    np.add.at(flows, slot[inside], flow_amounts[inside])
+
+    previous = values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (values[1:] - previous - flows[1:]) / previous
+    returns[~(previous > 0)] = np.nan
+    return returns
+
+
+def benchmark_returns(days, closes, on_days):
+    """Daily returns over on_days (sorted) of a series of closes on days,
+    its last close carried over the days it has none"""
+    if not len(days):
+        return np.full(max(len(on_days) - 1, 0), np.nan)
+    slot = np.searchsorted(days, on_days, side='right') - 1
+    values = np.where(slot >= 0, closes[np.maximum(slot, 0)], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values[1:] / values[:-1] - 1.0
+
+
+def covariance(returns):
+    """Annualized covariance of the columns of returns, pairwise over shared days"""
+    present = ~np.isnan(returns)
+    x = np.where(present, returns, 0.0)
+    m = present.astype(float)
+    n = m.T @ m
+    # s[i, j]: sum of asset i's returns over the days asset j also has one
+    s = x.T @ m
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (x.T @ x - s * s.T / n) / (n - 1)
+    cov[n < 2] = np.nan
+    return cov * TRADING_DAYS
+
+
+def correlation(cov):
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / np.outer(std, std)
+
+
+def risk_metrics(returns, benchmark=None, risk_free_rate=RISK_FREE_RATE):
+    """Summary statistics of a daily return series (NaN days are skipped);
+    all None with fewer than MIN_OBSERVATIONS returns"""
+    keep = ~np.isnan(returns)
+    r = returns[keep]
+    metrics = {'observations': len(r), 'annual_return': None, 'volatility': None,
+               'sharpe': None, 'sortino': None, 'max_drawdown': None, 'beta': None}
+    if len(r) < MIN_OBSERVATIONS:
+        return metrics
+
+    rf = risk_free_rate / TRADING_DAYS
+    excess = r - rf
+    std = r.std(ddof=1)
+    downside = np.sqrt(np.mean(np.minimum(excess, 0.0) ** 2))
+    growth = np.cumprod(1.0 + r)
+    drawdown = growth / np.maximum.accumulate(growth) - 1.0
+
+    metrics['annual_return'] = float(growth[-1] ** (TRADING_DAYS / len(r)) - 1.0)
+    metrics['volatility'] = float(std * np.sqrt(TRADING_DAYS))
+    if std > 0:
+        metrics['sharpe'] = float(excess.mean() / std * np.sqrt(TRADING_DAYS))
+    if downside > 0:
+        metrics['sortino'] = float(excess.mean() / downside * np.sqrt(TRADING_DAYS))
+    metrics['max_drawdown'] = float(drawdown.min())
+
+    if benchmark is not None:
+        b = benchmark[keep]
+        both = ~np.isnan(b)
+        if both.sum() >= MIN_OBSERVATIONS:
+            var = b[both].var(ddof=1)
+            if var > 0:
+                metrics['beta'] = float(np.cov(r[both], b[both])[0, 1] / var)
+    return metrics
+
+
+# Putting it together
+
+def _segments(ids):
+    """(id, start, stop) for each run of equal values in a sorted id array"""
+    if not len(ids):
+        return []
+    starts = np.flatnonzero(np.diff(ids)) + 1
+    bounds = np.concatenate(([0], starts, [len(ids)]))
+    return [(int(ids[a]), a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def analyze(data, risk_free_rate=RISK_FREE_RATE):
+    """Risk metrics per portfolio plus the covariance of all held assets"""
+    perf, flows, holdings, prices = (data['performance'], data['flows'],
+                                     data['holdings'], data['prices'])
+
+    assets, days, closes = price_matrix(prices['asset_id'], prices['day'], prices['close'])
+    asset_returns = closes[1:] / closes[:-1] - 1.0
+    benchmark = benchmark_returns(data['benchmark']['day'], data['benchmark']['close'], days)
+    cov = covariance(asset_returns)
+
+    results = {}
+    history = {pid: (a, b) for pid, a, b in _segments(perf['portfolio_id'])}
+    order = np.argsort(holdings['portfolio_id'], kind='stable')
+    held = {pid: order[a:b] for pid, a, b in _segments(holdings['portfolio_id'][order])}
+
+    for pid in sorted(set(history) | set(held)):
+        # Current weights of the holdings that have a price history
+        weights, columns = None, None
+        if pid in held:
+            rows = held[pid]
+            columns = np.searchsorted(assets, holdings['asset_id'][rows])
+            known = columns < len(assets)
+            known[known] = assets[columns[known]] == holdings['asset_id'][rows][known]
+            columns = columns[known]
+            values = np.nan_to_num(holdings['value'][rows][known])
+            if values.sum() > 0:
+                weights = values / values.sum()
+
+        recorded, measured = None, 0
+        if pid in history:
+            a, b = history[pid]
+            in_portfolio = flows['portfolio_id'] == pid
+            recorded = flow_adjusted_returns(perf['value'][a:b], perf['day'][a:b],
+                                             flows['day'][in_portfolio],
+                                             flows['amount'][in_portfolio])
+            measured = int((~np.isnan(recorded)).sum())
+
+        if recorded is not None and measured >= MIN_OBSERVATIONS:
+            metrics = risk_metrics(recorded, perf['benchmark'][a + 1:b], risk_free_rate)
+            metrics['source'] = 'history'
+        elif weights is not None and len(asset_returns):
+            # Too short a recorded history: replay today's weights over past prices
+            returns = np.nan_to_num(asset_returns[:, columns]) @ weights
+            metrics = risk_metrics(returns, benchmark, risk_free_rate)
+            metrics['source'] = 'holdings'
+        elif recorded is not None:
+            metrics = risk_metrics(recorded, perf['benchmark'][a + 1:b], risk_free_rate)
+            metrics['source'] = 'history'
+        else:
+            metrics = risk_metrics(np.empty(0))
+            metrics['source'] = None
+
+        metrics['ex_ante_volatility'] = None
+        if weights is not None:
+            sub = np.nan_to_num(cov[np.ix_(columns, columns)])
+            metrics['ex_ante_volatility'] = float(np.sqrt(max(weights @ sub @ weights, 0.0)))
+        results[pid] = metrics
+
+    return {
+        'portfolios': results,
+        'assets': [holdings['symbol'][int(a)] for a in assets],
+        'covariance': cov,
+        'correlation': correlation(cov)
+    }
+
+
+def top_correlations(report, count=3):
+    """The most correlated pairs of held assets as (symbol, symbol, rho)"""
+    corr = report['correlation']
+    i, j = np.triu_indices(len(corr), k=1)
+    rho = corr[i, j]
+    valid = ~np.isnan(rho)
+    i, j, rho = i[valid], j[valid], rho[valid]
+    best = np.argsort(-rho)[:count]
+    symbols = report['assets']
+    return [(symbols[i[k]], symbols[j[k]], float(rho[k])) for k in best]
+
+
+def portfolio_risk(user_id):
+    """Load and analyze a user's portfolios; called on a worker thread"""
+    with timings.measure('analytics', 'load'):
+        data = load(user_id)
+    with timings.measure('analytics', 'analyze'):
+        return analyze(data)
@@ -0,0 +1,498 @@
+"""
+Storage backends for the Portfolio Management System
+
+DatabaseConnection (database.py) runs every query through a backend,
+chosen by STORAGE_CONFIG or the PORTFOLIO_DB environment variable:
+
+    mysql           the MySQL server of DB_CONFIG (default)
+    sqlite:PATH     an embedded SQLite database file in WAL mode, created
+                    from schema_sqlite.sql on first use and upgraded when
+                    an older release made it; for running the
+                    application offline, without a MySQL server
+
+The application's SQL is written for MySQL. The SQLite backend accepts
+it unchanged: each statement is translated on the fly (placeholders,
+FULLTEXT search, ON DUPLICATE KEY UPDATE, LIKE escapes, FOR UPDATE), result values
+come back as MySQL returns them (Decimal, date, datetime) and SQLite
+errors are raised as the matching mysql.connector errors, so callers
+cannot tell the backends apart.
+
+DuckDBAnalytics optionally runs the report aggregations in DuckDB, a
+columnar engine, reading the same database through DuckDB's sqlite or
+mysql extension; see DatabaseConnection.run_report.
+"""
+
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+import mysql.connector
+from mysql.connector import errors
+
+logger = logging.getLogger('portfolio.backends')
+
+SQLITE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_sqlite.sql')
+
+# The last migration in schema_sqlite.sql, kept in PRAGMA user_version
+SQLITE_SCHEMA_VERSION = 11
+
+# Files created before schema_sqlite.sql set user_version have migrations
+# 001-005 (and possibly later tables, which upgrading leaves alone)
+SQLITE_UNVERSIONED = 5
+
+# What brings a SQLite file up to each migration: tables whose columns
+# changed, rebuilt to their definition in schema_sqlite.sql (SQLite cannot
+# add a column defaulting to CURRENT_TIMESTAMP), then statements. New
+# tables, indexes, triggers and views come from rerunning the script.
+SQLITE_UPGRADES = {
+    6: (['Portfolios', 'Portfolio_Holdings', 'Performance_Metrics', 'Watchlist'], []),
+    9: (['Assets', 'Portfolios'], ["DROP VIEW IF EXISTS v_user_portfolios"]),
+    11: ([], ["DROP INDEX IF EXISTS idx_user_id"]),
+}
+
+# FULLTEXT columns and the FTS5 table indexing each in schema_sqlite.sql
+SQLITE_FULLTEXT = {'asset_name': 'Assets_fts'}
+
+# Parameters are stored the way MySQL prints them
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+
+
+def _sqlite_date(text):
+    # As a MySQL DATE column would hold it, whatever time was stored
+    try:
+        return date.fromisoformat(text[:10].decode())
+    except ValueError:
+        return text.decode()
+
+
+def _sqlite_datetime(text):
+    try:
+        return datetime.fromisoformat(text.decode())
+    except ValueError:
+        return text.decode()
+
+
+class _Untyped(str):
+    """Text of a result column with no declared type, e.g. MAX(metric_date)"""
+    __slots__ = ()
+
+
+def _untyped_text(text):
+    return _Untyped(text, 'utf-8')
+
+
+# Values come back by the declared type of their column (detect_types):
+# DECIMAL columns hold integers as INTEGER, dates and timestamps are
+# text, and text declared as text is kept as it is
+sqlite3.register_converter('DECIMAL', lambda text: Decimal(text.decode()))
+sqlite3.register_converter('DATE', _sqlite_date)
+sqlite3.register_converter('DATETIME', _sqlite_datetime)
+sqlite3.register_converter('TIMESTAMP', _sqlite_datetime)
+for _type in ('TEXT', 'VARCHAR', 'CHAR'):
+    sqlite3.register_converter(_type, bytes.decode)
+
+
+def open_backend(spec, mysql_config):
+    """Backend for 'mysql' (connecting with mysql_config) or 'sqlite:PATH'"""
+    if spec == 'mysql':
+        return MySQLBackend(mysql_config)
+    if spec.startswith('sqlite:') and spec[len('sqlite:'):]:
+        return SQLiteBackend(os.path.expanduser(spec[len('sqlite:'):]))
+    raise ValueError(f"Unknown database {spec!r}: use mysql or sqlite:PATH")
+
+
+class MySQLBackend:
+    """A MySQL server, through mysql.connector"""
+
+    name = 'mysql'
+    explain = 'EXPLAIN '
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self):
+        conn = mysql.connector.connect(**self.config)
+        # Each query runs in its own transaction; without autocommit a reused
+        # connection would keep reading from the snapshot of its first SELECT
+        conn.autocommit = True
+        return conn
+
+    def duckdb_source(self):
+        """(connection string, type) for DuckDB's ATTACH"""
+        keys = ('host', 'port', 'user', 'password', 'database')
+        return ' '.join(f"{key}={self.config[key]}" for key in keys if key in self.config), 'mysql'
+
+    def __str__(self):
+        return f"MySQL {self.config.get('database')} on {self.config.get('host')}"
+
+
+class SQLiteBackend:
+    """An embedded SQLite database file, in WAL mode"""
+
+    name = 'sqlite'
+    explain = 'EXPLAIN QUERY PLAN '
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout      # Seconds a writer waits for the write lock
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with _sqlite_errors():
+            raw = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                  check_same_thread=False,
+                                  detect_types=sqlite3.PARSE_DECLTYPES)
+            raw.text_factory = _untyped_text
+            # WAL lets readers run alongside the one writer
+            raw.execute("PRAGMA journal_mode = WAL")
+            raw.execute("PRAGMA synchronous = NORMAL")
+            raw.execute("PRAGMA foreign_keys = ON")
+            with self._lock:
+                if not self._ready:
+                    self._create_schema(raw)
+                    self._ready = True
+        return SQLiteConnection(raw)
+
+    @staticmethod
+    def _create_schema(raw):
+        """Create the schema in a new file, or upgrade an older one"""
+        version = raw.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SQLITE_SCHEMA_VERSION:
+            return
+        with open(SQLITE_SCHEMA, encoding='utf-8') as f:
+            script = f.read()
+        exists = raw.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                             "AND name = 'Users'").fetchone()
+        if exists:
+            version = version or SQLITE_UNVERSIONED
+            logger.info("Upgrading %s from schema version %d to %d",
+                        SQLITE_SCHEMA, version, SQLITE_SCHEMA_VERSION)
+            _upgrade_schema(raw, script, version)
+        else:
+            logger.info("Creating the schema from %s", SQLITE_SCHEMA)
+        # Creates whatever is missing and sets user_version
+        raw.executescript(script)
+
+    def duckdb_source(self):
+        return self.path, 'sqlite'
+
+    def __str__(self):
+        return f"SQLite {self.path}"
+
+
+def _upgrade_schema(raw, script, version):
+    """Apply SQLITE_UPGRADES after version in one transaction; views and
+    triggers are dropped, for the script to create again"""
+    steps = [SQLITE_UPGRADES[step] for step in sorted(SQLITE_UPGRADES) if step > version]
+    tables = list(dict.fromkeys(table for rebuilt, _ in steps for table in rebuilt))
+    # Off outside a transaction only: tables referenced by others are rebuilt
+    raw.execute("PRAGMA foreign_keys = OFF")
+    try:
+        raw.execute("BEGIN IMMEDIATE")
+        try:
+            for kind, name in raw.execute("SELECT type, name FROM sqlite_master "
+                                          "WHERE type IN ('view', 'trigger')").fetchall():
+                raw.execute(f"DROP {kind.upper()} {name}")
+            for table in tables:
+                _rebuild_table(raw, script, table)
+            for _, statements in steps:
+                for statement in statements:
+                    raw.execute(statement)
+            if raw.execute("PRAGMA foreign_key_check").fetchone():
+                raise sqlite3.IntegrityError("foreign key violations after upgrading")
+            raw.execute("COMMIT")
+        except BaseException:
+            raw.execute("ROLLBACK")
+            raise
+    finally:
+        raw.execute("PRAGMA foreign_keys = ON")
+
+
+def _rebuild_table(raw, script, table):
+    """Recreate table as schema_sqlite.sql defines it, keeping its rows"""
+    definition = re.search(rf'CREATE TABLE IF NOT EXISTS {table} (\(.*?\n\)[^;]*);',
+                           script, re.S)
+    raw.execute(f"CREATE TABLE {table}_upgrade {definition.group(1)}")
+    old = {row[1] for row in raw.execute(f"PRAGMA table_info({table})")}
+    columns, values = [], []
+    for _, name, _, notnull, default, _ in raw.execute(f"PRAGMA table_info({table}_upgrade)"):
+        if name in old:
+            columns.append(name)
+            # A column now NOT NULL takes its default where it was NULL
+            values.append(f"COALESCE({name}, {default})" if notnull and default else name)
+    raw.execute(f"INSERT INTO {table}_upgrade ({', '.join(columns)}) "
+                f"SELECT {', '.join(values)} FROM {table}")
+    raw.execute(f"DROP TABLE {table}")
+    raw.execute(f"ALTER TABLE {table}_upgrade RENAME TO {table}")
+
+
+# SQLite connections with the mysql.connector interface the pool uses
+
+class SQLiteConnection:
+    """A sqlite3 connection in autocommit mode; see start_transaction"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.autocommit = True      # Statements outside start_transaction() commit at once
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def cursor(self, dictionary=False, buffered=True):
+        return SQLiteCursor(self._raw.cursor(), dictionary)
+
+    def start_transaction(self):
+        # Take the write lock up front: a deferred transaction that reads
+        # first could fail to upgrade when another connection writes
+        with _sqlite_errors():
+            self._raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        with _sqlite_errors():
+            if self._raw.in_transaction:
+                self._raw.execute("COMMIT")
+
+    def rollback(self):
+        with _sqlite_errors():
+            if self._raw.in_transaction:
+                self._raw.execute("ROLLBACK")
+
+    def ping(self, reconnect=False):
+        with _sqlite_errors():
+            self._raw.execute("SELECT 1")
+
+    def close(self):
+        with _sqlite_errors():
+            self._raw.close()
+
+
+class SQLiteCursor:
+    """Translates each statement and returns MySQL-typed rows"""
+
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+        self._columns = None
+        self._lastrowid = None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid if self._lastrowid is None else self._lastrowid
+
+    @property
+    def column_names(self):
+        return tuple(self._columns or ())
+
+    def execute(self, query, params=()):
+        query, convert = translate(query)
+        self._lastrowid = None
+        with _sqlite_errors():
+            self._cursor.execute(query, convert(params or ()))
+        self._columns = ([column[0] for column in self._cursor.description]
+                         if self._cursor.description else None)
+
+    def executemany(self, query, seq_params):
+        query, convert = translate(query)
+        self._lastrowid = None
+        with _sqlite_errors():
+            self._cursor.executemany(query, (convert(params) for params in seq_params))
+            if _INSERT.match(query) and self._cursor.rowcount > 0:
+                # As mysql.connector after a multi-row INSERT: the first new
+                # id. Inside a transaction no other writer gets ids in between
+                last = self._cursor.connection.execute("SELECT last_insert_rowid()").fetchone()[0]
+                self._lastrowid = last - self._cursor.rowcount + 1
+
+    def fetchone(self):
+        with _sqlite_errors():
+            row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchmany(self, size=1):
+        with _sqlite_errors():
+            return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        with _sqlite_errors():
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def _row(self, row):
+        values = [mysql_value(value) for value in row]
+        return dict(zip(self._columns, values)) if self._dictionary else tuple(values)
+
+    def close(self):
+        self._cursor.close()
+
+
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}\Z')
+_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?\Z')
+
+
+def mysql_value(value):
+    """A SQLite value as mysql.connector would return the same column.
+
+    The schema has no FLOAT columns, so every float is a DECIMAL. Dates
+    and timestamps are stored as ISO text, converted by the declared type
+    of their column; text computed by an expression has no declared type
+    (MySQL types it by the expression), so it becomes a date or datetime
+    only if it is exactly one.
+    """
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    if type(value) is _Untyped:
+        if _DATE.match(value):
+            return date.fromisoformat(value)
+        if _DATETIME.match(value):
+            return datetime.fromisoformat(value)
+        return str(value)
+    return value
+
+
+# SQLite errors as the mysql.connector errors callers already handle
+_LOST = ('database is locked', 'unable to open', 'disk i/o', 'readonly', 'closed')
+
+
+@contextmanager
+def _sqlite_errors():
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        raise errors.IntegrityError(msg=str(e)) from e
+    except sqlite3.DataError as e:
+        raise errors.DataError(msg=str(e)) from e
+    except sqlite3.OperationalError as e:
+        # SQLite also reports bad SQL as OperationalError
+        message = str(e)
+        if any(text in message.lower() for text in _LOST):
+            raise errors.OperationalError(msg=message) from e
+        raise errors.ProgrammingError(msg=message) from e
+    except sqlite3.ProgrammingError as e:
+        raise errors.ProgrammingError(msg=str(e)) from e
+    except sqlite3.Error as e:
+        raise errors.DatabaseError(msg=str(e)) from e
+
+
+# MySQL to SQLite translation
+
+_TOKENS = re.compile(r"'(?:[^'\\]|\\.|'')*'|%s|%%")
+_MATCH = re.compile(r'MATCH\s*\((\w+)\)\s*AGAINST\s*\(\s*%s\s+IN\s+BOOLEAN\s+MODE\s*\)',
+                    re.IGNORECASE)
+_LIKE = re.compile(r'\bLIKE\s+\?', re.IGNORECASE)
+_UPSERT = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE)
+_UPSERT_VALUE = re.compile(r'\bVALUES\s*\(\s*(\w+)\s*\)', re.IGNORECASE)
+_INSERT_IGNORE = re.compile(r'^\s*INSERT\s+IGNORE\b', re.IGNORECASE)
+_INSERT = re.compile(r'\s*INSERT\b', re.IGNORECASE)
+# SQLite has no row locks: BEGIN IMMEDIATE already holds the write lock
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*\Z', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def translate(query):
+    """(SQLite query, function converting its parameters) for a MySQL query"""
+    fulltext = []       # Indexes of the parameters holding boolean-mode searches
+
+    def match(m):
+        fulltext.append(query[:m.start()].count('%s'))
+        table = SQLITE_FULLTEXT[m.group(1).lower()]
+        return f"rowid IN (SELECT rowid FROM {table} WHERE {table} MATCH %s)"
+
+    query = placeholders(_MATCH.sub(match, query))
+    # MySQL escapes LIKE patterns with a backslash by default, SQLite only if told
+    query = _LIKE.sub(r"LIKE ? ESCAPE '\\'", query)
+    query = _INSERT_IGNORE.sub('INSERT OR IGNORE', query)
+    query = _FOR_UPDATE.sub('', query)
+    upsert = _UPSERT.search(query)
+    if upsert:
+        tail = _UPSERT_VALUE.sub(r'excluded.\1', query[upsert.end():])
+        query = query[:upsert.start()] + 'ON CONFLICT DO UPDATE SET' + tail
+
+    if not fulltext:
+        return query, tuple
+
+    def convert(params):
+        params = list(params)
+        for index in fulltext:
+            params[index] = fts_query(params[index])
+        return params
+    return query, convert
+
+
+def placeholders(query):
+    """query with qmark placeholders instead of mysql.connector's %s"""
+    return _TOKENS.sub(lambda m: {'%s': '?', '%%': '%'}.get(m.group(0), m.group(0)), query)
+
+
+def fts_query(boolean):
+    """A MySQL boolean-mode search ('+word* +other') as an FTS5 query"""
+    terms = []
+    for word in boolean.split():
+        prefix = word.endswith('*')
+        word = word.strip('+*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' AND '.join(terms) or '""'
+
+
+# Reports on DuckDB
+
+class DuckDBAnalytics:
+    """Runs read-only report queries in DuckDB over the backend's database.
+
+    DuckDB attaches the SQLite file or MySQL server through its sqlite or
+    mysql extension and reads the live tables, so there is nothing to keep
+    in sync. Raises ImportError without DuckDB and duckdb.Error when the
+    database cannot be attached (e.g. the extension is not installed).
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, backend):
+        import duckdb
+        self.error = duckdb.Error
+        source, kind = backend.duckdb_source()
+        self._conn = duckdb.connect()
+        self._conn.execute(f"ATTACH '{source.replace(chr(39), chr(39) * 2)}' "
+                           f"AS portfolio (TYPE {kind}, READ_ONLY)")
+        self._local = threading.local()
+
+    def _cursor(self):
+        # A DuckDB connection is used by one thread at a time
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self._conn.cursor()
+            cursor.execute("USE portfolio")
+        return cursor
+
+    def run(self, query, params=None):
+        cursor = self._cursor()
+        cursor.execute(placeholders(query), list(params or ()))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, [mysql_value(value) for value in row]))
+                for row in cursor.fetchall()]
+
+    def chunks(self, query, params=None, size=1000):
+        """The rows of run() size at a time, as (column names, tuples)"""
+        cursor = self._cursor()
+        cursor.execute(placeholders(query), list(params or ()))
+        columns = tuple(column[0] for column in cursor.description)
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield columns, [tuple(mysql_value(value) for value in row) for row in rows]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,264 @@
+"""
+Query benchmarks for the Portfolio Management System
+
+Times every query path the application runs, with parameters drawn at
+random (but reproducibly) from the data in the database, typically made
+by datagen.py:
+
+    python datagen.py --rows 1M --db sqlite:bench.db
+    python bench.py --db sqlite:bench.db --output before.json
+    ...
+    python bench.py --db sqlite:bench.db --compare before.json
+
+Each path is run `warmup` times untimed, then `iterations` times.
+Results (latency percentiles in milliseconds, rows returned and round
+trips to the database per run) are written as JSON together with the row counts they were measured at, and
+--compare prints each path's p50 and p95 against an earlier run. The
+query cache is not used, so every call reaches the database; the report
+paths (performance, asset_count) run on the analytics engine when one is
+available, as in the application.
+"""
+
+import argparse
+import json
+import platform
+import random
+import re
+import time
+from datetime import date, datetime, timedelta
+
+import queries
+from database import DatabaseConnection
+from datagen import DEFAULT_SEED, HISTORY_DAYS, row_counts
+from search import AssetSearchIndex
+
+ITERATIONS = 200
+WARMUP = 20
+SEARCH_TERMS = ['a', 'ab', 'bank', 'corp', 'energy', 'fund', 'glo', 'pharma', 'solar',
+                'zen', 'ti', 'xyz']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Bench:
+    """The query paths, run through DatabaseConnection without the cache"""
+
+    def __init__(self, seed=DEFAULT_SEED):
+        self.round_trips = 0
+        self.query = self._counted(DatabaseConnection.run_query)
+        self.report = self._counted(DatabaseConnection.run_report)
+        self.rng = random.Random(seed)
+        self.users = self.query(
+            "SELECT user_id, email FROM Users WHERE status = 'active' ORDER BY user_id")
+        if not self.users:
+            raise SystemExit("No active users: fill the database with datagen.py first")
+        self.portfolios = {}
+        for row in self.query("SELECT portfolio_id, user_id FROM Portfolios"):
+            self.portfolios.setdefault(row['user_id'], []).append(row['portfolio_id'])
+        self.index = AssetSearchIndex(self.query(queries.ASSET_CATALOG))
+
+    def _counted(self, run):
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return run(*args, **kwargs)
+        return counted
+
+    def paths(self):
+        """name -> function running the path once and returning its row count"""
+        return {
+            'login': self.login,
+            'user_portfolios': self.user_portfolios,
+            'portfolio_choices': self.portfolio_choices,
+            'holdings': self.holdings,
+            'transactions_first_page': self.transactions_first_page,
+            'transactions_deep_page': self.transactions_deep_page,
+            'asset_catalog': self.asset_catalog,
+            'asset_search_index': self.asset_search_index,
+            'asset_search_sql': self.asset_search_sql,
+            'performance': self.performance,
+            'asset_count': self.asset_count,
+            'dashboard': self.dashboard,
+            'dashboard_separate': self.dashboard_separate,
+            'watchlist': self.watchlist
+        }
+
+    def _user(self):
+        return self.rng.choice(self.users)
+
+    def _portfolio_ids(self, user_id):
+        return self.portfolios.get(user_id, [])
+
+    def login(self):
+        return len(self.query(queries.LOGIN, (self._user()['email'],)))
+
+    def user_portfolios(self):
+        return len(self.query(queries.USER_PORTFOLIOS, (self._user()['user_id'],)))
+
+    def portfolio_choices(self):
+        # Also the reports tab's portfolio count
+        return len(self.query(queries.PORTFOLIO_CHOICES, (self._user()['user_id'],)))
+
+    def holdings(self):
+        portfolio_ids = self._portfolio_ids(self._user()['user_id']) or [0]
+        return len(self.query(queries.PORTFOLIO_HOLDINGS,
+                                     (self.rng.choice(portfolio_ids),)))
+
+    def transactions_first_page(self):
+        return len(self._transaction_page(self._user()['user_id']))
+
+    def transactions_deep_page(self):
+        # A page starting at a random point of the history, as reached by
+        # paging down; keyset paging should make it cost what the first does
+        moment = datetime.now() - timedelta(days=self.rng.uniform(0, HISTORY_DAYS))
+        return len(self._transaction_page(self._user()['user_id'],
+                                          (moment.replace(microsecond=0), 2 ** 62)))
+
+    def _transaction_page(self, user_id, after=None):
+        query, params = queries.transaction_page(self._portfolio_ids(user_id), after=after)
+        return self.query(query, params) if query else []
+
+    def asset_catalog(self):
+        """Loading the catalog and building the search index over it"""
+        rows = self.query(queries.ASSET_CATALOG)
+        AssetSearchIndex(rows)
+        return len(rows)
+
+    def asset_search_index(self):
+        return len(self.index.search(self.rng.choice(SEARCH_TERMS)))
+
+    def asset_search_sql(self):
+        return len(self.query(*queries.asset_search(self.rng.choice(SEARCH_TERMS))))
+
+    def performance(self):
+        return len(self.report(queries.PORTFOLIO_PERFORMANCE, (self._user()['user_id'],)))
+
+    def asset_count(self):
+        return self.report(queries.ASSET_COUNT, (self._user()['user_id'],))[0]['count']
+
+    def dashboard(self):
+        """What the portfolios, holdings and reports tabs need after a login"""
+        return len(self.query(queries.DASHBOARD, (self._user()['user_id'], date.today())))
+
+    def dashboard_separate(self):
+        """The same from the queries it replaced, one round trip each"""
+        user_id = self._user()['user_id']
+        rows = len(self.query(queries.USER_PORTFOLIOS, (user_id,)))
+        self.query(queries.PORTFOLIO_CHOICES, (user_id,))
+        self.report(queries.PORTFOLIO_PERFORMANCE, (user_id,))
+        self.report(queries.ASSET_COUNT, (user_id,))
+        return rows
+
+    def watchlist(self):
+        return len(self.query(queries.WATCHLIST, (self._user()['user_id'],)))
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies, rows = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        rows += fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'min_ms': latencies[0],
+        'max_ms': latencies[-1],
+        'mean_rows': rows / iterations
+    }
+
+
+def run(iterations=ITERATIONS, warmup=WARMUP, seed=DEFAULT_SEED, only=None):
+    bench = Bench(seed)
+    analytics = DatabaseConnection.get_analytics()
+    results = {}
+    for name, fn in bench.paths().items():
+        if only and not any(re.search(pattern, name) for pattern in only):
+            continue
+        # The catalog is reloaded whole each time: fewer rounds
+        count = max(3, iterations // 20) if name == 'asset_catalog' else iterations
+        warm = min(warmup, count)
+        before = bench.round_trips
+        results[name] = measure(fn, count, warm)
+        results[name]['round_trips'] = (bench.round_trips - before) / (count + warm)
+    return {
+        'meta': {
+            'backend': DatabaseConnection.get_backend().name,
+            'analytics': analytics.name if analytics else None,
+            'seed': seed,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'rows': row_counts()
+        },
+        'results': results
+    }
+
+
+def report(result, baseline=None):
+    rows = result['meta']['rows']
+    engine = result['meta']['analytics']
+    print(f"{result['meta']['backend']}{f' + {engine}' if engine else ''}, "
+          f"{sum(rows.values()):,} rows "
+          f"({rows['Transactions']:,} transactions)")
+    header = (f"{'path':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'rows':>8}"
+              f"{'trips':>7}")
+    if baseline:
+        header += f"{'p50 x':>8}{'p95 x':>8}"
+    print(header)
+    for name, r in result['results'].items():
+        line = (f"{name:<26}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                f"{r['max_ms']:>9.2f}{r['mean_rows']:>8.0f}{r.get('round_trips', 0):>7.0f}")
+        before = (baseline or {}).get('results', {}).get(name)
+        if before:
+            line += f"{_ratio(r['p50_ms'], before['p50_ms']):>8}"
+            line += f"{_ratio(r['p95_ms'], before['p95_ms']):>8}"
+        print(line)
+
+
+def _ratio(now, before):
+    """now relative to before: below 1.00 is faster"""
+    return f"{now / before:.2f}" if before else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the portfolio query paths")
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--only', action='append',
+                        help="Run only paths matching this regex (repeatable)")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Earlier results (JSON) to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    DatabaseConnection.configure(args.db)
+    try:
+        result = run(args.iterations, args.warmup, args.seed, args.only)
+    finally:
+        DatabaseConnection.close_pool()
+
+    report(result, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Client-side query result cache for the Portfolio Management System
+
+QueryCache sits in front of DatabaseConnection.run_query for reference
+data that several tabs read: the asset catalog, portfolio lists and
+account counts. Entries expire after a TTL, the least recently used
+entries are evicted beyond an entry count or memory cap, and any write
+through run_query drops every entry that reads a table it touched.
+
+A result read while a write invalidated one of its tables may predate
+the write, so it is not stored: callers take generation() before running
+the query and hand it to put().
+"""
+
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# TTLs (seconds) used by callers
+REFERENCE_TTL = 300     # Assets, Asset_Categories: shared by every user
+ACCOUNT_TTL = 60        # One user's portfolio lists and counts
+
+# Views and procedures expand to the base tables they read or write
+VIEW_TABLES = {
+    'v_user_portfolios': {'Users', 'Portfolios', 'Performance_Metrics'},
+    'v_portfolio_performance': {'Portfolios', 'Portfolio_Holdings', 'Assets'}
+}
+PROCEDURE_TABLES = {
+    'sp_add_transaction': {'Transactions', 'Portfolio_Holdings'}
+}
+
+_READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?', re.IGNORECASE)
+_WRITE_TABLE = re.compile(
+    r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM|'
+    r'TRUNCATE(?:\s+TABLE)?|CALL)\s+`?(\w+)`?', re.IGNORECASE)
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def _canonical(names, mapping):
+    tables = set()
+    for name in names:
+        tables |= mapping.get(name, {name})
+    return {t.lower() for t in tables}
+
+
+def read_tables(query):
+    """Base tables a SELECT reads (lower case)"""
+    return _canonical(_READ_TABLES.findall(query), VIEW_TABLES)
+
+
+def written_tables(query):
+    """Base tables a write statement touches, or None if unknown"""
+    match = _WRITE_TABLE.match(query)
+    if not match:
+        return None
+    return _canonical([match.group(1)], PROCEDURE_TABLES)
+
+
+def estimate_size(value):
+    """Approximate memory footprint of a query result in bytes"""
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        # Keys are column names shared by every row, so only values count
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """TTL + LRU cache of query results with a memory cap"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (expires, size, tables, value)
+        self._bytes = 0
+        # Invalidations are numbered; the number of the last one per table
+        # and of the last one of everything
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                       'invalidations': 0, 'oversized': 0, 'superseded': 0}
+
+    @staticmethod
+    def make_key(query, params):
+        return normalize_query(query), tuple(params or ())
+
+    def get(self, key):
+        """(True, value) on a fresh hit, (False, None) otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return True, entry[3]
+
+    def generation(self):
+        """Number of the last invalidation, for put()"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, ttl, generation=None):
+        """Store a result for ttl seconds; with generation (taken before the
+        query ran), not if a table it reads was invalidated since"""
+        size = estimate_size(value)
+        tables = read_tables(key[0])
+        with self._lock:
+            if generation is not None and (
+                    self._cleared > generation
+                    or any(self._invalidated.get(t, 0) > generation for t in tables)):
+                self._stats['superseded'] += 1
+                return
+            # One result must not push everything else out
+            if size > self.max_bytes // 2:
+                self._stats['oversized'] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, size, tables, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, tables=None):
+        """Drop entries reading any of tables (all entries if tables is None)"""
+        with self._lock:
+            self._generation += 1
+            if tables is None:
+                self._cleared = self._generation
+                dropped = list(self._entries)
+            else:
+                tables = {t.lower() for t in tables}
+                self._invalidated.update(dict.fromkeys(tables, self._generation))
+                dropped = [key for key, entry in self._entries.items() if entry[2] & tables]
+            for key in dropped:
+                self._drop(key)
+            self._stats['invalidations'] += len(dropped)
+
+    def invalidate_for_write(self, query):
+        self.invalidate(written_tables(query))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        self.invalidate()
@@ -0,0 +1,84 @@
+"""
+Column-oriented query results for the Portfolio Management System
+
+run_query() returns a dict per row holding a Decimal, date or str object
+per value: around a kilobyte a row, most of it thrown away once the
+analytics have copied the numbers into NumPy arrays. fetch() skips that
+step. It reads the result a chunk at a time from an unbuffered cursor
+(DatabaseConnection.stream_chunks) as plain tuples and converts each
+chunk's columns into typed arrays straight away, so no more than one
+chunk of row objects exists at a time:
+
+    prices = columnar.fetch(*queries.price_history(asset_ids, since),
+                            types={'asset_id': np.int64, 'price_date': DAY,
+                                   'close_price': float})
+    prices['close_price']       # float64 array, NaN for NULL
+
+A column's type is float, a NumPy integer type, DAY (dates and
+timestamps as proleptic day ordinals, cheaper to sort and match than
+dates), a dict of codes for a column with a few known values (e.g.
+{'buy': 0, 'sell': 1}, stored as int8), or object for anything else
+(with one object per distinct value).
+Columns of the result not named in types are skipped.
+"""
+
+import numpy as np
+
+from database import DatabaseConnection
+
+# Rows converted at a time: bounds the row objects alive at once
+CHUNK_ROWS = 10000
+
+# Date and timestamp columns as day ordinals
+DAY = 'day'
+
+
+def _convert(values, kind, distinct):
+    count = len(values)
+    if kind is float:
+        return np.fromiter((np.nan if v is None else v for v in values),
+                           dtype=float, count=count)
+    if kind is DAY:
+        return np.fromiter((v.toordinal() for v in values), dtype=np.int64, count=count)
+    if isinstance(kind, dict):
+        return np.fromiter((kind[v] for v in values), dtype=np.int8, count=count)
+    if kind is object:
+        # Equal values share one object, as the drivers return a new one per row
+        array = np.empty(count, dtype=object)
+        array[:] = [distinct.setdefault(v, v) for v in values]
+        return array
+    return np.fromiter(values, dtype=kind, count=count)
+
+
+def _empty(kind):
+    if kind is DAY:
+        return np.empty(0, dtype=np.int64)
+    return np.empty(0, dtype=np.int8 if isinstance(kind, dict) else kind)
+
+
+def empty(types):
+    """The result of fetch() for a query returning no rows"""
+    return {name: _empty(kind) for name, kind in types.items()}
+
+
+def fetch(query, params=None, types=None, report=False, size=CHUNK_ROWS):
+    """{column: array} of a query's result, for the columns named in types.
+
+    With report, the query runs where run_report() would run it (the
+    analytics engine, if there is one). Raises KeyError for a column of
+    types the query does not return, or a value a dict of codes lacks.
+    """
+    chunks = (DatabaseConnection.report_chunks if report
+              else DatabaseConnection.stream_chunks)(query, params, size)
+    parts = {name: [] for name in types}
+    distinct = {name: {} for name in types}
+    try:
+        for columns, rows in chunks:
+            index = {name: i for i, name in enumerate(columns)}
+            values = list(zip(*rows))
+            for name, kind in types.items():
+                parts[name].append(_convert(values[index[name]], kind, distinct[name]))
+    finally:
+        chunks.close()
+    return {name: np.concatenate(parts[name]) if parts[name] else _empty(kind)
+            for name, kind in types.items()}
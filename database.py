@@ -0,0 +1,617 @@
+"""
+Database access layer for the Portfolio Management System
+
+Holds the database configuration and a bounded connection pool, so the
+application reuses authenticated connections instead of opening a new
+TCP connection (and paying the auth handshake) for every query.
+Connections come from the storage backend of STORAGE_CONFIG: MySQL, or
+an embedded SQLite file (see backends.py).
+
+Database Configuration:
+Update the DB_CONFIG dictionary with your MySQL credentials
+"""
+
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors
+
+from backends import DuckDBAnalytics, open_backend
+from cache import QueryCache, written_tables
+from instrumentation import ROW_BUCKETS, metrics, query_label, slow_queries, timings
+
+logger = logging.getLogger('portfolio.database')
+
+# Database Configuration
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': 'your_password',  # Change this
+    'database': 'portfolio_management'
+}
+
+# Storage Backend Configuration (see backends.py)
+STORAGE_CONFIG = {
+    'backend': os.environ.get('PORTFOLIO_DB', 'mysql'),          # 'mysql' or 'sqlite:PATH'
+    'analytics': os.environ.get('PORTFOLIO_ANALYTICS', 'duckdb'),  # Report engine; '' for none
+    # Local copy of the GUI user's data (see replica.py); '' for none
+    'replica': os.environ.get('PORTFOLIO_REPLICA', '~/.portfolio/replica.db')
+}
+
+# Connection Pool Configuration
+POOL_CONFIG = {
+    'pool_size': 5,               # Maximum number of open connections
+    'acquire_timeout': 10,        # Seconds to wait for a free connection
+    'health_check_interval': 30   # Ping connections idle longer than this (seconds)
+}
+
+# Query Cache Configuration (see cache.py)
+CACHE_CONFIG = {
+    'max_entries': 256,               # Cached result sets
+    'max_bytes': 64 * 1024 * 1024     # Approximate memory cap
+}
+
+# Errors that mean the socket itself is unusable
+CONNECTION_ERRORS = (errors.OperationalError, errors.InterfaceError)
+
+# Slow statements whose plan is captured for the slow query log
+EXPLAINABLE = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+# Answers the reads of the current context instead of the server; see reading_from
+_read_source = contextvars.ContextVar('read_source', default=None)
+
+
+class PoolTimeoutError(errors.PoolError):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class DatabaseUnavailableError(errors.InterfaceError):
+    """Raised when no connection to the server can be obtained"""
+
+
+class ConnectionPool:
+    """Bounded pool of reusable connections to a backend"""
+
+    def __init__(self, backend, pool_size=5, acquire_timeout=10,
+                 health_check_interval=30):
+        self.backend = backend
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        self._idle = deque()        # (connection, last_used) pairs
+        self._size = 0              # Open connections, idle or checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'created': 0,
+            'reconnects': 0,
+            'discarded': 0
+        }
+
+    def _connect(self):
+        conn = self.backend.connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except errors.Error:
+            return False
+
+    def acquire(self):
+        """Borrow a connection, waiting if every connection is in use"""
+        deadline = time.monotonic() + self.acquire_timeout
+        wait_started = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise errors.PoolError("Connection pool is closed")
+                if self._idle:
+                    # Most recently used first: it is the least likely to be stale
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.pool_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+
+                if wait_started is None:
+                    wait_started = time.monotonic()
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['wait_time'] += time.monotonic() - wait_started
+                    raise PoolTimeoutError(
+                        f"No free connection after {self.acquire_timeout}s "
+                        f"(pool size {self.pool_size})")
+                self._cond.wait(remaining)
+
+            self._stats['checkouts'] += 1
+            if wait_started is not None:
+                self._stats['wait_time'] += time.monotonic() - wait_started
+
+        # Connect and health check outside the lock so other threads are not blocked
+        try:
+            if conn is None:
+                return self._connect()
+            if time.monotonic() - last_used > self.health_check_interval:
+                if not self._healthy(conn):
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._stats['reconnects'] += 1
+                    return self._connect()
+            return conn
+        except Exception:
+            self._forget()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a borrowed connection; discard it if the socket is broken"""
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except errors.Error:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                self._stats['discarded'] += int(discard)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard or self._closed:
+            self._close_quietly(conn)
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except errors.Error:
+            pass
+
+    def stats(self):
+        """Snapshot of pool size and usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pool_size'] = self.pool_size
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        return stats
+
+    def close(self):
+        """Close idle connections; checked-out ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+class DatabaseConnection:
+    """Handle database connections and queries"""
+
+    _backend = None
+    _analytics = None       # DuckDBAnalytics, False if unavailable
+    _pool = None
+    _pool_lock = threading.Lock()
+    cache = QueryCache(**CACHE_CONFIG)
+    # Called with (title, message) by show_error; the GUI installs a dialog,
+    # headless callers (the API server, scripts) log instead
+    error_handler = None
+
+    @staticmethod
+    def set_error_handler(handler):
+        DatabaseConnection.error_handler = handler
+
+    @staticmethod
+    def configure(spec):
+        """Switch to the backend spec ('mysql' or 'sqlite:PATH') from now on"""
+        backend = open_backend(spec, DB_CONFIG)
+        DatabaseConnection.close_pool()
+        with DatabaseConnection._pool_lock:
+            if DatabaseConnection._analytics:
+                DatabaseConnection._analytics.close()
+            DatabaseConnection._backend = backend
+            DatabaseConnection._analytics = None
+        DatabaseConnection.cache.invalidate(None)
+
+    @staticmethod
+    def get_backend():
+        with DatabaseConnection._pool_lock:
+            if DatabaseConnection._backend is None:
+                DatabaseConnection._backend = open_backend(STORAGE_CONFIG['backend'], DB_CONFIG)
+            return DatabaseConnection._backend
+
+    @staticmethod
+    def get_connection():
+        """Open a dedicated (unpooled) connection"""
+        try:
+            return DatabaseConnection.get_backend().connect()
+        except mysql.connector.Error as e:
+            DatabaseConnection.show_error(DatabaseUnavailableError(msg=f"Failed to connect: {e}"))
+            return None
+
+    @staticmethod
+    def get_pool():
+        backend = DatabaseConnection.get_backend()
+        with DatabaseConnection._pool_lock:
+            if DatabaseConnection._pool is None:
+                DatabaseConnection._pool = ConnectionPool(backend, **POOL_CONFIG)
+            return DatabaseConnection._pool
+
+    @staticmethod
+    def pool_stats():
+        return DatabaseConnection.get_pool().stats()
+
+    @staticmethod
+    def cache_stats():
+        return DatabaseConnection.cache.stats()
+
+    @staticmethod
+    def invalidate_cache(*tables):
+        """Drop cached results reading any of tables (everything if none given)"""
+        DatabaseConnection.cache.invalidate(tables or None)
+
+    @staticmethod
+    def close_pool():
+        with DatabaseConnection._pool_lock:
+            if DatabaseConnection._pool is not None:
+                DatabaseConnection._pool.close()
+                DatabaseConnection._pool = None
+
+    @staticmethod
+    def _execute(conn, query, params, fetch):
+        label = query_label(query)
+        started = time.perf_counter()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params or ())
+            if fetch:
+                result = cursor.fetchall()
+                rows = len(result)
+            else:
+                conn.commit()
+                result = rows = cursor.rowcount
+        except errors.Error as e:
+            metrics.increment('query_errors', name=label, error=type(e).__name__)
+            raise
+        finally:
+            cursor.close()
+
+        elapsed = time.perf_counter() - started
+        timings.record('query', label, elapsed)
+        metrics.observe('query_rows', rows, ROW_BUCKETS, name=label)
+        if elapsed >= slow_queries.threshold:
+            DatabaseConnection._log_slow(conn, query, params, label, elapsed, rows)
+        return result
+
+    @staticmethod
+    def _log_slow(conn, query, params, label, seconds, rows):
+        plan = None
+        if EXPLAINABLE.match(query) and slow_queries.should_explain(label):
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(DatabaseConnection.get_backend().explain + query, params or ())
+                plan = cursor.fetchall()
+            except errors.Error as e:
+                plan = [{'error': str(e)}]
+            finally:
+                cursor.close()
+        slow_queries.add(label, seconds, rows, plan)
+
+    @staticmethod
+    def run_query(query, params=None, fetch=True, cache_ttl=None):
+        """Execute a query and return its rows (or rowcount); raises on failure.
+
+        With cache_ttl (seconds) a read is served from the query cache while
+        fresh; callers must not modify the rows they get back. Every write
+        invalidates cached results of the tables it touches.
+
+        Safe to call from worker threads: it never touches the GUI.
+        """
+        source = _read_source.get()
+        if fetch and source is not None:
+            return source.run_query(query, params)
+
+        cache = DatabaseConnection.cache
+        if fetch and cache_ttl:
+            key = cache.make_key(query, params)
+            hit, rows = cache.get(key)
+            if hit:
+                return rows
+            generation = cache.generation()
+            rows = DatabaseConnection._run(query, params, fetch)
+            cache.put(key, rows, cache_ttl, generation)
+            return rows
+
+        try:
+            return DatabaseConnection._run(query, params, fetch)
+        finally:
+            if not fetch:
+                # Even a failed write may have changed something (e.g. a CALL)
+                cache.invalidate_for_write(query)
+
+    @staticmethod
+    def run_report(query, params=None, cache_ttl=None):
+        """Run a read-only aggregation for the reports; returns its rows.
+
+        Runs in the analytics engine of STORAGE_CONFIG (DuckDB) when it is
+        installed and can read the database, and like run_query otherwise,
+        including when the engine fails on the query.
+        """
+        engine = DatabaseConnection.get_analytics()
+        if engine is None or _read_source.get() is not None:
+            return DatabaseConnection.run_query(query, params, cache_ttl=cache_ttl)
+
+        cache = DatabaseConnection.cache
+        key = cache.make_key(query, params)
+        if cache_ttl:
+            hit, rows = cache.get(key)
+            if hit:
+                return rows
+        generation = cache.generation()
+        label = query_label(query)
+        started = time.perf_counter()
+        try:
+            rows = engine.run(query, params)
+        except engine.error as e:
+            logger.warning("%s could not run %s (%s); using %s", engine.name, label, e,
+                           DatabaseConnection.get_backend())
+            return DatabaseConnection.run_query(query, params, cache_ttl=cache_ttl)
+        timings.record('report', label, time.perf_counter() - started)
+        metrics.observe('query_rows', len(rows), ROW_BUCKETS, name=label, engine=engine.name)
+        if cache_ttl:
+            cache.put(key, rows, cache_ttl, generation)
+        return rows
+
+    @staticmethod
+    @contextmanager
+    def reading_from(source):
+        """Send the reads made inside the block to source.run_query instead.
+
+        Used by the offline replica (replica.py); the query cache is
+        bypassed and writes still go to the server. QueryExecutor carries
+        the setting over to its worker threads.
+        """
+        token = _read_source.set(source)
+        try:
+            yield
+        finally:
+            _read_source.reset(token)
+
+    @staticmethod
+    def read_source():
+        """The source of reading_from() in effect, None for the server"""
+        return _read_source.get()
+
+    @staticmethod
+    def get_analytics():
+        """The report engine, or None if none is configured or it is unavailable"""
+        backend = DatabaseConnection.get_backend()
+        with DatabaseConnection._pool_lock:
+            if DatabaseConnection._analytics is None:
+                DatabaseConnection._analytics = False
+                if STORAGE_CONFIG.get('analytics') == 'duckdb':
+                    try:
+                        DatabaseConnection._analytics = DuckDBAnalytics(backend)
+                    except ImportError:
+                        logger.info("DuckDB is not installed: reports run on %s", backend)
+                    except Exception as e:
+                        logger.warning("DuckDB cannot read %s (%s): reports run there",
+                                       backend, e)
+            return DatabaseConnection._analytics or None
+
+    @staticmethod
+    def _run(query, params, fetch):
+        # A read that hits a socket dropped since the last health check is
+        # retried once on a fresh connection; writes are never replayed
+        attempts = 2 if fetch else 1
+        for attempt in range(attempts):
+            pool, conn = DatabaseConnection._acquire()
+            discard = False
+            try:
+                return DatabaseConnection._execute(conn, query, params, fetch)
+            except CONNECTION_ERRORS:
+                discard = True
+                if attempt + 1 == attempts:
+                    raise
+            finally:
+                pool.release(conn, discard=discard)
+
+    @staticmethod
+    def _acquire():
+        pool = DatabaseConnection.get_pool()
+        started = time.perf_counter()
+        try:
+            conn = pool.acquire()
+        except mysql.connector.Error as e:
+            metrics.increment('pool_acquire_errors', error=type(e).__name__)
+            raise DatabaseUnavailableError(msg=f"Failed to connect: {e}") from e
+        metrics.observe('pool_acquire_seconds', time.perf_counter() - started)
+        return pool, conn
+
+    @staticmethod
+    @contextmanager
+    def transaction(tables=None):
+        """Run several statements on one connection as a single transaction.
+
+        Yields a cursor; commits when the block ends and rolls back if it
+        raises. Cached results reading tables are invalidated afterwards
+        (all of them if tables is None).
+        """
+        pool, conn = DatabaseConnection._acquire()
+        discard = False
+        try:
+            conn.start_transaction()
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            conn.commit()
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            # release() rolls back a transaction left open by a failure
+            pool.release(conn, discard=discard)
+            DatabaseConnection.cache.invalidate(tables)
+
+    @staticmethod
+    def run_many(query, seq_params):
+        """Execute a write for every parameter tuple in one transaction.
+
+        Returns the total rowcount; raises on failure, leaving nothing
+        written.
+        """
+        with DatabaseConnection.transaction(written_tables(query)) as cursor:
+            with timings.measure('query', query_label(query)):
+                cursor.executemany(query, seq_params)
+            return cursor.rowcount
+
+    @staticmethod
+    def insert_many(query, seq_params):
+        """run_many() for an INSERT of new rows into a table with an
+        AUTO_INCREMENT key; returns (first, last), the ids the rows got.
+
+        The ids are consecutive: MySQL allots those of a multi-row INSERT
+        (as executemany sends it) in one block, since the number of rows
+        is known up front, and on SQLite the transaction holds the write
+        lock throughout.
+        """
+        with DatabaseConnection.transaction(written_tables(query)) as cursor:
+            with timings.measure('query', query_label(query)):
+                cursor.executemany(query, seq_params)
+            return cursor.lastrowid, cursor.lastrowid + cursor.rowcount - 1
+
+    @staticmethod
+    def stream(query, params=None, size=1000):
+        """Yield the rows of a large result without holding them all in memory.
+
+        Rows are fetched size at a time over an unbuffered cursor, which
+        keeps a pooled connection busy until the generator is exhausted.
+        """
+        chunks = DatabaseConnection.stream_chunks(query, params, size)
+        try:
+            for columns, rows in chunks:
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            chunks.close()
+
+    @staticmethod
+    def stream_chunks(query, params=None, size=1000):
+        """Yield a large result size rows at a time, as (column names, rows)
+        with each row a tuple: the raw material of columnar.py.
+
+        Uses an unbuffered cursor like stream().
+        """
+        pool, conn = DatabaseConnection._acquire()
+        discard = False
+        label = query_label(query)
+        started = time.perf_counter()
+        count = 0
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(query, params or ())
+            columns = tuple(cursor.column_names)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                count += len(rows)
+                yield columns, rows
+            # Includes the time the caller spent on each chunk
+            timings.record('stream', label, time.perf_counter() - started)
+            metrics.observe('query_rows', count, ROW_BUCKETS, name=label)
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        except GeneratorExit:
+            # Unread rows are still on the socket: do not reuse the connection
+            discard = True
+            raise
+        finally:
+            try:
+                cursor.close()
+            except errors.Error:
+                discard = True
+            pool.release(conn, discard=discard)
+
+    @staticmethod
+    def report_chunks(query, params=None, size=1000):
+        """stream_chunks() for a read-only report query, run in the analytics
+        engine when run_report() would run it there"""
+        engine = DatabaseConnection.get_analytics()
+        if engine is None:
+            yield from DatabaseConnection.stream_chunks(query, params, size)
+            return
+
+        label = query_label(query)
+        started = time.perf_counter()
+        count = 0
+        chunks = engine.chunks(query, params, size)
+        try:
+            chunk = next(chunks, None)
+        except engine.error as e:
+            logger.warning("%s could not run %s (%s); using %s", engine.name, label, e,
+                           DatabaseConnection.get_backend())
+            yield from DatabaseConnection.stream_chunks(query, params, size)
+            return
+        while chunk is not None:
+            count += len(chunk[1])
+            yield chunk
+            chunk = next(chunks, None)
+        timings.record('report', label, time.perf_counter() - started)
+        metrics.observe('query_rows', count, ROW_BUCKETS, name=label, engine=engine.name)
+
+    @staticmethod
+    def describe_error(error):
+        """Dialog title and message for a failed query"""
+        if isinstance(error, DatabaseUnavailableError):
+            return "Database Error", str(error.msg)
+        return "Query Error", f"Query failed: {error}"
+
+    @staticmethod
+    def show_error(error):
+        title, message = DatabaseConnection.describe_error(error)
+        handler = DatabaseConnection.error_handler
+        if handler is None:
+            logger.error("%s: %s", title, message)
+        else:
+            handler(title, message)
+
+    @staticmethod
+    def execute_query(query, params=None, fetch=True, cache_ttl=None):
+        try:
+            return DatabaseConnection.run_query(query, params, fetch, cache_ttl)
+        except mysql.connector.Error as e:
+            DatabaseConnection.show_error(e)
+            return None
@@ -0,0 +1,407 @@
+"""
+Synthetic data for the Portfolio Management System
+
+Fills the schema with a reproducible, seeded data set of a given total
+size, from a thousand rows to tens of millions, for benchmarks (bench.py)
+and load tests:
+
+    python datagen.py --rows 1M                         # the MySQL of DB_CONFIG
+    python datagen.py --rows 100k --db sqlite:bench.db  # SQLite stand-in
+
+The same seed and size always produce the same rows. Transactions are
+generated per portfolio in date order and Portfolio_Holdings is the
+result of replaying them (as importer.rebuild_holdings would), so
+holdings, history and the latest Performance_Metrics snapshot agree.
+Rows are written a chunk of users at a time, parents before children,
+so memory stays flat however large the data set.
+
+--db takes the same backends as PORTFOLIO_DB (see backends.py); a new
+SQLite file gets schema_sqlite.sql, the MySQL schema with every
+migration applied.
+"""
+
+import argparse
+import random
+import re
+import time
+from datetime import date, datetime, timedelta
+
+from database import DatabaseConnection
+
+DEFAULT_SEED = 42
+USERS_PER_CHUNK = 1000
+INSERT_BATCH = 5000     # Rows per executemany
+HISTORY_DAYS = 5 * 365  # Transactions fall within this many days before today
+SNAPSHOT_DAYS = 3       # Performance_Metrics rows per portfolio
+PORTFOLIOS_PER_USER = 3
+WATCHLIST_PER_USER = 8
+
+# Tables derived from the generated ones, emptied first by --reset
+DERIVED_TABLES = ['Asset_Price_History', 'Tax_Lot_Selections', 'Realized_Gains', 'Tax_Lots',
+                  'Tax_Lot_Checkpoints', 'Performance_Returns', 'Rebalance_Trades']
+
+# Children after parents; deleted in reverse. The first three are
+# reference data, the rest is generated a chunk of users at a time
+TABLES = ['Asset_Categories', 'Assets', 'FX_Rates', 'Users', 'Portfolios', 'Transactions',
+          'Portfolio_Holdings', 'Performance_Metrics', 'Watchlist']
+
+# As in the sample data of dbmysql.frm: (name, description, risk, asset types)
+CATEGORIES = [
+    ('Technology', 'Technology sector stocks and assets', 'high', ('stock', 'etf', 'crypto')),
+    ('Healthcare', 'Healthcare and pharmaceutical companies', 'medium', ('stock', 'mutual_fund')),
+    ('Finance', 'Banking and financial services', 'medium', ('stock', 'mutual_fund', 'etf')),
+    ('Energy', 'Oil, gas, and renewable energy', 'high', ('stock', 'commodity')),
+    ('Real Estate', 'REITs and property investments', 'low', ('etf', 'mutual_fund')),
+    ('Government Bonds', 'Treasury and government securities', 'low', ('bond',))
+]
+EXCHANGES = ['NYSE', 'NASDAQ', 'LSE', 'TSX', 'US Treasury']
+EXCHANGE_CURRENCIES = {'LSE': 'GBP', 'TSX': 'CAD'}     # USD otherwise
+
+# Units of each currency per USD at the start of the rates, and their daily volatility
+FX_RATES = {'GBP': (0.79, 0.005), 'CAD': (1.36, 0.004)}
+FX_DAYS = HISTORY_DAYS + 366    # Rates from before the first registration
+# Portfolio currencies, weighted
+PORTFOLIO_CURRENCIES = (('USD', 'GBP', 'CAD'), (8, 1, 1))
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'David', 'Emma', 'Farid', 'Grace', 'Hiro', 'Ines',
+               'James', 'Kemi', 'Liam', 'Maria', 'Noah', 'Olga', 'Priya', 'Quinn', 'Rosa',
+               'Sam', 'Tariq', 'Uma', 'Victor', 'Wen', 'Yusuf', 'Zoe']
+LAST_NAMES = ['Anderson', 'Brown', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes',
+              'Ivanova', 'Johnson', 'Kim', 'Lopez', 'Martin', 'Nguyen', 'Okafor', 'Patel',
+              'Rossi', 'Smith', 'Tanaka', 'Walker']
+NAME_WORDS = ['Apex', 'Blue', 'Cedar', 'Delta', 'Eagle', 'First', 'Global', 'Harbor',
+              'Iron', 'Lunar', 'Meridian', 'North', 'Orion', 'Pacific', 'Quantum', 'River',
+              'Summit', 'Titan', 'United', 'Vertex', 'Western', 'Zenith']
+NAME_SECTORS = {
+    'Technology': ['Software', 'Semiconductor', 'Cloud', 'Networks', 'Digital'],
+    'Healthcare': ['Pharma', 'Biotech', 'Medical', 'Health', 'Genomics'],
+    'Finance': ['Bank', 'Capital', 'Financial', 'Insurance', 'Credit'],
+    'Energy': ['Energy', 'Oil', 'Solar', 'Power', 'Gas'],
+    'Real Estate': ['Realty', 'Property', 'Estates', 'REIT', 'Land'],
+    'Government Bonds': ['Treasury', 'Municipal', 'Sovereign', 'Federal', 'Gilt']
+}
+NAME_SUFFIXES = {'stock': ['Inc.', 'Corp.', 'Holdings', 'Group', 'plc'],
+                 'etf': ['ETF', 'Index ETF'], 'mutual_fund': ['Fund', 'Income Fund'],
+                 'bond': ['Bond 10Y', 'Bond 30Y', 'Note 5Y'], 'commodity': ['Trust'],
+                 'crypto': ['Token', 'Coin']}
+PORTFOLIO_NAMES = ['Retirement', 'Growth', 'Income', 'Education', 'Speculative', 'Core']
+
+INSERTS = {
+    'Asset_Categories': """INSERT INTO Asset_Categories (category_id, category_name,
+          description, risk_level) VALUES (%s, %s, %s, %s)""",
+    'Assets': """INSERT INTO Assets (asset_id, category_id, asset_symbol, asset_name,
+          asset_type, current_price, exchange, currency)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+    'FX_Rates': """INSERT INTO FX_Rates (base_currency, quote_currency, rate_date, rate)
+          VALUES (%s, %s, %s, %s)""",
+    'Users': """INSERT INTO Users (user_id, first_name, last_name, email, phone,
+          date_of_birth, address, registration_date, status)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+    'Portfolios': """INSERT INTO Portfolios (portfolio_id, user_id, portfolio_name,
+          portfolio_type, creation_date, total_value, currency, status)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+    'Transactions': """INSERT INTO Transactions (transaction_id, portfolio_id, asset_id,
+          transaction_type, quantity, price_per_unit, transaction_date, fees)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+    'Portfolio_Holdings': """INSERT INTO Portfolio_Holdings (holding_id, portfolio_id,
+          asset_id, quantity, purchase_price, purchase_date) VALUES (%s, %s, %s, %s, %s, %s)""",
+    'Performance_Metrics': """INSERT INTO Performance_Metrics (metric_id, portfolio_id,
+          metric_date, total_value, market_value, cost_basis, holdings_count,
+          daily_return, total_return) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+    'Watchlist': """INSERT INTO Watchlist (watchlist_id, user_id, asset_id, added_date,
+          target_price) VALUES (%s, %s, %s, %s, %s)"""
+}
+
+
+# Writing
+
+def insert(table, rows):
+    with DatabaseConnection.transaction([table]) as cursor:
+        for start in range(0, len(rows), INSERT_BATCH):
+            cursor.executemany(INSERTS[table], rows[start:start + INSERT_BATCH])
+
+
+def delete_all():
+    with DatabaseConnection.transaction() as cursor:
+        for table in DERIVED_TABLES + TABLES[::-1]:
+            cursor.execute(f"DELETE FROM {table}")
+
+
+def row_counts():
+    return {table: DatabaseConnection.run_query(f"SELECT COUNT(*) AS n FROM {table}")[0]['n']
+            for table in TABLES}
+
+
+# Sizes
+
+def parse_size(text):
+    """'250000', '250k' or '10M'"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kKmM]?)\s*', str(text))
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text!r}")
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'k': 1000, 'm': 1000000}[unit.lower()])
+
+
+def plan(rows):
+    """Approximate row counts per table for a data set of about rows rows.
+
+    Transactions take whatever the other tables leave, 60-90%. Users grow
+    slower than the data set, so larger sets also have longer histories
+    per portfolio: about 7 transactions at 1k rows, 170 at 10M.
+    """
+    users = max(5, int(rows ** 0.75 / 10))
+    portfolios = users * PORTFOLIOS_PER_USER
+    assets = min(max(rows // 100, 20), 100000)
+    holdings = portfolios * 5
+    other = (len(CATEGORIES) + assets + users + portfolios + holdings
+             + portfolios * SNAPSHOT_DAYS + users * WATCHLIST_PER_USER)
+    return {
+        'Asset_Categories': len(CATEGORIES),
+        'Assets': assets,
+        'Users': users,
+        'Portfolios': portfolios,
+        'Transactions': max(rows - other, portfolios),
+        'Portfolio_Holdings': holdings,
+        'Performance_Metrics': portfolios * SNAPSHOT_DAYS,
+        'Watchlist': users * WATCHLIST_PER_USER
+    }
+
+
+def symbol(n):
+    """AAA, AAB, ... ZZZ, AAAA, ...: unique for every n >= 0"""
+    n += 26 * 26 + 26    # Skip the one and two letter symbols
+    letters = []
+    while n >= 0:
+        n, r = divmod(n, 26)
+        letters.append(chr(65 + r))
+        n -= 1
+    return ''.join(reversed(letters))
+
+
+# Generation
+
+class Generator:
+    """Seeded rows for every table, yielded a chunk of users at a time"""
+
+    def __init__(self, rows, seed=DEFAULT_SEED, today=None):
+        self.sizes = plan(rows)
+        self.seed = seed
+        self.today = today or date.today()
+        self.rng = random.Random(seed)
+        self.prices = []        # current_price by asset_id - 1
+        self.currencies = []    # currency by asset_id - 1
+        self.usd_rates = {}     # currency: units per USD by days before today
+        self.next_ids = {table: 1 for table in TABLES}
+
+    def _ids(self, table, count=1):
+        first = self.next_ids[table]
+        self.next_ids[table] += count
+        return first
+
+    def reference_data(self):
+        """Asset_Categories, Assets and FX_Rates rows"""
+        rng = self.rng
+        categories = [(i, name, description, risk)
+                      for i, (name, description, risk, _) in enumerate(CATEGORIES, 1)]
+        assets = []
+        for n in range(self.sizes['Assets']):
+            category_id = rng.randrange(len(CATEGORIES)) + 1
+            category, _, _, types = CATEGORIES[category_id - 1]
+            asset_type = rng.choice(types)
+            name = (f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_SECTORS[category])} "
+                    f"{rng.choice(NAME_SUFFIXES[asset_type])}")
+            price = round(rng.lognormvariate(4, 1), 4) or 0.01
+            exchange = 'US Treasury' if asset_type == 'bond' else rng.choice(EXCHANGES[:4])
+            currency = EXCHANGE_CURRENCIES.get(exchange, 'USD')
+            self.prices.append(price)
+            self.currencies.append(currency)
+            assets.append((n + 1, category_id, symbol(n), name, asset_type, price, exchange,
+                           currency))
+        self.next_ids['Assets'] = len(assets) + 1
+        return {'Asset_Categories': categories, 'Assets': assets, 'FX_Rates': self._fx_rates()}
+
+    def _fx_rates(self):
+        """A random walk per currency over FX_DAYS, moving and stored on weekdays"""
+        rows = []
+        self.usd_rates['USD'] = [1.0] * FX_DAYS
+        for currency, (rate, volatility) in FX_RATES.items():
+            rates = []
+            for days_ago in range(FX_DAYS - 1, -1, -1):
+                day = self.today - timedelta(days=days_ago)
+                if day.weekday() < 5:
+                    rate = round(rate * (1 + self.rng.gauss(0, volatility)), 6)
+                    rows.append(('USD', currency, day, rate))
+                rates.append(rate)
+            self.usd_rates[currency] = rates[::-1]
+        return rows
+
+    def _fx(self, base, quote, day):
+        """The rate of a pair on day; weekends have Friday's"""
+        days_ago = min((self.today - day).days, FX_DAYS - 1)
+        return self.usd_rates[quote][days_ago] / self.usd_rates[base][days_ago]
+
+    def chunks(self, users_per_chunk=USERS_PER_CHUNK):
+        """Yield {table: rows} for consecutive chunks of users"""
+        users = self.sizes['Users']
+        portfolios = self.sizes['Portfolios']
+        per_portfolio = self.sizes['Transactions'] / portfolios
+        for start in range(0, users, users_per_chunk):
+            chunk = {table: [] for table in TABLES[3:]}
+            for _ in range(min(users_per_chunk, users - start)):
+                self._user(chunk, per_portfolio)
+            yield chunk
+
+    def _user(self, chunk, per_portfolio):
+        rng = self.rng
+        user_id = self._ids('Users')
+        registered = self._moment(HISTORY_DAYS + 365, HISTORY_DAYS)
+        chunk['Users'].append((
+            user_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+            f"user{user_id}@example.com", f"555-{rng.randrange(10000):04d}",
+            date(1950, 1, 1) + timedelta(days=rng.randrange(50 * 365)),
+            f"{rng.randrange(1, 1000)} {rng.choice(NAME_WORDS)} St",
+            registered, 'inactive' if rng.random() < 0.05 else 'active'))
+
+        for _ in range(PORTFOLIOS_PER_USER):
+            count = max(1, round(per_portfolio * rng.uniform(0.5, 1.5)))
+            self._portfolio(chunk, user_id, registered, count)
+
+        watched = rng.sample(range(len(self.prices)), min(WATCHLIST_PER_USER, len(self.prices)))
+        for index in watched:
+            target = (round(self.prices[index] * rng.uniform(0.8, 1.2), 4)
+                      if rng.random() < 0.8 else None)
+            chunk['Watchlist'].append((self._ids('Watchlist'), user_id, index + 1,
+                                       self._moment(HISTORY_DAYS, 0), target))
+
+    def _portfolio(self, chunk, user_id, registered, transactions):
+        rng = self.rng
+        portfolio_id = self._ids('Portfolios')
+        portfolio_type = rng.choice(('aggressive', 'moderate', 'conservative'))
+        currency = rng.choices(*PORTFOLIO_CURRENCIES)[0]
+        status = 'closed' if rng.random() < 0.05 else 'active'
+
+        # Each position: first a buy, then buys, sells and dividends in date order
+        assets = rng.sample(range(len(self.prices)),
+                            min(len(self.prices), transactions, rng.randint(2, 8)))
+        split = [1] * len(assets)
+        for _ in range(transactions - len(assets)):
+            split[rng.randrange(len(assets))] += 1
+
+        market_value = cost_basis = 0.0
+        held = 0
+        for index, count in zip(assets, split):
+            asset_id, current = index + 1, self.prices[index]
+            quantity = price = 0.0
+            opened = None
+            offsets = sorted(rng.random() for _ in range(count))
+            span = (self._now() - registered).total_seconds()
+            for i, offset in enumerate(offsets):
+                when = registered + timedelta(seconds=int(offset * span))
+                unit_price = round(current * rng.uniform(0.6, 1.4), 4) or 0.01
+                kind = 'buy' if i == 0 or quantity <= 0 else rng.choices(
+                    ('buy', 'sell', 'dividend'), (6, 3, 1))[0]
+                if kind == 'buy':
+                    units = round(rng.uniform(1, 500), 6)
+                    if quantity <= 0:
+                        quantity, price, opened = units, unit_price, when.date()
+                    else:
+                        price = (quantity * price + units * unit_price) / (quantity + units)
+                        quantity += units
+                elif kind == 'sell':
+                    units = quantity if rng.random() < 0.1 else round(
+                        quantity * rng.uniform(0.1, 0.6), 6)
+                    quantity = round(quantity - units, 6)
+                else:
+                    units, unit_price = quantity, round(unit_price * 0.005, 4) or 0.0001
+                chunk['Transactions'].append((
+                    self._ids('Transactions'), portfolio_id, asset_id, kind, units,
+                    unit_price, when, round(rng.uniform(0, 10), 2) if kind != 'dividend' else 0))
+            if quantity > 0:
+                quantity, price = round(quantity, 6), round(price, 4)
+                chunk['Portfolio_Holdings'].append((
+                    self._ids('Portfolio_Holdings'), portfolio_id, asset_id, quantity,
+                    price, opened))
+                # Snapshots are in the portfolio's currency, the cost at its
+                # purchase date's rate
+                asset_currency = self.currencies[index]
+                market_value += quantity * current * self._fx(asset_currency, currency,
+                                                              self.today)
+                cost_basis += quantity * price * self._fx(asset_currency, currency, opened)
+                held += 1
+
+        total_value = round(market_value, 2)
+        chunk['Portfolios'].append((portfolio_id, user_id,
+                                    f"{rng.choice(PORTFOLIO_NAMES)} {portfolio_id}",
+                                    portfolio_type, registered, total_value, currency,
+                                    status))
+
+        # Snapshots walking back from today's, ending at the current values
+        value = market_value
+        snapshots = []
+        for days_ago in range(SNAPSHOT_DAYS):
+            previous = value / (1 + rng.gauss(0, 0.01))
+            snapshots.append((self.today - timedelta(days=days_ago), value, previous))
+            value = previous
+        for day, value, previous in reversed(snapshots):
+            daily = round((value - previous) / previous * 100, 4) if previous else None
+            total = round((value - cost_basis) / cost_basis * 100, 4) if cost_basis else None
+            chunk['Performance_Metrics'].append((
+                self._ids('Performance_Metrics'), portfolio_id, day, round(value, 2),
+                round(value, 2), round(cost_basis, 2), held, daily,
+                total if total is None or abs(total) < 10000 else None))
+
+    def _now(self):
+        return datetime.combine(self.today, datetime.min.time())
+
+    def _moment(self, from_days, to_days):
+        """A random time between from_days and to_days before today"""
+        seconds = self.rng.uniform(to_days * 86400, from_days * 86400)
+        return (self._now() - timedelta(seconds=seconds)).replace(microsecond=0)
+
+
+def generate(rows, seed=DEFAULT_SEED, progress=print):
+    """Fill the database with a data set of about rows rows; returns the row counts"""
+    generator = Generator(rows, seed)
+    started = time.perf_counter()
+    for table, table_rows in generator.reference_data().items():
+        insert(table, table_rows)
+
+    written = 0
+    for chunk in generator.chunks():
+        for table in TABLES[3:]:
+            if chunk[table]:
+                insert(table, chunk[table])
+        written += sum(len(table_rows) for table_rows in chunk.values())
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(f"{written:,} rows, {written / elapsed:,.0f} rows/s")
+    return row_counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic portfolio data")
+    parser.add_argument('--rows', type=parse_size, default='100k',
+                        help="Approximate total rows, e.g. 1k, 250k, 10M")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    parser.add_argument('--reset', action='store_true',
+                        help="Delete every existing row first")
+    args = parser.parse_args()
+
+    DatabaseConnection.configure(args.db)
+    try:
+        if args.reset:
+            delete_all()
+        elif any(row_counts().values()):
+            parser.error("The database already has data; use --reset to replace it")
+        counts = generate(args.rows, args.seed)
+    finally:
+        DatabaseConnection.close_pool()
+    for table, count in counts.items():
+        print(f"{table:<22}{count:>12,}")
+    print(f"{'total':<22}{sum(counts.values()):>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Background query execution for the Portfolio Management System
+
+Tkinter is single threaded: any blocking call made from a widget callback
+freezes the whole window. QueryExecutor runs database work on a small pool
+of worker threads and hands the results back to the Tk main loop, which
+polls a result queue with root.after. Only the main thread ever touches a
+widget.
+
+A job and its callbacks run in a copy of the submitter's context, so the
+instrumentation call site (instrumentation.call_site) follows the work
+to the worker thread and back.
+"""
+
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import TclError
+
+
+class Task:
+    """Handle for one submitted job"""
+
+    def __init__(self, key, on_success, on_error):
+        self.key = key
+        self.on_success = on_success
+        self.on_error = on_error
+        self.future = None
+        self.context = contextvars.copy_context()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Drop the result; the job is also skipped if it has not started yet"""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class QueryExecutor:
+    """Run blocking work on worker threads and deliver results on the Tk thread"""
+
+    def __init__(self, root, max_workers=4, poll_interval=25):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._workers = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='query')
+        self._results = queue.Queue()
+        self._tasks = set()          # Submitted and not yet delivered
+        self._latest = {}            # key -> newest Task for that key
+        self._polling = False
+
+    def submit(self, fn, *args, key=None, on_success=None, on_error=None, **kwargs):
+        """Run fn(*args, **kwargs) in the background.
+
+        on_success(result) or on_error(exception) is later called on the Tk
+        thread. Submitting with the key of a pending task supersedes it: the
+        older task is cancelled and its result is never delivered.
+        """
+        if key is not None:
+            self.cancel(key)
+
+        task = Task(key, on_success, on_error)
+        if key is not None:
+            self._latest[key] = task
+        self._tasks.add(task)
+
+        def run():
+            if task.cancelled:
+                return
+            try:
+                result = task.context.run(fn, *args, **kwargs)
+            except Exception as e:
+                self._results.put((task, False, e))
+            else:
+                self._results.put((task, True, result))
+
+        task.future = self._workers.submit(run)
+        # A job cancelled before it started never runs; report it anyway so
+        # the poll loop stops waiting for it
+        task.future.add_done_callback(
+            lambda future: future.cancelled() and self._results.put((task, False, None)))
+        self._schedule_poll()
+        return task
+
+    def cancel(self, key):
+        task = self._latest.pop(key, None)
+        if task is not None:
+            task.cancel()
+            self._tasks.discard(task)
+
+    def cancel_all(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+        self._latest.clear()
+
+    def pending(self, key):
+        task = self._latest.get(key)
+        return task is not None and not task.cancelled
+
+    def shutdown(self):
+        self.cancel_all()
+        self._workers.shutdown(wait=False)
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            try:
+                self.root.after(self.poll_interval, self._poll)
+            except TclError:
+                # Root window already destroyed
+                self._polling = False
+
+    def _poll(self):
+        self._polling = False
+        try:
+            while True:
+                try:
+                    task, ok, value = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                self._deliver(task, ok, value)
+        finally:
+            if self._tasks:
+                self._schedule_poll()
+
+    def _deliver(self, task, ok, value):
+        self._tasks.discard(task)
+        if task.key is not None and self._latest.get(task.key) is task:
+            del self._latest[task.key]
+        if task.cancelled:
+            return
+
+        callback = task.on_success if ok else task.on_error
+        if callback is not None:
+            task.context.run(callback, value)
+        elif not ok:
+            raise value
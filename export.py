@@ -0,0 +1,384 @@
+"""
+Report export for the Portfolio Management System
+
+Writes one of a user's data sets, whatever its size, to a file:
+
+    holdings        every holding of every portfolio, priced today
+    transactions    the full transaction history
+    performance     the daily snapshots (Performance_Metrics)
+    watchlist       the watched assets and their target prices
+
+in one of three formats:
+
+    csv             plain text, a header line first
+    xlsx            an Excel workbook, a new sheet every 1,048,575 rows
+    parquet         columnar and zstd-compressed (requires pyarrow)
+
+Rows are streamed from an unbuffered server-side cursor straight into
+the writer, so memory use does not grow with the number of rows: CSV
+and XLSX rows are written out as they arrive, Parquet a row group at a
+time. The file is written under a temporary name and only takes the
+requested one once complete. The desktop application runs exports from
+the reports tab on a worker thread; from the command line:
+
+    python export.py transactions --user 1 --output history.parquet
+"""
+
+import argparse
+import csv
+import os
+import sys
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+import queries
+from database import DatabaseConnection
+
+# Rows fetched per round trip, and between progress reports
+CHUNK_ROWS = 5000
+
+# Rows per Parquet row group: the most held in memory at once
+ROW_GROUP = 65536
+
+# Data rows per XLSX sheet: Excel's row limit less the header
+SHEET_ROWS = 1_048_575
+
+# DECIMAL(precision, scale) columns, as in the schema
+MONEY = (15, 2)
+PRICE = (12, 4)
+QUANTITY = (15, 6)
+PERCENT = (8, 4)
+
+# Per data set: the query and its columns as (field, header, type); a
+# type is 'int', 'text', 'date', 'datetime' or a DECIMAL's (precision, scale)
+REPORTS = {
+    'holdings': (queries.export_holdings, [
+        ('portfolio_id', 'Portfolio ID', 'int'),
+        ('portfolio_name', 'Portfolio', 'text'),
+        ('asset_symbol', 'Symbol', 'text'),
+        ('asset_name', 'Asset', 'text'),
+        ('asset_type', 'Type', 'text'),
+        ('quantity', 'Quantity', QUANTITY),
+        ('purchase_price', 'Purchase Price', PRICE),
+        ('purchase_date', 'Purchase Date', 'date'),
+        ('current_price', 'Current Price', PRICE),
+        ('market_value', 'Market Value', MONEY),
+        ('currency', 'Currency', 'text')]),
+    'transactions': (queries.export_transactions, [
+        ('transaction_id', 'Transaction ID', 'int'),
+        ('portfolio_id', 'Portfolio ID', 'int'),
+        ('portfolio_name', 'Portfolio', 'text'),
+        ('asset_symbol', 'Symbol', 'text'),
+        ('transaction_type', 'Type', 'text'),
+        ('quantity', 'Quantity', QUANTITY),
+        ('price_per_unit', 'Price', PRICE),
+        ('total_amount', 'Total', MONEY),
+        ('fees', 'Fees', MONEY),
+        ('currency', 'Currency', 'text'),
+        ('transaction_date', 'Date', 'datetime'),
+        ('notes', 'Notes', 'text')]),
+    'performance': (queries.export_performance, [
+        ('portfolio_id', 'Portfolio ID', 'int'),
+        ('portfolio_name', 'Portfolio', 'text'),
+        ('metric_date', 'Date', 'date'),
+        ('total_value', 'Total Value', MONEY),
+        ('market_value', 'Market Value', MONEY),
+        ('cost_basis', 'Cost Basis', MONEY),
+        ('holdings_count', 'Holdings', 'int'),
+        ('daily_return', 'Daily Return %', PERCENT),
+        ('total_return', 'Total Return %', PERCENT),
+        ('benchmark_return', 'Benchmark Return %', PERCENT),
+        ('currency', 'Currency', 'text')]),
+    'watchlist': (queries.export_watchlist, [
+        ('asset_symbol', 'Symbol', 'text'),
+        ('asset_name', 'Asset', 'text'),
+        ('current_price', 'Current Price', PRICE),
+        ('currency', 'Currency', 'text'),
+        ('target_price', 'Target Price', PRICE),
+        ('added_date', 'Added', 'datetime'),
+        ('notes', 'Notes', 'text')]),
+}
+
+
+class ExportError(ValueError):
+    """An export that cannot be made as asked"""
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+# Writers: write(row) takes dict rows, close() completes the file
+
+class CsvWriter:
+    def __init__(self, path, columns, title):
+        self.fields = [field for field, _, _ in columns]
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([header for _, header, _ in columns])
+
+    def write(self, row):
+        self.writer.writerow([_text(row[field]) for field in self.fields])
+
+    def close(self):
+        self.file.close()
+
+
+# Excel counts days from 1899-12-30; styles 1 and 2 of _XLSX_STYLES
+# display them as a date and a date and time
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+
+_XLSX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="1"><fill><patternFill patternType="none"/></fill></fills>
+<borders count="1"><border/></borders>
+<cellStyleXfs count="1"><xf/></cellStyleXfs>
+<cellXfs count="4"><xf/><xf numFmtId="14" applyNumberFormat="1"/><xf numFmtId="22" applyNumberFormat="1"/><xf fontId="1" applyFont="1"/></cellXfs>
+</styleSheet>"""
+
+
+class XlsxWriter:
+    """A workbook written as its rows arrive.
+
+    Strings are stored inline rather than in a shared string table, so
+    nothing needs to be kept until the end; each sheet is one compressed
+    entry of the zip file, written as a stream.
+    """
+
+    def __init__(self, path, columns, title):
+        self.columns = columns
+        self.title = title[:25]
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self.sheets = 0
+        self.sheet = None
+        self._new_sheet()
+
+    def _new_sheet(self):
+        if self.sheet is not None:
+            self.sheet.write(b'</sheetData></worksheet>')
+            self.sheet.close()
+        self.sheets += 1
+        self.rows = 0
+        self.sheet = self.zip.open(f'xl/worksheets/sheet{self.sheets}.xml', 'w',
+                                   force_zip64=True)
+        self.sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         b'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                         b'spreadsheetml/2006/main"><sheetData>')
+        self.sheet.write(('<row>' + ''.join(self._string(header, ' s="3"')
+                                            for _, header, _ in self.columns)
+                          + '</row>').encode())
+
+    @staticmethod
+    def _string(value, style=''):
+        value = escape(str(value).translate(_XML_ILLEGAL))
+        return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{value}</t></is></c>'
+
+    def _cell(self, value, kind):
+        if value is None:
+            return '<c/>'
+        if kind in ('date', 'datetime') and isinstance(value, date):
+            moment = value if isinstance(value, datetime) else datetime.combine(value, datetime.min.time())
+            serial = (moment - _EXCEL_EPOCH).total_seconds() / 86400
+            return f'<c s="{1 if kind == "date" else 2}"><v>{serial!r}</v></c>'
+        if kind != 'text' and isinstance(value, (int, float, Decimal)):
+            return f'<c><v>{value}</v></c>'
+        return self._string(value)
+
+    def write(self, row):
+        if self.rows == SHEET_ROWS:
+            self._new_sheet()
+        self.rows += 1
+        self.sheet.write(('<row>' + ''.join(self._cell(row[field], kind)
+                                            for field, _, kind in self.columns)
+                          + '</row>').encode())
+
+    def close(self):
+        self.sheet.write(b'</sheetData></worksheet>')
+        self.sheet.close()
+        sheets = range(1, self.sheets + 1)
+        names = [self.title if n == 1 else f"{self.title} {n}" for n in sheets]
+        main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+        relations = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+        package = 'http://schemas.openxmlformats.org/package/2006/relationships'
+        self.zip.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for n in sheets)
+            + '</Types>'))
+        self.zip.writestr('_rels/.rels', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{package}">'
+            f'<Relationship Id="rId1" Type="{relations}/officeDocument" Target="xl/workbook.xml"/>'
+            f'</Relationships>'))
+        self.zip.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{main}" xmlns:r="{relations}"><sheets>'
+            + ''.join(f'<sheet name="{escape(name)}" sheetId="{n}" r:id="rId{n}"/>'
+                      for n, name in zip(sheets, names))
+            + '</sheets></workbook>'))
+        self.zip.writestr('xl/_rels/workbook.xml.rels', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{package}">'
+            + ''.join(f'<Relationship Id="rId{n}" Type="{relations}/worksheet" '
+                      f'Target="worksheets/sheet{n}.xml"/>' for n in sheets)
+            + f'<Relationship Id="rId{self.sheets + 1}" Type="{relations}/styles" '
+              f'Target="styles.xml"/></Relationships>'))
+        self.zip.writestr('xl/styles.xml', _XLSX_STYLES)
+        self.zip.close()
+
+
+class ParquetWriter:
+    """Row groups of ROW_GROUP rows, converted column by column"""
+
+    def __init__(self, path, columns, title):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ExportError("Install pyarrow to export Parquet") from None
+        self.pa = pyarrow
+        types = {'int': pyarrow.int64(), 'text': pyarrow.string(),
+                 'date': pyarrow.date32(), 'datetime': pyarrow.timestamp('s')}
+        self.schema = pyarrow.schema([
+            (field, types[kind] if isinstance(kind, str) else pyarrow.decimal128(*kind))
+            for field, _, kind in columns])
+        self.fields = [field for field, _, _ in columns]
+        self.scales = [None if isinstance(kind, str) else Decimal(1).scaleb(-kind[1])
+                       for _, _, kind in columns]
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        self.columns = [[] for _ in self.fields]
+
+    def write(self, row):
+        for values, field, scale in zip(self.columns, self.fields, self.scales):
+            value = row[field]
+            if scale is not None and value is not None:
+                # DECIMAL columns hold exactly their scale's digits
+                value = Decimal(str(value)).quantize(scale)
+            values.append(value)
+        if len(self.columns[0]) >= ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        arrays = [self.pa.array(values, type=field.type)
+                  for values, field in zip(self.columns, self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = [[] for _ in self.fields]
+
+    def close(self):
+        if self.columns[0]:
+            self._flush()
+        self.writer.close()
+
+
+FORMATS = {'csv': CsvWriter, 'xlsx': XlsxWriter, 'parquet': ParquetWriter}
+
+
+def format_for(path):
+    """The format a file name asks for by its extension, or None"""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'pq': 'parquet'}.get(extension, extension) if extension else None
+
+
+def export_report(report, user_id, path, fmt=None, progress=None, cancelled=None,
+                  chunk=CHUNK_ROWS):
+    """Write one of the user's REPORTS to path, as fmt or as its extension says.
+
+    Can run on a worker thread. progress(fraction, result) is called
+    every chunk rows; cancelled() is checked as often, and a cancelled
+    export leaves no file behind. Returns a summary dict.
+    """
+    if report not in REPORTS:
+        raise ExportError(f"Export one of {', '.join(REPORTS)}, not {report!r}")
+    fmt = fmt or format_for(path)
+    if fmt not in FORMATS:
+        raise ExportError(f"Export as one of {', '.join(FORMATS)}, e.g. {report}.csv")
+    build, columns = REPORTS[report]
+    query, params = build(user_id)
+    total = DatabaseConnection.run_query(*queries.row_count(query, params))[0]['count']
+    result = {'report': report, 'format': fmt, 'path': path, 'total': total,
+              'written': 0, 'cancelled': False}
+
+    partial = path + '.part'
+    writer = FORMATS[fmt](partial, columns, report.capitalize())
+    try:
+        rows = DatabaseConnection.stream(query, params, size=chunk)
+        try:
+            for row in rows:
+                writer.write(row)
+                result['written'] += 1
+                if result['written'] % chunk == 0:
+                    if progress is not None:
+                        progress(result['written'] / max(total, 1), result)
+                    if cancelled is not None and cancelled():
+                        result['cancelled'] = True
+                        break
+        finally:
+            rows.close()
+        writer.close()
+    except BaseException:
+        _discard(writer, partial)
+        raise
+    if result['cancelled']:
+        os.remove(partial)
+    else:
+        os.replace(partial, path)
+        if progress is not None:
+            progress(1.0, result)
+    return result
+
+
+def _discard(writer, partial):
+    try:
+        writer.close()
+    except Exception:
+        pass
+    if os.path.exists(partial):
+        os.remove(partial)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a user's data to a file")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--user', type=int, required=True, help="User id")
+    parser.add_argument('--output', required=True,
+                        help="File to write; the format follows its extension")
+    parser.add_argument('--format', choices=sorted(FORMATS),
+                        help="Format, if the extension does not say")
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    args = parser.parse_args()
+
+    def show(fraction, result):
+        print(f"\r{result['written']:,} of {result['total']:,} rows ({fraction:.0%})",
+              end='', file=sys.stderr, flush=True)
+
+    DatabaseConnection.configure(args.db)
+    try:
+        result = export_report(args.report, args.user, args.output, args.format,
+                               progress=show)
+    except ExportError as e:
+        parser.error(str(e))
+    finally:
+        DatabaseConnection.close_pool()
+    print(file=sys.stderr)
+    print(f"Wrote {result['written']:,} rows to {result['path']}")
+
+
+if __name__ == "__main__":
+    main()
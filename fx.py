@@ -0,0 +1,236 @@
+"""
+Currency conversion for the Portfolio Management System
+
+Assets are priced in their own currency (Assets.currency) and portfolios
+report in theirs (Portfolios.currency); FX_Rates keeps the daily history
+of exchange rates (migrations/009_currencies.sql). A stored rate is the
+number of units of quote_currency one unit of base_currency buys.
+
+RATES indexes every stored rate in memory, rebuilds the index only when
+the cached FX_Rates rows change, and memoizes lookups by (pair, date).
+A lookup takes the pair's latest rate on or before the date (its first
+rate for earlier dates), inverts the opposite pair or crosses through
+USD. Values are never converted with a lookup per row:
+
+    RATES.convert(rows, fields, ...)    one lookup per distinct currency
+                                        pair and date among the rows
+    RATES.series(base, quote, ...)      the rate of each day of a range,
+                                        for whole columns of daily values
+
+Load rates from a CSV file of base,quote,date,rate rows (with a header
+line) and refresh the snapshots they change:
+
+    python fx.py rates.csv
+"""
+
+import argparse
+import csv
+import os
+import threading
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import queries
+import snapshots
+from cache import REFERENCE_TTL
+from database import DatabaseConnection
+
+# Pairs not stored either way are crossed through this currency
+PIVOT = 'USD'
+
+# Totals across portfolios in different currencies are reported in this one
+REPORT_CURRENCY = os.environ.get('PORTFOLIO_CURRENCY', 'USD')
+
+# Shown before amounts; other currencies are shown by their code
+CURRENCY_SYMBOLS = {'USD': '$', 'GBP': '£', 'EUR': '€', 'JPY': '¥', 'CAD': 'C$'}
+
+_ONE = Decimal(1)
+
+
+class MissingRate(LookupError):
+    """No stored rate converts one currency into another"""
+
+
+def money(value, currency):
+    """An amount for display in its currency, e.g. €1,234.50 or 1,234.50 CHF"""
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{value:,.2f}" if symbol else f"{value:,.2f} {currency}"
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _stored(pairs, base, quote, first_day, count):
+    """Rates of a stored pair, or of the opposite pair inverted, for count
+    days from ordinal first_day; None if neither is stored"""
+    if (base, quote) in pairs:
+        (days, rates), invert = pairs[(base, quote)], False
+    elif (quote, base) in pairs:
+        (days, rates), invert = pairs[(quote, base)], True
+    else:
+        return None
+    i = max(bisect_right(days, first_day) - 1, 0)
+    found = []
+    for day in range(first_day, first_day + count):
+        while i + 1 < len(days) and days[i + 1] <= day:
+            i += 1
+        found.append(rates[i])
+    return [_ONE / rate for rate in found] if invert else found
+
+
+def _find(pairs, base, quote, first_day, count):
+    rates = _stored(pairs, base, quote, first_day, count)
+    if rates is None and PIVOT not in (base, quote):
+        to_pivot = _stored(pairs, base, PIVOT, first_day, count)
+        from_pivot = _stored(pairs, PIVOT, quote, first_day, count)
+        if to_pivot is not None and from_pivot is not None:
+            rates = [a * b for a, b in zip(to_pivot, from_pivot)]
+    if rates is None:
+        raise MissingRate(f"No exchange rate from {base} to {quote}")
+    return rates
+
+
+def _pick(spec, row):
+    return spec(row) if callable(spec) else spec
+
+
+class RateCache:
+    """Exchange rates by currency pair and date, answered from memory.
+
+    The index is built from the FX_Rates rows in the query cache and
+    rebuilt when those are replaced, after REFERENCE_TTL or a write to
+    FX_Rates; rates looked up are memoized until then.
+    """
+
+    def __init__(self):
+        self._rows = None
+        self._pairs = {}    # (base, quote): ([day ordinals], [rates])
+        self._memo = {}     # ((base, quote), date): rate
+        self._lock = threading.Lock()
+
+    def _index(self):
+        rows = DatabaseConnection.run_query(queries.FX_RATES, cache_ttl=REFERENCE_TTL)
+        with self._lock:
+            if rows is not self._rows:
+                pairs = {}
+                for row in rows:    # Ordered by pair and date
+                    days, rates = pairs.setdefault(
+                        (row['base_currency'], row['quote_currency']), ([], []))
+                    days.append(row['rate_date'].toordinal())
+                    rates.append(_decimal(row['rate']))
+                self._rows, self._pairs, self._memo = rows, pairs, {}
+            return self._pairs, self._memo
+
+    @staticmethod
+    def _rate(pairs, memo, base, quote, day):
+        if base == quote:
+            return _ONE
+        key = ((base, quote), day)
+        rate = memo.get(key)
+        if rate is None:
+            rate = memo[key] = _find(pairs, base, quote, day.toordinal(), 1)[0]
+        return rate
+
+    def rate(self, base, quote, day=None):
+        """Units of quote one unit of base buys on day (today), as a Decimal.
+        Raises MissingRate if no rate relates the two currencies."""
+        pairs, memo = self._index()
+        return self._rate(pairs, memo, base, quote, day or date.today())
+
+    def series(self, base, quote, first_day, count):
+        """The rate on each of count days from ordinal first_day, as floats"""
+        if base == quote:
+            return [1.0] * count
+        pairs, _ = self._index()
+        return [float(rate) for rate in _find(pairs, base, quote, first_day, count)]
+
+    def convert(self, rows, fields, target, day=None):
+        """Copies of dict rows with fields converted from row['currency'] into
+        target at the rates of day (today).
+
+        target and day are one value for every row or a function of the
+        row. Decimal and int values become Decimal, floats stay floats.
+        """
+        pairs, memo = self._index()
+        day = day or date.today()
+        factors = {}
+        converted = []
+        for row in rows:
+            key = (row['currency'], _pick(target, row), _pick(day, row))
+            factor = factors.get(key)
+            if factor is None:
+                rate = self._rate(pairs, memo, *key)
+                factor = factors[key] = (rate, float(rate))
+            row = dict(row)
+            for field in fields:
+                value = row[field]
+                if value is not None:
+                    row[field] = value * factor[1 if isinstance(value, float) else 0]
+            converted.append(row)
+        return converted
+
+
+RATES = RateCache()
+
+
+# Loading rates
+
+def read_rates(path):
+    """(base, quote, date, rate) tuples of a CSV file; raises ValueError"""
+    rates = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for line, record in enumerate(reader, 2):
+            if not any(field.strip() for field in record):
+                continue
+            try:
+                base, quote, day, rate = (field.strip() for field in record)
+                base, quote = base.upper(), quote.upper()
+                day, rate = date.fromisoformat(day), Decimal(rate)
+            except (ValueError, InvalidOperation):
+                raise ValueError(f"Line {line}: expected base,quote,YYYY-MM-DD,rate") from None
+            if not (len(base) == len(quote) == 3 and base.isalpha() and quote.isalpha()):
+                raise ValueError(f"Line {line}: currencies are three-letter codes")
+            if base == quote or not rate > 0:
+                raise ValueError(f"Line {line}: a rate is positive and between two currencies")
+            rates.append((base, quote, day, rate))
+    return rates
+
+
+def save_rates(rates):
+    """Store (base, quote, date, rate) rows and drop the returns cached for
+    ranges ending on or after the first of them; returns the currencies"""
+    rates = list(rates)
+    if not rates:
+        return []
+    DatabaseConnection.run_many(queries.UPSERT_FX_RATE, rates)
+    DatabaseConnection.run_query(*queries.delete_returns_since(min(r[2] for r in rates)),
+                                 fetch=False)
+    return sorted({currency for rate in rates for currency in rate[:2]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load exchange rates into FX_Rates")
+    parser.add_argument('csv', help="File of base,quote,date,rate rows with a header line")
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    args = parser.parse_args()
+    try:
+        rates = read_rates(args.csv)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    DatabaseConnection.configure(args.db)
+    try:
+        currencies = save_rates(rates)
+        refreshed = snapshots.on_rate_change(currencies)
+        print(f"Loaded {len(rates):,} rates for {', '.join(currencies) or 'no currencies'}; "
+              f"refreshed {refreshed:,} snapshots")
+    finally:
+        DatabaseConnection.close_pool()
+
+
+if __name__ == "__main__":
+    main()
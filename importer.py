@@ -0,0 +1,347 @@
+"""
+Bulk transaction import for the Portfolio Management System
+
+Loads broker exports (CSV or OFX) into Transactions without reading the
+whole file into memory: records are parsed as the file is read, checked,
+and inserted batch_size at a time with executemany, one transaction per
+batch. Symbols are resolved through a map of the asset catalog loaded
+once up front. The imported transactions are applied to the holdings
+of the affected portfolios once at the end, followed by their snapshots.
+
+CSV files need a header row. Column names are matched loosely, e.g.
+"Trade Date", "Ticker", "Action", "Shares", "Price", "Commission"; an
+optional "Portfolio" column (portfolio id) overrides the target
+portfolio per row.
+"""
+
+import csv
+import io
+import os
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import queries
+import snapshots
+from cache import ACCOUNT_TTL, REFERENCE_TTL
+from database import DatabaseConnection
+
+BATCH_SIZE = 2000
+MAX_ERRORS = 100        # Rejected rows reported back in detail
+READ_SIZE = 64 * 1024   # OFX is tokenized this many characters at a time
+
+# Header aliases, compared lower case without spaces or underscores
+CSV_COLUMNS = {
+    'date': ('date', 'tradedate', 'transactiondate'),
+    'symbol': ('symbol', 'assetsymbol', 'ticker'),
+    'type': ('type', 'action', 'transactiontype'),
+    'quantity': ('quantity', 'qty', 'shares', 'units'),
+    'price': ('price', 'priceperunit', 'unitprice'),
+    'fees': ('fees', 'fee', 'commission'),
+    'notes': ('notes', 'description', 'memo'),
+    'portfolio': ('portfolio', 'portfolioid')
+}
+REQUIRED_COLUMNS = ('date', 'symbol', 'type', 'quantity', 'price')
+
+TRANSACTION_TYPES = {
+    'buy': 'buy', 'bought': 'buy', 'b': 'buy',
+    'sell': 'sell', 'sold': 'sell', 's': 'sell',
+    'dividend': 'dividend', 'div': 'dividend', 'income': 'dividend'
+}
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%Y%m%d', '%Y%m%d%H%M%S')
+
+# Column limits of the Transactions table
+MAX_QUANTITY = Decimal('1e9')
+MAX_PRICE = Decimal('1e8')
+
+# OFX investment transaction aggregates and what they mean here
+OFX_TRADES = {
+    'BUYSTOCK': 'buy', 'BUYMF': 'buy', 'BUYDEBT': 'buy', 'BUYOPT': 'buy',
+    'BUYOTHER': 'buy', 'REINVEST': 'buy',
+    'SELLSTOCK': 'sell', 'SELLMF': 'sell', 'SELLDEBT': 'sell', 'SELLOPT': 'sell',
+    'SELLOTHER': 'sell', 'INCOME': 'dividend'
+}
+OFX_FIELDS = {'DTTRADE', 'UNIQUEID', 'TICKER', 'UNITS', 'UNITPRICE', 'COMMISSION',
+              'FEES', 'TOTAL', 'MEMO'}
+
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported"""
+
+
+# Parsing
+
+def _header_key(name):
+    return re.sub(r'[\s_]+', '', name.strip().lower())
+
+
+def iter_csv(text):
+    """Yield (line, record) for each row of a CSV export"""
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    aliases = {alias: field for field, names in CSV_COLUMNS.items() for alias in names}
+    columns = {}
+    for i, name in enumerate(header):
+        field = aliases.get(_header_key(name))
+        if field is not None and field not in columns:
+            columns[field] = i
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise RecordError(f"Missing column(s): {', '.join(missing)}")
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield reader.line_num, {field: row[i] if i < len(row) else ''
+                                for field, i in columns.items()}
+
+
+def _ofx_tags(text):
+    """Yield (closing, TAG, value) from an OFX file, SGML or XML flavour"""
+    pending = ''
+    while True:
+        chunk = text.read(READ_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        # Keep the last, possibly incomplete, tag for the next round
+        cut = pending.rfind('<')
+        for match in _OFX_TAG.finditer(pending, 0, cut if cut > 0 else 0):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        pending = pending[cut:] if cut > 0 else pending
+    for match in _OFX_TAG.finditer(pending):
+        yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+
+
+def ofx_securities(text):
+    """Map each security id in an OFX SECLIST to its ticker"""
+    tickers, current = {}, None
+    for closing, tag, value in _ofx_tags(text):
+        if tag == 'SECINFO':
+            if closing and current and current.get('UNIQUEID') and current.get('TICKER'):
+                tickers[current['UNIQUEID']] = current['TICKER']
+            current = None if closing else {}
+        elif current is not None and not closing and tag in ('UNIQUEID', 'TICKER'):
+            current[tag] = value
+    return tickers
+
+
+def iter_ofx(text, tickers):
+    """Yield (number, record) for each investment transaction of an OFX export"""
+    number, kind, fields = 0, None, None
+    for closing, tag, value in _ofx_tags(text):
+        if tag in OFX_TRADES:
+            if not closing:
+                kind, fields = tag, {}
+            elif kind == tag:
+                number += 1
+                yield number, _ofx_record(kind, fields, tickers)
+                kind, fields = None, None
+        elif fields is not None and not closing and tag in OFX_FIELDS:
+            fields[tag] = value
+
+
+def _ofx_record(kind, fields, tickers):
+    security = fields.get('UNIQUEID', '')
+    record = {
+        'date': fields.get('DTTRADE', '')[:8],
+        'symbol': tickers.get(security) or fields.get('TICKER') or security,
+        'type': OFX_TRADES[kind],
+        'quantity': fields.get('UNITS', ''),
+        'price': fields.get('UNITPRICE', ''),
+        'fees': ' + '.join(fields[f] for f in ('COMMISSION', 'FEES') if f in fields),
+        'notes': fields.get('MEMO', '')
+    }
+    if kind == 'INCOME':
+        # Income has only a total: record it as one unit at that price
+        record['quantity'], record['price'] = '1', fields.get('TOTAL', '')
+    return record
+
+
+# Validation
+
+def _decimal(text, field):
+    cleaned = text.strip().replace(',', '').replace('$', '')
+    try:
+        value = Decimal(cleaned)
+    except InvalidOperation:
+        raise RecordError(f"invalid {field}: {text!r}") from None
+    if not value.is_finite():
+        raise RecordError(f"invalid {field}: {text!r}")
+    return value
+
+
+def _date(text):
+    text = text.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise RecordError(f"invalid date: {text!r}")
+
+
+def parse_record(record, symbols, portfolios, portfolio_id=None):
+    """Turn a raw record into an INSERT_TRANSACTION row; raises RecordError"""
+    kind = TRANSACTION_TYPES.get(record['type'].strip().lower())
+    if kind is None:
+        raise RecordError(f"unknown transaction type: {record['type']!r}")
+
+    symbol = record['symbol'].strip().upper()
+    asset_id = symbols.get(symbol)
+    if asset_id is None:
+        raise RecordError(f"unknown symbol: {symbol!r}")
+
+    target = record.get('portfolio', '').strip()
+    if target:
+        try:
+            target = int(target)
+        except ValueError:
+            raise RecordError(f"invalid portfolio: {target!r}") from None
+    else:
+        target = portfolio_id
+    if target not in portfolios:
+        raise RecordError(f"not one of your portfolios: {target}")
+
+    # Brokers often sign quantities by direction
+    quantity = abs(_decimal(record['quantity'], 'quantity'))
+    price = _decimal(record['price'], 'price')
+    # OFX may report commission and fees separately, e.g. "4.95 + 0.05"
+    fees = sum((abs(_decimal(part, 'fees')) for part in record.get('fees', '').split(' + ')
+                if part.strip()), Decimal(0))
+    if quantity == 0 or quantity >= MAX_QUANTITY:
+        raise RecordError(f"quantity out of range: {quantity}")
+    if price < 0 or price >= MAX_PRICE:
+        raise RecordError(f"price out of range: {price}")
+    if fees >= MAX_PRICE:
+        raise RecordError(f"fees out of range: {fees}")
+
+    notes = record.get('notes', '').strip() or None
+    return (target, asset_id, kind, quantity, price, _date(record['date']), fees, notes)
+
+
+# Holdings
+
+def rebuild_holdings(portfolio_ids, id_ranges):
+    """Apply to the holdings of portfolio_ids the transactions with ids in
+    id_ranges ((first, last) pairs, as DatabaseConnection.insert_many
+    returns them).
+
+    Works the way sp_add_transaction does, in date order: buys average
+    into the position, sells reduce it, and a position sold to zero is
+    closed so the next buy starts a new one. Positions start from the
+    holdings as they are, so holdings no transaction explains (e.g.
+    entered directly) are kept, and positions without new transactions
+    are not touched. Only the given transactions are applied: one added
+    meanwhile through sp_add_transaction is already in the holdings, and
+    the holdings stay locked from being read until they are rewritten.
+    Returns the number of positions rewritten.
+    """
+    with DatabaseConnection.transaction(['Portfolio_Holdings']) as cursor:
+        cursor.execute(*queries.position_holdings(sorted(portfolio_ids)))
+        positions = {}
+        for portfolio_id, asset_id, quantity, price, opened in cursor.fetchall():
+            key = (portfolio_id, asset_id)
+            if key in positions:
+                # Several rows of one asset become a single position
+                held, held_price, opened = positions[key]
+                price = (held * held_price + quantity * price) / (held + quantity)
+                quantity += held
+            positions[key] = (quantity, price, opened)
+
+        changed = {}
+        for row in DatabaseConnection.stream(*queries.transaction_replay(id_ranges)):
+            key = (row['portfolio_id'], row['asset_id'])
+            quantity, price, opened = changed.get(key) or positions.get(
+                key, (Decimal(0), Decimal(0), None))
+            units, unit_price = row['quantity'], row['price_per_unit']
+            if row['transaction_type'] == 'buy':
+                if quantity <= 0:
+                    quantity, price, opened = units, unit_price, row['transaction_date'].date()
+                else:
+                    price = (quantity * price + units * unit_price) / (quantity + units)
+                    quantity += units
+            elif row['transaction_type'] == 'sell':
+                quantity -= units
+            changed[key] = (quantity, price, opened)
+
+        holdings = [(*key, quantity, price, opened)
+                    for key, (quantity, price, opened) in changed.items() if quantity > 0]
+        if changed:
+            cursor.executemany(queries.DELETE_POSITION, list(changed))
+        if holdings:
+            cursor.executemany(queries.INSERT_HOLDING, holdings)
+    return len(holdings)
+
+
+# Import
+
+def import_file(path, user_id, portfolio_id=None, batch_size=BATCH_SIZE,
+                progress=None, cancelled=None):
+    """Import a CSV or OFX export into the user's portfolios.
+
+    Called on a worker thread. progress(fraction, result) is called after
+    each batch; cancelled() is checked between batches, and batches that
+    were already committed are kept. Returns a summary dict.
+    """
+    run = DatabaseConnection.run_query
+    symbols = {row['asset_symbol'].upper(): row['asset_id']
+               for row in run(queries.ASSET_SYMBOLS, cache_ttl=REFERENCE_TTL)}
+    portfolios = {row['portfolio_id']
+                  for row in run(queries.PORTFOLIO_CHOICES, (user_id,), cache_ttl=ACCOUNT_TTL)}
+
+    is_ofx = os.path.splitext(path)[1].lower() in ('.ofx', '.qfx')
+    tickers = {}
+    if is_ofx:
+        # SECLIST usually follows the transactions: read it in a first pass
+        with open(path, encoding='utf-8', errors='replace') as text:
+            tickers = ofx_securities(text)
+
+    result = {'read': 0, 'imported': 0, 'rejected': 0, 'errors': [],
+              'cancelled': False, 'holdings': 0}
+    touched = set()
+    inserted = []       # Ranges of the transaction ids the import got
+    size = os.path.getsize(path) or 1
+    batch = []
+
+    def flush():
+        first, last = DatabaseConnection.insert_many(queries.INSERT_TRANSACTION, batch)
+        if inserted and inserted[-1][1] + 1 == first:
+            inserted[-1] = (inserted[-1][0], last)
+        else:
+            inserted.append((first, last))
+        result['imported'] += len(batch)
+        touched.update(row[0] for row in batch)
+        batch.clear()
+
+    with open(path, 'rb') as raw:
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace', newline='')
+        records = iter_ofx(text, tickers) if is_ofx else iter_csv(text)
+        for line, record in records:
+            result['read'] += 1
+            try:
+                batch.append(parse_record(record, symbols, portfolios, portfolio_id))
+            except RecordError as e:
+                result['rejected'] += 1
+                if len(result['errors']) < MAX_ERRORS:
+                    result['errors'].append((line, str(e)))
+            if len(batch) >= batch_size:
+                flush()
+                if progress is not None:
+                    progress(raw.tell() / size, result)
+                if cancelled is not None and cancelled():
+                    result['cancelled'] = True
+                    break
+        if batch:
+            flush()
+
+    if touched:
+        result['holdings'] = rebuild_holdings(touched, inserted)
+        snapshots.refresh(touched)
+    if progress is not None:
+        progress(1.0, result)
+    return result
@@ -0,0 +1,336 @@
+"""
+Timing instrumentation for the Portfolio Management System
+
+Records how long queries take and how long each dashboard tab takes to
+build and fill, so startup regressions can be spotted. Set the
+PORTFOLIO_TIMINGS environment variable to log every measurement.
+
+Every measurement also lands in a histogram of `metrics`, labelled with
+the call site that caused it: the GUI method or API handler that
+started the work (see call_site and tagged). Alongside query latency
+the histograms hold rows returned, connection acquire time and table
+render time. Queries slower than slow_queries.threshold are kept in the
+slow query log with their EXPLAIN plan. metrics.export() writes
+everything as Prometheus text or JSON; set PORTFOLIO_METRICS_FILE to
+have the application rewrite such a file periodically.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('portfolio.timing')
+slow_logger = logging.getLogger('portfolio.slow_query')
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+SLOW_QUERY_SECONDS = 0.5
+EXPLAIN_INTERVAL = 300      # Seconds before the same slow query is explained again
+EXPORT_INTERVAL = 15        # Seconds between rewrites of PORTFOLIO_METRICS_FILE
+
+_site = contextvars.ContextVar('call_site', default=None)
+
+
+def query_label(query):
+    """Short single-line label for a SQL statement"""
+    text = re.sub(r'\s+', ' ', query).strip()
+    return text if len(text) <= 80 else text[:77] + '...'
+
+
+# Call sites
+
+@contextmanager
+def call_site(name):
+    """Attribute the measurements made inside the block to name.
+
+    QueryExecutor and the API server carry the call site over to the
+    worker thread that runs the query.
+    """
+    token = _site.set(name)
+    try:
+        yield
+    finally:
+        _site.reset(token)
+
+
+def current_site():
+    return _site.get() or 'untagged'
+
+
+def tagged(fn):
+    """Decorator: run fn as the call site named after it"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with call_site(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# Metrics
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate, interpolating linearly within the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Metrics:
+    """Thread-safe histograms and counters keyed by name and labels.
+
+    Every series is labelled with the current call site unless a site
+    label is given explicitly.
+    """
+
+    def __init__(self, prefix='portfolio'):
+        self.prefix = prefix
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._counters = {}     # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(metric, labels):
+        labels.setdefault('site', current_site())
+        return metric, tuple(sorted(labels.items()))
+
+    def observe(self, metric, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(metric, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, metric, amount=1, **labels):
+        key = self._key(metric, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Every series as plain dicts, histograms with p50/p95/p99 estimates"""
+        with self._lock:
+            histograms = [(name, dict(labels), h.buckets, list(h.counts), h.count, h.sum,
+                           h.max, [h.quantile(q) for q in (0.5, 0.95, 0.99)])
+                          for (name, labels), h in self._histograms.items()]
+            counters = [(name, dict(labels), value)
+                        for (name, labels), value in self._counters.items()]
+        return {
+            'histograms': [
+                {'name': name, 'labels': labels, 'count': count, 'sum': total, 'max': worst,
+                 'p50': p50, 'p95': p95, 'p99': p99,
+                 'buckets': dict(zip([str(b) for b in buckets] + ['+Inf'], counts))}
+                for name, labels, buckets, counts, count, total, worst, (p50, p95, p99)
+                in sorted(histograms, key=lambda h: (h[0], sorted(h[1].items())))],
+            'counters': [{'name': name, 'labels': labels, 'value': value}
+                         for name, labels, value
+                         in sorted(counters, key=lambda c: (c[0], sorted(c[1].items())))]
+        }
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for h in snapshot['histograms']:
+            name = f"{self.prefix}_{h['name']}"
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, count in h['buckets'].items():
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(h['labels'], le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(h['labels'])} {h['sum']:.6f}")
+            lines.append(f"{name}_count{_labels(h['labels'])} {h['count']}")
+        for c in snapshot['counters']:
+            name = f"{self.prefix}_{c['name']}_total"
+            declare(name, 'counter')
+            lines.append(f"{name}{_labels(c['labels'])} {c['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        snapshot = self.snapshot()
+        snapshot['slow_queries'] = slow_queries.entries()
+        return json.dumps(snapshot, default=str, indent=1)
+
+    def export(self, path):
+        """Write Prometheus text, or JSON if path ends in .json; atomically"""
+        text = self.to_json() if path.endswith('.json') else self.prometheus()
+        temp = f"{path}.tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, path)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items.items()) + '}'
+
+
+def start_exporter(path, interval=EXPORT_INTERVAL):
+    """Rewrite path with the current metrics every interval seconds.
+
+    Returns a function that stops the exporter after a final write.
+    """
+    stopping = threading.Event()
+
+    def run():
+        while not stopping.wait(interval):
+            _export_quietly(path)
+        _export_quietly(path)
+
+    thread = threading.Thread(target=run, name='metrics-export', daemon=True)
+    thread.start()
+
+    def stop():
+        stopping.set()
+        thread.join()
+    return stop
+
+
+def _export_quietly(path):
+    try:
+        metrics.export(path)
+    except OSError:
+        logger.exception("Could not write metrics to %s", path)
+
+
+# Slow queries
+
+class SlowQueryLog:
+    """The most recent queries slower than threshold, with their plans"""
+
+    def __init__(self, threshold=SLOW_QUERY_SECONDS, maxlen=100):
+        self.threshold = threshold
+        self._entries = deque(maxlen=maxlen)
+        self._explained = {}    # label -> when its plan was last captured
+        self._lock = threading.Lock()
+
+    def should_explain(self, label):
+        """True at most once per EXPLAIN_INTERVAL per query"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(label)
+            if last is not None and now - last < EXPLAIN_INTERVAL:
+                return False
+            self._explained[label] = now
+            return True
+
+    def add(self, label, seconds, rows, plan=None, site=None):
+        entry = {'time': time.time(), 'site': site or current_site(), 'query': label,
+                 'seconds': seconds, 'rows': rows, 'plan': plan}
+        with self._lock:
+            self._entries.append(entry)
+        slow_logger.warning("%.0f ms, %s rows [%s] %s", seconds * 1000, rows,
+                            entry['site'], label)
+        return entry
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._explained.clear()
+
+
+class Timings:
+    """Thread-safe log of named durations, grouped by category"""
+
+    def __init__(self, maxlen=5000):
+        self._events = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, category, name, seconds):
+        with self._lock:
+            self._events.append((category, name, seconds, time.time()))
+        metrics.observe(f"{category}_seconds", seconds, name=name)
+        logger.info("%s %s: %.1f ms", category, name, seconds * 1000)
+
+    @contextmanager
+    def measure(self, category, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(category, name, time.perf_counter() - start)
+
+    def events(self, category=None):
+        with self._lock:
+            events = list(self._events)
+        if category is not None:
+            events = [e for e in events if e[0] == category]
+        return events
+
+    def summary(self, category=None):
+        """Count, total and worst duration per (category, name)"""
+        summary = {}
+        for cat, name, seconds, _ in self.events(category):
+            entry = summary.setdefault((cat, name), {'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+
+# Shared by the database layer, the GUI and the API server
+metrics = Metrics()
+slow_queries = SlowQueryLog()
+timings = Timings()
@@ -0,0 +1,159 @@
+"""
+Load test for the HTTP API (server.py)
+
+Opens a number of keep-alive client connections, logs each one in, then
+has them request a weighted mix of read endpoints as fast as the server
+answers for a fixed duration. Reports requests per second and latency
+percentiles per endpoint and overall:
+
+    python server.py &
+    python loadtest.py --email alice@example.com --clients 50 --seconds 30
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+# Endpoint mix: (weight, path); {portfolio} is one of the user's portfolios
+DEFAULT_MIX = [
+    (30, '/portfolios'),
+    (20, '/portfolios/{portfolio}/holdings'),
+    (20, '/transactions'),
+    (15, '/assets?q={term}'),
+    (10, '/watchlist'),
+    (5, '/reports')
+]
+SEARCH_TERMS = ['a', 'ap', 'bank', 'corp', 'energy', 'fund', 'ms', 'tech', 'z']
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self._reader = self._writer = None
+
+    async def request(self, method, path, payload=None):
+        """Send a request; returns (status, parsed JSON body)"""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}",
+                f"Content-Length: {len(body)}"]
+        if body:
+            head.append("Content-Type: application/json")
+        if self.token:
+            head.append(f"Authorization: Bearer {self.token}")
+        self._writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        try:
+            await self._writer.drain()
+            status_line, headers = await self._read_head()
+            data = await self._reader.readexactly(int(headers.get('content-length', 0)))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        status = int(status_line.split(' ')[1])
+        return status, json.loads(data) if data else None
+
+    async def _read_head(self):
+        lines = (await self._reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return lines[0], headers
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_client(client, email, mix, deadline, results):
+    status, body = await client.request('POST', '/login', {'email': email})
+    if status != 200:
+        raise RuntimeError(f"Login as {email} failed: {status} {body}")
+    client.token = body['token']
+    status, portfolios = await client.request('GET', '/portfolios')
+    portfolio_ids = [p['portfolio_id'] for p in portfolios or []] or [0]
+
+    weights = [weight for weight, _ in mix]
+    while time.monotonic() < deadline:
+        _, template = random.choices(mix, weights)[0]
+        path = template.format(portfolio=random.choice(portfolio_ids),
+                               term=random.choice(SEARCH_TERMS))
+        name = template.split('?')[0]
+        started = time.perf_counter()
+        try:
+            status, _ = await client.request('GET', path)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 'disconnected'
+        latency = time.perf_counter() - started
+        results.setdefault(name, []).append((latency, status))
+    client.close()
+
+
+def report(results, elapsed):
+    print(f"{'endpoint':<34}{'requests':>10}{'errors':>8}{'p50 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}")
+    everything = []
+    for name in sorted(results):
+        samples = results[name]
+        everything.extend(samples)
+        _print_row(name, samples)
+    _print_row('all', everything)
+    print(f"\n{len(everything):,} requests in {elapsed:.1f}s: "
+          f"{len(everything) / elapsed:,.0f} requests/s")
+
+
+def _print_row(name, samples):
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = sum(1 for _, status in samples if status != 200)
+    print(f"{name:<34}{len(samples):>10,}{errors:>8,}{percentile(latencies, 0.5):>9.1f}"
+          f"{percentile(latencies, 0.99):>9.1f}{latencies[-1] if latencies else 0:>9.1f}")
+
+
+async def run(url, email, clients, seconds, mix=DEFAULT_MIX):
+    parts = urlsplit(url)
+    host, port = parts.hostname or '127.0.0.1', parts.port or 80
+    results = {}
+    started = time.monotonic()
+    tasks = [run_client(Client(host, port), email, mix, started + seconds, results)
+             for _ in range(clients)]
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    failures = [o for o in outcomes if isinstance(o, Exception)]
+    if failures:
+        print(f"{len(failures)} of {clients} clients failed, e.g.: {failures[0]!r}")
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the portfolio API")
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--email', required=True, help="User the clients log in as")
+    parser.add_argument('--clients', type=int, default=20, help="Concurrent connections")
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    results, elapsed = asyncio.run(run(args.url, args.email, args.clients, args.seconds))
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Tax-lot accounting for the Portfolio Management System
+
+Replays Transactions into tax lots (migrations/007_tax_lots.sql). Every
+buy opens a lot at its price plus fees per unit; every sell relieves the
+open lots of the same asset in the order of a relief method:
+
+    fifo        oldest lot first
+    lifo        newest lot first
+    hifo        highest unit cost first (the smallest gain)
+    specific    the lots chosen for the sale (Tax_Lot_Selections) first,
+                then oldest first
+
+Each lot (part) a sale relieves becomes a Realized_Gains row with its
+share of the proceeds after fees, its cost basis, and whether it was held
+more than a year. The open lots and the last transaction replayed are
+saved per portfolio and method, so update() only applies the trades
+recorded since. A trade dated before a portfolio's checkpoint (entered
+late) replays that portfolio from its first transaction.
+
+Dividends open or relieve nothing; realized_report() adds them up as
+income from Transactions.
+
+    python lots.py [--method fifo] [--user ID] [--rebuild] [--year 2024]
+"""
+
+import argparse
+import heapq
+import logging
+from collections import deque
+from datetime import date
+from decimal import Decimal
+
+import queries
+from database import DatabaseConnection
+
+logger = logging.getLogger('portfolio.lots')
+
+METHODS = ('fifo', 'lifo', 'hifo', 'specific')
+
+# Portfolios replayed and written per transaction
+LOT_BATCH = 200
+
+# Rows per executemany
+WRITE_BATCH = 5000
+
+LOT_TABLES = ['Tax_Lots', 'Realized_Gains', 'Tax_Lot_Checkpoints']
+
+_CENT = Decimal('0.01')
+_UNIT_COST = Decimal('0.00000001')     # DECIMAL(18, 8)
+_ZERO = Decimal(0)
+
+
+class Lot:
+    """What is still open of one buy"""
+    __slots__ = ('lot_id', 'asset_id', 'acquired', 'quantity', 'unit_cost')
+
+    def __init__(self, lot_id, asset_id, acquired, quantity, unit_cost):
+        self.lot_id = lot_id
+        self.asset_id = asset_id
+        self.acquired = acquired
+        self.quantity = quantity
+        self.unit_cost = unit_cost
+
+
+class Position:
+    """The open lots of one asset in one portfolio, in relief order.
+
+    FIFO and LIFO keep the lots in a deque in acquisition order and take
+    from its left or right end; HIFO keeps a heap on the negated unit
+    cost. Specific-lot relief can use up a lot in the middle of the
+    deque: used-up lots are dropped when they reach the end.
+    """
+    __slots__ = ('method', 'lots', 'by_id')
+
+    def __init__(self, method):
+        self.method = method
+        self.lots = [] if method == 'hifo' else deque()
+        self.by_id = {} if method == 'specific' else None
+
+    def add(self, lot):
+        if self.method == 'hifo':
+            heapq.heappush(self.lots, (-lot.unit_cost, lot.acquired, lot.lot_id, lot))
+        else:
+            self.lots.append(lot)
+        if self.by_id is not None:
+            self.by_id[lot.lot_id] = lot
+
+    def relieve(self, quantity, selections=()):
+        """Take quantity out of the open lots.
+
+        Returns [(lot, quantity taken)] and the quantity no lot covered.
+        """
+        taken = []
+        for lot_id, wanted in selections:
+            lot = self.by_id.get(lot_id) if self.by_id is not None else None
+            if lot is not None and quantity > 0:
+                quantity -= self._take(lot, min(wanted, quantity), taken)
+        while quantity > 0:
+            lot = self._next()
+            if lot is None:
+                break
+            quantity -= self._take(lot, quantity, taken)
+        return taken, quantity
+
+    def _take(self, lot, quantity, taken):
+        quantity = min(quantity, lot.quantity)
+        lot.quantity -= quantity
+        if lot.quantity <= 0 and self.by_id is not None:
+            del self.by_id[lot.lot_id]
+        taken.append((lot, quantity))
+        return quantity
+
+    def _next(self):
+        """The lot to relieve next, or None when none is open"""
+        lots = self.lots
+        while lots:
+            if self.method == 'hifo':
+                lot = lots[0][3]
+            elif self.method == 'lifo':
+                lot = lots[-1]
+            else:
+                lot = lots[0]
+            if lot.quantity > 0:
+                return lot
+            if self.method == 'hifo':
+                heapq.heappop(lots)
+            elif self.method == 'lifo':
+                lots.pop()
+            else:
+                lots.popleft()
+        return None
+
+    def open_lots(self):
+        lots = (entry[3] for entry in self.lots) if self.method == 'hifo' else self.lots
+        return [lot for lot in lots if lot.quantity > 0]
+
+
+class LotBook:
+    """Transactions of a set of portfolios replayed with one relief method"""
+
+    def __init__(self, method, selections=None):
+        self.method = method
+        # Sell transaction_id -> [(lot_id, quantity)] for specific-lot relief
+        self.selections = selections or {}
+        self.positions = {}     # (portfolio_id, asset_id) -> Position
+        self.realized = []      # INSERT_REALIZED_GAIN rows
+        # portfolio_id -> (highest transaction_id, latest transaction_date):
+        # ids are not in date order when trades are entered late
+        self.last = {}
+        self.applied = 0
+        self.unmatched = 0      # Sales of more than the portfolio held
+
+    def _position(self, portfolio_id, asset_id):
+        position = self.positions.get((portfolio_id, asset_id))
+        if position is None:
+            position = self.positions[portfolio_id, asset_id] = Position(self.method)
+        return position
+
+    def load(self, row):
+        """Restore a saved lot (a saved_lots row)"""
+        self._position(row['portfolio_id'], row['asset_id']).add(
+            Lot(row['lot_id'], row['asset_id'], row['acquired_date'],
+                Decimal(row['quantity']), Decimal(row['unit_cost'])))
+
+    def apply(self, row):
+        """Replay one transaction (a lot_replay row)"""
+        portfolio_id, asset_id = row['portfolio_id'], row['asset_id']
+        transaction_id, when = row['transaction_id'], row['transaction_date']
+        last = self.last.get(portfolio_id)
+        self.last[portfolio_id] = ((transaction_id, when) if last is None else
+                                   (max(last[0], transaction_id), max(last[1], when)))
+        self.applied += 1
+        quantity = Decimal(row['quantity'])
+        if row['transaction_type'] == 'dividend' or quantity <= 0:
+            return
+
+        fees = Decimal(row['fees'] or 0)
+        amount = quantity * Decimal(row['price_per_unit'])
+        position = self._position(portfolio_id, asset_id)
+        if row['transaction_type'] == 'buy':
+            unit_cost = ((amount + fees) / quantity).quantize(_UNIT_COST)
+            position.add(Lot(transaction_id, asset_id, when, quantity, unit_cost))
+            return
+
+        # The sale's fees reduce the proceeds of every lot it relieves
+        net = amount - fees
+        taken, uncovered = position.relieve(quantity, self.selections.get(transaction_id, ()))
+        for lot, units in taken:
+            proceeds = (net * units / quantity).quantize(_CENT)
+            cost_basis = (units * lot.unit_cost).quantize(_CENT)
+            self.realized.append((portfolio_id, self.method, transaction_id, lot.lot_id,
+                                  asset_id, lot.acquired, when, units, proceeds, cost_basis,
+                                  proceeds - cost_basis, long_term(lot.acquired, when)))
+        if uncovered > 0:
+            # Sold more than was bought (e.g. history imported part way):
+            # recorded without a lot or cost basis
+            self.unmatched += 1
+            logger.debug("Sale %s of portfolio %s: %s units not covered by open lots",
+                         transaction_id, portfolio_id, uncovered)
+            proceeds = (net * uncovered / quantity).quantize(_CENT)
+            self.realized.append((portfolio_id, self.method, transaction_id, None, asset_id,
+                                  None, when, uncovered, proceeds, _ZERO, proceeds, False))
+
+    def lot_rows(self, portfolio_ids):
+        """INSERT_LOT rows of the open lots of portfolio_ids"""
+        portfolio_ids = set(portfolio_ids)
+        return [(portfolio_id, self.method, lot.lot_id, lot.asset_id, lot.acquired,
+                 lot.quantity, lot.unit_cost)
+                for (portfolio_id, _), position in self.positions.items()
+                if portfolio_id in portfolio_ids
+                for lot in position.open_lots()]
+
+
+def long_term(acquired, sold):
+    """Whether a lot was held more than a year"""
+    acquired = acquired.date() if hasattr(acquired, 'date') else acquired
+    sold = sold.date() if hasattr(sold, 'date') else sold
+    try:
+        anniversary = acquired.replace(year=acquired.year + 1)
+    except ValueError:      # Bought on 29 February
+        anniversary = date(acquired.year + 1, 2, 28)
+    return sold > anniversary
+
+
+def update(portfolio_ids, method='fifo', rebuild=False):
+    """Bring the lots and realized gains of portfolio_ids up to date.
+
+    Only transactions after each portfolio's checkpoint are applied, to
+    its saved lots; portfolios with a back-dated trade (or all of them,
+    with rebuild) are replayed from the start. Returns counts of what was
+    done.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown relief method: {method}")
+    summary = {'portfolios': 0, 'replayed': 0, 'transactions': 0, 'realized': 0,
+               'unmatched': 0}
+    portfolio_ids = sorted(set(portfolio_ids))
+    for start in range(0, len(portfolio_ids), LOT_BATCH):
+        _update(portfolio_ids[start:start + LOT_BATCH], method, rebuild, summary)
+    if summary['portfolios']:
+        logger.info("%s lots: %s", method, summary)
+    return summary
+
+
+def _update(portfolio_ids, method, rebuild, summary):
+    if rebuild:
+        fresh, incremental = portfolio_ids, []
+    else:
+        fresh, incremental = [], []
+        for row in DatabaseConnection.run_query(*queries.lot_changes(portfolio_ids, method)):
+            checkpoint = row['last_transaction_date']
+            if checkpoint is None or row['first_date'] < checkpoint:
+                fresh.append(row['portfolio_id'])
+            else:
+                incremental.append(row['portfolio_id'])
+        if not fresh and not incremental:
+            return
+
+    selections = None
+    if method == 'specific':
+        selections = {}
+        for row in DatabaseConnection.run_query(*queries.lot_selections(fresh + incremental)):
+            selections.setdefault(row['sell_transaction_id'], []).append(
+                (row['lot_id'], Decimal(row['quantity'])))
+    book = LotBook(method, selections)
+    if incremental:
+        for row in DatabaseConnection.run_query(*queries.saved_lots(incremental, method)):
+            book.load(row)
+        for row in DatabaseConnection.stream(*queries.lot_replay(incremental, method)):
+            book.apply(row)
+    if fresh:
+        for row in DatabaseConnection.stream(*queries.lot_replay(fresh)):
+            book.apply(row)
+
+    changed = fresh + incremental
+    with DatabaseConnection.transaction(LOT_TABLES) as cursor:
+        cursor.execute(*queries.delete_lot_state('Tax_Lots', changed, method))
+        if fresh:
+            cursor.execute(*queries.delete_lot_state('Realized_Gains', fresh, method))
+            cursor.execute(*queries.delete_lot_state('Tax_Lot_Checkpoints', fresh, method))
+        _write(cursor, queries.INSERT_LOT, book.lot_rows(changed))
+        _write(cursor, queries.INSERT_REALIZED_GAIN, book.realized)
+        _write(cursor, queries.UPSERT_LOT_CHECKPOINT,
+               [(portfolio_id, method, transaction_id, when)
+                for portfolio_id, (transaction_id, when) in book.last.items()])
+
+    summary['portfolios'] += len(changed)
+    summary['replayed'] += len(fresh)
+    summary['transactions'] += book.applied
+    summary['realized'] += len(book.realized)
+    summary['unmatched'] += book.unmatched
+
+
+def _write(cursor, query, rows):
+    for start in range(0, len(rows), WRITE_BATCH):
+        cursor.executemany(query, rows[start:start + WRITE_BATCH])
+
+
+def update_user(user_id, method='fifo', rebuild=False):
+    rows = DatabaseConnection.run_query(queries.PORTFOLIO_CHOICES, (user_id,))
+    return update((row['portfolio_id'] for row in rows), method, rebuild)
+
+
+def rebuild_all(method='fifo'):
+    """Replay every portfolio's transactions from the start"""
+    rows = DatabaseConnection.run_query(queries.ALL_PORTFOLIOS)
+    return update((row['portfolio_id'] for row in rows), method, rebuild=True)
+
+
+def select_lots(sell_transaction_id, portfolio_id, selections):
+    """Record the lots a sale relieves under specific-lot relief.
+
+    selections: [(lot_id, quantity)], buy transactions of the sale's
+    portfolio and asset. The portfolio's specific-lot state is replayed
+    from the start by the next update.
+    """
+    with DatabaseConnection.transaction(['Tax_Lot_Selections'] + LOT_TABLES) as cursor:
+        cursor.execute(queries.DELETE_LOT_SELECTIONS, (sell_transaction_id,))
+        cursor.executemany(queries.INSERT_LOT_SELECTION,
+                           [(sell_transaction_id, lot_id, quantity)
+                            for lot_id, quantity in selections])
+        cursor.execute(queries.DELETE_LOT_CHECKPOINT, (portfolio_id, 'specific'))
+
+
+def open_lots(user_id, method='fifo'):
+    """The user's open lots valued at current prices (after update)"""
+    return DatabaseConnection.run_query(queries.OPEN_LOTS, (user_id, method))
+
+
+def realized_report(user_id, year, method='fifo'):
+    """Realized gains and dividend income of a tax year (after update)"""
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    gains = DatabaseConnection.run_query(queries.REALIZED_GAINS, (user_id, method, start, end))
+    dividends = DatabaseConnection.run_query(queries.DIVIDEND_INCOME, (user_id, start, end))
+    return {
+        'year': year,
+        'method': method,
+        'gains': gains,
+        'dividends': dividends,
+        'totals': {
+            'short_term': sum((row['gain'] for row in gains if not row['long_term']), _ZERO),
+            'long_term': sum((row['gain'] for row in gains if row['long_term']), _ZERO),
+            'dividends': sum((row['income'] for row in dividends), _ZERO)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay transactions into tax lots")
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    parser.add_argument('--method', choices=METHODS, default='fifo')
+    parser.add_argument('--user', type=int, help="Only this user's portfolios")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Replay every transaction instead of those since the checkpoints")
+    parser.add_argument('--year', type=int,
+                        help="Print the user's realized gains of this tax year (with --user)")
+    args = parser.parse_args()
+    if args.year and not args.user:
+        parser.error("--year needs --user")
+
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    DatabaseConnection.configure(args.db)
+    try:
+        if args.user:
+            summary = update_user(args.user, args.method, args.rebuild)
+        elif args.rebuild:
+            summary = rebuild_all(args.method)
+        else:
+            rows = DatabaseConnection.run_query(queries.ALL_PORTFOLIOS)
+            summary = update((row['portfolio_id'] for row in rows), args.method)
+        print(f"{summary['portfolios']:,} portfolios updated ({summary['replayed']:,} replayed "
+              f"from the start), {summary['transactions']:,} transactions, "
+              f"{summary['realized']:,} realized gains")
+
+        if args.year:
+            report = realized_report(args.user, args.year, args.method)
+            for row in report['gains']:
+                print(f"{row['portfolio_name']:<24}{row['asset_symbol']:<10}"
+                      f"{'long' if row['long_term'] else 'short':<7}{row['gain']:>14,.2f}")
+            totals = report['totals']
+            print(f"Short term {totals['short_term']:,.2f}  Long term "
+                  f"{totals['long_term']:,.2f}  Dividends {totals['dividends']:,.2f}")
+    finally:
+        DatabaseConnection.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,58 +9,125 @@ Requirements:
 - tkinter (usually comes with Python)
 
 Database Configuration:
-Update the DB_CONFIG dictionary with your MySQL credentials
+Update the DB_CONFIG dictionary in database.py with your MySQL credentials
 """
 
+import logging
+import os
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import mysql.connector
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from datetime import datetime
 from decimal import Decimal
 
-# Database Configuration
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': 'your_password',  # Change this
-    'database': 'portfolio_management'
-}
+import alerts
+import export
+import importer
+import queries
+import replica
+import service
+from cache import REFERENCE_TTL
+from database import DatabaseConnection, DatabaseUnavailableError
+from executor import QueryExecutor
+from fx import money
+from instrumentation import call_site, metrics, slow_queries, start_exporter, tagged, timings
+from service import analytics, returns, simulation
+from widgets import VirtualTable
 
-class DatabaseConnection:
-    """Handle database connections and queries"""
-    
-    @staticmethod
-    def get_connection():
-        try:
-            return mysql.connector.connect(**DB_CONFIG)
-        except mysql.connector.Error as e:
-            messagebox.showerror("Database Error", f"Failed to connect: {e}")
-            return None
-    
-    @staticmethod
-    def execute_query(query, params=None, fetch=True):
-        conn = DatabaseConnection.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(query, params or ())
-            
-            if fetch:
-                result = cursor.fetchall()
-            else:
-                conn.commit()
-                result = cursor.rowcount
-            
-            cursor.close()
-            conn.close()
-            return result
-        except mysql.connector.Error as e:
-            messagebox.showerror("Query Error", f"Query failed: {e}")
-            return None
+# Row formatters: turn a query result row into Treeview display values.
+# VirtualTable calls them only for rows that are on screen.
+
+def format_portfolio(p):
+    return (
+        p['portfolio_id'],
+        p['portfolio_name'],
+        p['portfolio_type'],
+        money(p['total_value'], p['currency']),
+        p['currency'],
+        p['status'],
+        p['total_holdings']
+    )
+
+# Prices and cost in the asset's currency, market value in the portfolio's
+def format_holding(h):
+    return (
+        h['asset_name'],
+        h['asset_symbol'],
+        h['asset_type'],
+        f"{h['quantity']:.2f}",
+        money(h['purchase_price'], h['currency']),
+        money(h['current_value'], h['currency']),
+        money(h['market_value'], h['portfolio_currency']),
+        h['purchase_date']
+    )
+
+def format_transaction(t):
+    return (
+        t['transaction_id'],
+        t['portfolio_name'],
+        t['asset_symbol'],
+        t['transaction_type'],
+        f"{t['quantity']:.2f}",
+        money(t['price_per_unit'], t['currency']),
+        money(t['total_amount'], t['currency']),
+        t['transaction_date'],
+        money(t['fees'], t['currency'])
+    )
+
+def format_asset(a):
+    return (
+        a['asset_symbol'],
+        a['asset_name'],
+        a['asset_type'],
+        a['category_name'],
+        money(a['current_price'], a['currency']),
+        a['exchange'],
+        a['last_updated']
+    )
+
+def format_watchlist_item(w):
+    return (
+        w['asset_name'],
+        w['asset_symbol'],
+        money(w['current_price'], w['currency']),
+        money(w['target_price'], w['currency']) if w['target_price'] else "N/A",
+        w['added_date'],
+        w['notes'] or ""
+    )
 
 class PortfolioManagementApp:
+    # Dashboard tabs in notebook order: (label, builder method, data source).
+    # A tab is built the first time it is selected.
+    DASHBOARD_TABS = [
+        ("My Portfolios", 'create_portfolios_tab', 'portfolios'),
+        ("Portfolio Holdings", 'create_holdings_tab', 'portfolio_choices'),
+        ("Transactions", 'create_transactions_tab', 'transactions'),
+        ("Available Assets", 'create_assets_tab', 'assets'),
+        ("Watchlist", 'create_watchlist_tab', 'watchlist'),
+        ("Reports & Analytics", 'create_reports_tab', 'reports')
+    ]
+    
+    # Data sources read from the offline replica once it holds the user's
+    # data; the reports write snapshots and read price history, so they
+    # always come from the server
+    REPLICATED = {'portfolios', 'portfolio_choices', 'transactions', 'assets', 'watchlist'}
+    
+    # How many tabs to the right of the selected one to prefetch
+    PREFETCH_AHEAD = 2
+    
+    # Pause in typing (ms) before the asset search runs
+    SEARCH_DEBOUNCE_MS = 200
+    
+    # How often (ms) the import and export progress bars are updated
+    IMPORT_POLL_MS = 200
+    
+    # How often (ms) watchlist prices are checked against their targets
+    ALERT_POLL_MS = 30000
+    
+    # How often (ms) the offline replica pulls changes from the server
+    REPLICA_SYNC_MS = 60000
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Portfolio Management System")
@@ -73,6 +140,14 @@ class PortfolioManagementApp:
         # Current user
         self.current_user = None
         
+        # Local copy of the user's data (replica.py); None if disabled
+        self.replica = replica.open_replica()
+        self.synced_at = None       # Server time of the replica's last sync
+        
+        # Queries run on worker threads so the window never blocks on MySQL
+        self.executor = QueryExecutor(root)
+        DatabaseConnection.set_error_handler(messagebox.showerror)
+        
         # Create main container
         self.main_container = ttk.Frame(root, padding="10")
         self.main_container.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -97,11 +172,200 @@ class PortfolioManagementApp:
                        background='#34495e', foreground='#ecf0f1')
         style.configure('TButton', font=('Helvetica', 10), padding=5)
         style.configure('Action.TButton', font=('Helvetica', 10, 'bold'))
+        style.configure('Alert.TLabel', font=('Helvetica', 10, 'bold'), foreground='#c0392b')
         
     def clear_container(self):
+        # Results for widgets about to be destroyed must not be delivered
+        self.executor.cancel_all()
         for widget in self.main_container.winfo_children():
             widget.destroy()
     
+    def run_query(self, key, query, params=None, callback=None, loading=None,
+                  fetch=True, cache_ttl=None):
+        """Run a query in the background and pass its result to callback.
+        
+        A newer query submitted with the same key supersedes the older one.
+        If loading is a VirtualTable, it shows a loading row until the result
+        arrives.
+        """
+        return self.run_task(key, DatabaseConnection.run_query, query, params, fetch,
+                             cache_ttl, callback=callback, loading=loading)
+    
+    def run_task(self, key, fn, *args, callback=None, loading=None, on_error=None):
+        if loading is not None:
+            self.show_loading(loading)
+        
+        def failed(error):
+            if loading is not None:
+                loading.clear()
+            self.show_error(error)
+            if on_error is not None:
+                on_error(error)
+        
+        return self.executor.submit(fn, *args, key=key, on_success=callback,
+                                    on_error=failed)
+    
+    def show_error(self, error):
+        if isinstance(error, (service.InvalidRequest, service.NotFound)):
+            messagebox.showerror("Error", str(error))
+        else:
+            DatabaseConnection.show_error(error)
+    
+    def data_source(self, name, refresh=False):
+        """Function and arguments that fetch the data for a dashboard tab.
+        
+        Replicated data is read from the offline replica once it has been
+        synced; on refresh the replica is synced first.
+        """
+        user_id = self.current_user['user_id']
+        sources = {
+            'portfolios': (service.portfolios, user_id),
+            'portfolio_choices': (service.portfolio_choices, user_id),
+            'transactions': (service.transaction_page, user_id),
+            'assets': (service.asset_catalog,),
+            'watchlist': (service.watchlist, user_id),
+            'reports': (service.reports, user_id)
+        }
+        fn, *args = sources[name]
+        if name not in self.REPLICATED:
+            return fn, args
+        if refresh and self.synced_at is not None:
+            return self.replica.refresh, [user_id, fn, *args]
+        return self.replicated(fn, *args)
+    
+    def replicated(self, fn, *args):
+        """fn and args, reading from the replica once it holds the user's data"""
+        if self.replica is None or self.synced_at is None:
+            return fn, list(args)
+        return self.replica.read, [fn, *args]
+    
+    def sync_replica(self, then=None):
+        """Pull the server's changes into the replica in the background.
+        
+        The tabs built from the replica are reloaded if anything changed;
+        then() is called once the sync is over. Returns False if there is
+        no replica.
+        """
+        if self.replica is None:
+            return False
+        status_label = self.replica_label
+        first = self.synced_at is None
+        
+        def synced(result):
+            changes, self.synced_at = result
+            if status_label.winfo_exists():
+                status_label.configure(text="")
+                # A first sync copied what the tabs were loaded with
+                if changes and not first:
+                    for reload in self.tab_loaders.values():
+                        reload()
+            if then is not None:
+                then()
+        
+        def failed(error):
+            replica.logger.warning("Replica sync failed: %s", error)
+            if status_label.winfo_exists() and self.synced_at is not None:
+                status_label.configure(
+                    text=f"Offline - data as of {self.synced_at:%Y-%m-%d %H:%M}")
+            if then is not None:
+                then()
+        
+        def sync(user_id):
+            return self.replica.sync(user_id), self.replica.synced_at(user_id)
+        
+        self.executor.submit(sync, self.current_user['user_id'],
+                             key='replica_sync' if then else None,
+                             on_success=synced, on_error=failed)
+        return True
+    
+    def watch_replica(self):
+        """Sync the replica now and every REPLICA_SYNC_MS while the dashboard is shown"""
+        status_label = self.replica_label
+        
+        @tagged
+        def poll_replica():
+            if status_label.winfo_exists():
+                self.sync_replica(then=schedule)
+        
+        def schedule():
+            # Stops once the dashboard has been left
+            if status_label.winfo_exists():
+                status_label.after(self.REPLICA_SYNC_MS, poll_replica)
+        
+        poll_replica()
+    
+    def prefetch(self, name):
+        """Start fetching a tab's data before the tab is opened"""
+        if name in self.prefetched:
+            return
+        entry = self.prefetched[name] = {}
+        
+        def arrived(result):
+            waiting = entry.pop('waiting', None)
+            if waiting:
+                waiting[0](result)
+            else:
+                entry['result'] = result
+        
+        def failed(error):
+            # Without a waiting tab the error is dropped; the tab queries again
+            waiting = entry.pop('waiting', None)
+            if waiting:
+                if waiting[1] is not None:
+                    waiting[1].clear()
+                self.show_error(error)
+        
+        fn, args = self.data_source(name)
+        with call_site('prefetch_' + name):
+            self.executor.submit(fn, *args, key='prefetch:' + name,
+                                 on_success=arrived, on_error=failed)
+    
+    def load_data(self, name, callback, loading=None, refresh=False):
+        """Fetch a tab's data, reusing a prefetched result when there is one"""
+        started = time.perf_counter()
+        
+        def done(result):
+            timings.record('tab_data', name, time.perf_counter() - started)
+            self.data_shown()
+            callback(result)
+        
+        entry = self.prefetched.get(name)
+        if entry is not None and not refresh and not entry.get('used'):
+            entry['used'] = True
+            if 'result' in entry:
+                done(entry.pop('result'))
+                return
+            if self.executor.pending('prefetch:' + name):
+                if loading is not None:
+                    self.show_loading(loading)
+                entry['waiting'] = (done, loading)
+                return
+        
+        fn, args = self.data_source(name, refresh)
+        self.run_task(name, fn, *args, callback=done, loading=loading)
+    
+    def cancel_data(self, name):
+        """Stop a pending load_data so a newer request can replace it"""
+        self.executor.cancel(name)
+        entry = self.prefetched.get(name)
+        if entry is not None:
+            entry.pop('waiting', None)
+    
+    def data_shown(self):
+        if self.first_paint is None:
+            self.first_paint = time.perf_counter() - self.dashboard_started
+            timings.record('startup', 'first_paint', self.first_paint)
+            self.prefetch_ahead()
+    
+    def prefetch_ahead(self):
+        index = self.notebook.index(self.notebook.select())
+        for ahead in range(index + 1, index + 1 + self.PREFETCH_AHEAD):
+            if ahead < len(self.DASHBOARD_TABS) and ahead not in self.built_tabs:
+                self.prefetch(self.DASHBOARD_TABS[ahead][2])
+    
+    def show_loading(self, table):
+        table.show_message("Loading...")
+    
     def show_login(self):
         self.clear_container()
         
@@ -121,9 +385,9 @@ class PortfolioManagementApp:
         self.email_entry.insert(0, "john.doe@email.com")  # Default for testing
         
         # Login button
-        login_btn = ttk.Button(login_frame, text="Login", command=self.login,
-                              style='Action.TButton')
-        login_btn.grid(row=1, column=0, columnspan=2, pady=10)
+        self.login_btn = ttk.Button(login_frame, text="Login", command=self.login,
+                                    style='Action.TButton')
+        self.login_btn.grid(row=1, column=0, columnspan=2, pady=10)
         
         # New user button
         new_user_btn = ttk.Button(login_frame, text="Register New User",
@@ -141,20 +405,48 @@ class PortfolioManagementApp:
             messagebox.showinfo("Success", "Database connection successful!")
             conn.close()
     
+    @tagged
     def login(self):
         email = self.email_entry.get().strip()
         if not email:
             messagebox.showerror("Error", "Please enter an email address")
             return
         
-        query = "SELECT * FROM Users WHERE email = %s AND status = 'active'"
-        result = DatabaseConnection.execute_query(query, (email,))
+        self.login_btn.configure(text="Logging in...", state=tk.DISABLED)
         
-        if result and len(result) > 0:
-            self.current_user = result[0]
-            self.show_dashboard()
-        else:
-            messagebox.showerror("Error", "User not found or account inactive")
+        def logged_in(result):
+            user, self.synced_at = result
+            if user is not None:
+                self.current_user = user
+                self.show_dashboard()
+            else:
+                self.login_btn.configure(text="Login", state=tk.NORMAL)
+                messagebox.showerror("Error", "User not found or account inactive")
+        
+        def failed(error):
+            self.login_btn.configure(text="Login", state=tk.NORMAL)
+            self.show_error(error)
+        
+        self.executor.submit(self.find_user, email, key='login',
+                             on_success=logged_in, on_error=failed)
+    
+    def find_user(self, email):
+        """(user, server time of the last replica sync) for a login; runs on a worker.
+        
+        Without a connection to the server, a user whose data is in the
+        replica logs in from there.
+        """
+        try:
+            user = service.login(email)
+        except DatabaseUnavailableError:
+            if self.replica is None:
+                raise
+            user = self.replica.read(service.login, email)
+            if user is None:
+                raise
+        if self.replica is None or user is None:
+            return user, None
+        return user, self.replica.synced_at(user['user_id'])
     
     def show_registration(self):
         reg_window = tk.Toplevel(self.root)
@@ -181,9 +473,8 @@ class PortfolioManagementApp:
             entry.grid(row=i, column=1, pady=5)
             entries[field] = entry
         
+        @tagged
         def register():
-            query = """INSERT INTO Users (first_name, last_name, email, phone, 
-                      date_of_birth, address) VALUES (%s, %s, %s, %s, %s, %s)"""
             params = (
                 entries['first_name'].get(),
                 entries['last_name'].get(),
@@ -193,10 +484,12 @@ class PortfolioManagementApp:
                 entries['address'].get()
             )
             
-            result = DatabaseConnection.execute_query(query, params, fetch=False)
-            if result:
-                messagebox.showinfo("Success", "User registered successfully!")
-                reg_window.destroy()
+            def registered(result):
+                if result:
+                    messagebox.showinfo("Success", "User registered successfully!")
+                    reg_window.destroy()
+            
+            self.run_task('register', service.register, *params, callback=registered)
         
         ttk.Button(frame, text="Register", command=register,
                   style='Action.TButton').grid(row=len(fields), column=0,
@@ -213,23 +506,209 @@ class PortfolioManagementApp:
         ttk.Label(header_frame, text=welcome_text, style='Header.TLabel').pack(side=tk.LEFT)
         
         ttk.Button(header_frame, text="Logout", command=self.show_login).pack(side=tk.RIGHT)
+        ttk.Button(header_frame, text="Diagnostics",
+                   command=self.show_diagnostics).pack(side=tk.RIGHT, padx=5)
+        
+        alert_label = ttk.Label(header_frame, text="", style='Alert.TLabel')
+        alert_label.pack(side=tk.RIGHT, padx=10)
+        self.watch_alerts(alert_label)
+        
+        self.replica_label = ttk.Label(header_frame, text="")
+        self.replica_label.pack(side=tk.RIGHT, padx=10)
         
         # Notebook for tabs
         notebook = ttk.Notebook(self.main_container)
         notebook.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
+        self.notebook = notebook
         
-        # Create tabs
-        self.create_portfolios_tab(notebook)
-        self.create_holdings_tab(notebook)
-        self.create_transactions_tab(notebook)
-        self.create_assets_tab(notebook)
-        self.create_watchlist_tab(notebook)
-        self.create_reports_tab(notebook)
+        # Startup bookkeeping
+        self.dashboard_started = time.perf_counter()
+        self.first_paint = None
+        self.built_tabs = set()
+        self.prefetched = {}
+        self.tab_loaders = {}       # Data source -> reload of a built tab
+        
+        # Empty tabs; each is built when first selected
+        for text, _, _ in self.DASHBOARD_TABS:
+            notebook.add(ttk.Frame(notebook, padding="10"), text=text)
+        
+        notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+        
+        # Tabs render from the replica; the sync catches up behind them
+        self.watch_replica()
     
-    def create_portfolios_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="My Portfolios")
+    def on_tab_changed(self, event=None):
+        index = self.notebook.index(self.notebook.select())
+        if index not in self.built_tabs:
+            self.built_tabs.add(index)
+            text, builder, _ = self.DASHBOARD_TABS[index]
+            frame = self.notebook.nametowidget(self.notebook.select())
+            with timings.measure('tab_build', text):
+                getattr(self, builder)(frame)
+        
+        if self.first_paint is not None:
+            self.prefetch_ahead()
+    
+    def watch_alerts(self, alert_label):
+        """Check the user's watchlist targets against current prices periodically"""
+        user_id = self.current_user['user_id']
+        engine = alerts.AlertEngine()
+        engine.add_sink(alerts.log_sink)
+        engine.add_sink(lambda fired: self.show_alerts(alert_label, fired))
+        
+        loaded = []
+        
+        def armed(count):
+            loaded.append(count)
+            poll_alerts()
+        
+        @tagged
+        def poll_alerts():
+            # Stops once the dashboard has been left
+            if not alert_label.winfo_exists():
+                return
+            if not loaded:
+                self.executor.submit(engine.load, user_id, key='alerts',
+                                     on_success=armed, on_error=retry)
+                return
+            self.executor.submit(DatabaseConnection.run_query, queries.WATCHLIST_PRICES,
+                                 (user_id,), key='alerts', on_success=check,
+                                 on_error=retry)
+        
+        def check(rows):
+            # The index lookups are cheap enough for the Tk thread
+            engine.check_prices({row['asset_id']: row['current_price'] for row in rows})
+            retry()
+        
+        def retry(error=None):
+            if error is not None:
+                alerts.logger.warning("Watchlist alert check failed: %s", error)
+            if alert_label.winfo_exists():
+                alert_label.after(self.ALERT_POLL_MS, poll_alerts)
+        
+        poll_alerts()
+    
+    def show_alerts(self, alert_label, fired):
+        alert_label.configure(text=f"\u25b2 {alerts.describe(fired[-1])}" if len(fired) == 1
+                              else f"\u25b2 {len(fired)} watchlist alerts")
+        messagebox.showinfo("Watchlist Alert",
+                            "\n".join(alerts.describe(alert) for alert in fired))
+    
+    def show_diagnostics(self):
+        """Latency per call site, slow queries and connection pool state"""
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("1000x600")
+        
+        notebook = ttk.Notebook(window)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 0))
+        
+        # Histograms, slowest p99 first
+        latency_frame = ttk.Frame(notebook, padding="5")
+        notebook.add(latency_frame, text="Latency")
+        columns = ('Metric', 'Site', 'Name', 'Count', 'p50', 'p95', 'p99', 'Max')
+        latency = ttk.Treeview(latency_frame, columns=columns, show='headings')
+        for col, width in zip(columns, (140, 170, 300, 60, 70, 70, 70, 70)):
+            latency.heading(col, text=col)
+            latency.column(col, width=width, anchor=tk.W if width > 100 else tk.E)
+        latency.pack(fill=tk.BOTH, expand=True)
+        
+        # Slow query log; selecting an entry shows its EXPLAIN plan
+        slow_frame = ttk.Frame(notebook, padding="5")
+        notebook.add(slow_frame, text="Slow Queries")
+        columns = ('Time', 'Site', 'ms', 'Rows', 'Query')
+        slow = ttk.Treeview(slow_frame, columns=columns, show='headings', height=10)
+        for col, width in zip(columns, (80, 150, 70, 70, 560)):
+            slow.heading(col, text=col)
+            slow.column(col, width=width, anchor=tk.E if width == 70 else tk.W)
+        slow.pack(fill=tk.BOTH, expand=True)
+        plan_text = tk.Text(slow_frame, height=10, wrap=tk.NONE, font=('Courier', 9))
+        plan_text.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        
+        # Pool, cache and error counters
+        state_frame = ttk.Frame(notebook, padding="10")
+        notebook.add(state_frame, text="Pool & Cache")
+        state_label = ttk.Label(state_frame, text="", font=('Courier', 10), justify=tk.LEFT)
+        state_label.pack(anchor=tk.W)
+        
+        entries = []
+        
+        def show_plan(event=None):
+            plan_text.delete('1.0', tk.END)
+            selection = slow.selection()
+            if not selection:
+                return
+            entry = entries[int(selection[0])]
+            lines = [entry['query'], '']
+            if entry['plan'] is None:
+                lines.append("(no plan: not a SELECT, or explained recently)")
+            for step in entry['plan'] or []:
+                lines.append("  ".join(f"{key}={value}" for key, value in step.items()
+                                       if value is not None))
+            plan_text.insert('1.0', "\n".join(lines))
+        
+        def refresh():
+            snapshot = metrics.snapshot()
+            histograms = sorted(snapshot['histograms'],
+                                key=lambda h: (h['name'], -h['p99']))
+            latency.delete(*latency.get_children())
+            for h in histograms:
+                if h['name'].endswith('_seconds'):
+                    stats = [f"{h[q] * 1000:.1f} ms" for q in ('p50', 'p95', 'p99', 'max')]
+                else:
+                    stats = [f"{h[q]:,.0f}" for q in ('p50', 'p95', 'p99', 'max')]
+                latency.insert('', tk.END, values=(
+                    h['name'], h['labels'].get('site', ''), h['labels'].get('name', ''),
+                    f"{h['count']:,}", *stats))
+            
+            entries[:] = slow_queries.entries()[::-1]
+            slow.delete(*slow.get_children())
+            for i, entry in enumerate(entries):
+                slow.insert('', tk.END, iid=str(i), values=(
+                    time.strftime('%H:%M:%S', time.localtime(entry['time'])), entry['site'],
+                    f"{entry['seconds'] * 1000:,.0f}", entry['rows'], entry['query']))
+            show_plan()
+            
+            lines = ["Connection pool"]
+            lines += [f"  {key:<12} {value}" for key, value in DatabaseConnection.pool_stats().items()]
+            lines += ["", "Query cache"]
+            lines += [f"  {key:<12} {value}" for key, value in DatabaseConnection.cache_stats().items()]
+            lines += ["", "Errors"]
+            lines += [f"  {c['name']:<20} {c['labels'].get('site', ''):<24} "
+                      f"{c['labels'].get('error', ''):<20} {c['value']}"
+                      for c in snapshot['counters']] or ["  none"]
+            state_label.configure(text="\n".join(lines))
+        
+        def reset():
+            metrics.clear()
+            slow_queries.clear()
+            timings.clear()
+            refresh()
+        
+        def export():
+            path = filedialog.asksaveasfilename(
+                parent=window, title="Export Metrics", defaultextension='.prom',
+                filetypes=[("Prometheus text", "*.prom"), ("JSON", "*.json")])
+            if not path:
+                return
+            try:
+                metrics.export(path)
+            except OSError as e:
+                messagebox.showerror("Export Error", str(e), parent=window)
+        
+        slow.bind('<<TreeviewSelect>>', show_plan)
+        
+        btn_frame = ttk.Frame(window, padding="10")
+        btn_frame.pack(fill=tk.X)
+        ttk.Button(btn_frame, text="Refresh", command=refresh).pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Reset", command=reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Export...", command=export).pack(side=tk.RIGHT)
         
+        refresh()
+    
+    @tagged
+    def create_portfolios_tab(self, frame):
         # Buttons
         btn_frame = ttk.Frame(frame)
         btn_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -237,49 +716,28 @@ class PortfolioManagementApp:
         ttk.Button(btn_frame, text="Add New Portfolio",
                   command=self.add_portfolio).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Refresh",
-                  command=lambda: self.load_portfolios(tree)).pack(side=tk.LEFT)
+                  command=lambda: self.load_portfolios(table, refresh=True)).pack(side=tk.LEFT)
         
-        # Treeview
+        # Table
         columns = ('ID', 'Name', 'Type', 'Total Value', 'Currency', 'Status', 'Holdings')
-        tree = ttk.Treeview(frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=100)
-        
-        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
-        
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
-        scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
-        tree.configure(yscrollcommand=scrollbar.set)
+        table = VirtualTable(frame, columns, format_portfolio,
+                             key=lambda p: p['portfolio_id'])
+        table.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
         # Configure grid weights
         frame.columnconfigure(0, weight=1)
         frame.rowconfigure(1, weight=1)
         
         # Load data
-        self.load_portfolios(tree)
-    
-    def load_portfolios(self, tree):
-        # Clear existing items
-        for item in tree.get_children():
-            tree.delete(item)
-        
-        query = "SELECT * FROM v_user_portfolios WHERE user_id = %s"
-        portfolios = DatabaseConnection.execute_query(query, (self.current_user['user_id'],))
-        
-        if portfolios:
-            for p in portfolios:
-                tree.insert('', tk.END, values=(
-                    p['portfolio_id'],
-                    p['portfolio_name'],
-                    p['portfolio_type'],
-                    f"${p['total_value']:,.2f}",
-                    'USD',
-                    p['status'],
-                    p['total_holdings']
-                ))
+        self.load_portfolios(table)
+        self.tab_loaders['portfolios'] = lambda: self.load_data(
+            'portfolios', lambda rows: table.set_rows(rows or []))
+    
+    @tagged
+    def load_portfolios(self, table, refresh=False):
+        # On refresh the table diffs against what it shows and only updates changed rows
+        self.load_data('portfolios', lambda rows: table.set_rows(rows or []),
+                       loading=None if refresh else table, refresh=refresh)
     
     def add_portfolio(self):
         dialog = tk.Toplevel(self.root)
@@ -305,28 +763,28 @@ class PortfolioManagementApp:
         value_entry.grid(row=2, column=1, pady=5)
         value_entry.insert(0, "0.00")
         
+        @tagged
         def save_portfolio():
-            query = """INSERT INTO Portfolios (user_id, portfolio_name, portfolio_type, total_value)
-                      VALUES (%s, %s, %s, %s)"""
             params = (
                 self.current_user['user_id'],
                 name_entry.get(),
                 type_var.get(),
-                float(value_entry.get())
+                value_entry.get()
             )
             
-            result = DatabaseConnection.execute_query(query, params, fetch=False)
-            if result:
-                messagebox.showinfo("Success", "Portfolio created successfully!")
-                dialog.destroy()
+            def saved(result):
+                if result:
+                    messagebox.showinfo("Success", "Portfolio created successfully!")
+                    dialog.destroy()
+                    self.sync_replica()
+            
+            self.run_task('save_portfolio', service.create_portfolio, *params, callback=saved)
         
         ttk.Button(frame, text="Save", command=save_portfolio,
                   style='Action.TButton').grid(row=3, column=0, columnspan=2, pady=20)
     
-    def create_holdings_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="Portfolio Holdings")
-        
+    @tagged
+    def create_holdings_tab(self, frame):
         # Portfolio selection
         select_frame = ttk.Frame(frame)
         select_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -337,123 +795,262 @@ class PortfolioManagementApp:
         portfolio_combo.pack(side=tk.LEFT, padx=5)
         
         # Load portfolios into combobox
-        portfolios = DatabaseConnection.execute_query(
-            "SELECT portfolio_id, portfolio_name FROM Portfolios WHERE user_id = %s",
-            (self.current_user['user_id'],)
-        )
-        if portfolios:
-            portfolio_combo['values'] = [f"{p['portfolio_id']} - {p['portfolio_name']}"
-                                        for p in portfolios]
-        
-        # Treeview
-        columns = ('Asset', 'Symbol', 'Type', 'Quantity', 'Purchase Price',
-                  'Current Value', 'Purchase Date')
-        tree = ttk.Treeview(frame, columns=columns, show='headings', height=15)
+        def show_choices(portfolios):
+            if portfolios:
+                portfolio_combo['values'] = [f"{p['portfolio_id']} - {p['portfolio_name']}"
+                                            for p in portfolios]
         
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=100)
+        self.load_data('portfolio_choices', show_choices)
         
-        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        # Table
+        columns = ('Asset', 'Symbol', 'Type', 'Quantity', 'Purchase Price',
+                  'Current Value', 'Market Value', 'Purchase Date')
+        table = VirtualTable(frame, columns, format_holding)
+        table.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
+        @tagged
         def load_holdings():
-            for item in tree.get_children():
-                tree.delete(item)
-            
             selected = self.portfolio_var.get()
             if not selected:
+                self.executor.cancel('holdings')
+                table.clear()
                 return
             
             portfolio_id = int(selected.split(' - ')[0])
             
-            query = """
-                SELECT a.asset_name, a.asset_symbol, a.asset_type, ph.quantity,
-                       ph.purchase_price, ph.current_value, ph.purchase_date
-                FROM Portfolio_Holdings ph
-                JOIN Assets a ON ph.asset_id = a.asset_id
-                WHERE ph.portfolio_id = %s
-            """
-            holdings = DatabaseConnection.execute_query(query, (portfolio_id,))
-            
-            if holdings:
-                for h in holdings:
-                    tree.insert('', tk.END, values=(
-                        h['asset_name'],
-                        h['asset_symbol'],
-                        h['asset_type'],
-                        f"{h['quantity']:.2f}",
-                        f"${h['purchase_price']:.2f}",
-                        f"${h['current_value']:.2f}",
-                        h['purchase_date']
-                    ))
+            fn, args = self.replicated(service.holdings, self.current_user['user_id'],
+                                       portfolio_id)
+            self.run_task('holdings', fn, *args,
+                          callback=lambda rows: table.set_rows(rows or []), loading=table)
+        
+        def reload():
+            self.load_data('portfolio_choices', show_choices)
+            if self.portfolio_var.get():
+                load_holdings()
         
         ttk.Button(select_frame, text="Load Holdings",
                   command=load_holdings).pack(side=tk.LEFT, padx=5)
+        self.tab_loaders['portfolio_choices'] = reload
         
         frame.columnconfigure(0, weight=1)
         frame.rowconfigure(1, weight=1)
     
-    def create_transactions_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="Transactions")
-        
+    @tagged
+    def create_transactions_tab(self, frame):
         # Buttons
         btn_frame = ttk.Frame(frame)
         btn_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=5)
         
         ttk.Button(btn_frame, text="Add Transaction",
                   command=self.add_transaction).pack(side=tk.LEFT, padx=5)
+        import_btn = ttk.Button(btn_frame, text="Import...")
+        import_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Filters, applied in SQL
+        filter_frame = ttk.Frame(frame)
+        filter_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=5)
         
-        # Treeview
+        ttk.Label(filter_frame, text="Portfolio:").pack(side=tk.LEFT, padx=5)
+        portfolio_var = tk.StringVar(value="All")
+        portfolio_combo = ttk.Combobox(filter_frame, textvariable=portfolio_var, width=24,
+                                       state='readonly', values=["All"])
+        portfolio_combo.pack(side=tk.LEFT)
+        
+        ttk.Label(filter_frame, text="Asset:").pack(side=tk.LEFT, padx=5)
+        asset_entry = ttk.Entry(filter_frame, width=8)
+        asset_entry.pack(side=tk.LEFT)
+        
+        ttk.Label(filter_frame, text="Type:").pack(side=tk.LEFT, padx=5)
+        type_var = tk.StringVar()
+        ttk.Combobox(filter_frame, textvariable=type_var, width=9, state='readonly',
+                     values=['', 'buy', 'sell', 'dividend']).pack(side=tk.LEFT)
+        
+        ttk.Label(filter_frame, text="From:").pack(side=tk.LEFT, padx=5)
+        from_entry = ttk.Entry(filter_frame, width=11)
+        from_entry.pack(side=tk.LEFT)
+        
+        ttk.Label(filter_frame, text="To:").pack(side=tk.LEFT, padx=5)
+        to_entry = ttk.Entry(filter_frame, width=11)
+        to_entry.pack(side=tk.LEFT)
+        
+        # Paging state: the next page starts after the last row shown
+        state = {'filters': {}, 'portfolios': None, 'after': None,
+                 'loading': True, 'done': False}
+        
+        def read_filters():
+            filters = {}
+            choice = portfolio_var.get()
+            if choice and choice != "All":
+                filters['portfolio_id'] = int(choice.split(' - ')[0])
+            symbol = asset_entry.get().strip().upper()
+            if symbol:
+                filters['asset_symbol'] = symbol
+            if type_var.get():
+                filters['transaction_type'] = type_var.get()
+            for key, entry in (('date_from', from_entry), ('date_to', to_entry)):
+                text = entry.get().strip()
+                if text:
+                    try:
+                        filters[key] = datetime.strptime(text, '%Y-%m-%d').date()
+                    except ValueError:
+                        messagebox.showerror("Error", f"Invalid date: {text} (use YYYY-MM-DD)")
+                        return None
+            return filters
+        
+        def show_page(result, first_page):
+            rows = result['rows']
+            # Update the paging state first: filling the table may ask for more
+            state['loading'] = False
+            state['done'] = len(rows) < queries.TRANSACTION_PAGE_SIZE
+            if rows:
+                state['after'] = (rows[-1]['transaction_date'], rows[-1]['transaction_id'])
+            
+            if first_page:
+                state['portfolios'] = result['portfolios']
+                portfolio_combo['values'] = ["All"] + [
+                    f"{p['portfolio_id']} - {p['portfolio_name']}" for p in result['portfolios']]
+                table.set_rows(rows)
+            else:
+                table.append_rows(rows)
+            
+            status = f"{len(table.rows):,} transactions"
+            if not state['done']:
+                status += " - scroll down to load more"
+            status_label.configure(text=status)
+        
+        def page_failed(error):
+            state['loading'] = False
+        
+        @tagged
+        def load_more():
+            if state['loading'] or state['done']:
+                return
+            state['loading'] = True
+            fn, args = self.replicated(service.transaction_page, self.current_user['user_id'],
+                                       state['filters'], state['after'], state['portfolios'])
+            self.run_task('transactions', fn, *args,
+                          callback=lambda result: show_page(result, False),
+                          on_error=page_failed)
+        
+        @tagged
+        def apply_filters():
+            filters = read_filters()
+            if filters is not None:
+                load_first_page(filters, state['portfolios'])
+        
+        def load_first_page(filters, portfolios=None):
+            # Supersedes any page still loading for the old filters
+            self.cancel_data('transactions')
+            state.update(filters=filters, after=None, loading=True, done=False)
+            fn, args = self.replicated(service.transaction_page, self.current_user['user_id'],
+                                       filters, None, portfolios)
+            self.run_task('transactions', fn, *args,
+                          callback=lambda result: show_page(result, True),
+                          loading=table, on_error=page_failed)
+        
+        def clear_filters():
+            portfolio_var.set("All")
+            type_var.set('')
+            for entry in (asset_entry, from_entry, to_entry):
+                entry.delete(0, tk.END)
+            apply_filters()
+        
+        ttk.Button(filter_frame, text="Apply", command=apply_filters).pack(side=tk.LEFT, padx=5)
+        ttk.Button(filter_frame, text="Clear", command=clear_filters).pack(side=tk.LEFT)
+        
+        # Bulk import runs on a worker; the progress bar polls what it reports
+        progress = {'fraction': 0.0, 'imported': 0, 'rejected': 0}
+        cancel_import = threading.Event()
+        progress_bar = ttk.Progressbar(btn_frame, length=200, maximum=1.0)
+        cancel_btn = ttk.Button(btn_frame, text="Cancel Import", command=cancel_import.set)
+        
+        def import_progress(fraction, result):
+            # Worker thread: only record the numbers
+            progress.update(fraction=fraction, imported=result['imported'],
+                            rejected=result['rejected'])
+        
+        def poll_import():
+            if not self.executor.pending('import'):
+                return
+            progress_bar['value'] = progress['fraction']
+            status_label.configure(text=f"Importing: {progress['imported']:,} imported, "
+                                        f"{progress['rejected']:,} rejected")
+            frame.after(self.IMPORT_POLL_MS, poll_import)
+        
+        def import_finished(result=None, error=None):
+            progress_bar.pack_forget()
+            cancel_btn.pack_forget()
+            import_btn.configure(state='normal')
+            if error is not None:
+                if isinstance(error, importer.RecordError):
+                    messagebox.showerror("Import Error", str(error))
+                else:
+                    self.show_error(error)
+                return
+            
+            summary = f"Imported {result['imported']:,} of {result['read']:,} records."
+            if result['cancelled']:
+                summary = "Import cancelled. " + summary
+            if result['rejected']:
+                summary += f"\n{result['rejected']:,} rejected, e.g.:\n" + "\n".join(
+                    f"  line {line}: {reason}" for line, reason in result['errors'][:10])
+            messagebox.showinfo("Import", summary)
+            # The sync reloads the transactions from the replica
+            if not self.sync_replica():
+                apply_filters()
+        
+        @tagged
+        def import_transactions():
+            choice = portfolio_var.get()
+            if not choice or choice == "All":
+                messagebox.showinfo("Import", "Select the portfolio to import into "
+                                    "with the Portfolio filter first.")
+                return
+            path = filedialog.askopenfilename(
+                title="Import Transactions",
+                filetypes=[("Broker exports", "*.csv *.ofx *.qfx"), ("All files", "*.*")])
+            if not path:
+                return
+            
+            cancel_import.clear()
+            progress.update(fraction=0.0, imported=0, rejected=0)
+            import_btn.configure(state='disabled')
+            progress_bar['value'] = 0
+            progress_bar.pack(side=tk.LEFT, padx=5)
+            cancel_btn.pack(side=tk.LEFT)
+            self.executor.submit(importer.import_file, path, self.current_user['user_id'],
+                                 int(choice.split(' - ')[0]), key='import',
+                                 progress=import_progress, cancelled=cancel_import.is_set,
+                                 on_success=import_finished,
+                                 on_error=lambda e: import_finished(error=e))
+            poll_import()
+        
+        import_btn.configure(command=import_transactions)
+        
+        # Table; scrolling near the end loads the next page
         columns = ('ID', 'Portfolio', 'Asset', 'Type', 'Quantity',
                   'Price', 'Total', 'Date', 'Fees')
-        tree = ttk.Treeview(frame, columns=columns, show='headings', height=15)
+        table = VirtualTable(frame, columns, format_transaction, widths=[90] * len(columns),
+                             key=lambda t: t['transaction_id'], on_scroll_end=load_more)
+        table.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=90)
-        
-        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
-        
-        # Load transactions
-        query = """
-            SELECT t.transaction_id, p.portfolio_name, a.asset_symbol,
-                   t.transaction_type, t.quantity, t.price_per_unit,
-                   t.total_amount, t.transaction_date, t.fees
-            FROM Transactions t
-            JOIN Portfolios p ON t.portfolio_id = p.portfolio_id
-            JOIN Assets a ON t.asset_id = a.asset_id
-            WHERE p.user_id = %s
-            ORDER BY t.transaction_date DESC
-            LIMIT 100
-        """
-        transactions = DatabaseConnection.execute_query(query, (self.current_user['user_id'],))
-        
-        if transactions:
-            for t in transactions:
-                tree.insert('', tk.END, values=(
-                    t['transaction_id'],
-                    t['portfolio_name'],
-                    t['asset_symbol'],
-                    t['transaction_type'],
-                    f"{t['quantity']:.2f}",
-                    f"${t['price_per_unit']:.2f}",
-                    f"${t['total_amount']:.2f}",
-                    t['transaction_date'],
-                    f"${t['fees']:.2f}"
-                ))
+        status_label = ttk.Label(frame, text="")
+        status_label.grid(row=3, column=0, sticky=tk.W)
+        
+        # Load the first page
+        self.load_data('transactions', lambda result: show_page(result, True),
+                       loading=table)
+        self.tab_loaders['transactions'] = lambda: load_first_page(state['filters'])
         
         frame.columnconfigure(0, weight=1)
-        frame.rowconfigure(1, weight=1)
+        frame.rowconfigure(2, weight=1)
     
     def add_transaction(self):
         messagebox.showinfo("Feature", "Transaction form would open here.\n"
                            "This would allow buying/selling assets.")
     
-    def create_assets_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="Available Assets")
-        
+    @tagged
+    def create_assets_tab(self, frame):
         # Search frame
         search_frame = ttk.Frame(frame)
         search_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -462,122 +1059,281 @@ class PortfolioManagementApp:
         search_entry = ttk.Entry(search_frame, width=30)
         search_entry.pack(side=tk.LEFT, padx=5)
         
-        # Treeview
+        # Table
         columns = ('Symbol', 'Name', 'Type', 'Category', 'Price', 'Exchange', 'Last Updated')
-        tree = ttk.Treeview(frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=100)
-        
-        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
-        
-        def load_assets():
-            for item in tree.get_children():
-                tree.delete(item)
-            
-            search_term = search_entry.get()
-            if search_term:
-                query = """
-                    SELECT a.*, ac.category_name
-                    FROM Assets a
-                    JOIN Asset_Categories ac ON a.category_id = ac.category_id
-                    WHERE a.asset_name LIKE %s OR a.asset_symbol LIKE %s
-                """
-                assets = DatabaseConnection.execute_query(query,
-                    (f"%{search_term}%", f"%{search_term}%"))
-            else:
-                query = """
-                    SELECT a.*, ac.category_name
-                    FROM Assets a
-                    JOIN Asset_Categories ac ON a.category_id = ac.category_id
-                    LIMIT 100
-                """
-                assets = DatabaseConnection.execute_query(query)
+        table = VirtualTable(frame, columns, format_asset, key=lambda a: a['asset_symbol'])
+        table.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        
+        status_label = ttk.Label(frame, text="")
+        status_label.grid(row=2, column=0, sticky=tk.W)
+        
+        # Searches run against the in-process index once the catalog is loaded
+        state = {'index': None, 'debounce': None}
+        
+        def show_results(assets, elapsed):
+            table.set_rows(assets)
+            status = f"{len(assets):,} assets"
+            if state['index'] is not None:
+                status += f" of {len(state['index']):,}"
+            status_label.configure(text=f"{status} ({elapsed * 1000:.1f} ms)")
+        
+        @tagged
+        def run_search():
+            state['debounce'] = None
+            term = search_entry.get().strip()
+            started = time.perf_counter()
             
-            if assets:
-                for a in assets:
-                    tree.insert('', tk.END, values=(
-                        a['asset_symbol'],
-                        a['asset_name'],
-                        a['asset_type'],
-                        a['category_name'],
-                        f"${a['current_price']:.2f}",
-                        a['exchange'],
-                        a['last_updated']
-                    ))
+            if state['index'] is not None:
+                self.executor.cancel('asset_search')
+                results = state['index'].search(term) if term else state['index'].rows
+                show_results(results, time.perf_counter() - started)
+            elif term:
+                # Catalog still loading: ask MySQL; a newer search supersedes this one
+                query, params = queries.asset_search(term)
+                self.run_query('asset_search', query, params, loading=table,
+                               cache_ttl=REFERENCE_TTL,
+                               callback=lambda rows: show_results(
+                                   rows or [], time.perf_counter() - started))
+        
+        def schedule_search(event=None):
+            # Debounce: search once typing pauses
+            if state['debounce'] is not None:
+                frame.after_cancel(state['debounce'])
+            state['debounce'] = frame.after(self.SEARCH_DEBOUNCE_MS, run_search)
+        
+        def catalog_loaded(index):
+            state['index'] = index
+            run_search()
+        
+        @tagged
+        def refresh_catalog():
+            DatabaseConnection.invalidate_cache('Assets')
+            self.load_data('assets', catalog_loaded, loading=table, refresh=True)
+        
+        search_entry.bind('<KeyRelease>', schedule_search)
+        search_entry.bind('<Return>', lambda event: run_search())
         
         ttk.Button(search_frame, text="Search",
-                  command=load_assets).pack(side=tk.LEFT, padx=5)
+                  command=run_search).pack(side=tk.LEFT, padx=5)
+        ttk.Button(search_frame, text="Refresh",
+                  command=refresh_catalog).pack(side=tk.LEFT)
         
-        load_assets()  # Initial load
+        self.load_data('assets', catalog_loaded, loading=table)  # Initial load
+        self.tab_loaders['assets'] = lambda: self.load_data('assets', catalog_loaded)
         
         frame.columnconfigure(0, weight=1)
         frame.rowconfigure(1, weight=1)
     
-    def create_watchlist_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="Watchlist")
-        
+    @tagged
+    def create_watchlist_tab(self, frame):
         ttk.Label(frame, text="Track assets you're interested in",
                  font=('Helvetica', 12)).grid(row=0, column=0, pady=10)
         
-        # Treeview
+        # Table
         columns = ('Asset', 'Symbol', 'Current Price', 'Target Price',
                   'Date Added', 'Notes')
-        tree = ttk.Treeview(frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=120)
-        
-        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        table = VirtualTable(frame, columns, format_watchlist_item, widths=[120] * len(columns),
+                             key=lambda w: w['asset_symbol'])
+        table.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
         # Load watchlist
-        query = """
-            SELECT a.asset_name, a.asset_symbol, a.current_price,
-                   w.target_price, w.added_date, w.notes
-            FROM Watchlist w
-            JOIN Assets a ON w.asset_id = a.asset_id
-            WHERE w.user_id = %s
-        """
-        watchlist = DatabaseConnection.execute_query(query, (self.current_user['user_id'],))
-        
-        if watchlist:
-            for w in watchlist:
-                tree.insert('', tk.END, values=(
-                    w['asset_name'],
-                    w['asset_symbol'],
-                    f"${w['current_price']:.2f}",
-                    f"${w['target_price']:.2f}" if w['target_price'] else "N/A",
-                    w['added_date'],
-                    w['notes'] or ""
-                ))
+        self.load_data('watchlist', lambda rows: table.set_rows(rows or []),
+                       loading=table)
+        self.tab_loaders['watchlist'] = lambda: self.load_data(
+            'watchlist', lambda rows: table.set_rows(rows or []))
         
         frame.columnconfigure(0, weight=1)
         frame.rowconfigure(1, weight=1)
     
-    def create_reports_tab(self, notebook):
-        frame = ttk.Frame(notebook, padding="10")
-        notebook.add(frame, text="Reports & Analytics")
-        
+    @tagged
+    def create_reports_tab(self, frame):
         # Performance summary
         perf_frame = ttk.LabelFrame(frame, text="Portfolio Performance", padding="10")
         perf_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=10)
+        ttk.Label(perf_frame, text="Loading...").grid(row=0, column=0)
+        
+        # Time- and money-weighted returns, this year to date until changed
+        returns_frame = ttk.LabelFrame(frame, text="Returns", padding="10")
+        returns_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=10)
+        show_returns = None
+        if returns:
+            show_returns = self.create_returns_panel(returns_frame)
+        else:
+            ttk.Label(returns_frame, text="Install NumPy to see returns").grid(row=0, column=0)
         
-        query = """
-            SELECT p.portfolio_name, 
-                   SUM(ph.quantity * a.current_price) AS current_value,
-                   SUM(ph.current_value) AS cost_basis,
-                   SUM(ph.quantity * a.current_price) - SUM(ph.current_value) AS gain_loss
-            FROM Portfolios p
-            JOIN Portfolio_Holdings ph ON p.portfolio_id = ph.portfolio_id
-            JOIN Assets a ON ph.asset_id = a.asset_id
-            WHERE p.user_id = %s AND p.status = 'active'
-            GROUP BY p.portfolio_id
-        """
-        performance = DatabaseConnection.execute_query(query, (self.current_user['user_id'],))
+        # Summary statistics
+        stats_frame = ttk.LabelFrame(frame, text="Account Summary", padding="10")
+        stats_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=10)
+        ttk.Label(stats_frame, text="Loading...").grid(row=0, column=0)
+        
+        # Risk metrics
+        risk_frame = ttk.LabelFrame(frame, text="Risk Analytics", padding="10")
+        risk_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=10)
+        ttk.Label(risk_frame, text="Loading..." if analytics else
+                  "Install NumPy to see risk metrics").grid(row=0, column=0)
+        
+        # Value at risk, simulated and historical
+        var_frame = ttk.LabelFrame(frame, text="Value at Risk", padding="10")
+        var_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=10)
+        ttk.Label(var_frame, text="Loading..." if simulation else
+                  "Install NumPy to see value at risk").grid(row=0, column=0)
+        
+        # Exports of whole data sets to a file
+        export_frame = ttk.LabelFrame(frame, text="Export", padding="10")
+        export_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=10)
+        self.create_export_panel(export_frame)
+        
+        frame.columnconfigure(0, weight=1)
+        
+        self.load_data('reports', lambda data: self.show_reports(
+            perf_frame, stats_frame, risk_frame, data, show_returns, var_frame))
+    
+    def create_returns_panel(self, frame):
+        """Date range entries over a tree of portfolios and their assets;
+        returns the function that fills the tree with a returns result"""
+        range_frame = ttk.Frame(frame)
+        range_frame.grid(row=0, column=0, sticky=tk.W)
+        today = datetime.now().date()
+        
+        ttk.Label(range_frame, text="From:").pack(side=tk.LEFT, padx=5)
+        from_entry = ttk.Entry(range_frame, width=11)
+        from_entry.insert(0, f"{today.year}-01-01")
+        from_entry.pack(side=tk.LEFT)
+        
+        ttk.Label(range_frame, text="To:").pack(side=tk.LEFT, padx=5)
+        to_entry = ttk.Entry(range_frame, width=11)
+        to_entry.insert(0, today.isoformat())
+        to_entry.pack(side=tk.LEFT)
+        
+        columns = ('Start Value', 'End Value', 'Net Invested', 'TWR', 'IRR')
+        tree = ttk.Treeview(frame, columns=columns, height=6)
+        tree.heading('#0', text="Portfolio / Asset")
+        tree.column('#0', width=220)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110, anchor=tk.E)
+        tree.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
+        frame.columnconfigure(0, weight=1)
         
+        def pct(value):
+            return "n/a" if value is None else f"{value * 100:+.2f}%"
+        
+        def show(result):
+            if not tree.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            parent = ''
+            for r in result['rows']:
+                values = (money(r['start_value'], r['currency']),
+                          money(r['end_value'], r['currency']),
+                          money(r['net_flow'], r['currency']), pct(r['twr']), pct(r['irr']))
+                if r['asset_symbol'] is None:
+                    parent = tree.insert('', tk.END, text=r['portfolio_name'], values=values)
+                else:
+                    tree.insert(parent, tk.END, text=r['asset_symbol'], values=values)
+        
+        @tagged
+        def calculate():
+            self.run_task('returns', service.portfolio_returns,
+                          self.current_user['user_id'], from_entry.get().strip(),
+                          to_entry.get().strip(), callback=show)
+        
+        ttk.Button(range_frame, text="Calculate",
+                  command=calculate).pack(side=tk.LEFT, padx=5)
+        return show
+    
+    def create_export_panel(self, frame):
+        """Data set and format choices and an Export button; the export
+        runs on a worker, with a progress bar and a Cancel button"""
+        ttk.Label(frame, text="Data:").pack(side=tk.LEFT, padx=5)
+        report_var = tk.StringVar(value='transactions')
+        ttk.Combobox(frame, textvariable=report_var, values=list(export.REPORTS),
+                     width=14, state='readonly').pack(side=tk.LEFT)
+        
+        ttk.Label(frame, text="Format:").pack(side=tk.LEFT, padx=5)
+        format_var = tk.StringVar(value='csv')
+        ttk.Combobox(frame, textvariable=format_var, values=list(export.FORMATS),
+                     width=8, state='readonly').pack(side=tk.LEFT)
+        
+        export_btn = ttk.Button(frame, text="Export...")
+        export_btn.pack(side=tk.LEFT, padx=5)
+        
+        # The worker reports progress; the bar polls it
+        progress = {'fraction': 0.0, 'written': 0, 'total': 0}
+        cancel_export = threading.Event()
+        progress_bar = ttk.Progressbar(frame, length=200, maximum=1.0)
+        cancel_btn = ttk.Button(frame, text="Cancel", command=cancel_export.set)
+        status_label = ttk.Label(frame, text="")
+        status_label.pack(side=tk.LEFT, padx=5)
+        
+        def export_progress(fraction, result):
+            # Worker thread: only record the numbers
+            progress.update(fraction=fraction, written=result['written'],
+                            total=result['total'])
+        
+        def poll_export():
+            if not self.executor.pending('export') or not frame.winfo_exists():
+                return
+            progress_bar['value'] = progress['fraction']
+            status_label.configure(text=f"{progress['written']:,} of "
+                                        f"{progress['total']:,} rows")
+            frame.after(self.IMPORT_POLL_MS, poll_export)
+        
+        def export_finished(result=None, error=None):
+            if not frame.winfo_exists():
+                return
+            progress_bar.pack_forget()
+            cancel_btn.pack_forget()
+            export_btn.configure(state='normal')
+            status_label.configure(text="")
+            if error is not None:
+                if isinstance(error, export.ExportError):
+                    messagebox.showerror("Export Error", str(error))
+                else:
+                    self.show_error(error)
+            elif result['cancelled']:
+                messagebox.showinfo("Export", "Export cancelled.")
+            else:
+                messagebox.showinfo("Export", f"Exported {result['written']:,} rows "
+                                    f"to {result['path']}.")
+        
+        @tagged
+        def export_report():
+            report, fmt = report_var.get(), format_var.get()
+            path = filedialog.asksaveasfilename(
+                title=f"Export {report.capitalize()}", defaultextension='.' + fmt,
+                initialfile=f"{report}.{fmt}",
+                filetypes=[(fmt.upper(), '*.' + fmt), ("All files", "*.*")])
+            if not path:
+                return
+            
+            cancel_export.clear()
+            progress.update(fraction=0.0, written=0, total=0)
+            export_btn.configure(state='disabled')
+            progress_bar['value'] = 0
+            progress_bar.pack(side=tk.LEFT, padx=5, before=status_label)
+            cancel_btn.pack(side=tk.LEFT, before=status_label)
+            self.executor.submit(export.export_report, report,
+                                 self.current_user['user_id'], path, fmt, key='export',
+                                 progress=export_progress, cancelled=cancel_export.is_set,
+                                 on_success=export_finished,
+                                 on_error=lambda e: export_finished(error=e))
+            poll_export()
+        
+        export_btn.configure(command=export_report)
+    
+    def show_reports(self, perf_frame, stats_frame, risk_frame, data, show_returns=None,
+                     var_frame=None):
+        frames = [perf_frame, stats_frame]
+        if data['risk']:
+            frames.append(risk_frame)
+        if simulation and var_frame is not None:
+            frames.append(var_frame)
+        for frame in frames:
+            for widget in frame.winfo_children():
+                widget.destroy()
+        
+        performance = data['performance']
         if performance:
             row = 0
             for p in performance:
@@ -589,38 +1345,25 @@ class PortfolioManagementApp:
                 cost = float(p['cost_basis']) if p['cost_basis'] else 0
                 gain = float(p['gain_loss']) if p['gain_loss'] else 0
                 
-                info = f"Value: ${current:,.2f} | Cost: ${cost:,.2f} | "
-                info += f"Gain/Loss: ${gain:,.2f}"
-                
-                if cost > 0:
-                    pct = (gain / cost) * 100
-                    info += f" ({pct:+.2f}%)"
-                
+                info = self.performance_line(current, cost, gain, p['currency'])
                 ttk.Label(perf_frame, text=info).grid(row=row, column=1,
                                                       sticky=tk.W, padx=20)
                 row += 1
+            
+            # Every portfolio converted into one currency
+            totals = data['totals']
+            ttk.Label(perf_frame, text=f"Total ({totals['currency']})",
+                     font=('Helvetica', 11, 'bold')).grid(row=row, column=0,
+                                                          sticky=tk.W, padx=5)
+            info = self.performance_line(float(totals['current_value']),
+                                         float(totals['cost_basis']),
+                                         float(totals['gain_loss']), totals['currency'])
+            ttk.Label(perf_frame, text=info).grid(row=row, column=1, sticky=tk.W, padx=20)
         else:
             ttk.Label(perf_frame, text="No portfolio data available").grid(row=0, column=0)
         
-        # Summary statistics
-        stats_frame = ttk.LabelFrame(frame, text="Account Summary", padding="10")
-        stats_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=10)
-        
-        # Total portfolios
-        portfolio_count = DatabaseConnection.execute_query(
-            "SELECT COUNT(*) as count FROM Portfolios WHERE user_id = %s",
-            (self.current_user['user_id'],)
-        )
-        
-        # Total assets
-        asset_count = DatabaseConnection.execute_query(
-            """SELECT COUNT(DISTINCT ph.asset_id) as count
-               FROM Portfolio_Holdings ph
-               JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
-               WHERE p.user_id = %s""",
-            (self.current_user['user_id'],)
-        )
-        
+        portfolio_count = data['portfolio_count']
+        asset_count = data['asset_count']
         stats = [
             f"Total Portfolios: {portfolio_count[0]['count'] if portfolio_count else 0}",
             f"Total Assets Held: {asset_count[0]['count'] if asset_count else 0}",
@@ -631,12 +1374,113 @@ class PortfolioManagementApp:
             ttk.Label(stats_frame, text=stat, font=('Helvetica', 10)).grid(
                 row=i, column=0, sticky=tk.W, pady=2)
         
-        frame.columnconfigure(0, weight=1)
+        if data['risk']:
+            self.show_risk(risk_frame, performance, data['risk'])
+        if data['returns'] and show_returns is not None:
+            show_returns(data['returns'])
+        if simulation and var_frame is not None:
+            self.show_var(var_frame, performance, data['var'])
+    
+    @staticmethod
+    def performance_line(current, cost, gain, currency):
+        info = f"Value: {money(current, currency)} | Cost: {money(cost, currency)} | "
+        info += f"Gain/Loss: {money(gain, currency)}"
+        if cost > 0:
+            info += f" ({gain / cost * 100:+.2f}%)"
+        return info
+    
+    def show_risk(self, risk_frame, performance, risk):
+        def pct(value):
+            return "n/a" if value is None else f"{value * 100:.2f}%"
+        
+        def ratio(value):
+            return "n/a" if value is None else f"{value:.2f}"
+        
+        names = {p['portfolio_id']: p['portfolio_name'] for p in performance or []}
+        row = 0
+        for portfolio_id, m in risk['portfolios'].items():
+            if m['source'] is None:
+                continue
+            ttk.Label(risk_frame, text=names.get(portfolio_id, f"Portfolio {portfolio_id}"),
+                     font=('Helvetica', 11, 'bold')).grid(row=row, column=0,
+                                                          sticky=tk.W, padx=5)
+            info = (f"Return: {pct(m['annual_return'])} | "
+                    f"Volatility: {pct(m['volatility'])} | "
+                    f"Sharpe: {ratio(m['sharpe'])} | Sortino: {ratio(m['sortino'])} | "
+                    f"Max Drawdown: {pct(m['max_drawdown'])} | Beta: {ratio(m['beta'])}")
+            if m['source'] == 'holdings':
+                info += " (current holdings)"
+            ttk.Label(risk_frame, text=info).grid(row=row, column=1, sticky=tk.W, padx=20)
+            row += 1
+        
+        if not row:
+            ttk.Label(risk_frame, text="No price history available").grid(row=0, column=0)
+            return
+        
+        pairs = analytics.top_correlations(risk)
+        if pairs:
+            text = ", ".join(f"{a}/{b} {rho:.2f}" for a, b, rho in pairs)
+            ttk.Label(risk_frame, text=f"Most correlated holdings: {text}").grid(
+                row=row, column=0, columnspan=2, sticky=tk.W, padx=5, pady=(5, 0))
+    
+    def show_var(self, var_frame, performance, var):
+        if not var:
+            ttk.Label(var_frame, text="Not enough price history available").grid(
+                row=0, column=0)
+            return
+        
+        # A column per horizon and confidence level, each "VaR / CVaR"
+        levels = [(h, c) for h in simulation.HORIZONS for c in simulation.CONFIDENCE]
+        columns = tuple(f"{h} day{'s' if h > 1 else ''} {c:.0%}" for h, c in levels)
+        names = {p['portfolio_id']: p['portfolio_name'] for p in performance or []}
+        risks = [(names.get(pid, f"Portfolio {pid}"), risk)
+                 for pid, risk in var['portfolios'].items()]
+        risks.append((f"Total ({var['total']['currency']})", var['total']))
+        
+        tree = ttk.Treeview(var_frame, columns=columns, height=min(3 * len(risks), 12))
+        tree.heading('#0', text="Portfolio / Method")
+        tree.column('#0', width=260)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=170, anchor=tk.E)
+        tree.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        var_frame.columnconfigure(0, weight=1)
+        
+        for name, risk in risks:
+            currency = risk['currency']
+            text = f"{name}: {money(risk['value'], currency)}"
+            if risk['measured'] < 1:
+                text += f" ({risk['measured']:.0%} measured)"
+            parent = tree.insert('', tk.END, text=text, open=True)
+            for method, label in (('monte_carlo', "Monte Carlo"), ('historical', "Historical")):
+                found = {(r['horizon'], r['confidence']): r for r in risk[method]}
+                tree.insert(parent, tk.END, text=label, values=tuple(
+                    f"{money(found[l]['var'], currency)} / {money(found[l]['cvar'], currency)}"
+                    if l in found else "n/a" for l in levels))
+        
+        ttk.Label(var_frame, text=(
+            f"VaR / CVaR: the loss not exceeded at the confidence level / the average "
+            f"loss beyond it. {var['paths']:,} simulated paths; {var['observations']} "
+            f"days of price history.")).grid(
+            row=1, column=0, sticky=tk.W, pady=(5, 0))
 
 def main():
+    if os.environ.get('PORTFOLIO_TIMINGS'):
+        logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    
+    # Keep a Prometheus (or .json) metrics file up to date for scraping
+    metrics_file = os.environ.get('PORTFOLIO_METRICS_FILE')
+    stop_exporter = start_exporter(metrics_file) if metrics_file else None
+    
     root = tk.Tk()
     app = PortfolioManagementApp(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.executor.shutdown()
+        DatabaseConnection.close_pool()
+        if stop_exporter is not None:
+            stop_exporter()
 
 if __name__ == "__main__":
     main()
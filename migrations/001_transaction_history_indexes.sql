@@ -0,0 +1,17 @@
+-- Migration 001: Indexes for keyset-paginated transaction history
+-- Run after dbmysql.frm on existing databases.
+--
+-- The transactions tab reads each portfolio's history newest first with
+-- a keyset on (transaction_date, transaction_id) and optional asset and
+-- type filters. Each index below lets one filter combination be read
+-- backwards in order and stop after one page, so a page costs the same
+-- whether it is the first one or the thousandth.
+
+USE portfolio_management;
+
+ALTER TABLE Transactions
+    -- Replaces idx_portfolio_date, which is a prefix of the new index
+    DROP INDEX idx_portfolio_date,
+    ADD INDEX idx_portfolio_date_id (portfolio_id, transaction_date, transaction_id),
+    ADD INDEX idx_portfolio_asset_date_id (portfolio_id, asset_id, transaction_date, transaction_id),
+    ADD INDEX idx_portfolio_type_date_id (portfolio_id, transaction_type, transaction_date, transaction_id);
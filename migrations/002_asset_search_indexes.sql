@@ -0,0 +1,12 @@
+-- Migration 002: Indexes for asset search
+--
+-- Search-as-you-type on the Available Assets tab ranks exact symbol,
+-- symbol prefix and name matches. Symbol prefixes already use the
+-- idx_symbol B-tree (LIKE 'TERM%'). Name matches need a FULLTEXT index
+-- so that word-prefix lookups (MATCH ... AGAINST ('+micro*' IN BOOLEAN
+-- MODE)) do not scan the whole Assets table.
+
+USE portfolio_management;
+
+ALTER TABLE Assets
+    ADD FULLTEXT INDEX ft_asset_name (asset_name);
@@ -0,0 +1,17 @@
+-- Migration 003: Daily asset prices for risk analytics
+--
+-- The Reports & Analytics tab computes volatility, drawdown and the
+-- covariance of holdings (analytics.py). Assets only carries the latest
+-- price, so closing prices are kept per asset and day. The primary key
+-- serves the analytics load, which reads every held asset's history
+-- from a start date in one query.
+
+USE portfolio_management;
+
+CREATE TABLE IF NOT EXISTS Asset_Price_History (
+    asset_id INT NOT NULL,
+    price_date DATE NOT NULL,
+    close_price DECIMAL(12, 4) NOT NULL,
+    PRIMARY KEY (asset_id, price_date),
+    FOREIGN KEY (asset_id) REFERENCES Assets(asset_id) ON DELETE CASCADE
+);
@@ -0,0 +1,31 @@
+-- Migration 004: Position and P&L snapshots
+--
+-- snapshots.py writes one Performance_Metrics row per portfolio and day
+-- whenever a transaction or a price change affects the portfolio. The
+-- reports tab and v_user_portfolios read the latest snapshot through the
+-- unique_portfolio_date key instead of aggregating every holding.
+--
+-- Backfill today's snapshots afterwards with: python snapshots.py
+
+USE portfolio_management;
+
+ALTER TABLE Performance_Metrics
+    ADD COLUMN market_value DECIMAL(15, 2) NOT NULL DEFAULT 0.00 AFTER total_value,
+    ADD COLUMN cost_basis DECIMAL(15, 2) NOT NULL DEFAULT 0.00 AFTER market_value,
+    ADD COLUMN holdings_count INT NOT NULL DEFAULT 0 AFTER cost_basis;
+
+CREATE OR REPLACE VIEW v_user_portfolios AS
+SELECT 
+    u.user_id,
+    CONCAT(u.first_name, ' ', u.last_name) AS user_name,
+    p.portfolio_id,
+    p.portfolio_name,
+    p.portfolio_type,
+    COALESCE(pm.total_value, p.total_value) AS total_value,
+    p.status,
+    COALESCE(pm.holdings_count, 0) AS total_holdings
+FROM Users u
+JOIN Portfolios p ON u.user_id = p.user_id
+LEFT JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+ AND pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                       WHERE portfolio_id = p.portfolio_id);
@@ -0,0 +1,10 @@
+-- Migration 005: Index for loading watchlist alert targets
+--
+-- alerts.py loads every watchlist target sorted by asset and target price
+-- to build its per-asset threshold arrays. This index returns the rows in
+-- that order, so the load needs no sort over millions of rows.
+
+USE portfolio_management;
+
+ALTER TABLE Watchlist
+    ADD INDEX idx_asset_target (asset_id, target_price);
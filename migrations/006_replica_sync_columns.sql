@@ -0,0 +1,29 @@
+-- Migration 006: Change tracking for the offline replica
+--
+-- replica.py keeps a local copy of a user's data and pulls only what
+-- changed since its last sync: rows whose last_updated is at or after
+-- the previous sync (Assets already has the column), and Transactions
+-- with a transaction_id above the last one pulled. Transactions needs
+-- no new index for that: InnoDB's portfolio_id index ends with the
+-- primary key. The indexes below serve the other delta queries.
+
+USE portfolio_management;
+
+ALTER TABLE Portfolios
+    ADD COLUMN last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_user_updated (user_id, last_updated);
+
+ALTER TABLE Portfolio_Holdings
+    ADD COLUMN last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_portfolio_updated (portfolio_id, last_updated);
+
+ALTER TABLE Performance_Metrics
+    ADD COLUMN last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_portfolio_updated (portfolio_id, last_updated);
+
+ALTER TABLE Watchlist
+    ADD COLUMN last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_user_updated (user_id, last_updated);
+
+ALTER TABLE Assets
+    ADD INDEX idx_last_updated (last_updated);
@@ -0,0 +1,64 @@
+-- Migration 007: Tax lots and realized gains
+--
+-- lots.py replays Transactions into tax lots, one per buy, relieved by
+-- sells in FIFO, LIFO, HIFO (highest cost first) or specific-lot order.
+-- The open lots and each portfolio's last replayed transaction are kept
+-- per method as a checkpoint, so new trades are applied to the saved
+-- lots instead of replaying the whole history. Realized_Gains holds one
+-- row per lot (part) a sale relieved, read by tax year through
+-- idx_portfolio_method_sold.
+--
+-- Specific-lot relief takes the lots recorded for a sale in
+-- Tax_Lot_Selections first, and falls back to FIFO for the rest.
+
+USE portfolio_management;
+
+CREATE TABLE IF NOT EXISTS Tax_Lot_Checkpoints (
+    portfolio_id INT NOT NULL,
+    method ENUM('fifo', 'lifo', 'hifo', 'specific') NOT NULL,
+    last_transaction_id INT NOT NULL,
+    last_transaction_date DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, method),
+    FOREIGN KEY (portfolio_id) REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS Tax_Lots (
+    portfolio_id INT NOT NULL,
+    method ENUM('fifo', 'lifo', 'hifo', 'specific') NOT NULL,
+    lot_id INT NOT NULL,                    -- The buy transaction
+    asset_id INT NOT NULL,
+    acquired_date DATETIME NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,       -- Still open
+    unit_cost DECIMAL(18, 8) NOT NULL,      -- Price plus fees per unit
+    PRIMARY KEY (portfolio_id, method, lot_id),
+    FOREIGN KEY (portfolio_id) REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    FOREIGN KEY (asset_id) REFERENCES Assets(asset_id)
+);
+
+CREATE TABLE IF NOT EXISTS Realized_Gains (
+    gain_id INT PRIMARY KEY AUTO_INCREMENT,
+    portfolio_id INT NOT NULL,
+    method ENUM('fifo', 'lifo', 'hifo', 'specific') NOT NULL,
+    sell_transaction_id INT NOT NULL,
+    lot_id INT,                             -- NULL: sold more than was bought
+    asset_id INT NOT NULL,
+    acquired_date DATETIME,
+    sold_date DATETIME NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,
+    proceeds DECIMAL(15, 2) NOT NULL,       -- After the sale's fees
+    cost_basis DECIMAL(15, 2) NOT NULL,
+    gain DECIMAL(15, 2) NOT NULL,
+    long_term BOOLEAN NOT NULL,             -- Held more than a year
+    FOREIGN KEY (portfolio_id) REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    FOREIGN KEY (asset_id) REFERENCES Assets(asset_id),
+    INDEX idx_portfolio_method_sold (portfolio_id, method, sold_date)
+);
+
+CREATE TABLE IF NOT EXISTS Tax_Lot_Selections (
+    sell_transaction_id INT NOT NULL,
+    lot_id INT NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,
+    PRIMARY KEY (sell_transaction_id, lot_id),
+    FOREIGN KEY (sell_transaction_id) REFERENCES Transactions(transaction_id),
+    FOREIGN KEY (lot_id) REFERENCES Transactions(transaction_id)
+);
@@ -0,0 +1,28 @@
+-- Migration 008: Time- and money-weighted returns
+--
+-- returns.py values each portfolio day by day from Transactions and
+-- Asset_Price_History and computes its time-weighted return (TWR) and
+-- annualized money-weighted return (XIRR) over a date range, for the
+-- whole portfolio (asset_id 0) and per asset. Performance_Metrics holds
+-- one snapshot per portfolio and day, so the results for a range are
+-- cached here beside it. A cached range is reused until the portfolio
+-- gets a new transaction (last_transaction_id) or, for a range ending
+-- today, its current prices age (computed_at).
+
+USE portfolio_management;
+
+CREATE TABLE IF NOT EXISTS Performance_Returns (
+    portfolio_id INT NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    asset_id INT NOT NULL DEFAULT 0,        -- 0: the whole portfolio
+    start_value DECIMAL(15, 2) NOT NULL,    -- At the close before start_date
+    end_value DECIMAL(15, 2) NOT NULL,
+    net_flow DECIMAL(15, 2) NOT NULL,       -- Bought, less sold and paid out
+    twr DECIMAL(20, 8),                     -- NULL: nothing was held
+    irr DECIMAL(20, 8),                     -- Annualized; NULL: no rate exists
+    last_transaction_id INT NOT NULL,
+    computed_at DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, start_date, end_date, asset_id),
+    FOREIGN KEY (portfolio_id) REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE
+);
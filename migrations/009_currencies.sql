@@ -0,0 +1,55 @@
+-- Migration 009: Currencies and exchange rates
+--
+-- Each asset is priced in the currency of its exchange and each
+-- portfolio reports in its own currency (Portfolios.currency). fx.py
+-- converts between them with the daily rates of FX_Rates: one unit of
+-- base_currency buys `rate` units of quote_currency on rate_date, and a
+-- day without a row uses the latest rate before it. Pairs not stored
+-- directly are inverted or crossed through USD, so a rate against USD
+-- per currency is enough.
+--
+-- Snapshots are in the portfolio's currency afterwards. Load rates and
+-- rebuild today's snapshots with: python fx.py rates.csv
+
+USE portfolio_management;
+
+ALTER TABLE Assets
+    ADD COLUMN currency CHAR(3) NOT NULL DEFAULT 'USD' AFTER exchange;
+
+UPDATE Assets SET currency = 'GBP' WHERE exchange = 'LSE';
+UPDATE Assets SET currency = 'CAD' WHERE exchange = 'TSX';
+
+UPDATE Portfolios SET currency = 'USD' WHERE currency IS NULL;
+ALTER TABLE Portfolios
+    MODIFY COLUMN currency CHAR(3) NOT NULL DEFAULT 'USD';
+
+CREATE TABLE IF NOT EXISTS FX_Rates (
+    base_currency CHAR(3) NOT NULL,
+    quote_currency CHAR(3) NOT NULL,
+    rate_date DATE NOT NULL,
+    rate DECIMAL(18, 8) NOT NULL,           -- Units of quote_currency per base_currency
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (base_currency, quote_currency, rate_date),
+    INDEX idx_last_updated (last_updated)   -- Synced to the offline replica like Assets
+);
+
+-- The portfolio list shows each portfolio's currency
+CREATE OR REPLACE VIEW v_user_portfolios AS
+SELECT
+    u.user_id,
+    CONCAT(u.first_name, ' ', u.last_name) AS user_name,
+    p.portfolio_id,
+    p.portfolio_name,
+    p.portfolio_type,
+    COALESCE(pm.total_value, p.total_value) AS total_value,
+    p.currency,
+    p.status,
+    COALESCE(pm.holdings_count, 0) AS total_holdings
+FROM Users u
+JOIN Portfolios p ON u.user_id = p.user_id
+LEFT JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+ AND pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                       WHERE portfolio_id = p.portfolio_id);
+
+-- Cached returns were valued without conversion
+DELETE FROM Performance_Returns;
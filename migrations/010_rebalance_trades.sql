@@ -0,0 +1,25 @@
+-- Migration 010: Rebalancing plans
+--
+-- rebalance.py compares each portfolio's holdings with the target
+-- allocation of its portfolio_type and, where an asset class has drifted
+-- beyond the tolerance band, plans the trades that bring it back. The
+-- nightly batch (python rebalance.py) keeps the latest plan of every
+-- active portfolio here: no rows means nothing to do. Quantities and
+-- prices are in the asset's currency, amounts and fees in the
+-- portfolio's.
+
+USE portfolio_management;
+
+CREATE TABLE IF NOT EXISTS Rebalance_Trades (
+    portfolio_id INT NOT NULL,
+    asset_id INT NOT NULL,
+    transaction_type ENUM('buy', 'sell') NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,
+    price_per_unit DECIMAL(12, 4) NOT NULL,
+    amount DECIMAL(15, 2) NOT NULL,
+    fees DECIMAL(10, 2) NOT NULL,
+    planned_at DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, asset_id),
+    FOREIGN KEY (portfolio_id) REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    FOREIGN KEY (asset_id) REFERENCES Assets(asset_id)
+);
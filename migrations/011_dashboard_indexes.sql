@@ -0,0 +1,14 @@
+-- Migration 011: Index for the dashboard summary
+--
+-- service.dashboard() loads the portfolio list, the portfolio choices
+-- and the report figures of a user in one query (queries.DASHBOARD),
+-- starting from the user's portfolios and their status. idx_user_status
+-- serves that start and the active-portfolio filters of the reports,
+-- and replaces idx_user_id, its prefix. The holdings side is served by
+-- idx_portfolio_asset (portfolio_id, asset_id) of the base schema.
+
+USE portfolio_management;
+
+ALTER TABLE Portfolios
+    ADD INDEX idx_user_status (user_id, status),
+    DROP INDEX idx_user_id;
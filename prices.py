@@ -0,0 +1,284 @@
+"""
+Price feed ingestion for the Portfolio Management System
+
+PriceUpdater accepts price updates from any thread and writes them to
+Assets.current_price and Asset_Price_History in the background. Updates
+are coalesced per asset and day within a time window, so a symbol that
+ticks a thousand times a second is written once per window. Each flush
+writes batch_size assets per multi-row UPDATE ... CASE statement, plus
+one multi-row history upsert, all in a single transaction.
+
+Feeds are plain iterables of (symbol, price, timestamp):
+
+    read_eod(path)      end-of-day CSV: symbol, date, close
+    read_ticks(path)    tick CSV: timestamp, symbol, price
+    mock_feed(...)      random walk over the asset catalog, for testing
+
+Run from the command line, e.g.:
+
+    python prices.py eod closes.csv
+    python prices.py mock --rate 20000 --seconds 30 --alerts
+"""
+
+import argparse
+import csv
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import alerts
+import queries
+import snapshots
+from database import DatabaseConnection
+from instrumentation import timings
+
+logger = logging.getLogger('portfolio.prices')
+
+FLUSH_WINDOW = 1.0      # Seconds updates are coalesced before writing
+BATCH_SIZE = 1000       # Assets per UPDATE statement
+
+# Column aliases in price files, compared lower case
+EOD_COLUMNS = {'symbol': ('symbol', 'ticker'), 'date': ('date', 'price_date'),
+               'price': ('close', 'close_price', 'price')}
+TICK_COLUMNS = {'symbol': ('symbol', 'ticker'), 'time': ('timestamp', 'time', 'datetime'),
+                'price': ('price', 'last')}
+
+
+class PriceUpdater:
+    """Coalesce price updates and write them to the database in batches"""
+
+    def __init__(self, window=FLUSH_WINDOW, batch_size=BATCH_SIZE):
+        self.window = window
+        self.batch_size = batch_size
+        self.symbols = {}
+        self._pending = {}          # (asset_id, day) -> (price, timestamp)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'received': 0, 'unknown': 0, 'written': 0, 'history': 0,
+                       'flushes': 0, 'failures': 0}
+        self.reload_symbols()
+
+    def reload_symbols(self):
+        rows = DatabaseConnection.run_query(queries.ASSET_SYMBOLS)
+        self.symbols = {row['asset_symbol'].upper(): row['asset_id'] for row in rows}
+
+    def add_listener(self, listener):
+        """Call listener({asset_id: price}) after each successful flush"""
+        self._listeners.append(listener)
+
+    def submit(self, symbol, price, timestamp=None):
+        """Queue a price; a later price for the same asset and day replaces it"""
+        asset_id = self.symbols.get(symbol.upper())
+        timestamp = timestamp or datetime.now()
+        with self._lock:
+            self._stats['received'] += 1
+            if asset_id is None:
+                self._stats['unknown'] += 1
+                return False
+            key = (asset_id, timestamp.date())
+            current = self._pending.get(key)
+            if current is None or current[1] <= timestamp:
+                self._pending[key] = (price, timestamp)
+        return True
+
+    # Background writing
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='price-flush',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and write whatever is still pending"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Write all pending updates now; returns the number of assets updated"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            # The newest price of each asset becomes its current price
+            latest = {}
+            for (asset_id, _), (price, timestamp) in pending.items():
+                if asset_id not in latest or latest[asset_id][1] < timestamp:
+                    latest[asset_id] = (price, timestamp)
+            history = [(asset_id, day, price) for (asset_id, day), (price, _) in pending.items()]
+
+            try:
+                with timings.measure('prices', 'flush'):
+                    self._write(latest, history)
+            except Exception:
+                logger.exception("Price flush of %d assets failed", len(latest))
+                with self._lock:
+                    self._stats['failures'] += 1
+                    # Keep the updates for the next flush unless newer ones arrived
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                return 0
+
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['written'] += len(latest)
+                self._stats['history'] += len(history)
+
+        prices = {asset_id: price for asset_id, (price, _) in latest.items()}
+        for listener in self._listeners:
+            try:
+                listener(prices)
+            except Exception:
+                logger.exception("Price listener %r failed", listener)
+        return len(latest)
+
+    def _write(self, latest, history):
+        updates = list(latest.items())
+        with DatabaseConnection.transaction(['Assets', 'Asset_Price_History']) as cursor:
+            for start in range(0, len(updates), self.batch_size):
+                chunk = updates[start:start + self.batch_size]
+                params = [value for asset_id, (price, _) in chunk for value in (asset_id, price)]
+                params.extend(asset_id for asset_id, _ in chunk)
+                cursor.execute(queries.price_update(len(chunk)), params)
+            for start in range(0, len(history), self.batch_size):
+                cursor.executemany(queries.UPSERT_PRICE_HISTORY,
+                                   history[start:start + self.batch_size])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+
+# Feeds
+
+def _columns(header, aliases, path):
+    names = [name.strip().lower() for name in header]
+    columns = {}
+    for field, options in aliases.items():
+        found = [names.index(option) for option in options if option in names]
+        if not found:
+            raise ValueError(f"{path}: no {field} column")
+        columns[field] = found[0]
+    return columns
+
+
+def _read(path, aliases, parse_time):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        columns = _columns(next(reader, []), aliases, path)
+        time_field = 'date' if 'date' in columns else 'time'
+        for row in reader:
+            try:
+                yield (row[columns['symbol']].strip(), Decimal(row[columns['price']]),
+                       parse_time(row[columns[time_field]].strip()))
+            except (IndexError, ValueError, InvalidOperation):
+                logger.warning("%s line %d: skipped %r", path, reader.line_num, row)
+
+
+def read_eod(path):
+    """(symbol, close, date) from an end-of-day CSV"""
+    return _read(path, EOD_COLUMNS, lambda text: datetime.strptime(text[:10], '%Y-%m-%d'))
+
+
+def read_ticks(path):
+    """(symbol, price, timestamp) from a tick CSV with ISO timestamps"""
+    return _read(path, TICK_COLUMNS, datetime.fromisoformat)
+
+
+def mock_feed(symbols, rate=10000, seconds=10, volatility=0.001, start_prices=None):
+    """Random-walk prices for symbols at roughly rate updates per second"""
+    prices = dict(start_prices or {})
+    symbols = list(symbols)
+    if not symbols:
+        return
+    deadline = time.monotonic() + seconds
+    sent, started = 0, time.monotonic()
+    while time.monotonic() < deadline:
+        symbol = random.choice(symbols)
+        price = prices.get(symbol, 100.0) * (1 + random.gauss(0, volatility))
+        prices[symbol] = max(price, 0.0001)
+        yield symbol, round(prices[symbol], 4), datetime.now()
+        sent += 1
+        # Throttle to the requested rate
+        ahead = sent / rate - (time.monotonic() - started)
+        if ahead > 0.01:
+            time.sleep(ahead)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load asset prices into the database")
+    parser.add_argument('feed', choices=['eod', 'ticks', 'mock'])
+    parser.add_argument('path', nargs='?', help="Price file (eod and ticks)")
+    parser.add_argument('--rate', type=int, default=10000, help="Mock updates per second")
+    parser.add_argument('--seconds', type=float, default=10, help="Mock feed duration")
+    parser.add_argument('--window', type=float, default=FLUSH_WINDOW)
+    parser.add_argument('--no-snapshots', action='store_true',
+                        help="Do not refresh portfolio snapshots after each flush")
+    parser.add_argument('--alerts', action='store_true',
+                        help="Check watchlist targets and log the alerts that fire")
+    parser.add_argument('--smtp', metavar='HOST:PORT',
+                        help="Also email alerts through this SMTP server")
+    args = parser.parse_args()
+    if args.feed != 'mock' and not args.path:
+        parser.error(f"{args.feed} needs a price file")
+
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    updater = PriceUpdater(window=args.window)
+    if not args.no_snapshots:
+        updater.add_listener(snapshots.on_price_change)
+    if args.alerts or args.smtp:
+        engine = alerts.AlertEngine()
+        engine.add_sink(alerts.log_sink)
+        if args.smtp:
+            host, _, port = args.smtp.partition(':')
+            engine.add_sink(alerts.SmtpSink(host, int(port or 25)))
+        logging.getLogger('portfolio.alerts').info("Watching %d targets", engine.load())
+        updater.add_listener(engine.check_prices)
+
+    if args.feed == 'eod':
+        feed = read_eod(args.path)
+    elif args.feed == 'ticks':
+        feed = read_ticks(args.path)
+    else:
+        # Walk from today's prices so the mock does not reset them all
+        start = {row['asset_symbol']: float(row['current_price'])
+                 for row in DatabaseConnection.run_query(queries.ASSET_PRICES)}
+        feed = mock_feed(updater.symbols, args.rate, args.seconds, start_prices=start)
+
+    started = time.perf_counter()
+    updater.start()
+    try:
+        for symbol, price, timestamp in feed:
+            updater.submit(symbol, price, timestamp)
+    finally:
+        updater.close()
+        DatabaseConnection.close_pool()
+    elapsed = time.perf_counter() - started
+    stats = updater.stats()
+    print(f"{stats['received']:,} updates in {elapsed:.1f}s "
+          f"({stats['received'] / elapsed:,.0f}/s): {stats['written']:,} asset writes, "
+          f"{stats['history']:,} history rows, {stats['unknown']:,} unknown symbols, "
+          f"{stats['failures']} failed flushes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,838 @@
+"""
+SQL used by the Portfolio Management System
+
+Kept apart from the GUI so that data for a tab can be fetched (or
+prefetched) without building the tab's widgets.
+"""
+
+import re
+from datetime import timedelta
+
+
+def _in_list(values):
+    """Placeholders for an IN (...) list of len(values) parameters"""
+    return ', '.join(['%s'] * len(values))
+
+# Users
+LOGIN = "SELECT * FROM Users WHERE email = %s AND status = 'active'"
+
+INSERT_USER = """INSERT INTO Users (first_name, last_name, email, phone,
+          date_of_birth, address) VALUES (%s, %s, %s, %s, %s, %s)"""
+
+# Portfolios
+USER_PORTFOLIOS = "SELECT * FROM v_user_portfolios WHERE user_id = %s"
+
+PORTFOLIO_CHOICES = "SELECT portfolio_id, portfolio_name FROM Portfolios WHERE user_id = %s"
+
+INSERT_PORTFOLIO = """INSERT INTO Portfolios (user_id, portfolio_name, portfolio_type, total_value)
+          VALUES (%s, %s, %s, %s)"""
+
+# Holdings
+# Prices and values are in the asset's currency; market_value is
+# converted into the portfolio's by service.holdings
+PORTFOLIO_HOLDINGS = """
+    SELECT a.asset_name, a.asset_symbol, a.asset_type, ph.quantity,
+           ph.purchase_price, ph.current_value, ph.purchase_date,
+           ph.quantity * a.current_price AS market_value, a.currency,
+           p.currency AS portfolio_currency
+    FROM Portfolio_Holdings ph
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
+    WHERE ph.portfolio_id = %s
+"""
+
+# Transactions
+# History is paged with a keyset on (transaction_date, transaction_id),
+# newest first; see migrations/001_transaction_history_indexes.sql
+TRANSACTION_PAGE_SIZE = 200
+
+TRANSACTION_COLUMNS = """t.transaction_id, t.portfolio_id, t.asset_id, t.transaction_type,
+           t.quantity, t.price_per_unit, t.total_amount, t.transaction_date, t.fees"""
+
+def transaction_page(portfolio_ids, filters=None, after=None, limit=TRANSACTION_PAGE_SIZE):
+    """Build (query, params) for one page of transaction history.
+
+    Each portfolio is read by its own LIMITed branch of a UNION ALL, so
+    every branch walks a (portfolio_id, ..., transaction_date,
+    transaction_id) index backwards and stops after `limit` rows: a page
+    costs the same however deep into the history it is.
+
+    filters may hold asset_symbol, transaction_type, date_from and date_to
+    (dates, both inclusive). after is the (transaction_date, transaction_id)
+    of the last row of the previous page. Returns (None, None) when there
+    are no portfolios to read.
+    """
+    filters = filters or {}
+    conditions, params = [], []
+
+    if filters.get('asset_symbol'):
+        conditions.append("t.asset_id = (SELECT asset_id FROM Assets WHERE asset_symbol = %s)")
+        params.append(filters['asset_symbol'])
+    if filters.get('transaction_type'):
+        conditions.append("t.transaction_type = %s")
+        params.append(filters['transaction_type'])
+    if filters.get('date_from'):
+        conditions.append("t.transaction_date >= %s")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        conditions.append("t.transaction_date < %s")
+        params.append(filters['date_to'] + timedelta(days=1))
+    if after is not None:
+        last_date, last_id = after
+        conditions.append("t.transaction_date <= %s "
+                          "AND (t.transaction_date < %s OR t.transaction_id < %s)")
+        params.extend([last_date, last_date, last_id])
+
+    where = ''.join(f" AND {c}" for c in conditions)
+    branches, all_params = [], []
+    for i, portfolio_id in enumerate(portfolio_ids):
+        branches.append(f"""
+        SELECT * FROM (
+            SELECT {TRANSACTION_COLUMNS}
+            FROM Transactions t
+            WHERE t.portfolio_id = %s{where}
+            ORDER BY t.transaction_date DESC, t.transaction_id DESC
+            LIMIT %s
+        ) AS page_{i}""")
+        all_params.extend([portfolio_id, *params, limit])
+
+    if not branches:
+        return None, None
+
+    query = f"""
+    SELECT t.transaction_id, p.portfolio_name, a.asset_symbol,
+           t.transaction_type, t.quantity, t.price_per_unit,
+           t.total_amount, t.transaction_date, t.fees, a.currency
+    FROM ({" UNION ALL ".join(branches)}
+    ) t
+    JOIN Portfolios p ON t.portfolio_id = p.portfolio_id
+    JOIN Assets a ON t.asset_id = a.asset_id
+    ORDER BY t.transaction_date DESC, t.transaction_id DESC
+    LIMIT %s
+    """
+    all_params.append(limit)
+    return query, tuple(all_params)
+
+# Import (importer.py)
+ASSET_SYMBOLS = "SELECT asset_id, asset_symbol FROM Assets"
+
+INSERT_TRANSACTION = """INSERT INTO Transactions (portfolio_id, asset_id, transaction_type,
+          quantity, price_per_unit, transaction_date, fees, notes)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+
+INSERT_HOLDING = """INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity,
+          purchase_price, purchase_date) VALUES (%s, %s, %s, %s, %s)"""
+
+def transaction_replay(id_ranges):
+    """Build (query, params) for the transactions with ids in id_ranges
+    ((first, last) pairs) in the order holdings evolve"""
+    conditions = ' OR '.join(['transaction_id BETWEEN %s AND %s'] * len(id_ranges))
+    query = f"""
+    SELECT portfolio_id, asset_id, transaction_type, quantity, price_per_unit,
+           transaction_date
+    FROM Transactions
+    WHERE {conditions}
+    ORDER BY portfolio_id, asset_id, transaction_date, transaction_id
+    """
+    return query, tuple(value for id_range in id_ranges for value in id_range)
+
+def position_holdings(portfolio_ids):
+    """Build (query, params) locking the holdings of the portfolios until
+    the transaction ends"""
+    query = f"""
+    SELECT portfolio_id, asset_id, quantity, purchase_price, purchase_date
+    FROM Portfolio_Holdings
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)})
+    ORDER BY portfolio_id, asset_id, purchase_date
+    FOR UPDATE"""
+    return query, tuple(portfolio_ids)
+
+DELETE_POSITION = "DELETE FROM Portfolio_Holdings WHERE portfolio_id = %s AND asset_id = %s"
+
+# Prices (prices.py)
+ASSET_PRICES = "SELECT asset_symbol, current_price FROM Assets"
+
+def price_update(count):
+    """UPDATE setting current_price of count assets in one statement.
+
+    Params: (asset_id, price) pairs for the CASE, then the asset ids.
+    """
+    cases = ' '.join(['WHEN %s THEN %s'] * count)
+    return f"""UPDATE Assets
+          SET current_price = CASE asset_id {cases} END,
+              last_updated = CURRENT_TIMESTAMP
+          WHERE asset_id IN ({_in_list(range(count))})"""
+
+UPSERT_PRICE_HISTORY = """INSERT INTO Asset_Price_History (asset_id, price_date, close_price)
+          VALUES (%s, %s, %s)
+          ON DUPLICATE KEY UPDATE close_price = VALUES(close_price)"""
+
+# Assets
+# The whole catalog, for the in-process search index (search.py)
+ASSET_CATALOG = """
+    SELECT a.*, ac.category_name
+    FROM Assets a
+    JOIN Asset_Categories ac ON a.category_id = ac.category_id
+    ORDER BY a.asset_symbol
+"""
+
+def asset_search(term, limit=100):
+    """Build (query, params) for a ranked, capped asset search in SQL.
+
+    Used until the in-process index is loaded. Symbol matches use the
+    idx_symbol range for a prefix LIKE; name matches use the ft_asset_name
+    FULLTEXT index (migrations/002_asset_search_indexes.sql). Ranks: 0 exact
+    symbol, 1 symbol prefix, 2 name match.
+    """
+    symbol = term.strip().upper()
+    prefix = symbol.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    branches = ["""
+        SELECT * FROM (
+            SELECT asset_id, CASE WHEN asset_symbol = %s THEN 0 ELSE 1 END AS match_rank
+            FROM Assets
+            WHERE asset_symbol LIKE %s
+            ORDER BY asset_symbol
+            LIMIT %s
+        ) AS by_symbol"""]
+    params = [symbol, prefix, limit]
+
+    # Every word must match the start of a word in the name
+    words = re.findall(r'\w+', term)
+    if words:
+        branches.append("""
+        SELECT * FROM (
+            SELECT asset_id, 2 AS match_rank
+            FROM Assets
+            WHERE MATCH(asset_name) AGAINST (%s IN BOOLEAN MODE)
+            LIMIT %s
+        ) AS by_name""")
+        params.extend([' '.join(f'+{w}*' for w in words), limit])
+
+    query = f"""
+    SELECT a.*, ac.category_name, m.match_rank
+    FROM (
+        SELECT asset_id, MIN(match_rank) AS match_rank
+        FROM ({" UNION ALL ".join(branches)}
+        ) matches
+        GROUP BY asset_id
+    ) m
+    JOIN Assets a ON a.asset_id = m.asset_id
+    JOIN Asset_Categories ac ON a.category_id = ac.category_id
+    ORDER BY m.match_rank, a.asset_symbol
+    LIMIT %s
+    """
+    params.append(limit)
+    return query, tuple(params)
+
+# Watchlist
+WATCHLIST = """
+    SELECT a.asset_name, a.asset_symbol, a.current_price, a.currency,
+           w.target_price, w.added_date, w.notes
+    FROM Watchlist w
+    JOIN Assets a ON w.asset_id = a.asset_id
+    WHERE w.user_id = %s
+"""
+
+# Alerts (alerts.py)
+# Latest prices of the assets a user has targets on, polled by the GUI
+WATCHLIST_PRICES = """
+    SELECT DISTINCT a.asset_id, a.current_price
+    FROM Watchlist w
+    JOIN Assets a ON w.asset_id = a.asset_id
+    WHERE w.user_id = %s AND w.target_price IS NOT NULL
+"""
+
+def watchlist_targets(user_id=None):
+    """Build (query, params) for the targets of active users (or one user),
+    sorted by asset and target; read through idx_asset_target"""
+    where, params = "", ()
+    if user_id is not None:
+        where, params = " AND w.user_id = %s", (user_id,)
+    query = f"""
+    SELECT w.watchlist_id, w.user_id, w.asset_id, w.target_price, a.current_price,
+           a.currency
+    FROM Watchlist w
+    JOIN Users u ON w.user_id = u.user_id
+    JOIN Assets a ON w.asset_id = a.asset_id
+    WHERE w.target_price IS NOT NULL AND u.status = 'active'{where}
+    ORDER BY w.asset_id, w.target_price
+    """
+    return query, params
+
+def user_contacts(user_ids):
+    query = f"SELECT user_id, email, first_name FROM Users WHERE user_id IN ({_in_list(user_ids)})"
+    return query, tuple(user_ids)
+
+# Reports
+# Reads the latest snapshot of each portfolio (snapshots.py): one indexed
+# lookup per portfolio instead of joining every holding to its asset.
+# Values are in the portfolio's currency
+PORTFOLIO_PERFORMANCE = """
+    SELECT p.portfolio_id, p.portfolio_name, p.currency, pm.metric_date,
+           pm.market_value AS current_value, pm.cost_basis,
+           pm.market_value - pm.cost_basis AS gain_loss
+    FROM Portfolios p
+    JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+     AND pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                           WHERE portfolio_id = p.portfolio_id)
+    WHERE p.user_id = %s AND p.status = 'active' AND pm.holdings_count > 0
+"""
+
+ASSET_COUNT = """SELECT COUNT(DISTINCT ph.asset_id) as count
+   FROM Portfolio_Holdings ph
+   JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
+   WHERE p.user_id = %s"""
+
+# Everything the dashboard tabs show about a user's portfolios in one
+# round trip: a row per portfolio with its latest snapshot (the portfolio
+# list, the choices and the performance report) and the number of
+# distinct assets the user holds (the account summary); see
+# migrations/011_dashboard_indexes.sql. A snapshot is stale when it is
+# missing, from before the given day, or older than the portfolio's
+# newest transaction or holding change (snapshots.py)
+DASHBOARD = """
+    WITH owned AS (
+        SELECT portfolio_id, portfolio_name, portfolio_type, currency, status, total_value
+        FROM Portfolios
+        WHERE user_id = %s
+    ),
+    latest AS (
+        SELECT pm.portfolio_id, pm.metric_date, pm.total_value, pm.market_value,
+               pm.cost_basis, pm.holdings_count, pm.last_updated
+        FROM Performance_Metrics pm
+        JOIN owned o ON pm.portfolio_id = o.portfolio_id
+        WHERE pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                                WHERE portfolio_id = o.portfolio_id)
+    ),
+    held AS (
+        SELECT COUNT(DISTINCT ph.asset_id) AS asset_count
+        FROM Portfolio_Holdings ph
+        JOIN owned o ON ph.portfolio_id = o.portfolio_id
+    )
+    SELECT o.portfolio_id, o.portfolio_name, o.portfolio_type, o.currency, o.status,
+           COALESCE(l.total_value, o.total_value) AS total_value,
+           COALESCE(l.holdings_count, 0) AS total_holdings,
+           l.metric_date, l.market_value AS current_value, l.cost_basis,
+           l.market_value - l.cost_basis AS gain_loss, h.asset_count,
+           CASE WHEN l.metric_date IS NULL OR l.metric_date < %s
+                  OR (SELECT MAX(t.transaction_date) FROM Transactions t
+                      WHERE t.portfolio_id = o.portfolio_id) > l.last_updated
+                  OR (SELECT MAX(ph.last_updated) FROM Portfolio_Holdings ph
+                      WHERE ph.portfolio_id = o.portfolio_id) > l.last_updated
+                THEN 1 ELSE 0 END AS snapshot_stale
+    FROM owned o
+    LEFT JOIN latest l ON l.portfolio_id = o.portfolio_id
+    CROSS JOIN held h
+    ORDER BY o.portfolio_id
+"""
+
+# Analytics
+# One bulk query per table for all of a user's portfolios (analytics.py)
+PERFORMANCE_HISTORY = """
+    SELECT pm.portfolio_id, pm.metric_date, pm.total_value, pm.benchmark_return
+    FROM Performance_Metrics pm
+    JOIN Portfolios p ON pm.portfolio_id = p.portfolio_id
+    WHERE p.user_id = %s AND p.status = 'active' AND pm.metric_date >= %s
+    ORDER BY pm.portfolio_id, pm.metric_date
+"""
+
+# Net money put into each portfolio per day and asset currency: buys in,
+# sales and dividends out
+TRANSACTION_FLOWS = """
+    SELECT t.portfolio_id, DATE(t.transaction_date) AS flow_date, a.currency,
+           p.currency AS portfolio_currency,
+           SUM(CASE WHEN t.transaction_type = 'buy' THEN t.total_amount
+                    ELSE -t.total_amount END) AS net_flow
+    FROM Transactions t
+    JOIN Portfolios p ON t.portfolio_id = p.portfolio_id
+    JOIN Assets a ON t.asset_id = a.asset_id
+    WHERE p.user_id = %s AND p.status = 'active' AND t.transaction_date >= %s
+    GROUP BY t.portfolio_id, DATE(t.transaction_date), a.currency, p.currency
+"""
+
+USER_HOLDINGS = """
+    SELECT ph.portfolio_id, ph.asset_id, a.asset_symbol,
+           ph.quantity * a.current_price AS market_value, a.currency,
+           p.currency AS portfolio_currency
+    FROM Portfolio_Holdings ph
+    JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    WHERE p.user_id = %s AND p.status = 'active'
+"""
+
+def price_history(asset_ids, since):
+    """Build (query, params) for the daily closes of asset_ids from since on"""
+    query = f"""
+    SELECT asset_id, price_date, close_price
+    FROM Asset_Price_History
+    WHERE asset_id IN ({_in_list(asset_ids)}) AND price_date >= %s
+    """
+    return query, (*asset_ids, since)
+
+# Snapshots
+ALL_ACTIVE_PORTFOLIOS = "SELECT portfolio_id FROM Portfolios WHERE status = 'active'"
+
+# last_updated is set even when no value changed (MySQL's ON UPDATE would
+# not): the snapshot is then newer than the change it was refreshed for
+UPSERT_SNAPSHOT = """
+    INSERT INTO Performance_Metrics (portfolio_id, metric_date, total_value, market_value,
+                                     cost_basis, holdings_count, daily_return, total_return,
+                                     benchmark_return)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        total_value = VALUES(total_value), market_value = VALUES(market_value),
+        cost_basis = VALUES(cost_basis), holdings_count = VALUES(holdings_count),
+        daily_return = VALUES(daily_return), total_return = VALUES(total_return),
+        benchmark_return = VALUES(benchmark_return),
+        last_updated = CURRENT_TIMESTAMP
+"""
+
+# The benchmark asset's daily closes and current price (snapshots.BENCHMARK)
+BENCHMARK_HISTORY = """
+    SELECT h.price_date, h.close_price
+    FROM Asset_Price_History h
+    JOIN Assets a ON h.asset_id = a.asset_id
+    WHERE a.asset_symbol = %s AND h.price_date BETWEEN %s AND %s
+    ORDER BY h.price_date
+"""
+
+BENCHMARK_PRICE = "SELECT current_price FROM Assets WHERE asset_symbol = %s"
+
+def portfolios_holding(asset_ids):
+    """Build (query, params) for the portfolios that hold any of asset_ids"""
+    query = f"""
+    SELECT DISTINCT portfolio_id
+    FROM Portfolio_Holdings
+    WHERE asset_id IN ({_in_list(asset_ids)})
+    """
+    return query, tuple(asset_ids)
+
+def snapshot_positions(portfolio_ids):
+    """Build (query, params) for the current totals of portfolio_ids, per
+    asset currency and purchase date (to convert the cost at its day's rate)"""
+    query = f"""
+    SELECT ph.portfolio_id, a.currency, p.currency AS portfolio_currency,
+           ph.purchase_date,
+           SUM(ph.quantity * a.current_price) AS market_value,
+           SUM(ph.current_value) AS cost_basis,
+           COUNT(*) AS holdings_count
+    FROM Portfolio_Holdings ph
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
+    WHERE ph.portfolio_id IN ({_in_list(portfolio_ids)})
+    GROUP BY ph.portfolio_id, a.currency, p.currency, ph.purchase_date
+    """
+    return query, tuple(portfolio_ids)
+
+def previous_snapshots(portfolio_ids, before):
+    """Build (query, params) for the last snapshot of each portfolio before a date"""
+    query = f"""
+    SELECT pm.portfolio_id, pm.metric_date, pm.total_value
+    FROM Performance_Metrics pm
+    WHERE pm.portfolio_id IN ({_in_list(portfolio_ids)})
+      AND pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                            WHERE portfolio_id = pm.portfolio_id AND metric_date < %s)
+    """
+    return query, (*portfolio_ids, before)
+
+def daily_flows(portfolio_ids, since):
+    """Build (query, params) for the net money put into each portfolio per
+    day and asset currency"""
+    query = f"""
+    SELECT t.portfolio_id, DATE(t.transaction_date) AS flow_date, a.currency,
+           p.currency AS portfolio_currency,
+           SUM(CASE WHEN t.transaction_type = 'buy' THEN t.total_amount
+                    ELSE -t.total_amount END) AS net_flow
+    FROM Transactions t
+    JOIN Assets a ON t.asset_id = a.asset_id
+    JOIN Portfolios p ON t.portfolio_id = p.portfolio_id
+    WHERE t.portfolio_id IN ({_in_list(portfolio_ids)}) AND t.transaction_date >= %s
+    GROUP BY t.portfolio_id, DATE(t.transaction_date), a.currency, p.currency
+    """
+    return query, (*portfolio_ids, since)
+
+# Replica (replica.py)
+# Rows changed on the server since a sync, by the last_updated columns of
+# migrations/006_replica_sync_columns.sql; generated columns are left out
+SERVER_TIME = "SELECT CURRENT_TIMESTAMP AS now"
+
+REPLICA_CATEGORIES = """SELECT category_id, category_name, description, risk_level
+          FROM Asset_Categories"""
+
+REPLICA_ASSETS = """
+    SELECT asset_id, category_id, asset_symbol, asset_name, asset_type, current_price,
+           last_updated, exchange, currency
+    FROM Assets
+    WHERE last_updated >= %s
+"""
+
+REPLICA_RATES = """
+    SELECT base_currency, quote_currency, rate_date, rate, last_updated
+    FROM FX_Rates
+    WHERE last_updated >= %s
+"""
+
+ASSET_TOTAL = "SELECT COUNT(*) AS count FROM Assets"
+
+REPLICA_USER = "SELECT * FROM Users WHERE user_id = %s"
+
+REPLICA_PORTFOLIOS = """
+    SELECT portfolio_id, user_id, portfolio_name, portfolio_type, creation_date,
+           total_value, currency, status, last_updated
+    FROM Portfolios
+    WHERE user_id = %s AND last_updated >= %s
+"""
+
+REPLICA_WATCHLIST = """
+    SELECT watchlist_id, user_id, asset_id, added_date, target_price, notes, last_updated
+    FROM Watchlist
+    WHERE user_id = %s AND last_updated >= %s
+"""
+
+WATCHLIST_IDS = "SELECT watchlist_id FROM Watchlist WHERE user_id = %s"
+
+def replica_holdings(portfolio_ids, since):
+    query = f"""
+    SELECT holding_id, portfolio_id, asset_id, quantity, purchase_price, purchase_date,
+           last_updated
+    FROM Portfolio_Holdings
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)}) AND last_updated >= %s
+    """
+    return query, (*portfolio_ids, since)
+
+def holding_ids(portfolio_ids):
+    query = f"""SELECT holding_id FROM Portfolio_Holdings
+          WHERE portfolio_id IN ({_in_list(portfolio_ids)})"""
+    return query, tuple(portfolio_ids)
+
+def replica_metrics(portfolio_ids, since):
+    query = f"""
+    SELECT metric_id, portfolio_id, metric_date, total_value, market_value, cost_basis,
+           holdings_count, daily_return, total_return, benchmark_return, last_updated
+    FROM Performance_Metrics
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)}) AND last_updated >= %s
+    """
+    return query, (*portfolio_ids, since)
+
+def replica_transactions(portfolio_ids, after_id):
+    """Build (query, params) for the transactions of portfolio_ids recorded
+    after transaction after_id, oldest first"""
+    query = f"""
+    SELECT transaction_id, portfolio_id, asset_id, transaction_type, quantity,
+           price_per_unit, transaction_date, fees, notes
+    FROM Transactions
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)}) AND transaction_id > %s
+    ORDER BY transaction_id
+    """
+    return query, (*portfolio_ids, after_id)
+
+def replica_upsert(table, columns):
+    """INSERT of a row into table that updates the row if its key exists"""
+    updates = ', '.join(f"{column} = VALUES({column})" for column in columns[1:])
+    return f"""INSERT INTO {table} ({', '.join(columns)}) VALUES ({_in_list(columns)})
+          ON DUPLICATE KEY UPDATE {updates}"""
+
+def replica_rows(table, column, values):
+    query = f"SELECT * FROM {table} WHERE {column} IN ({_in_list(values)})"
+    return query, tuple(values)
+
+def replica_delete(table, column, values):
+    query = f"DELETE FROM {table} WHERE {column} IN ({_in_list(values)})"
+    return query, tuple(values)
+
+# Sync state, kept in the replica only
+REPLICA_STATE = """CREATE TABLE IF NOT EXISTS Replica_Sync (
+          name VARCHAR(100) PRIMARY KEY,
+          mark VARCHAR(30) NOT NULL)"""
+
+REPLICA_MARKS = "SELECT name, mark FROM Replica_Sync"
+
+SET_REPLICA_MARK = """INSERT INTO Replica_Sync (name, mark) VALUES (%s, %s)
+          ON DUPLICATE KEY UPDATE mark = VALUES(mark)"""
+
+# Tax lots (lots.py)
+# Portfolios with transactions the lots of a method have not seen yet, and
+# the earliest date among them (a back-dated trade means a full replay)
+def lot_changes(portfolio_ids, method):
+    query = f"""
+    SELECT t.portfolio_id, MIN(t.transaction_date) AS first_date,
+           c.last_transaction_date
+    FROM Transactions t
+    LEFT JOIN Tax_Lot_Checkpoints c ON c.portfolio_id = t.portfolio_id AND c.method = %s
+    WHERE t.portfolio_id IN ({_in_list(portfolio_ids)})
+      AND t.transaction_id > COALESCE(c.last_transaction_id, 0)
+    GROUP BY t.portfolio_id, c.last_transaction_date
+    """
+    return query, (method, *portfolio_ids)
+
+def lot_replay(portfolio_ids, method=None):
+    """Build (query, params) for the transactions to replay, oldest first:
+    all of them, or with method those after the method's checkpoint.
+    Read through idx_portfolio_date_id"""
+    join = where = ""
+    params = tuple(portfolio_ids)
+    if method is not None:
+        join = """
+    LEFT JOIN Tax_Lot_Checkpoints c ON c.portfolio_id = t.portfolio_id AND c.method = %s"""
+        where = " AND t.transaction_id > COALESCE(c.last_transaction_id, 0)"
+        params = (method, *portfolio_ids)
+    query = f"""
+    SELECT t.transaction_id, t.portfolio_id, t.asset_id, t.transaction_type, t.quantity,
+           t.price_per_unit, t.fees, t.transaction_date
+    FROM Transactions t{join}
+    WHERE t.portfolio_id IN ({_in_list(portfolio_ids)}){where}
+    ORDER BY t.portfolio_id, t.transaction_date, t.transaction_id
+    """
+    return query, params
+
+def saved_lots(portfolio_ids, method):
+    query = f"""
+    SELECT portfolio_id, lot_id, asset_id, acquired_date, quantity, unit_cost
+    FROM Tax_Lots
+    WHERE method = %s AND portfolio_id IN ({_in_list(portfolio_ids)})
+    ORDER BY portfolio_id, acquired_date, lot_id
+    """
+    return query, (method, *portfolio_ids)
+
+def lot_selections(portfolio_ids):
+    query = f"""
+    SELECT s.sell_transaction_id, s.lot_id, s.quantity
+    FROM Tax_Lot_Selections s
+    JOIN Transactions t ON t.transaction_id = s.sell_transaction_id
+    WHERE t.portfolio_id IN ({_in_list(portfolio_ids)})
+    """
+    return query, tuple(portfolio_ids)
+
+def delete_lot_state(table, portfolio_ids, method):
+    """DELETE of a method's rows of portfolio_ids from a tax lot table"""
+    query = f"DELETE FROM {table} WHERE method = %s AND portfolio_id IN ({_in_list(portfolio_ids)})"
+    return query, (method, *portfolio_ids)
+
+INSERT_LOT = """INSERT INTO Tax_Lots (portfolio_id, method, lot_id, asset_id, acquired_date,
+          quantity, unit_cost) VALUES (%s, %s, %s, %s, %s, %s, %s)"""
+
+INSERT_REALIZED_GAIN = """INSERT INTO Realized_Gains (portfolio_id, method, sell_transaction_id,
+          lot_id, asset_id, acquired_date, sold_date, quantity, proceeds, cost_basis, gain,
+          long_term) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+UPSERT_LOT_CHECKPOINT = """INSERT INTO Tax_Lot_Checkpoints (portfolio_id, method,
+          last_transaction_id, last_transaction_date) VALUES (%s, %s, %s, %s)
+          ON DUPLICATE KEY UPDATE last_transaction_id = VALUES(last_transaction_id),
+          last_transaction_date = VALUES(last_transaction_date)"""
+
+SELL_TRANSACTION = """SELECT t.transaction_id, t.portfolio_id, t.asset_id, t.quantity
+    FROM Transactions t
+    JOIN Portfolios p ON t.portfolio_id = p.portfolio_id
+    WHERE t.transaction_id = %s AND p.user_id = %s AND t.transaction_type = 'sell'"""
+
+def lot_buys(portfolio_id, asset_id, lot_ids):
+    """Which of lot_ids are buys of an asset in a portfolio"""
+    query = f"""
+    SELECT transaction_id FROM Transactions
+    WHERE portfolio_id = %s AND asset_id = %s AND transaction_type = 'buy'
+      AND transaction_id IN ({_in_list(lot_ids)})
+    """
+    return query, (portfolio_id, asset_id, *lot_ids)
+
+DELETE_LOT_SELECTIONS = "DELETE FROM Tax_Lot_Selections WHERE sell_transaction_id = %s"
+
+INSERT_LOT_SELECTION = """INSERT INTO Tax_Lot_Selections (sell_transaction_id, lot_id, quantity)
+          VALUES (%s, %s, %s)"""
+
+DELETE_LOT_CHECKPOINT = "DELETE FROM Tax_Lot_Checkpoints WHERE portfolio_id = %s AND method = %s"
+
+# Closed portfolios keep their realized gains
+ALL_PORTFOLIOS = "SELECT portfolio_id FROM Portfolios"
+
+# Open lots valued at current prices
+OPEN_LOTS = """
+    SELECT l.portfolio_id, p.portfolio_name, l.lot_id, a.asset_symbol, a.asset_name,
+           l.acquired_date, l.quantity, l.unit_cost, a.current_price,
+           l.quantity * l.unit_cost AS cost_basis,
+           l.quantity * a.current_price AS market_value,
+           l.quantity * (a.current_price - l.unit_cost) AS unrealized_gain
+    FROM Tax_Lots l
+    JOIN Portfolios p ON l.portfolio_id = p.portfolio_id
+    JOIN Assets a ON l.asset_id = a.asset_id
+    WHERE p.user_id = %s AND l.method = %s
+    ORDER BY p.portfolio_name, a.asset_symbol, l.acquired_date, l.lot_id
+"""
+
+# Realized gains of a tax year (sold_date in [start, end)), per asset and term
+REALIZED_GAINS = """
+    SELECT rg.portfolio_id, p.portfolio_name, a.asset_symbol, rg.long_term,
+           SUM(rg.quantity) AS quantity, SUM(rg.proceeds) AS proceeds,
+           SUM(rg.cost_basis) AS cost_basis, SUM(rg.gain) AS gain
+    FROM Portfolios p
+    JOIN Realized_Gains rg ON rg.portfolio_id = p.portfolio_id
+    JOIN Assets a ON rg.asset_id = a.asset_id
+    WHERE p.user_id = %s AND rg.method = %s AND rg.sold_date >= %s AND rg.sold_date < %s
+    GROUP BY rg.portfolio_id, p.portfolio_name, a.asset_symbol, rg.long_term
+    ORDER BY p.portfolio_name, a.asset_symbol, rg.long_term
+"""
+
+DIVIDEND_INCOME = """
+    SELECT t.portfolio_id, p.portfolio_name, a.asset_symbol,
+           SUM(t.total_amount - COALESCE(t.fees, 0)) AS income
+    FROM Portfolios p
+    JOIN Transactions t ON t.portfolio_id = p.portfolio_id
+    JOIN Assets a ON t.asset_id = a.asset_id
+    WHERE p.user_id = %s AND t.transaction_type = 'dividend'
+      AND t.transaction_date >= %s AND t.transaction_date < %s
+    GROUP BY t.portfolio_id, p.portfolio_name, a.asset_symbol
+    ORDER BY p.portfolio_name, a.asset_symbol
+"""
+
+# Returns (returns.py)
+def return_transactions(portfolio_ids, before):
+    """Build (query, params) for the transactions of portfolio_ids dated
+    before a day. Read through idx_portfolio_date_id"""
+    query = f"""
+    SELECT portfolio_id, asset_id, transaction_type, quantity, price_per_unit, total_amount,
+           fees, transaction_date
+    FROM Transactions
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)}) AND transaction_date < %s
+    """
+    return query, (*portfolio_ids, before)
+
+def return_assets(asset_ids):
+    query = f"""
+    SELECT asset_id, asset_symbol, current_price, currency
+    FROM Assets
+    WHERE asset_id IN ({_in_list(asset_ids)})
+    """
+    return query, tuple(asset_ids)
+
+def transaction_marks(portfolio_ids):
+    """Build (query, params) for the highest transaction_id of each portfolio"""
+    query = f"""
+    SELECT portfolio_id, MAX(transaction_id) AS last_transaction_id
+    FROM Transactions
+    WHERE portfolio_id IN ({_in_list(portfolio_ids)})
+    GROUP BY portfolio_id
+    """
+    return query, tuple(portfolio_ids)
+
+def cached_returns(portfolio_ids, start, end):
+    query = f"""
+    SELECT portfolio_id, asset_id, start_value, end_value, net_flow, twr, irr,
+           last_transaction_id, computed_at
+    FROM Performance_Returns
+    WHERE start_date = %s AND end_date = %s AND portfolio_id IN ({_in_list(portfolio_ids)})
+    """
+    return query, (start, end, *portfolio_ids)
+
+def delete_cached_returns(portfolio_ids, start, end):
+    query = f"""DELETE FROM Performance_Returns
+    WHERE start_date = %s AND end_date = %s AND portfolio_id IN ({_in_list(portfolio_ids)})"""
+    return query, (start, end, *portfolio_ids)
+
+INSERT_RETURN = """INSERT INTO Performance_Returns (portfolio_id, start_date, end_date, asset_id,
+          start_value, end_value, net_flow, twr, irr, last_transaction_id, computed_at)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+def portfolio_currencies(portfolio_ids):
+    query = f"""SELECT portfolio_id, currency FROM Portfolios
+          WHERE portfolio_id IN ({_in_list(portfolio_ids)})"""
+    return query, tuple(portfolio_ids)
+
+# Exchange rates (fx.py)
+# Every stored rate, in the order fx.RateCache indexes them
+FX_RATES = """
+    SELECT base_currency, quote_currency, rate_date, rate
+    FROM FX_Rates
+    ORDER BY base_currency, quote_currency, rate_date
+"""
+
+UPSERT_FX_RATE = """INSERT INTO FX_Rates (base_currency, quote_currency, rate_date, rate)
+          VALUES (%s, %s, %s, %s)
+          ON DUPLICATE KEY UPDATE rate = VALUES(rate)"""
+
+def foreign_holders(currencies):
+    """Build (query, params) for the active portfolios holding an asset
+    priced in another currency than theirs, where either is in currencies"""
+    query = f"""
+    SELECT DISTINCT ph.portfolio_id
+    FROM Portfolio_Holdings ph
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    JOIN Portfolios p ON ph.portfolio_id = p.portfolio_id
+    WHERE p.status = 'active' AND a.currency <> p.currency
+      AND (a.currency IN ({_in_list(currencies)}) OR p.currency IN ({_in_list(currencies)}))
+    """
+    return query, (*currencies, *currencies)
+
+def delete_returns_since(day):
+    return "DELETE FROM Performance_Returns WHERE end_date >= %s", (day,)
+
+# Rebalancing (rebalance.py)
+def rebalance_positions(first_id, last_id):
+    """Build (query, params) for the holdings of the active portfolios with
+    ids from first_id to last_id, with what the targets are set by"""
+    query = """
+    SELECT p.portfolio_id, p.portfolio_type, p.currency AS portfolio_currency,
+           ph.asset_id, ph.quantity, a.asset_type, ac.category_name, a.current_price,
+           a.currency
+    FROM Portfolios p
+    JOIN Portfolio_Holdings ph ON ph.portfolio_id = p.portfolio_id
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    JOIN Asset_Categories ac ON a.category_id = ac.category_id
+    WHERE p.portfolio_id BETWEEN %s AND %s AND p.status = 'active' AND ph.quantity > 0
+    """
+    return query, (first_id, last_id)
+
+LAST_PORTFOLIO_ID = "SELECT MAX(portfolio_id) AS last_id FROM Portfolios"
+
+def delete_rebalance_trades(first_id, last_id):
+    return ("DELETE FROM Rebalance_Trades WHERE portfolio_id BETWEEN %s AND %s",
+            (first_id, last_id))
+
+INSERT_REBALANCE_TRADE = """INSERT INTO Rebalance_Trades (portfolio_id, asset_id,
+          transaction_type, quantity, price_per_unit, amount, fees, planned_at)
+          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+
+# Exports (export.py)
+# A user's full data sets, streamed in a stable order
+def export_holdings(user_id):
+    query = """
+    SELECT p.portfolio_id, p.portfolio_name, a.asset_symbol, a.asset_name, a.asset_type,
+           ph.quantity, ph.purchase_price, ph.purchase_date, a.current_price,
+           ROUND(ph.quantity * a.current_price, 2) AS market_value, a.currency
+    FROM Portfolios p
+    JOIN Portfolio_Holdings ph ON ph.portfolio_id = p.portfolio_id
+    JOIN Assets a ON ph.asset_id = a.asset_id
+    WHERE p.user_id = %s
+    ORDER BY p.portfolio_id, a.asset_symbol, ph.purchase_date
+    """
+    return query, (user_id,)
+
+def export_transactions(user_id):
+    query = """
+    SELECT t.transaction_id, p.portfolio_id, p.portfolio_name, a.asset_symbol,
+           t.transaction_type, t.quantity, t.price_per_unit, t.total_amount, t.fees,
+           a.currency, t.transaction_date, t.notes
+    FROM Portfolios p
+    JOIN Transactions t ON t.portfolio_id = p.portfolio_id
+    JOIN Assets a ON t.asset_id = a.asset_id
+    WHERE p.user_id = %s
+    ORDER BY p.portfolio_id, t.transaction_date, t.transaction_id
+    """
+    return query, (user_id,)
+
+def export_performance(user_id):
+    query = """
+    SELECT p.portfolio_id, p.portfolio_name, pm.metric_date, pm.total_value,
+           pm.market_value, pm.cost_basis, pm.holdings_count, pm.daily_return,
+           pm.total_return, pm.benchmark_return, p.currency
+    FROM Portfolios p
+    JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+    WHERE p.user_id = %s
+    ORDER BY p.portfolio_id, pm.metric_date
+    """
+    return query, (user_id,)
+
+def export_watchlist(user_id):
+    return WATCHLIST + "    ORDER BY a.asset_symbol\n", (user_id,)
+
+def row_count(query, params):
+    """Build (query, params) counting the rows of a query"""
+    return f"SELECT COUNT(*) AS count FROM ({query}) counted", params
@@ -0,0 +1,316 @@
+"""
+Rebalancing for the Portfolio Management System
+
+Each portfolio_type has a target allocation, by asset_type or by asset
+category (TARGETS). A portfolio drifts as prices move; once any class
+it holds is more than DRIFT_BAND from its target weight, plan() works
+out the trades that bring every class back:
+
+    - weights are market values in the portfolio's currency (fx.py);
+      targets are spread over the classes the portfolio holds, as there
+      is no asset to buy a class it does not hold with
+    - each class moves by its gap alone: a sale of the largest holdings
+      first or a purchase of its largest holding, so a class is never
+      both bought and sold and few trades are needed
+    - quantities are rounded down to the asset's lot size, trades whose
+      fee exceeds MAX_FEE_SHARE of their amount are dropped, and buys
+      are scaled down to what the sales raise net of fees: a plan never
+      needs cash
+
+plan() solves a whole batch of portfolios at once with NumPy array
+operations, so the cost is a few passes over the holdings whatever the
+number of portfolios. Run this module to plan every active portfolio
+into Rebalance_Trades (migrations/010_rebalance_trades.sql), e.g. from
+the nightly job:
+
+    python rebalance.py [--by asset_type|category] [--workers N]
+
+Portfolio id ranges of REBALANCE_BATCH are planned in parallel across a
+pool of worker processes, each with its own connection and rate cache,
+while this process writes each range's plan as it comes in.
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import fx
+import queries
+from database import DatabaseConnection
+
+# Target weights per portfolio_type; each row sums to 1
+TARGETS = {
+    'asset_type': {
+        'aggressive': {'stock': .60, 'etf': .15, 'crypto': .10, 'commodity': .05,
+                       'mutual_fund': .05, 'bond': .05},
+        'moderate': {'stock': .40, 'etf': .15, 'mutual_fund': .10, 'commodity': .05,
+                     'bond': .30},
+        'conservative': {'stock': .15, 'etf': .10, 'mutual_fund': .15, 'bond': .60},
+    },
+    'category': {
+        'aggressive': {'Technology': .35, 'Healthcare': .15, 'Finance': .15, 'Energy': .15,
+                       'Real Estate': .10, 'Government Bonds': .10},
+        'moderate': {'Technology': .25, 'Healthcare': .15, 'Finance': .15, 'Energy': .10,
+                     'Real Estate': .10, 'Government Bonds': .25},
+        'conservative': {'Technology': .10, 'Healthcare': .10, 'Finance': .10, 'Energy': .05,
+                         'Real Estate': .15, 'Government Bonds': .50},
+    },
+}
+
+# Row field each way of classifying reads
+CLASS_FIELDS = {'asset_type': 'asset_type', 'category': 'category_name'}
+
+# A portfolio is rebalanced once a class weight is this far from its target
+DRIFT_BAND = 0.05
+
+# Fee of a trade, in the portfolio's currency: fixed plus a share of the amount
+TRADE_FEE = 1.00
+FEE_RATE = 0.001
+
+# Trades costing more than this share of their amount in fees are not worth it
+MAX_FEE_SHARE = 0.01
+
+# Smallest tradable quantity per asset_type
+LOT_SIZES = {'stock': 1, 'etf': 1, 'bond': 1, 'commodity': 1, 'mutual_fund': 0.001,
+             'crypto': 0.0001}
+
+# Portfolio ids planned per worker task
+REBALANCE_BATCH = 2000
+
+# Guards floor() against quantities a rounding error below a whole lot
+_EPSILON = 1e-9
+
+_CENT = 0.01
+
+
+def _classes(by):
+    if by not in TARGETS:
+        raise ValueError(f"Rebalance by one of {', '.join(TARGETS)}, not {by!r}")
+    targets = TARGETS[by]
+    classes = sorted({name for weights in targets.values() for name in weights})
+    matrix = {portfolio_type: np.array([weights.get(name, 0.0) for name in classes])
+              for portfolio_type, weights in targets.items()}
+    return classes, matrix
+
+
+def _frame(rows, by):
+    """The holdings of rows as arrays, merged per portfolio and asset"""
+    classes, targets = _classes(by)
+    field = CLASS_FIELDS[by]
+    class_index = {name: i for i, name in enumerate(classes)}
+    n = len(rows)
+    portfolio_id = np.fromiter((row['portfolio_id'] for row in rows), np.int64, n)
+    asset_id = np.fromiter((row['asset_id'] for row in rows), np.int64, n)
+    quantity = np.fromiter((row['quantity'] for row in rows), float, n)
+    price = np.fromiter((row['current_price'] for row in rows), float, n)
+    # Classes without a target in any type (a new category) get index -1
+    klass = np.fromiter((class_index.get(row[field], -1) for row in rows), np.int64, n)
+    lot = np.fromiter((LOT_SIZES.get(row['asset_type'], 1) for row in rows), float, n)
+
+    # One rate lookup per currency pair converts prices into portfolio currencies
+    rate = np.ones(n)
+    pairs = {}
+    for i, row in enumerate(rows):
+        pairs.setdefault((row['currency'], row['portfolio_currency']), []).append(i)
+    for (base, quote), index in pairs.items():
+        rate[index] = float(fx.RATES.rate(base, quote))
+
+    # A portfolio may hold an asset in several rows (bought on several days)
+    keys, first, holding = np.unique(portfolio_id * (asset_id.max(initial=0) + 1) + asset_id,
+                                     return_index=True, return_inverse=True)
+    quantity = np.bincount(holding, quantity, len(keys))
+    portfolio_ids, portfolio = np.unique(portfolio_id[first], return_inverse=True)
+    types = {}
+    for row in rows:
+        types.setdefault(row['portfolio_id'], row['portfolio_type'])
+    target = np.array([targets[types[pid]] for pid in portfolio_ids.tolist()]).reshape(
+        len(portfolio_ids), len(classes))
+    return {'classes': classes, 'portfolio_ids': portfolio_ids, 'target': target,
+            'portfolio': portfolio, 'asset_id': asset_id[first], 'class': klass[first],
+            'quantity': quantity, 'price': price[first], 'rate': rate[first],
+            'lot': lot[first]}
+
+
+def _fees(amount):
+    return np.where(amount > 0, TRADE_FEE + FEE_RATE * amount, 0.0)
+
+
+def _units(amount, f, cap=None):
+    """Whole lots of amount (portfolio currency), at most cap, and their value"""
+    unit_value = f['price'] * f['rate']
+    units = np.divide(amount, unit_value, out=np.zeros(len(amount)), where=unit_value > 0)
+    units = np.floor(units / f['lot'] + _EPSILON) * f['lot']
+    if cap is not None:
+        units = np.minimum(units, cap)
+    units = np.round(units, 6)
+    return units, units * f['price'] * f['rate']
+
+
+def plan(rows, by='asset_type'):
+    """Rebalance the portfolios of queries.rebalance_positions rows.
+
+    Returns a dict of arrays: portfolio_ids, their class weights and
+    targets (portfolios x classes, see classes), value, and per holding
+    (index into portfolio_ids) asset_id, side (+1 buy, -1 sell, 0 none),
+    quantity, price (asset currency), amount and fee (portfolio currency).
+    """
+    f = _frame(rows, by)
+    portfolios, classes = len(f['portfolio_ids']), len(f['classes'])
+    targeted = f['class'] >= 0
+    p, c = f['portfolio'], np.where(targeted, f['class'], 0)
+    value = f['quantity'] * f['price'] * f['rate']
+
+    cell = p * classes + c
+    current = np.bincount(cell[targeted], value[targeted], portfolios * classes).reshape(
+        portfolios, classes)
+    total = current.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.where(total[:, None] > 0, current / total[:, None], 0.0)
+
+        # Targets spread over the classes held
+        holds = np.bincount(cell[targeted & (value > 0)], minlength=portfolios * classes).reshape(
+            portfolios, classes) > 0
+        reachable = np.where(holds, f['target'], 0.0)
+        share = reachable.sum(axis=1)
+        reachable = np.where(share[:, None] > 0, reachable / share[:, None], 0.0)
+    breached = (np.abs(weights - reachable) > DRIFT_BAND).any(axis=1) & (share > 0)
+
+    # Each class's gap, placed on its holdings largest first; holdings
+    # without a target class are groups of their own and never traded
+    gap = np.where(breached[:, None], reachable * total[:, None] - current, 0.0)
+    need = np.where(targeted, gap.ravel()[cell], 0.0)
+    group = np.where(targeted, p * (classes + 1) + c, p * (classes + 1) + classes)
+    order = np.lexsort((-value, group))
+    sorted_cell, sorted_value = group[order], value[order]
+    starts = np.r_[True, sorted_cell[1:] != sorted_cell[:-1]]
+    running = np.cumsum(sorted_value)
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))
+    before = np.empty(len(order))
+    before[order] = running - sorted_value - (running - sorted_value)[group_start]
+    largest = np.zeros(len(order), bool)
+    largest[order[starts]] = True
+    sell = np.where(need < 0, np.clip(-need - before, 0.0, value), 0.0)
+    buy = np.where((need > 0) & largest, need, 0.0)
+
+    # Whole lots; a holding sold off entirely is sold to the last unit
+    whole = (sell > 0) & (sell >= value * (1 - _EPSILON))
+    sell_units, sell = _units(sell, f, f['quantity'])
+    sell_units = np.where(whole, f['quantity'], sell_units)
+    sell = np.where(sell_units > 0, sell_units * f['price'] * f['rate'], 0.0)
+    buy_units, buy = _units(buy, f)
+    sell = np.where(_fees(sell) <= MAX_FEE_SHARE * sell, sell, 0.0)
+    buy = np.where(_fees(buy) <= MAX_FEE_SHARE * buy, buy, 0.0)
+
+    # Buys spend at most the sales' proceeds net of every fee, less a cent a
+    # trade for amounts and fees being rounded separately
+    proceeds = np.bincount(p, sell - _fees(sell) - _CENT * (sell > 0), portfolios)
+    buys = np.bincount(p, buy, portfolios)
+    buy_count = np.bincount(p, buy > 0, portfolios)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.clip((proceeds - buy_count * (TRADE_FEE + _CENT)) / (buys * (1 + FEE_RATE)),
+                        0.0, 1.0)
+    scale = np.where(buys > 0, scale, 0.0)
+    buy_units, buy = _units(buy * scale[p], f)
+    buy = np.where(_fees(buy) <= MAX_FEE_SHARE * buy, buy, 0.0)
+
+    side = np.where(sell > 0, -1, np.where(buy > 0, 1, 0))
+    amount = np.round(sell + buy, 2)
+    return {'classes': f['classes'], 'portfolio_ids': f['portfolio_ids'],
+            'weights': weights, 'targets': f['target'], 'value': total,
+            'portfolio': p, 'asset_id': f['asset_id'], 'side': side,
+            'quantity': np.where(side < 0, sell_units, np.where(side > 0, buy_units, 0.0)),
+            'price': f['price'], 'amount': amount, 'fee': np.round(_fees(amount), 2)}
+
+
+def trades(result, planned_at):
+    """The planned trades of a plan() result as Rebalance_Trades rows"""
+    rows = []
+    portfolio_ids = result['portfolio_ids'].tolist()
+    for i in np.flatnonzero(result['side']).tolist():
+        rows.append((portfolio_ids[result['portfolio'][i]], int(result['asset_id'][i]),
+                     'buy' if result['side'][i] > 0 else 'sell',
+                     round(float(result['quantity'][i]), 6), float(result['price'][i]),
+                     float(result['amount'][i]), float(result['fee'][i]), planned_at))
+    return rows
+
+
+def plan_range(first_id, last_id, by='asset_type'):
+    """plan() of the active portfolios with ids from first_id to last_id"""
+    rows = DatabaseConnection.run_query(*queries.rebalance_positions(first_id, last_id))
+    return plan(rows, by) if rows else None
+
+
+def _plan_task(first_id, last_id, by, planned_at):
+    result = plan_range(first_id, last_id, by)
+    return first_id, last_id, trades(result, planned_at) if result else []
+
+
+def _save(first_id, last_id, rows):
+    with DatabaseConnection.transaction(['Rebalance_Trades']) as cursor:
+        cursor.execute(*queries.delete_rebalance_trades(first_id, last_id))
+        if rows:
+            cursor.executemany(queries.INSERT_REBALANCE_TRADE, rows)
+
+
+def rebalance_all(spec, by='asset_type', workers=None, batch=REBALANCE_BATCH):
+    """Plan every active portfolio into Rebalance_Trades; returns the number
+    of trades planned.
+
+    Worker processes read and solve ranges of portfolio ids, configured
+    for the backend spec; this process is the only writer, replacing a
+    range's plan in one transaction as each arrives.
+    """
+    _classes(by)
+    last = DatabaseConnection.run_query(queries.LAST_PORTFOLIO_ID)[0]['last_id'] or 0
+    ranges = [(first, min(first + batch - 1, last)) for first in range(1, last + 1, batch)]
+    planned_at = datetime.now().replace(microsecond=0)
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    count = 0
+    if workers <= 1:
+        for first, last_id in ranges:
+            rows = _plan_task(first, last_id, by, planned_at)[2]
+            _save(first, last_id, rows)
+            count += len(rows)
+        return count
+
+    # Spawned, not forked: a child must not share the parent's connections
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context,
+                             initializer=DatabaseConnection.configure,
+                             initargs=(spec,)) as pool:
+        tasks = [pool.submit(_plan_task, first, last_id, by, planned_at)
+                 for first, last_id in ranges]
+        for task in tasks:
+            first, last_id, rows = task.result()
+            _save(first, last_id, rows)
+            count += len(rows)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan the rebalancing of every portfolio")
+    parser.add_argument('--by', choices=sorted(TARGETS), default='asset_type',
+                        help="Classify assets by asset_type or category")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: one per CPU; 1 plans in this process)")
+    parser.add_argument('--db', default='mysql', help="mysql or sqlite:PATH")
+    args = parser.parse_args()
+
+    DatabaseConnection.configure(args.db)
+    started = time.perf_counter()
+    try:
+        count = rebalance_all(args.db, args.by, args.workers)
+        print(f"Planned {count:,} trades in {time.perf_counter() - started:.1f}s")
+    except fx.MissingRate as e:
+        parser.exit(1, f"{e}; load rates with fx.py\n")
+    finally:
+        DatabaseConnection.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Offline replica for the Portfolio Management System
+
+A local SQLite file (schema_sqlite.sql) holding what the dashboard shows
+a user: their account, portfolios, holdings, transactions, performance
+snapshots and watchlist, plus the asset catalog. The window renders from
+the replica straight away and brings it up to date in the background;
+without a connection to the server it still shows the last synced data.
+
+sync() pulls only what changed since the user's previous sync:
+
+    Assets, FX_Rates, Portfolios,            rows whose last_updated is at
+    Portfolio_Holdings, Performance_Metrics, or after the previous sync's
+    Watchlist                                server time (migration 006)
+    Transactions                             rows above the highest
+                                             transaction_id pulled
+    Users, Asset_Categories                  the user's row; the categories
+                                             whenever assets changed
+
+Rows deleted on the server are found by comparing ids, which are few per
+user; the asset catalog is only compared when its row counts differ.
+A replica file made from an older schema_sqlite.sql is started over.
+
+read(fn, *args) runs a service function against the replica: the
+function's own queries are answered from the local file through the
+SQLite backend's translation. Writes always go to the server and reach
+the replica with the next sync.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from mysql.connector import errors
+
+import queries
+from backends import SQLITE_SCHEMA_VERSION, SQLiteBackend
+from database import STORAGE_CONFIG, ConnectionPool, DatabaseConnection
+from instrumentation import ROW_BUCKETS, metrics, query_label, timings
+
+logger = logging.getLogger('portfolio.replica')
+
+# Rows changed this long before a sync are pulled again by the next one:
+# a write committing late can carry a timestamp from before the sync
+SYNC_OVERLAP = timedelta(minutes=5)
+
+# Transactions written to the replica per executemany
+SYNC_BATCH = 5000
+
+# Pulled rows compared with the replica's copies per query
+COMPARE_BATCH = 500
+
+# The mark of a table that was never synced
+EPOCH = datetime(1970, 1, 1)
+
+# Replicated tables in foreign key order
+TABLES = ['Asset_Categories', 'Assets', 'FX_Rates', 'Users', 'Portfolios',
+          'Portfolio_Holdings', 'Transactions', 'Performance_Metrics', 'Watchlist']
+
+
+def open_replica(path=None):
+    """The replica at path (STORAGE_CONFIG['replica'] by default), or None
+    if it is disabled, cannot be opened or the database is local already"""
+    path = STORAGE_CONFIG.get('replica') if path is None else path
+    if not path or DatabaseConnection.get_backend().name != 'mysql':
+        return None
+    path = os.path.expanduser(path)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        return Replica(path)
+    except (OSError, errors.Error) as e:
+        logger.warning("Cannot open the offline replica %s: %s", path, e)
+        return None
+
+
+class Replica:
+    """Local copy of users' dashboard data, kept in step with the server"""
+
+    def __init__(self, path, pool_size=3):
+        self.path = path
+        if _outdated(path):
+            logger.info("Replica %s has an older schema: starting over", path)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        self._pool = ConnectionPool(SQLiteBackend(path), pool_size=pool_size)
+        self._sync_lock = threading.Lock()
+        with self._transaction() as cursor:
+            cursor.execute(queries.REPLICA_STATE)
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._pool.acquire()
+        try:
+            conn.start_transaction()
+            cursor = conn.cursor(dictionary=True)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            conn.commit()
+        finally:
+            # release() rolls back a failed sync
+            self._pool.release(conn)
+
+    def run_query(self, query, params=None):
+        """Rows of a read against the replica"""
+        label = query_label(query)
+        started = time.perf_counter()
+        conn = self._pool.acquire()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(query, params or ())
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            self._pool.release(conn)
+        timings.record('replica', label, time.perf_counter() - started)
+        metrics.observe('query_rows', len(rows), ROW_BUCKETS, name=label, engine='replica')
+        return rows
+
+    def read(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) with its reads answered by the replica"""
+        with DatabaseConnection.reading_from(self):
+            return fn(*args, **kwargs)
+
+    def refresh(self, user_id, fn, *args, **kwargs):
+        """Sync user_id's data, then read(fn, *args, **kwargs)"""
+        self.sync(user_id)
+        return self.read(fn, *args, **kwargs)
+
+    def synced_at(self, user_id):
+        """Server time of user_id's last completed sync; None if there was none"""
+        return self._marks().get(f'user:{user_id}')
+
+    def _marks(self):
+        marks = {row['name']: row['mark'] for row in self.run_query(queries.REPLICA_MARKS)}
+        # Server times are kept as text, like the other marks
+        return {name: datetime.fromisoformat(mark)
+                if name == 'assets' or name.startswith('user:') else mark
+                for name, mark in marks.items()}
+
+    def sync(self, user_id):
+        """Pull what changed on the server since user_id's last sync.
+
+        Returns {table: rows pulled or dropped} for the tables that
+        changed. The replica is written in one transaction, so reads see
+        it either before or after the sync; if the server cannot be
+        reached this raises mysql.connector.Error and nothing changes.
+        """
+        with self._sync_lock, timings.measure('replica', 'sync'):
+            marks = self._marks()
+            now = DatabaseConnection.run_query(queries.SERVER_TIME)[0]['now']
+            source = str(DatabaseConnection.get_backend())
+            changes = {}
+            with self._transaction() as cursor:
+                if marks.get('source', source) != source:
+                    logger.info("Replica %s was synced from %s: starting over",
+                                self.path, marks['source'])
+                    for table in reversed(TABLES + ['Replica_Sync']):
+                        cursor.execute(f"DELETE FROM {table}")
+                    marks = {}
+
+                since = marks.get('assets', EPOCH) - SYNC_OVERLAP
+                self._sync_assets(cursor, since, changes)
+
+                since = marks.get(f'user:{user_id}', EPOCH) - SYNC_OVERLAP
+                after = int(marks.get(f'transactions:{user_id}', 0))
+                after = self._sync_user(cursor, user_id, since, after, changes)
+
+                for name, mark in (('source', source), ('assets', now),
+                                   (f'user:{user_id}', now),
+                                   (f'transactions:{user_id}', after)):
+                    cursor.execute(queries.SET_REPLICA_MARK, (name, mark))
+
+        logger.info("Replica sync for user %s: %s", user_id,
+                    ', '.join(f"{table} {count:,}" for table, count in changes.items())
+                    or "no changes")
+        return changes
+
+    def _sync_assets(self, cursor, since, changes):
+        pull = DatabaseConnection.run_query
+        assets = pull(queries.REPLICA_ASSETS, (since,))
+        if assets:
+            _store(cursor, 'Asset_Categories', pull(queries.REPLICA_CATEGORIES), changes)
+            _store(cursor, 'Assets', assets, changes)
+        # Keyed by pair and date; rates are corrected, never deleted
+        _store(cursor, 'FX_Rates', pull(queries.REPLICA_RATES, (since,)), changes,
+               compare=False)
+
+        cursor.execute(queries.ASSET_TOTAL)
+        if cursor.fetchone()['count'] != pull(queries.ASSET_TOTAL)[0]['count']:
+            try:
+                _drop_missing(cursor, 'Assets', 'asset_id', (queries.ASSET_SYMBOLS, ()),
+                              changes)
+            except errors.IntegrityError as e:
+                # Still referenced by rows of another user kept in the replica
+                logger.info("Keeping deleted assets in the replica: %s", e)
+
+    def _sync_user(self, cursor, user_id, since, after, changes):
+        """Sync user_id's rows; returns the new transaction_id mark"""
+        pull = DatabaseConnection.run_query
+        _store(cursor, 'Users', pull(queries.REPLICA_USER, (user_id,)), changes)
+
+        _store(cursor, 'Portfolios', pull(queries.REPLICA_PORTFOLIOS, (user_id, since)),
+               changes)
+        portfolio_ids = [row['portfolio_id']
+                         for row in pull(queries.PORTFOLIO_CHOICES, (user_id,))]
+        cursor.execute(queries.PORTFOLIO_CHOICES, (user_id,))
+        gone = [row['portfolio_id'] for row in cursor.fetchall()
+                if row['portfolio_id'] not in set(portfolio_ids)]
+        # Holdings and snapshots go with their portfolio, transactions do not
+        _drop(cursor, 'Transactions', 'portfolio_id', gone, changes)
+        _drop(cursor, 'Portfolios', 'portfolio_id', gone, changes)
+
+        # Deleted rows are dropped before the upserts, which could otherwise
+        # run into them on a unique key (e.g. an asset watched again)
+        if portfolio_ids:
+            _drop_missing(cursor, 'Portfolio_Holdings', 'holding_id',
+                          queries.holding_ids(portfolio_ids), changes)
+            _store(cursor, 'Portfolio_Holdings',
+                   pull(*queries.replica_holdings(portfolio_ids, since)), changes)
+            _store(cursor, 'Performance_Metrics',
+                   pull(*queries.replica_metrics(portfolio_ids, since)), changes)
+
+            # Transactions are only ever inserted: the id mark is enough
+            batch = []
+            for row in DatabaseConnection.stream(
+                    *queries.replica_transactions(portfolio_ids, after)):
+                batch.append(row)
+                if len(batch) == SYNC_BATCH:
+                    _store(cursor, 'Transactions', batch, changes, compare=False)
+                    batch = []
+                after = row['transaction_id']
+            _store(cursor, 'Transactions', batch, changes, compare=False)
+
+        _drop_missing(cursor, 'Watchlist', 'watchlist_id',
+                      (queries.WATCHLIST_IDS, (user_id,)), changes)
+        _store(cursor, 'Watchlist', pull(queries.REPLICA_WATCHLIST, (user_id, since)),
+               changes)
+        return after
+
+    def close(self):
+        self._pool.close()
+
+
+def _outdated(path):
+    """Whether the file at path predates the current schema_sqlite.sql"""
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0] < SQLITE_SCHEMA_VERSION
+    finally:
+        conn.close()
+
+
+def _store(cursor, table, rows, changes, compare=True):
+    """Insert or update rows (dicts with the same keys, the key first).
+
+    With compare, rows the replica already holds unchanged (pulled again
+    by the overlap, or the user's row) are skipped and not counted.
+    """
+    if rows and compare:
+        rows = _changed(cursor, table, rows)
+    if not rows:
+        return
+    columns = list(rows[0])
+    cursor.executemany(queries.replica_upsert(table, columns),
+                       [tuple(row[column] for column in columns) for row in rows])
+    changes[table] = changes.get(table, 0) + len(rows)
+
+
+def _drop_missing(cursor, table, key, query_params, changes):
+    """Drop the rows of an id query that it no longer returns on the server"""
+    query, params = query_params
+    kept = {row[key] for row in DatabaseConnection.run_query(query, params)}
+    cursor.execute(query, params)
+    _drop(cursor, table, key, [row[key] for row in cursor.fetchall() if row[key] not in kept],
+          changes)
+
+
+def _drop(cursor, table, column, values, changes):
+    if not values:
+        return
+    cursor.execute(*queries.replica_delete(table, column, values))
+    changes[table] = changes.get(table, 0) + len(values)
+
+
+def _changed(cursor, table, rows):
+    key = next(iter(rows[0]))
+    local = {}
+    for start in range(0, len(rows), COMPARE_BATCH):
+        keys = [row[key] for row in rows[start:start + COMPARE_BATCH]]
+        cursor.execute(*queries.replica_rows(table, key, keys))
+        local.update((row[key], row) for row in cursor.fetchall())
+    return [row for row in rows if not _same(row, local.get(row[key]))]
+
+
+def _same(row, local):
+    return local is not None and all(local[column] == value for column, value in row.items())
@@ -0,0 +1,371 @@
+"""
+Time- and money-weighted returns for the Portfolio Management System
+
+Values each portfolio day by day over a date range from its Transactions
+and prices, with NumPy: quantities held and cash flows are days x assets
+matrices, and each asset is priced at its latest close on or before the
+day (Asset_Price_History), falling back to its latest trade price, and
+at Assets.current_price today. Values and flows are converted into the
+portfolio's currency at each day's exchange rate (fx.py), one column of
+rates per asset currency. From the daily values:
+
+    TWR     time-weighted return: daily returns net of the money put in
+            (buys) and taken out (sales, dividends), chained, so it
+            measures the holdings and not the timing of the flows
+    IRR     money-weighted return (XIRR): the annual rate at which the
+            value before the range, the flows and the final value
+            discount to zero
+
+Both are computed per portfolio and per asset and cached per portfolio
+and range in Performance_Returns (migrations/008_performance_returns.sql)
+until the portfolio gets a new transaction.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import columnar
+import fx
+import queries
+from analytics import PRICE_TYPES, _column, _segments, forward_fill
+from columnar import DAY
+from database import DatabaseConnection
+from instrumentation import timings
+
+# Codes of Transactions.transaction_type
+TRANSACTION_KINDS = {'buy': 0, 'sell': 1, 'dividend': 2}
+
+# Closes looked up before the range to value what was held when it began
+PRICE_LOOKBACK = timedelta(days=31)
+
+# Results for a range ending today are recomputed after this long, as
+# current prices move
+LIVE_TTL = timedelta(minutes=15)
+
+# Bounds on log(1 + IRR): beyond them a rate is not worth reporting
+_LOG_RATE_LIMIT = 50.0
+
+# NPVs evaluated to find a bracket
+_BRACKET_POINTS = 401
+
+# The largest |twr| or |irr| Performance_Returns can hold
+_STORABLE = 1e11
+
+
+def xirr(days, amounts, tolerance=1e-10, iterations=200):
+    """Annualized rate r with sum(amount * (1 + r) ** -years) == 0, or None.
+
+    days are ordinals, amounts signed cash flows (money paid in negative).
+    Solved for x = log(1 + r), which keeps r above -100%, by Newton steps
+    kept inside a bracket on which the NPV changes sign: a step leaving
+    the bracket is replaced by bisection, so it always converges. None
+    when the NPV does not change sign within the rate bounds.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    if not ((amounts > 0).any() and (amounts < 0).any()):
+        return None
+    years = (np.asarray(days, dtype=float) - days[0]) / 365.0
+    # exp(x * years) overflows past 709
+    limit = min(_LOG_RATE_LIMIT, 700.0 / max(years[-1], 1e-9))
+
+    def npv(x):
+        discount = np.exp(-x * years)
+        return float(amounts @ discount), float(-(amounts * years) @ discount)
+
+    # The NPV at a grid of rates in one matrix product; the bracket is the
+    # sign change nearest 0% (flows changing sign twice can have two rates)
+    grid = np.linspace(-limit, limit, _BRACKET_POINTS)
+    values = np.exp(-np.outer(grid, years)) @ amounts
+    change = np.flatnonzero(np.sign(values[:-1]) != np.sign(values[1:]))
+    if not len(change):
+        return None
+    i = change[np.argmin(np.abs(grid[change] + grid[change + 1]))]
+    lo, hi, f_lo = grid[i], grid[i + 1], values[i]
+    if f_lo == 0:
+        return float(np.expm1(lo))
+
+    x = 0.0 if lo < 0.0 < hi else (lo + hi) / 2
+    for _ in range(iterations):
+        f, slope = npv(x)
+        if f == 0:
+            break
+        if (f < 0) == (f_lo < 0):
+            lo, f_lo = x, f
+        else:
+            hi = x
+        step = x - f / slope if slope else None
+        if step is None or not lo < step < hi:
+            step = (lo + hi) / 2
+        if abs(step - x) < tolerance:
+            x = step
+            break
+        x = step
+    return float(np.expm1(x))
+
+
+def time_weighted(values, inflows, outflows):
+    """Chained daily returns of each column of a days x assets value matrix.
+
+    Row 0 is the close before the range. A day's flows happen at its
+    close, at the prices it is valued at, except that money put into an
+    empty position counts from the start of the day. Days with nothing
+    held do not count; columns never held give NaN.
+    """
+    previous = values[:-1]
+    held = previous > 0
+    begin = np.where(held, previous, inflows[1:])
+    end = values[1:] + outflows[1:] - np.where(held, inflows[1:], 0.0)
+    counted = begin > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(counted, end / begin, 1.0)
+    twr = np.prod(growth, axis=0) - 1.0
+    twr[~counted.any(axis=0)] = np.nan
+    return twr
+
+
+def load(portfolio_ids, start, end):
+    """Everything needed to value portfolio_ids from the day before start to end.
+
+    Transactions and closes are fetched as columns (columnar.py): a full
+    transaction history takes a few dozen bytes a trade.
+    """
+    run = DatabaseConnection.run_query
+    trades = columnar.fetch(*queries.return_transactions(portfolio_ids, end + timedelta(days=1)),
+                            types={'portfolio_id': np.int64, 'asset_id': np.int64,
+                                   'transaction_type': TRANSACTION_KINDS,
+                                   'transaction_date': DAY, 'quantity': float,
+                                   'price_per_unit': float, 'total_amount': float,
+                                   'fees': float})
+    asset_ids = np.unique(trades['asset_id']).tolist()
+    assets, prices = [], columnar.empty(PRICE_TYPES)
+    if asset_ids:
+        assets = sorted(run(*queries.return_assets(asset_ids)), key=lambda row: row['asset_id'])
+        prices = columnar.fetch(*queries.price_history(asset_ids, start - PRICE_LOOKBACK),
+                                types=PRICE_TYPES)
+
+    # A day's rate for each pair between an asset's and a portfolio's currency
+    currencies = {row['portfolio_id']: row['currency']
+                  for row in run(*queries.portfolio_currencies(portfolio_ids))}
+    first_day = start.toordinal() - 1
+    days = end.toordinal() - first_day + 1
+    rates = {(base, quote): np.array(fx.RATES.series(base, quote, first_day, days))
+             for base in {row['currency'] for row in assets}
+             for quote in set(currencies.values())}
+
+    return {
+        'trades': {
+            'portfolio_id': trades['portfolio_id'],
+            'asset_id': trades['asset_id'],
+            'kind': trades['transaction_type'],
+            'day': trades['transaction_date'],
+            'quantity': trades['quantity'],
+            'price': trades['price_per_unit'],
+            'amount': trades['total_amount'],
+            'fees': np.nan_to_num(trades['fees'])
+        },
+        'assets': {
+            'asset_id': _column(assets, 'asset_id', np.int64),
+            'symbol': {row['asset_id']: row['asset_symbol'] for row in assets},
+            'price': _column(assets, 'current_price'),
+            'currency': [row['currency'] for row in assets]
+        },
+        'prices': {
+            'asset_id': prices['asset_id'],
+            'day': prices['price_date'],
+            'close': prices['close_price']
+        },
+        'currencies': currencies,
+        'rates': rates
+    }
+
+
+def rate_grid(data, currency, days):
+    """days x assets matrix of the rate converting each asset's currency into
+    currency on each day: one column of rates per asset currency"""
+    asset_currencies = data['assets']['currency']
+    grid = np.ones((days, len(asset_currencies)))
+    for base in set(asset_currencies) - {currency}:
+        columns = [i for i, c in enumerate(asset_currencies) if c == base]
+        grid[:, columns] = data['rates'][(base, currency)][:, None]
+    return grid
+
+
+def price_grid(data, first_day, days, today):
+    """days x assets matrix of the price of each asset on each day from first_day.
+
+    Every known price is placed on its day (earlier ones on day 0) and
+    carried forward. On the same day a close beats a trade price, and
+    today the current price beats both.
+    """
+    trades, assets, prices = data['trades'], data['assets'], data['prices']
+    asset_ids = assets['asset_id']
+    # A dividend's price is the amount paid per unit
+    traded = trades['kind'] != 2
+    current = np.full(len(asset_ids), today)
+    asset = np.concatenate((trades['asset_id'][traded], prices['asset_id'], asset_ids))
+    day = np.concatenate((trades['day'][traded], prices['day'], current))
+    price = np.concatenate((trades['price'][traded], prices['close'], assets['price']))
+    rank = np.concatenate((np.zeros(traded.sum()), np.ones(len(prices['day'])),
+                           np.full(len(asset_ids), 2)))
+
+    keep = (day < first_day + days) & ~np.isnan(price)
+    asset, day, price, rank = asset[keep], day[keep], price[keep], rank[keep]
+    column = np.searchsorted(asset_ids, asset)
+    row = np.maximum(day - first_day, 0)
+    # The latest (then highest ranked) price of each cell wins
+    cell = row * len(asset_ids) + column
+    order = np.lexsort((rank, day, cell))
+    cell = cell[order]
+    last = np.append(cell[1:] != cell[:-1], True)
+
+    grid = np.full((days, len(asset_ids)), np.nan)
+    grid[row[order][last], column[order][last]] = price[order][last]
+    return np.nan_to_num(forward_fill(grid))
+
+
+def compute(data, start, end, today=None):
+    """{portfolio_id: {asset_id: result}} with asset_id 0 for the portfolio.
+
+    A result holds the value at the close before start and at end, the
+    net money put in during the range, the TWR and the IRR (None where
+    they do not exist), in the portfolio's currency.
+    """
+    today = (today or date.today()).toordinal()
+    first_day = start.toordinal() - 1
+    days = end.toordinal() - first_day + 1
+    trades = data['trades']
+    asset_ids = data['assets']['asset_id']
+    if not len(trades['day']):
+        return {}
+    prices = price_grid(data, first_day, days, today)
+
+    order = np.lexsort((trades['day'], trades['portfolio_id']))
+    trades = {name: values[order] for name, values in trades.items()}
+    grids = {}
+    results = {}
+    for portfolio_id, a, b in _segments(trades['portfolio_id']):
+        currency = data['currencies'][portfolio_id]
+        if currency not in grids:
+            grids[currency] = rate_grid(data, currency, days)
+        rates = grids[currency]
+        kind, day = trades['kind'][a:b], trades['day'][a:b]
+        column = np.searchsorted(asset_ids, trades['asset_id'][a:b])
+        row = np.maximum(day - first_day, 0)
+        quantity, amount, fees = (trades['quantity'][a:b], trades['amount'][a:b],
+                                  trades['fees'][a:b])
+
+        # Earlier trades all land on day 0: only their holdings matter
+        held = np.zeros((days, len(asset_ids)))
+        change = np.select([kind == 0, kind == 1], [quantity, -quantity], 0.0)
+        np.add.at(held, (row, column), change)
+        held = np.maximum(np.cumsum(held, axis=0), 0.0)
+
+        inside = day > first_day
+        inflows = np.zeros((days, len(asset_ids)))
+        outflows = np.zeros((days, len(asset_ids)))
+        buy, paid = inside & (kind == 0), inside & (kind != 0)
+        rate = rates[row, column]
+        np.add.at(inflows, (row[buy], column[buy]), (amount[buy] + fees[buy]) * rate[buy])
+        np.add.at(outflows, (row[paid], column[paid]),
+                  (amount[paid] - fees[paid]) * rate[paid])
+
+        values = held * prices * rates
+        used = np.unique(column)
+        columns = [(0, values.sum(axis=1), inflows.sum(axis=1), outflows.sum(axis=1))]
+        columns += [(int(asset_ids[c]), values[:, c], inflows[:, c], outflows[:, c])
+                    for c in used]
+        twr = time_weighted(np.column_stack([c[1] for c in columns]),
+                            np.column_stack([c[2] for c in columns]),
+                            np.column_stack([c[3] for c in columns]))
+
+        results[portfolio_id] = {}
+        for (asset_id, value, inflow, outflow), growth in zip(columns, twr):
+            if asset_id and not (value[0] or value[-1] or inflow.any() or outflow.any()):
+                continue
+            # The investor's flows: the value before the range and money
+            # put in are paid, money taken out and the final value received
+            flows = outflow - inflow
+            flows[0] -= value[0]
+            flows[-1] += value[-1]
+            nonzero = np.flatnonzero(flows)
+            irr = (xirr(first_day + nonzero, flows[nonzero]) if len(nonzero) > 1
+                   else None)
+            results[portfolio_id][asset_id] = {
+                'start_value': round(float(value[0]), 2),
+                'end_value': round(float(value[-1]), 2),
+                'net_flow': round(float(inflow.sum() - outflow.sum()), 2),
+                'twr': _storable(growth),
+                'irr': _storable(irr)
+            }
+    return results
+
+
+def _storable(value):
+    if value is None or not np.isfinite(value) or abs(value) >= _STORABLE:
+        return None
+    return round(float(value), 8)
+
+
+def _fresh(row, end, mark, now):
+    if row['last_transaction_id'] != mark:
+        return False
+    # A range that had ended when it was computed only used past closes
+    return end < row['computed_at'].date() or now - row['computed_at'] < LIVE_TTL
+
+
+def portfolio_returns(portfolio_ids, start, end):
+    """Returns of portfolio_ids over [start, end] as compute() gives them,
+    from Performance_Returns where it is up to date.
+
+    Also returns the symbols of the assets and the currencies of the
+    portfolios: ({portfolio_id: {asset_id: result}}, {asset_id: symbol},
+    {portfolio_id: currency}). Raises fx.MissingRate without the rates
+    to convert an asset's currency into its portfolio's.
+    """
+    portfolio_ids = sorted(set(portfolio_ids))
+    if not portfolio_ids:
+        return {}, {}, {}
+    end = min(end, date.today())
+    now = datetime.now().replace(microsecond=0)
+    run = DatabaseConnection.run_query
+    marks = {row['portfolio_id']: row['last_transaction_id']
+             for row in run(*queries.transaction_marks(portfolio_ids))}
+
+    cached = {}
+    for row in run(*queries.cached_returns(portfolio_ids, start, end)):
+        if _fresh(row, end, marks.get(row['portfolio_id'], 0), now):
+            cached.setdefault(row['portfolio_id'], {})[row['asset_id']] = {
+                name: None if row[name] is None else float(row[name])
+                for name in ('start_value', 'end_value', 'net_flow', 'twr', 'irr')}
+
+    stale = [pid for pid in portfolio_ids if 0 not in cached.get(pid, {})]
+    results = {pid: cached[pid] for pid in portfolio_ids if pid not in stale}
+    symbols, currencies = {}, {}
+    if stale:
+        with timings.measure('returns', 'compute'):
+            data = load(stale, start, end)
+            computed = compute(data, start, end)
+        symbols, currencies = data['assets']['symbol'], data['currencies']
+        rows = []
+        for pid in stale:
+            # A portfolio without trades is cached as empty
+            result = computed.get(pid) or {0: {'start_value': 0.0, 'end_value': 0.0,
+                                                'net_flow': 0.0, 'twr': None, 'irr': None}}
+            results[pid] = result
+            rows.extend((pid, start, end, asset_id, r['start_value'], r['end_value'],
+                         r['net_flow'], r['twr'], r['irr'], marks.get(pid, 0), now)
+                        for asset_id, r in result.items())
+        with DatabaseConnection.transaction(['Performance_Returns']) as cursor:
+            cursor.execute(*queries.delete_cached_returns(stale, start, end))
+            cursor.executemany(queries.INSERT_RETURN, rows)
+
+    missing = sorted({asset_id for result in results.values() for asset_id in result
+                      if asset_id and asset_id not in symbols})
+    if missing:
+        symbols.update((row['asset_id'], row['asset_symbol'])
+                       for row in run(*queries.return_assets(missing)))
+    if len(currencies) < len(portfolio_ids):
+        currencies = {row['portfolio_id']: row['currency']
+                      for row in run(*queries.portfolio_currencies(portfolio_ids))}
+    return results, symbols, currencies
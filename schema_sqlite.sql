@@ -0,0 +1,305 @@
+-- Portfolio Management System Database Schema, SQLite edition
+--
+-- The schema of dbmysql.frm with migrations 001-011 applied, for running
+-- the application's queries without a MySQL server (benchmarks, tests,
+-- offline use; see backends.py). ENUMs become CHECK constraints,
+-- CONCAT becomes || and the FULLTEXT index on asset names is the FTS5
+-- table Assets_fts, kept up to date by triggers. Triggers also stand in
+-- for ON UPDATE CURRENT_TIMESTAMP on the last_updated columns.
+-- user_version is the number of the last migration applied.
+
+PRAGMA foreign_keys = ON;
+PRAGMA user_version = 11;
+
+CREATE TABLE IF NOT EXISTS Users (
+    user_id INTEGER PRIMARY KEY,
+    first_name VARCHAR(50) NOT NULL,
+    last_name VARCHAR(50) NOT NULL,
+    email VARCHAR(100) UNIQUE NOT NULL,
+    phone VARCHAR(15),
+    date_of_birth DATE,
+    address TEXT,
+    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'inactive', 'suspended'))
+);
+
+CREATE TABLE IF NOT EXISTS Portfolios (
+    portfolio_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    portfolio_name VARCHAR(100) NOT NULL,
+    portfolio_type TEXT NOT NULL CHECK (portfolio_type IN ('aggressive', 'moderate', 'conservative')),
+    creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    total_value DECIMAL(15, 2) DEFAULT 0.00,
+    currency CHAR(3) NOT NULL DEFAULT 'USD',   -- Migration 009
+    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'closed')),
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+-- Migration 011 (replaces idx_user_id)
+CREATE INDEX IF NOT EXISTS idx_user_status ON Portfolios (user_id, status);
+-- Migration 006
+CREATE INDEX IF NOT EXISTS idx_portfolios_user_updated ON Portfolios (user_id, last_updated);
+
+CREATE TABLE IF NOT EXISTS Asset_Categories (
+    category_id INTEGER PRIMARY KEY,
+    category_name VARCHAR(50) UNIQUE NOT NULL,
+    description TEXT,
+    risk_level TEXT NOT NULL CHECK (risk_level IN ('low', 'medium', 'high'))
+);
+
+CREATE TABLE IF NOT EXISTS Assets (
+    asset_id INTEGER PRIMARY KEY,
+    category_id INTEGER NOT NULL REFERENCES Asset_Categories(category_id),
+    asset_symbol VARCHAR(10) UNIQUE NOT NULL,
+    asset_name VARCHAR(100) NOT NULL,
+    asset_type TEXT NOT NULL
+        CHECK (asset_type IN ('stock', 'bond', 'mutual_fund', 'etf', 'commodity', 'crypto')),
+    current_price DECIMAL(12, 4) NOT NULL,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    exchange VARCHAR(50),
+    currency CHAR(3) NOT NULL DEFAULT 'USD'    -- Migration 009
+);
+CREATE INDEX IF NOT EXISTS idx_last_updated ON Assets (last_updated);
+
+-- Migration 002: MATCH(asset_name) AGAINST (...) is translated to a lookup here
+CREATE VIRTUAL TABLE IF NOT EXISTS Assets_fts
+    USING fts5(asset_name, content='Assets', content_rowid='asset_id');
+
+CREATE TRIGGER IF NOT EXISTS assets_fts_insert AFTER INSERT ON Assets BEGIN
+    INSERT INTO Assets_fts (rowid, asset_name) VALUES (new.asset_id, new.asset_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_fts_delete AFTER DELETE ON Assets BEGIN
+    INSERT INTO Assets_fts (Assets_fts, rowid, asset_name)
+        VALUES ('delete', old.asset_id, old.asset_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS assets_fts_update AFTER UPDATE OF asset_name ON Assets BEGIN
+    INSERT INTO Assets_fts (Assets_fts, rowid, asset_name)
+        VALUES ('delete', old.asset_id, old.asset_name);
+    INSERT INTO Assets_fts (rowid, asset_name) VALUES (new.asset_id, new.asset_name);
+END;
+
+CREATE TABLE IF NOT EXISTS Portfolio_Holdings (
+    holding_id INTEGER PRIMARY KEY,
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    quantity DECIMAL(15, 6) NOT NULL,
+    purchase_price DECIMAL(12, 4) NOT NULL,
+    purchase_date DATE NOT NULL,
+    current_value DECIMAL(15, 2) GENERATED ALWAYS AS (ROUND(quantity * purchase_price, 2)) STORED,
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_portfolio_asset ON Portfolio_Holdings (portfolio_id, asset_id);
+CREATE INDEX IF NOT EXISTS idx_holdings_portfolio_updated
+    ON Portfolio_Holdings (portfolio_id, last_updated);
+
+CREATE TABLE IF NOT EXISTS Transactions (
+    transaction_id INTEGER PRIMARY KEY,
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id),
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('buy', 'sell', 'dividend')),
+    quantity DECIMAL(15, 6) NOT NULL,
+    price_per_unit DECIMAL(12, 4) NOT NULL,
+    total_amount DECIMAL(15, 2) GENERATED ALWAYS AS (ROUND(quantity * price_per_unit, 2)) STORED,
+    transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fees DECIMAL(10, 2) DEFAULT 0.00,
+    notes TEXT
+);
+-- Migration 001
+CREATE INDEX IF NOT EXISTS idx_portfolio_date_id
+    ON Transactions (portfolio_id, transaction_date, transaction_id);
+CREATE INDEX IF NOT EXISTS idx_portfolio_asset_date_id
+    ON Transactions (portfolio_id, asset_id, transaction_date, transaction_id);
+CREATE INDEX IF NOT EXISTS idx_portfolio_type_date_id
+    ON Transactions (portfolio_id, transaction_type, transaction_date, transaction_id);
+
+-- Migration 004 columns included
+CREATE TABLE IF NOT EXISTS Performance_Metrics (
+    metric_id INTEGER PRIMARY KEY,
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    metric_date DATE NOT NULL,
+    total_value DECIMAL(15, 2) NOT NULL,
+    market_value DECIMAL(15, 2) NOT NULL DEFAULT 0.00,
+    cost_basis DECIMAL(15, 2) NOT NULL DEFAULT 0.00,
+    holdings_count INTEGER NOT NULL DEFAULT 0,
+    daily_return DECIMAL(8, 4),
+    total_return DECIMAL(8, 4),
+    benchmark_return DECIMAL(8, 4),
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (portfolio_id, metric_date)
+);
+CREATE INDEX IF NOT EXISTS idx_date ON Performance_Metrics (metric_date);
+CREATE INDEX IF NOT EXISTS idx_metrics_portfolio_updated
+    ON Performance_Metrics (portfolio_id, last_updated);
+
+CREATE TABLE IF NOT EXISTS Watchlist (
+    watchlist_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    target_price DECIMAL(12, 4),
+    notes TEXT,
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, asset_id)
+);
+-- Migration 005
+CREATE INDEX IF NOT EXISTS idx_asset_target ON Watchlist (asset_id, target_price);
+CREATE INDEX IF NOT EXISTS idx_watchlist_user_updated ON Watchlist (user_id, last_updated);
+
+-- Migration 003
+CREATE TABLE IF NOT EXISTS Asset_Price_History (
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id) ON DELETE CASCADE,
+    price_date DATE NOT NULL,
+    close_price DECIMAL(12, 4) NOT NULL,
+    PRIMARY KEY (asset_id, price_date)
+) WITHOUT ROWID;
+
+
+-- Migration 007
+CREATE TABLE IF NOT EXISTS Tax_Lot_Checkpoints (
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    method TEXT NOT NULL CHECK (method IN ('fifo', 'lifo', 'hifo', 'specific')),
+    last_transaction_id INTEGER NOT NULL,
+    last_transaction_date DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, method)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS Tax_Lots (
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    method TEXT NOT NULL CHECK (method IN ('fifo', 'lifo', 'hifo', 'specific')),
+    lot_id INTEGER NOT NULL,
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    acquired_date DATETIME NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,
+    unit_cost DECIMAL(18, 8) NOT NULL,
+    PRIMARY KEY (portfolio_id, method, lot_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS Realized_Gains (
+    gain_id INTEGER PRIMARY KEY,
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    method TEXT NOT NULL CHECK (method IN ('fifo', 'lifo', 'hifo', 'specific')),
+    sell_transaction_id INTEGER NOT NULL,
+    lot_id INTEGER,
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    acquired_date DATETIME,
+    sold_date DATETIME NOT NULL,
+    quantity DECIMAL(15, 6) NOT NULL,
+    proceeds DECIMAL(15, 2) NOT NULL,
+    cost_basis DECIMAL(15, 2) NOT NULL,
+    gain DECIMAL(15, 2) NOT NULL,
+    long_term BOOLEAN NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_portfolio_method_sold
+    ON Realized_Gains (portfolio_id, method, sold_date);
+
+CREATE TABLE IF NOT EXISTS Tax_Lot_Selections (
+    sell_transaction_id INTEGER NOT NULL REFERENCES Transactions(transaction_id),
+    lot_id INTEGER NOT NULL REFERENCES Transactions(transaction_id),
+    quantity DECIMAL(15, 6) NOT NULL,
+    PRIMARY KEY (sell_transaction_id, lot_id)
+) WITHOUT ROWID;
+
+-- Migration 008
+CREATE TABLE IF NOT EXISTS Performance_Returns (
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    asset_id INTEGER NOT NULL DEFAULT 0,
+    start_value DECIMAL(15, 2) NOT NULL,
+    end_value DECIMAL(15, 2) NOT NULL,
+    net_flow DECIMAL(15, 2) NOT NULL,
+    twr DECIMAL(20, 8),
+    irr DECIMAL(20, 8),
+    last_transaction_id INTEGER NOT NULL,
+    computed_at DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, start_date, end_date, asset_id)
+) WITHOUT ROWID;
+
+-- Migration 009
+CREATE TABLE IF NOT EXISTS FX_Rates (
+    base_currency CHAR(3) NOT NULL,
+    quote_currency CHAR(3) NOT NULL,
+    rate_date DATE NOT NULL,
+    rate DECIMAL(18, 8) NOT NULL,
+    last_updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (base_currency, quote_currency, rate_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_fx_last_updated ON FX_Rates (last_updated);
+
+-- Migration 010
+CREATE TABLE IF NOT EXISTS Rebalance_Trades (
+    portfolio_id INTEGER NOT NULL REFERENCES Portfolios(portfolio_id) ON DELETE CASCADE,
+    asset_id INTEGER NOT NULL REFERENCES Assets(asset_id),
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('buy', 'sell')),
+    quantity DECIMAL(15, 6) NOT NULL,
+    price_per_unit DECIMAL(12, 4) NOT NULL,
+    amount DECIMAL(15, 2) NOT NULL,
+    fees DECIMAL(10, 2) NOT NULL,
+    planned_at DATETIME NOT NULL,
+    PRIMARY KEY (portfolio_id, asset_id)
+) WITHOUT ROWID;
+
+-- Migration 006: ON UPDATE CURRENT_TIMESTAMP, unless the update sets last_updated itself
+CREATE TRIGGER IF NOT EXISTS assets_last_updated AFTER UPDATE ON Assets
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE Assets SET last_updated = CURRENT_TIMESTAMP WHERE asset_id = new.asset_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS portfolios_last_updated AFTER UPDATE ON Portfolios
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE Portfolios SET last_updated = CURRENT_TIMESTAMP WHERE portfolio_id = new.portfolio_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS portfolio_holdings_last_updated AFTER UPDATE ON Portfolio_Holdings
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE Portfolio_Holdings SET last_updated = CURRENT_TIMESTAMP WHERE holding_id = new.holding_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS performance_metrics_last_updated AFTER UPDATE ON Performance_Metrics
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE Performance_Metrics SET last_updated = CURRENT_TIMESTAMP WHERE metric_id = new.metric_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS watchlist_last_updated AFTER UPDATE ON Watchlist
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE Watchlist SET last_updated = CURRENT_TIMESTAMP WHERE watchlist_id = new.watchlist_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS fx_rates_last_updated AFTER UPDATE ON FX_Rates
+    WHEN new.last_updated IS old.last_updated BEGIN
+    UPDATE FX_Rates SET last_updated = CURRENT_TIMESTAMP
+    WHERE base_currency = new.base_currency AND quote_currency = new.quote_currency
+      AND rate_date = new.rate_date;
+END;
+
+-- Views (v_user_portfolios as replaced by migration 009)
+CREATE VIEW IF NOT EXISTS v_user_portfolios AS
+SELECT
+    u.user_id,
+    u.first_name || ' ' || u.last_name AS user_name,
+    p.portfolio_id,
+    p.portfolio_name,
+    p.portfolio_type,
+    COALESCE(pm.total_value, p.total_value) AS total_value,
+    p.currency,
+    p.status,
+    COALESCE(pm.holdings_count, 0) AS total_holdings
+FROM Users u
+JOIN Portfolios p ON u.user_id = p.user_id
+LEFT JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+ AND pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                       WHERE portfolio_id = p.portfolio_id);
+
+CREATE VIEW IF NOT EXISTS v_portfolio_performance AS
+SELECT
+    p.portfolio_id,
+    p.portfolio_name,
+    SUM(ph.quantity * a.current_price) AS current_market_value,
+    SUM(ph.current_value) AS cost_basis,
+    SUM(ph.quantity * a.current_price) - SUM(ph.current_value) AS unrealized_gain_loss,
+    ROUND(((SUM(ph.quantity * a.current_price) - SUM(ph.current_value)) / SUM(ph.current_value) * 100), 2) AS return_percentage
+FROM Portfolios p
+JOIN Portfolio_Holdings ph ON p.portfolio_id = ph.portfolio_id
+JOIN Assets a ON ph.asset_id = a.asset_id
+GROUP BY p.portfolio_id;
@@ -0,0 +1,104 @@
+"""
+In-process asset search for the Portfolio Management System
+
+AssetSearchIndex is built once over the asset catalog and answers
+search-as-you-type queries without touching MySQL. Matches are ranked:
+
+    0. exact symbol            AAPL
+    1. symbol prefix           AA -> AAPL, AAL
+    2. word prefix in name     micro -> Microsoft Corporation
+    3. substring in name       soft -> Microsoft Corporation
+
+Prefix tiers are answered by binary search over sorted keys. Substrings
+are answered by a trigram posting list, with a final substring check.
+Each tier stops as soon as the result cap is reached, so a lookup costs
+O(log n + limit) for prefixes rather than a scan of the catalog.
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+
+SEARCH_LIMIT = 100
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class AssetSearchIndex:
+    """Ranked symbol/name lookup over a list of asset rows"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self._symbols = sorted((row['asset_symbol'].upper(), i)
+                               for i, row in enumerate(self.rows))
+        self._names = [row['asset_name'].lower() for row in self.rows]
+
+        words = []
+        trigrams = {}
+        for i, name in enumerate(self._names):
+            for word in set(_WORD.findall(name)):
+                words.append((word, i))
+            for gram in _trigrams(name):
+                postings = trigrams.get(gram)
+                if postings is None:
+                    postings = trigrams[gram] = array('i')
+                postings.append(i)
+        words.sort()
+        self._words = words
+        self._trigrams = trigrams
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, term, limit=SEARCH_LIMIT):
+        """Up to limit rows matching term, best matches first"""
+        term = term.strip()
+        if not term:
+            return self.rows[:limit]
+
+        found = []
+        seen = set()
+
+        def take(i):
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+            return len(found) >= limit
+
+        # Tiers 0 and 1: symbols sort before any longer symbol they prefix,
+        # so an exact match comes first
+        symbol = term.upper()
+        for pos in range(bisect_left(self._symbols, (symbol, -1)), len(self._symbols)):
+            key, i = self._symbols[pos]
+            if not key.startswith(symbol) or take(i):
+                break
+        if len(found) >= limit:
+            return self._result(found)
+
+        # Tier 2: any word of the name starts with the term
+        lowered = term.lower()
+        words = _WORD.findall(lowered)
+        if len(words) == 1:
+            for pos in range(bisect_left(self._words, (words[0], -1)), len(self._words)):
+                word, i = self._words[pos]
+                if not word.startswith(words[0]) or take(i):
+                    break
+            if len(found) >= limit:
+                return self._result(found)
+
+        # Tier 3: substring of the name, via the rarest trigram of the term
+        if len(lowered) >= 3:
+            postings = [self._trigrams.get(gram) for gram in _trigrams(lowered)]
+            if all(p is not None for p in postings):
+                for i in min(postings, key=len):
+                    if lowered in self._names[i] and take(i):
+                        break
+
+        return self._result(found)
+
+    def _result(self, found):
+        return [self.rows[i] for i in found]
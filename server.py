@@ -0,0 +1,491 @@
+"""
+HTTP/JSON API for the Portfolio Management System
+
+Serves the service layer (service.py) to many clients from one process,
+so they all share one connection pool and one query cache. Requests are
+parsed on an asyncio event loop, which holds thousands of idle or
+keep-alive connections cheaply; the blocking database work runs on a
+thread pool sized to the connection pool, so excess requests queue here
+instead of timing out in the pool.
+
+    python server.py --host 127.0.0.1 --port 8080
+
+Endpoints (JSON in and out; all but /health, /login and /users need an
+"Authorization: Bearer <token>" header from /login):
+
+    GET  /health                        pool and cache statistics
+    GET  /metrics                       Prometheus text (?format=json for JSON)
+    POST /login                         {"email"} -> {"token", "user"}
+    POST /logout
+    POST /users                         register a user
+    GET  /portfolios
+    POST /portfolios                    {"portfolio_name", "portfolio_type", "initial_value"}
+    GET  /portfolios/<id>/holdings
+    GET  /portfolios/<id>/rebalance     ?by=asset_type|category: drift and trades
+    GET  /transactions                  ?portfolio_id=&asset_symbol=&transaction_type=
+                                         &date_from=&date_to=&after_date=&after_id=
+    GET  /assets                        ?q=&limit=
+    GET  /watchlist
+    GET  /reports
+    GET  /returns                       ?start=&end= (YYYY-MM-DD; this year to date)
+    GET  /tax/lots                      ?method=fifo|lifo|hifo|specific
+    GET  /tax/realized                  ?year=&method=
+    PUT  /transactions/<id>/lots        {"lots": [{"lot_id", "quantity"}]} for a sale
+
+Like the desktop login, /login trusts the email address it is given:
+bind the server to a trusted network only.
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from mysql.connector import errors
+
+import queries
+import service
+from database import POOL_CONFIG, DatabaseConnection, DatabaseUnavailableError, PoolTimeoutError
+from instrumentation import call_site, metrics, start_exporter, timings
+from search import SEARCH_LIMIT
+
+logger = logging.getLogger('portfolio.server')
+
+SESSION_TTL = 8 * 3600          # Seconds a login token stays valid
+KEEP_ALIVE_TIMEOUT = 15         # Seconds an idle connection is kept open
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_ASSET_RESULTS = 1000
+
+
+class Text(str):
+    """A handler payload sent as plain text rather than JSON"""
+
+
+class HTTPError(Exception):
+    """An error response: status code and message"""
+
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        # As a string: money must not pass through a float
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, 'tolist'):    # NumPy arrays and scalars
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_json(payload):
+    return json.dumps(payload, default=_json_default, separators=(',', ':')).encode()
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path.rstrip('/') or '/'
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+        self.route = None
+        self.user = None
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return data
+
+    def keep_alive(self, version):
+        connection = self.headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def int_param(self, name, default=None):
+        value = self.query.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise HTTPError(400, f"{name} must be an integer") from None
+
+
+class Sessions:
+    """Login tokens; only touched from the event loop, so unlocked"""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}     # token -> (user, expires)
+
+    def create(self, user):
+        self._prune()
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (user, time.monotonic() + self.ttl)
+        return token
+
+    def get(self, token):
+        session = self._sessions.get(token)
+        if session is None or session[1] < time.monotonic():
+            self._sessions.pop(token, None)
+            return None
+        return session[0]
+
+    def drop(self, token):
+        self._sessions.pop(token, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [token for token, (_, expires) in self._sessions.items() if expires < now]
+        for token in expired:
+            del self._sessions[token]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class APIServer:
+    """Route HTTP requests to the service layer"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or POOL_CONFIG['pool_size']
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix='api')
+        self.sessions = Sessions()
+        self._server = None
+        # (method, path pattern, handler, needs a login)
+        self.routes = [
+            ('GET', r'/health', self.health, False),
+            ('GET', r'/metrics', self.export_metrics, False),
+            ('POST', r'/login', self.login, False),
+            ('POST', r'/logout', self.logout, True),
+            ('POST', r'/users', self.register, False),
+            ('GET', r'/portfolios', self.portfolios, True),
+            ('POST', r'/portfolios', self.create_portfolio, True),
+            ('GET', r'/portfolios/(\d+)/holdings', self.holdings, True),
+            ('GET', r'/portfolios/(\d+)/rebalance', self.rebalance, True),
+            ('GET', r'/transactions', self.transactions, True),
+            ('GET', r'/assets', self.assets, True),
+            ('GET', r'/watchlist', self.watchlist, True),
+            ('GET', r'/reports', self.reports, True),
+            ('GET', r'/returns', self.returns, True),
+            ('GET', r'/tax/lots', self.tax_lots, True),
+            ('GET', r'/tax/realized', self.realized_gains, True),
+            ('PUT', r'/transactions/(\d+)/lots', self.select_lots, True)
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler, auth)
+                       for method, pattern, handler, auth in self.routes]
+
+    async def call(self, fn, *args, **kwargs):
+        """Run blocking service code on the worker threads, under the request's call site"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run,
+                                          partial(fn, *args, **kwargs))
+
+    # Handlers return (status, payload)
+
+    async def health(self, request):
+        return 200, {'status': 'ok', 'sessions': len(self.sessions),
+                     'pool': DatabaseConnection.pool_stats(),
+                     'cache': DatabaseConnection.cache_stats()}
+
+    async def export_metrics(self, request):
+        if request.query.get('format') == 'json':
+            return 200, json.loads(metrics.to_json())
+        return 200, Text(metrics.prometheus())
+
+    async def login(self, request):
+        email = request.json().get('email')
+        if not isinstance(email, str) or not email.strip():
+            raise HTTPError(400, "email is required")
+        user = await self.call(service.login, email)
+        if user is None:
+            raise HTTPError(401, "User not found or account inactive")
+        return 200, {'token': self.sessions.create(user), 'user': user}
+
+    async def logout(self, request):
+        self.sessions.drop(self._token(request))
+        return 200, {'status': 'ok'}
+
+    async def register(self, request):
+        data = request.json()
+        await self.call(service.register, data.get('first_name'), data.get('last_name'),
+                        data.get('email'), data.get('phone'), data.get('date_of_birth'),
+                        data.get('address'))
+        return 201, {'status': 'created'}
+
+    async def portfolios(self, request):
+        return 200, await self.call(service.portfolios, request.user['user_id'])
+
+    async def create_portfolio(self, request):
+        data = request.json()
+        await self.call(service.create_portfolio, request.user['user_id'],
+                        data.get('portfolio_name'), data.get('portfolio_type', 'moderate'),
+                        data.get('initial_value', 0))
+        return 201, {'status': 'created'}
+
+    async def holdings(self, request, portfolio_id):
+        return 200, await self.call(service.holdings, request.user['user_id'],
+                                    int(portfolio_id))
+
+    async def rebalance(self, request, portfolio_id):
+        return 200, await self.call(service.rebalance_plan, request.user['user_id'],
+                                    int(portfolio_id), request.query.get('by'))
+
+    async def transactions(self, request):
+        filters = {'portfolio_id': request.int_param('portfolio_id')}
+        for name in ('asset_symbol', 'transaction_type'):
+            if request.query.get(name):
+                filters[name] = request.query[name]
+        for name in ('date_from', 'date_to'):
+            if request.query.get(name):
+                filters[name] = service.parse_date(request.query[name], name)
+        if filters.get('transaction_type') not in (None,) + service.TRANSACTION_TYPES:
+            raise HTTPError(400, "Unknown transaction_type")
+
+        after = None
+        if request.query.get('after_date'):
+            try:
+                after_date = datetime.fromisoformat(request.query['after_date'])
+            except ValueError:
+                raise HTTPError(400, "after_date must be an ISO date and time") from None
+            after = (after_date, request.int_param('after_id', 0))
+
+        result = await self.call(service.transaction_page, request.user['user_id'],
+                                 filters, after)
+        rows = result['rows']
+        next_page = None
+        if len(rows) >= queries.TRANSACTION_PAGE_SIZE:
+            last = rows[-1]
+            next_page = {'after_date': last['transaction_date'],
+                         'after_id': last['transaction_id']}
+        return 200, {'rows': rows, 'next': next_page}
+
+    async def assets(self, request):
+        limit = min(request.int_param('limit', SEARCH_LIMIT), MAX_ASSET_RESULTS)
+        return 200, await self.call(service.search_assets, request.query.get('q', ''), limit)
+
+    async def watchlist(self, request):
+        return 200, await self.call(service.watchlist, request.user['user_id'])
+
+    async def reports(self, request):
+        data = await self.call(service.reports, request.user['user_id'])
+        risk = data['risk']
+        if risk is not None:
+            # The full matrices are for plotting; send the summary instead
+            data['risk'] = {'portfolios': risk['portfolios'], 'assets': risk['assets'],
+                            'top_correlations': service.analytics.top_correlations(risk)}
+        return 200, data
+
+    async def returns(self, request):
+        return 200, await self.call(service.portfolio_returns, request.user['user_id'],
+                                    request.query.get('start'), request.query.get('end'))
+
+    async def tax_lots(self, request):
+        return 200, await self.call(service.tax_lots, request.user['user_id'],
+                                    request.query.get('method'))
+
+    async def realized_gains(self, request):
+        return 200, await self.call(service.realized_gains, request.user['user_id'],
+                                    request.int_param('year'), request.query.get('method'))
+
+    async def select_lots(self, request, transaction_id):
+        selections = request.json().get('lots')
+        if not isinstance(selections, list) or not all(isinstance(s, dict) for s in selections):
+            raise HTTPError(400, "lots must be a list of {\"lot_id\", \"quantity\"}")
+        await self.call(service.select_lots, request.user['user_id'], int(transaction_id),
+                        [(s.get('lot_id'), s.get('quantity')) for s in selections])
+        return 200, {'status': 'updated'}
+
+    # Dispatch
+
+    @staticmethod
+    def _token(request):
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        return token.strip() if scheme.lower() == 'bearer' else ''
+
+    async def dispatch(self, request):
+        allowed = []
+        for method, pattern, handler, auth in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed.append(method)
+                continue
+            request.route = handler.__name__
+            if auth:
+                request.user = self.sessions.get(self._token(request))
+                if request.user is None:
+                    raise HTTPError(401, "Log in first")
+            with call_site('api_' + request.route):
+                return await handler(request, *match.groups())
+        if allowed:
+            raise HTTPError(405)
+        raise HTTPError(404)
+
+    async def respond(self, request):
+        """(status, body, content type) for a request; never raises"""
+        started = time.perf_counter()
+        try:
+            status, payload = await self.dispatch(request)
+        except HTTPError as e:
+            status, payload = e.status, {'error': str(e)}
+        except service.InvalidRequest as e:
+            status, payload = 400, {'error': str(e)}
+        except service.NotFound as e:
+            status, payload = 404, {'error': str(e)}
+        except (DatabaseUnavailableError, PoolTimeoutError) as e:
+            status, payload = 503, {'error': DatabaseConnection.describe_error(e)[1]}
+        except errors.IntegrityError as e:
+            status, payload = 409, {'error': str(e.msg)}   # e.g. the email is taken
+        except errors.DataError as e:
+            status, payload = 400, {'error': str(e.msg)}
+        except Exception:
+            logger.exception("%s %s failed", request.method, request.path)
+            status, payload = 500, {'error': "Internal server error"}
+        timings.record('api', f"{request.method} {request.route or 'unrouted'}",
+                       time.perf_counter() - started)
+        if isinstance(payload, Text):
+            return status, payload.encode(), 'text/plain; version=0.0.4'
+        return status, encode_json(payload), 'application/json'
+
+    # HTTP/1.1
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, 431, encode_json({'error': "Headers too large"}),
+                                     False)
+                    break
+
+                try:
+                    request, version = await self._read_request(reader, head)
+                except HTTPError as e:
+                    await self._send(writer, e.status, encode_json({'error': str(e)}), False)
+                    break
+
+                keep_alive = request.keep_alive(version)
+                status, body, content_type = await self.respond(request)
+                await self._send(writer, status, body, keep_alive, content_type)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader, head):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(400, "Malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        if 'transfer-encoding' in headers:
+            raise HTTPError(411, "Send a Content-Length instead of a chunked body")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length") from None
+        if length > MAX_BODY_BYTES or length < 0:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length else b''
+        return Request(method.upper(), target, headers, body), version
+
+    @staticmethod
+    async def _send(writer, status, body, keep_alive, content_type='application/json'):
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    # Lifecycle
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self._server = await asyncio.start_server(self.handle, host, port,
+                                                  limit=MAX_HEADER_BYTES)
+        return self._server
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await self.start(host, port)
+        logger.info("Serving on %s with %d workers",
+                    ', '.join(str(s.getsockname()) for s in server.sockets), self.workers)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the portfolio API over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Threads running queries (default: the connection pool size)")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help="Keep a Prometheus (or .json) metrics file up to date here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    if not os.environ.get('PORTFOLIO_TIMINGS'):
+        # A line per query and request is too much for a server
+        logging.getLogger('portfolio.timing').setLevel(logging.WARNING)
+    api = APIServer(args.workers)
+    stop_exporter = start_exporter(args.metrics_file) if args.metrics_file else None
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        DatabaseConnection.close_pool()
+        if stop_exporter is not None:
+            stop_exporter()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+GUI-free service layer for the Portfolio Management System
+
+Every data operation of the application as a plain function: it takes
+ids and values, returns rows or dicts, and raises on failure. Nothing
+here touches Tkinter, so the same functions serve the desktop window
+(on its worker threads), the HTTP API (server.py) and scripts, all
+sharing the process's connection pool and query cache.
+
+Functions that take a user_id only return or change that user's data.
+"""
+
+import threading
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import fx
+import lots
+import queries
+import snapshots
+from cache import ACCOUNT_TTL, REFERENCE_TTL
+from database import DatabaseConnection
+from search import SEARCH_LIMIT, AssetSearchIndex
+
+try:
+    import analytics
+    import rebalance
+    import returns
+    import simulation
+except ImportError:     # NumPy not installed: reports without risk metrics or returns
+    analytics = rebalance = returns = simulation = None
+
+PORTFOLIO_TYPES = ('aggressive', 'moderate', 'conservative')
+TRANSACTION_TYPES = ('buy', 'sell', 'dividend')
+
+
+class InvalidRequest(ValueError):
+    """Input that cannot be acted on"""
+
+
+class NotFound(LookupError):
+    """A record that does not exist or belongs to another user"""
+
+
+@contextmanager
+def _rates_needed():
+    """Report a missing exchange rate as NotFound"""
+    try:
+        yield
+    except fx.MissingRate as e:
+        raise NotFound(f"{e}; load rates with fx.py") from None
+
+
+# Users
+
+def login(email):
+    """The active user with this email, or None"""
+    rows = DatabaseConnection.run_query(queries.LOGIN, (email.strip(),))
+    return rows[0] if rows else None
+
+
+def register(first_name, last_name, email, phone=None, date_of_birth=None, address=None):
+    if not (first_name and last_name and email):
+        raise InvalidRequest("First name, last name and email are required")
+    if date_of_birth:
+        date_of_birth = parse_date(date_of_birth, 'date of birth')
+    return DatabaseConnection.run_query(
+        queries.INSERT_USER,
+        (first_name, last_name, email, phone or None, date_of_birth or None, address or None),
+        fetch=False)
+
+
+# Portfolios
+
+def dashboard(user_id):
+    """A row per portfolio of the user with its latest snapshot and the
+    user's number of distinct assets held, in one query.
+
+    The portfolio list, the portfolio choices and the reports are all
+    cut from these rows, so the tabs share one cached result. Stale
+    snapshots of active portfolios (none yet, or older than a change,
+    e.g. a transaction from sp_add_transaction) are refreshed first.
+    """
+    params = (user_id, date.today())
+    rows = DatabaseConnection.run_query(queries.DASHBOARD, params, cache_ttl=ACCOUNT_TTL)
+    stale = [row['portfolio_id'] for row in rows
+             if row['status'] == 'active' and row['snapshot_stale']]
+    # A replica gets the refreshed snapshots with its next sync
+    if stale and DatabaseConnection.read_source() is None:
+        try:
+            snapshots.refresh(stale)
+        except fx.MissingRate:
+            # Shown as last snapshotted until the rates are loaded
+            return rows
+        # The snapshot write dropped the cached rows
+        rows = DatabaseConnection.run_query(queries.DASHBOARD, params, cache_ttl=ACCOUNT_TTL)
+    return rows
+
+
+def portfolios(user_id):
+    return dashboard(user_id)
+
+
+def portfolio_choices(user_id):
+    """(portfolio_id, portfolio_name) of the user's portfolios; shared from the cache"""
+    return [{'portfolio_id': row['portfolio_id'], 'portfolio_name': row['portfolio_name']}
+            for row in dashboard(user_id)]
+
+
+def create_portfolio(user_id, name, portfolio_type='moderate', initial_value=0):
+    name = (name or '').strip()
+    if not name:
+        raise InvalidRequest("Portfolio name is required")
+    if portfolio_type not in PORTFOLIO_TYPES:
+        raise InvalidRequest(f"Portfolio type must be one of {', '.join(PORTFOLIO_TYPES)}")
+    try:
+        initial_value = Decimal(str(initial_value))
+    except InvalidOperation:
+        raise InvalidRequest(f"Invalid initial value: {initial_value!r}") from None
+    return DatabaseConnection.run_query(queries.INSERT_PORTFOLIO,
+                                        (user_id, name, portfolio_type, initial_value),
+                                        fetch=False)
+
+
+def holdings(user_id, portfolio_id):
+    """The portfolio's holdings, priced in their assets' currencies, with
+    market_value in the portfolio's"""
+    if not any(p['portfolio_id'] == portfolio_id for p in portfolio_choices(user_id)):
+        raise NotFound(f"No portfolio {portfolio_id}")
+    rows = DatabaseConnection.run_query(queries.PORTFOLIO_HOLDINGS, (portfolio_id,))
+    with _rates_needed():
+        return fx.RATES.convert(rows, ['market_value'],
+                                rows[0]['portfolio_currency'] if rows else None)
+
+
+def rebalance_plan(user_id, portfolio_id, by='asset_type'):
+    """The portfolio's allocation against the targets of its type, by
+    asset_type or category, and the trades that would restore it.
+
+    Returns {'portfolio_id', 'by', 'currency', 'value', 'allocation',
+    'trades'}: a row per class with its weight, target and drift, and a
+    row per trade with amount and fees in the portfolio's currency; no
+    trades while every class is within the drift band.
+    """
+    if rebalance is None:
+        raise InvalidRequest("Install NumPy to plan rebalancing")
+    by = by or 'asset_type'
+    if by not in rebalance.TARGETS:
+        raise InvalidRequest(f"Rebalance by one of {', '.join(rebalance.TARGETS)}")
+    if not any(p['portfolio_id'] == portfolio_id for p in portfolio_choices(user_id)):
+        raise NotFound(f"No portfolio {portfolio_id}")
+    rows = DatabaseConnection.run_query(*queries.rebalance_positions(portfolio_id, portfolio_id))
+    plan = {'portfolio_id': portfolio_id, 'by': by, 'currency': None, 'value': 0.0,
+            'allocation': [], 'trades': []}
+    if not rows:
+        return plan
+    with _rates_needed():
+        result = rebalance.plan(rows, by)
+    plan['currency'] = rows[0]['portfolio_currency']
+    plan['value'] = round(float(result['value'][0]), 2)
+    for name, weight, target in zip(result['classes'], result['weights'][0].tolist(),
+                                    result['targets'][0].tolist()):
+        if weight or target:
+            plan['allocation'].append({'class': name, 'weight': round(weight, 4),
+                                       'target': target, 'drift': round(weight - target, 4)})
+    trades = rebalance.trades(result, None)
+    if trades:
+        assets = {row['asset_id']: row for row in DatabaseConnection.run_query(
+            *queries.return_assets([trade[1] for trade in trades]))}
+        for _, asset_id, side, quantity, price, amount, fees, _ in trades:
+            plan['trades'].append({
+                'asset_id': asset_id, 'asset_symbol': assets[asset_id]['asset_symbol'],
+                'transaction_type': side, 'quantity': quantity, 'price_per_unit': price,
+                'asset_currency': assets[asset_id]['currency'], 'amount': amount,
+                'fees': fees})
+    return plan
+
+
+# Transactions
+
+def transaction_page(user_id, filters=None, after=None, portfolios=None):
+    """One page of transaction history, newest first.
+
+    filters are those of queries.transaction_page plus portfolio_id;
+    after is the (transaction_date, transaction_id) of the previous
+    page's last row. Returns {'portfolios': ..., 'rows': ...}.
+    """
+    if portfolios is None:
+        portfolios = portfolio_choices(user_id)
+
+    portfolio_ids = [p['portfolio_id'] for p in portfolios]
+    if filters and filters.get('portfolio_id') is not None:
+        portfolio_ids = [pid for pid in portfolio_ids if pid == filters['portfolio_id']]
+
+    query, params = queries.transaction_page(portfolio_ids, filters, after)
+    rows = DatabaseConnection.run_query(query, params) if query else []
+    return {'portfolios': portfolios, 'rows': rows}
+
+
+# Assets
+
+_catalog = {'rows': None, 'index': None}
+_catalog_lock = threading.Lock()
+
+
+def asset_catalog():
+    """Search index over the asset catalog.
+
+    The index is rebuilt only when the cached catalog rows change, i.e.
+    after REFERENCE_TTL or an invalidation of Assets.
+    """
+    rows = DatabaseConnection.run_query(queries.ASSET_CATALOG, cache_ttl=REFERENCE_TTL)
+    with _catalog_lock:
+        if _catalog['rows'] is not rows:
+            _catalog['rows'], _catalog['index'] = rows, AssetSearchIndex(rows)
+        return _catalog['index']
+
+
+def search_assets(term, limit=SEARCH_LIMIT):
+    index = asset_catalog()
+    term = (term or '').strip()
+    return index.search(term, limit) if term else index.rows[:limit]
+
+
+# Watchlist
+
+def watchlist(user_id):
+    return DatabaseConnection.run_query(queries.WATCHLIST, (user_id,))
+
+
+# Reports
+
+def reports(user_id):
+    """Performance, account summary, risk metrics and value at risk of the
+    user's portfolios"""
+    # Usually cached already by the portfolios and holdings tabs
+    rows = dashboard(user_id)
+    with _rates_needed():
+        performance = [row for row in rows
+                       if row['status'] == 'active' and row['total_holdings'] > 0]
+        return {
+            'performance': performance,
+            'totals': performance_totals(performance),
+            'portfolio_count': [{'count': len(rows)}],
+            'asset_count': [{'count': rows[0]['asset_count'] if rows else 0}],
+            'risk': analytics.portfolio_risk(user_id) if analytics else None,
+            'var': simulation.portfolio_var(user_id) if simulation else None,
+            'returns': portfolio_returns(user_id) if returns else None
+        }
+
+
+def performance_totals(performance, currency=fx.REPORT_CURRENCY):
+    """Value, cost and gain of the performance rows summed in one
+    currency, each portfolio converted at today's rate of its currency"""
+    fields = ['current_value', 'cost_basis', 'gain_loss']
+    totals = dict.fromkeys(fields, Decimal(0))
+    with _rates_needed():
+        performance = fx.RATES.convert(performance, fields, currency)
+    for row in performance:
+        for name in fields:
+            totals[name] += Decimal(str(row[name] or 0))
+    totals = {name: round(value, 2) for name, value in totals.items()}
+    totals['currency'] = currency
+    return totals
+
+
+def portfolio_returns(user_id, start=None, end=None):
+    """Time- and money-weighted returns of the user's portfolios and their
+    assets from start to end (this year to date by default).
+
+    Returns {'start', 'end', 'rows'}: a row per portfolio (asset_symbol
+    None) followed by rows for its assets, in the portfolio's currency.
+    """
+    if returns is None:
+        raise InvalidRequest("Install NumPy to compute returns")
+    end = min(parse_date(end, 'end date') if end else date.today(), date.today())
+    start = parse_date(start, 'start date') if start else date(end.year, 1, 1)
+    if start > end:
+        raise InvalidRequest("The start date is after the end date")
+
+    portfolios = portfolio_choices(user_id)
+    with _rates_needed():
+        results, symbols, currencies = returns.portfolio_returns(
+            [p['portfolio_id'] for p in portfolios], start, end)
+    rows = []
+    for p in portfolios:
+        result = results.get(p['portfolio_id'], {})
+        assets = sorted((symbols.get(asset_id, str(asset_id)), asset_id)
+                        for asset_id in result if asset_id)
+        for symbol, asset_id in [(None, 0)] + assets:
+            if asset_id in result:
+                rows.append(dict(result[asset_id], portfolio_id=p['portfolio_id'],
+                                 portfolio_name=p['portfolio_name'], asset_symbol=symbol,
+                                 currency=currencies.get(p['portfolio_id'])))
+    return {'start': start, 'end': end, 'rows': rows}
+
+
+# Tax lots
+
+def _lot_method(method):
+    method = (method or 'fifo').lower()
+    if method not in lots.METHODS:
+        raise InvalidRequest(f"Relief method must be one of {', '.join(lots.METHODS)}")
+    return method
+
+
+def _update_lots(user_id, method):
+    # Applies only the trades since the last call: usually nothing
+    lots.update((p['portfolio_id'] for p in portfolio_choices(user_id)), method)
+
+
+def tax_lots(user_id, method='fifo'):
+    """The user's open tax lots valued at current prices"""
+    method = _lot_method(method)
+    _update_lots(user_id, method)
+    return lots.open_lots(user_id, method)
+
+
+def realized_gains(user_id, year=None, method='fifo'):
+    """Realized gains and dividend income of a tax year (this one by default)"""
+    method = _lot_method(method)
+    _update_lots(user_id, method)
+    return lots.realized_report(user_id, year or date.today().year, method)
+
+
+def select_lots(user_id, sell_transaction_id, selections):
+    """Choose the lots a sale relieves under specific-lot relief.
+
+    selections: [(lot_id, quantity)], buys of the sale's asset in its
+    portfolio, together no more than the sale's quantity.
+    """
+    rows = DatabaseConnection.run_query(queries.SELL_TRANSACTION,
+                                        (sell_transaction_id, user_id))
+    if not rows:
+        raise NotFound(f"No sale {sell_transaction_id}")
+    sale = rows[0]
+
+    chosen = {}
+    for lot_id, quantity in selections:
+        try:
+            lot_id, quantity = int(lot_id), Decimal(str(quantity))
+        except (TypeError, ValueError, InvalidOperation):
+            raise InvalidRequest(f"Invalid lot selection: {lot_id!r}, {quantity!r}") from None
+        if quantity <= 0:
+            raise InvalidRequest("Selected quantities must be positive")
+        chosen[lot_id] = chosen.get(lot_id, 0) + quantity
+    if sum(chosen.values()) > sale['quantity']:
+        raise InvalidRequest(f"More than the {sale['quantity']} units sold are selected")
+    if chosen:
+        buys = {row['transaction_id'] for row in DatabaseConnection.run_query(
+            *queries.lot_buys(sale['portfolio_id'], sale['asset_id'], list(chosen)))}
+        missing = sorted(set(chosen) - buys)
+        if missing:
+            raise InvalidRequest(f"Not buys of the sold asset: {', '.join(map(str, missing))}")
+    lots.select_lots(sell_transaction_id, sale['portfolio_id'], list(chosen.items()))
+
+
+# Input parsing shared by the GUI and the API
+
+def parse_date(text, field='date'):
+    if isinstance(text, date):
+        return text
+    try:
+        return date.fromisoformat(str(text).strip())
+    except ValueError:
+        raise InvalidRequest(f"Invalid {field}: {text} (use YYYY-MM-DD)") from None
@@ -0,0 +1,307 @@
+"""
+Value at Risk for the Portfolio Management System
+
+Estimates how much a user's portfolios could lose over the next days
+from their current holdings and the daily closes of the held assets
+(Asset_Price_History), two ways:
+
+    Monte Carlo     PATHS draws of the assets' log returns over each
+                    horizon from a normal distribution with their
+                    historical covariance (and no drift), each asset
+                    revalued at exp(return)
+    historical      the assets' actual returns over every past window
+                    of the horizon's length, applied to today's holdings
+
+VaR at a confidence level is the loss exceeded in only (1 - confidence)
+of the outcomes, CVaR the average loss in those outcomes. Both are
+computed per portfolio, in its currency, and for all of them together
+in fx.REPORT_CURRENCY, for every horizon in HORIZONS (days) and level
+in CONFIDENCE. Exchange rates are held at today's: only price risk is
+measured.
+
+Paths are generated in blocks with NumPy, each block one matrix product
+of standard normals with a factor of the covariance matrix, and valued
+for every portfolio at once. Large simulations spread the blocks over a
+pool of worker processes: the factor, the exposures and the simulated
+profit and loss live in shared memory, so a task only carries names,
+shapes and a block's bounds. Time one with random data:
+
+    python simulation.py --assets 500 --paths 1000000
+"""
+
+import argparse
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import columnar
+import fx
+import queries
+from analytics import MIN_OBSERVATIONS, PRICE_TYPES, price_matrix
+from database import DatabaseConnection
+from instrumentation import timings
+
+# Days ahead, and confidence levels, VaR is reported for
+HORIZONS = (1, 10)
+CONFIDENCE = (0.95, 0.99)
+
+# Monte Carlo paths per report; a fixed seed keeps reports stable
+PATHS = 200_000
+SEED = 0
+
+# Price history the covariance and the historical windows come from
+HISTORY = timedelta(days=730)
+
+# Simulated returns per block (paths x assets); bounds a block's memory
+BLOCK_VALUES = 1 << 22
+
+# Simulations smaller than this (paths x assets) are not worth a process pool
+PARALLEL_WORK = 50_000_000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _portfolio_currency(row):
+    return row['portfolio_currency']
+
+
+def load(user_id, since=None):
+    """Holdings and daily log returns of what a user's active portfolios hold"""
+    since = since or date.today() - HISTORY
+    run = DatabaseConnection.run_report
+    rows = run(queries.USER_HOLDINGS, (user_id,))
+    local = fx.RATES.convert(rows, ['market_value'], _portfolio_currency)
+    reported = fx.RATES.convert(rows, ['market_value'], fx.REPORT_CURRENCY)
+
+    asset_ids = sorted({row['asset_id'] for row in rows})
+    prices = (columnar.fetch(*queries.price_history(asset_ids, since), types=PRICE_TYPES,
+                             report=True)
+              if asset_ids else columnar.empty(PRICE_TYPES))
+    assets, _, closes = price_matrix(prices['asset_id'], prices['price_date'],
+                                     prices['close_price'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(closes), axis=0)
+    measured = (~np.isnan(returns)).sum(axis=0) >= MIN_OBSERVATIONS
+    assets, returns = assets[measured], np.nan_to_num(returns[:, measured])
+
+    # Exposure of each portfolio, and of all of them, to each measured asset
+    portfolio_ids = sorted({row['portfolio_id'] for row in rows})
+    column = {pid: i for i, pid in enumerate(portfolio_ids)}
+    exposure = np.zeros((len(assets), len(portfolio_ids) + 1))
+    value = np.zeros(len(portfolio_ids) + 1)
+    currencies = {}
+    for row, total in zip(local, reported):
+        k = column[row['portfolio_id']]
+        currencies[row['portfolio_id']] = row['portfolio_currency']
+        amount, total_amount = float(row['market_value']), float(total['market_value'])
+        value[k] += amount
+        value[-1] += total_amount
+        i = np.searchsorted(assets, row['asset_id'])
+        if i < len(assets) and assets[i] == row['asset_id']:
+            exposure[i, k] += amount
+            exposure[i, -1] += total_amount
+    return {'portfolio_ids': portfolio_ids, 'currencies': currencies, 'value': value,
+            'exposure': exposure, 'returns': returns}
+
+
+def covariance_factor(returns):
+    """F with F @ F.T the covariance of the columns of returns.
+
+    From the eigendecomposition rather than Cholesky, so a covariance
+    that is only semi-definite (more assets than days) still factors;
+    F has a column per positive eigenvalue, and a path needs as many
+    random draws.
+    """
+    cov = np.atleast_2d(np.cov(returns, rowvar=False))
+    eigenvalues, vectors = np.linalg.eigh(cov)
+    keep = eigenvalues > max(eigenvalues.max(), 0.0) * 1e-12
+    return vectors[:, keep] * np.sqrt(eigenvalues[keep])
+
+
+def _simulate(factor, exposure, horizons, seed, out):
+    """Fill out (horizons x paths x portfolios) with simulated profit and loss"""
+    rng = np.random.default_rng(seed)
+    draws = rng.standard_normal((out.shape[1], factor.shape[1]), dtype=np.float32)
+    moves = draws @ factor.T
+    for i, horizon in enumerate(horizons):
+        out[i] = np.expm1(moves * np.float32(np.sqrt(horizon))) @ exposure
+
+
+def _simulate_shared(arrays, horizons, seed, start, stop):
+    """_simulate() of paths start to stop, in a worker process"""
+    memories = [shared_memory.SharedMemory(name=name) for name, _, _ in arrays]
+    factor, exposure, out = (np.ndarray(shape, dtype, buffer=memory.buf)
+                             for memory, (_, shape, dtype) in zip(memories, arrays))
+    _simulate(factor, exposure, horizons, seed, out[:, start:stop])
+    # The views must go before the memory is closed
+    del factor, exposure, out
+    for memory in memories:
+        memory.close()
+
+
+def _executor(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned: a forked child would inherit the parent's connections
+            _pool = ProcessPoolExecutor(workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def _shared(array):
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=memory.buf)[...] = array
+    return memory
+
+
+def monte_carlo(factor, exposure, horizons=HORIZONS, paths=PATHS, seed=SEED, workers=None):
+    """Simulated profit and loss, horizons x paths x the columns of exposure"""
+    factor = np.ascontiguousarray(factor, dtype=np.float32)
+    exposure = np.ascontiguousarray(exposure, dtype=np.float32)
+    assets = factor.shape[0]
+    size = max(BLOCK_VALUES // max(assets, 1), 1024)
+    blocks = [(start, min(start + size, paths)) for start in range(0, paths, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+    shape = (len(horizons), paths, exposure.shape[1])
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or paths * assets < PARALLEL_WORK:
+        out = np.empty(shape)
+        for (start, stop), block_seed in zip(blocks, seeds):
+            _simulate(factor, exposure, horizons, block_seed, out[:, start:stop])
+        return out
+
+    memories = [_shared(factor), _shared(exposure),
+                shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)]
+    try:
+        arrays = [(memories[0].name, factor.shape, factor.dtype),
+                  (memories[1].name, exposure.shape, exposure.dtype),
+                  (memories[2].name, shape, np.float64)]
+        pool = _executor(workers)
+        tasks = [pool.submit(_simulate_shared, arrays, horizons, block_seed, start, stop)
+                 for (start, stop), block_seed in zip(blocks, seeds)]
+        for task in tasks:
+            task.result()
+        return np.ndarray(shape, np.float64, buffer=memories[2].buf).copy()
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def historical(returns, exposure, horizons=HORIZONS):
+    """Profit and loss of exposure over every past window of each horizon;
+    a list of windows x columns arrays, None where history is too short"""
+    cumulative = np.vstack([np.zeros((1, returns.shape[1])), np.cumsum(returns, axis=0)])
+    outcomes = []
+    for horizon in horizons:
+        windows = cumulative[horizon:] - cumulative[:-horizon]
+        outcomes.append(np.expm1(windows) @ exposure
+                        if len(windows) >= MIN_OBSERVATIONS else None)
+    return outcomes
+
+
+def tail_risk(pnl, confidence):
+    """(VaR, CVaR) of each column of pnl as positive losses"""
+    losses = -pnl
+    var = np.quantile(losses, confidence, axis=0)
+    tail = losses >= var
+    cvar = (losses * tail).sum(axis=0) / np.maximum(tail.sum(axis=0), 1)
+    return var, cvar
+
+
+def _levels(outcomes, horizons, confidence, columns):
+    """{'horizon', 'confidence', 'var', 'cvar'} rows per column"""
+    levels = [[] for _ in range(columns)]
+    for horizon, pnl in zip(horizons, outcomes):
+        if pnl is None:
+            continue
+        for level in confidence:
+            var, cvar = tail_risk(pnl, level)
+            for k in range(columns):
+                levels[k].append({'horizon': horizon, 'confidence': level,
+                                  'var': round(float(var[k]), 2),
+                                  'cvar': round(float(cvar[k]), 2)})
+    return levels
+
+
+def value_at_risk(data, horizons=HORIZONS, confidence=CONFIDENCE, paths=PATHS, seed=SEED,
+                  workers=None):
+    """VaR and CVaR of load() data per portfolio and in total.
+
+    Returns {'portfolios': {portfolio_id: risk}, 'total': risk, 'paths',
+    'observations'}, each risk {'currency', 'value', 'measured' (the
+    share of the value with a price history), 'monte_carlo',
+    'historical'}, or None without enough history.
+    """
+    returns, exposure = data['returns'], data['exposure']
+    if not exposure.shape[0] or len(returns) < MIN_OBSERVATIONS:
+        return None
+    columns = exposure.shape[1]
+    with timings.measure('simulation', 'monte_carlo'):
+        simulated = monte_carlo(covariance_factor(returns), exposure, horizons, paths, seed,
+                                workers)
+        simulated = _levels(simulated, horizons, confidence, columns)
+    with timings.measure('simulation', 'historical'):
+        actual = _levels(historical(returns, exposure, horizons), horizons, confidence,
+                         columns)
+
+    risks = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measured = np.where(data['value'] > 0, exposure.sum(axis=0) / data['value'], 0.0)
+    for k, pid in enumerate(data['portfolio_ids'] + [None]):
+        risks.append({'currency': data['currencies'].get(pid, fx.REPORT_CURRENCY),
+                      'value': round(float(data['value'][k]), 2),
+                      'measured': round(float(measured[k]), 4),
+                      'monte_carlo': simulated[k], 'historical': actual[k]})
+    return {'portfolios': dict(zip(data['portfolio_ids'], risks)), 'total': risks[-1],
+            'paths': paths, 'observations': len(returns)}
+
+
+def portfolio_var(user_id, **options):
+    """Load and simulate a user's portfolios; called on a worker thread"""
+    with timings.measure('simulation', 'load'):
+        data = load(user_id)
+    return value_at_risk(data, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time a Monte Carlo VaR of a random portfolio")
+    parser.add_argument('--assets', type=int, default=500)
+    parser.add_argument('--days', type=int, default=500, help="Days of random returns")
+    parser.add_argument('--paths', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(SEED)
+    loadings = rng.normal(0, 0.01, (args.assets, 3))
+    returns = (rng.standard_normal((args.days, 3)) @ loadings.T
+               + rng.normal(0, 0.01, (args.days, args.assets)))
+    exposure = rng.uniform(1_000, 10_000, (args.assets, 1))
+
+    started = time.perf_counter()
+    factor = covariance_factor(returns)
+    pnl = monte_carlo(factor, exposure, HORIZONS, args.paths, SEED, args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"{args.paths:,} paths x {args.assets} assets x {len(HORIZONS)} horizons "
+          f"in {elapsed:.2f}s; portfolio value {exposure.sum():,.0f}")
+    for horizon, outcome in zip(HORIZONS, pnl):
+        for level in CONFIDENCE:
+            var, cvar = tail_risk(outcome, level)
+            print(f"  {horizon:>2} days {level:.0%}: VaR {var[0]:,.0f}  CVaR {cvar[0]:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
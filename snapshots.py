@@ -0,0 +1,171 @@
+"""
+Position and P&L snapshots for the Portfolio Management System
+
+Keeps one Performance_Metrics row per portfolio and day holding the
+portfolio's market value, cost basis and number of holdings
+(migrations/004_performance_snapshots.sql), in the portfolio's currency:
+market values are converted at the day's exchange rate and costs at the
+rate of their purchase date (fx.py). Each row also records the return of
+the benchmark asset (BENCHMARK) since the portfolio's previous snapshot,
+which analytics.py measures beta against. Snapshots are refreshed only
+for the portfolios a change affects:
+
+    on_price_change(asset_ids)      after asset prices are updated
+    on_rate_change(currencies)      after exchange rates are loaded
+    refresh(portfolio_ids)          after an import (importer.py)
+
+Reports and v_user_portfolios then read the latest snapshot per
+portfolio instead of aggregating every holding. Transactions recorded
+by sp_add_transaction reach no code here: service.dashboard() finds the
+snapshots older than their portfolio's newest transaction or holding
+change, or than today, and refreshes them before the tabs read them.
+Run this module to rebuild today's snapshot of every active portfolio,
+e.g. after the migration or from a nightly job:
+
+    python snapshots.py
+"""
+
+import os
+from bisect import bisect_right
+from datetime import date, timedelta
+from decimal import Decimal
+
+import fx
+import queries
+from database import DatabaseConnection
+
+# Portfolios refreshed per round of queries
+SNAPSHOT_BATCH = 500
+
+# Symbol of the asset the portfolios are compared with
+BENCHMARK = os.environ.get('PORTFOLIO_BENCHMARK', 'SPY')
+
+# How far back the benchmark's last close before a snapshot is looked for
+BENCHMARK_LOOKBACK = timedelta(days=7)
+
+# Percentages are stored as DECIMAL(8, 4)
+_MAX_PERCENT = Decimal('9999.9999')
+
+
+def _percent(gain, base):
+    if not base or base <= 0:
+        return None
+    value = round(gain / base * 100, 4)
+    return value if abs(value) <= _MAX_PERCENT else None
+
+
+def refresh(portfolio_ids, day=None):
+    """Recompute the snapshot of portfolio_ids for day (today); returns how many"""
+    portfolio_ids = sorted(set(portfolio_ids))
+    day = day or date.today()
+    for start in range(0, len(portfolio_ids), SNAPSHOT_BATCH):
+        _refresh_batch(portfolio_ids[start:start + SNAPSHOT_BATCH], day)
+    return len(portfolio_ids)
+
+
+def _portfolio_currency(row):
+    return row['portfolio_currency']
+
+
+def _benchmark_prices(since, day):
+    """(dates, closes) of BENCHMARK from since to day, and its current price"""
+    run = DatabaseConnection.run_query
+    rows = run(queries.BENCHMARK_HISTORY, (BENCHMARK, since, day))
+    current = run(queries.BENCHMARK_PRICE, (BENCHMARK,))
+    return ([row['price_date'] for row in rows], [row['close_price'] for row in rows],
+            current[0]['current_price'] if current else None)
+
+
+def _benchmark_return(prices, start):
+    """Percentage change of BENCHMARK from its last close on or before start
+    to its current price, the price the snapshot values holdings at"""
+    dates, closes, current = prices
+    i = bisect_right(dates, start) - 1
+    if i < 0 or current is None or closes[i] is None:
+        return None
+    return _percent(current - closes[i], closes[i])
+
+
+def _refresh_batch(portfolio_ids, day):
+    run = DatabaseConnection.run_query
+
+    # Positions come per asset currency and purchase date; each distinct
+    # (currency, date) is converted with one rate lookup
+    rows = run(*queries.snapshot_positions(portfolio_ids))
+    rows = fx.RATES.convert(rows, ['market_value'], _portfolio_currency, day)
+    rows = fx.RATES.convert(rows, ['cost_basis'], _portfolio_currency,
+                            lambda row: min(row['purchase_date'], day))
+    positions = {}
+    for row in rows:
+        total = positions.setdefault(row['portfolio_id'], {
+            'market_value': Decimal(0), 'cost_basis': Decimal(0), 'holdings_count': 0})
+        for name in total:
+            total[name] += row[name]
+    previous = {row['portfolio_id']: row
+                for row in run(*queries.previous_snapshots(portfolio_ids, day))}
+
+    # Money added since each portfolio's previous snapshot is not a gain
+    flows = {}
+    benchmark = None
+    if previous:
+        first = min(row['metric_date'] for row in previous.values())
+        benchmark = _benchmark_prices(first - BENCHMARK_LOOKBACK, day)
+        since = first + timedelta(days=1)
+        rows = run(*queries.daily_flows(portfolio_ids, since))
+        for row in fx.RATES.convert(rows, ['net_flow'], _portfolio_currency,
+                                    lambda row: row['flow_date']):
+            prev = previous.get(row['portfolio_id'])
+            if prev is not None and prev['metric_date'] < row['flow_date'] <= day:
+                flows[row['portfolio_id']] = flows.get(row['portfolio_id'], 0) + row['net_flow']
+
+    snapshots = []
+    for portfolio_id in portfolio_ids:
+        position = positions.get(portfolio_id)
+        market_value = round(position['market_value'], 2) if position else Decimal(0)
+        cost_basis = round(position['cost_basis'], 2) if position else Decimal(0)
+        holdings_count = position['holdings_count'] if position else 0
+
+        daily_return = benchmark_return = None
+        prev = previous.get(portfolio_id)
+        if prev is not None:
+            prev_value = prev['total_value']
+            gain = market_value - prev_value - flows.get(portfolio_id, 0)
+            daily_return = _percent(gain, prev_value)
+            # Over the same period as daily_return
+            benchmark_return = _benchmark_return(benchmark, prev['metric_date'])
+
+        snapshots.append((portfolio_id, day, market_value, market_value, cost_basis,
+                          holdings_count, daily_return,
+                          _percent(market_value - cost_basis, cost_basis), benchmark_return))
+
+    DatabaseConnection.run_many(queries.UPSERT_SNAPSHOT, snapshots)
+
+
+def on_price_change(asset_ids):
+    """Refresh every portfolio holding one of asset_ids"""
+    asset_ids = sorted(set(asset_ids))
+    if not asset_ids:
+        return 0
+    rows = DatabaseConnection.run_query(*queries.portfolios_holding(asset_ids))
+    return refresh(row['portfolio_id'] for row in rows)
+
+
+def on_rate_change(currencies):
+    """Refresh every portfolio converting to or from one of currencies"""
+    currencies = sorted(set(currencies))
+    if not currencies:
+        return 0
+    rows = DatabaseConnection.run_query(*queries.foreign_holders(currencies))
+    return refresh(row['portfolio_id'] for row in rows)
+
+
+def rebuild_all(day=None):
+    rows = DatabaseConnection.run_query(queries.ALL_ACTIVE_PORTFOLIOS)
+    return refresh((row['portfolio_id'] for row in rows), day)
+
+
+if __name__ == "__main__":
+    try:
+        print(f"Snapshotted {rebuild_all()} portfolios")
+    finally:
+        DatabaseConnection.close_pool()
@@ -0,0 +1,27 @@
+"""Fixtures: each test gets an empty SQLite database with the full schema"""
+
+import pytest
+
+import database
+from database import DatabaseConnection
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """An empty database with one user, portfolio 1 and assets 1 (AAPL) and
+    2 (GOOGL); returns DatabaseConnection.run_query"""
+    monkeypatch.setitem(database.STORAGE_CONFIG, 'analytics', '')
+    DatabaseConnection.configure(f"sqlite:{tmp_path / 'test.db'}")
+    run = DatabaseConnection.run_query
+    run("""INSERT INTO Users (user_id, first_name, last_name, email)
+           VALUES (1, 'Test', 'User', 'test@example.com')""", fetch=False)
+    run("""INSERT INTO Portfolios (portfolio_id, user_id, portfolio_name, portfolio_type)
+           VALUES (1, 1, 'Core', 'moderate')""", fetch=False)
+    run("""INSERT INTO Asset_Categories (category_id, category_name, risk_level)
+           VALUES (1, 'Equities', 'medium')""", fetch=False)
+    for asset_id, symbol, price in ((1, 'AAPL', 150), (2, 'GOOGL', 140)):
+        run("""INSERT INTO Assets (asset_id, category_id, asset_symbol, asset_name,
+               asset_type, current_price) VALUES (%s, 1, %s, %s, 'stock', %s)""",
+            (asset_id, symbol, symbol, price), fetch=False)
+    yield run
+    DatabaseConnection.close_pool()
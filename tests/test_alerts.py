@@ -0,0 +1,16 @@
+import alerts
+
+
+def test_alert_is_described_in_the_asset_currency(db):
+    db("UPDATE Assets SET currency = 'EUR' WHERE asset_id = 1", fetch=False)
+    db("UPDATE Assets SET currency = 'CHF' WHERE asset_id = 2", fetch=False)
+    db("""INSERT INTO Watchlist (user_id, asset_id, target_price)
+          VALUES (1, 1, 160), (1, 2, 130)""", fetch=False)
+    engine = alerts.AlertEngine()
+    assert engine.load(1) == 2
+
+    fired = engine.check_prices({1: 161.5, 2: 129})
+
+    assert sorted(alerts.describe(alert) for alert in fired) == [
+        "AAPL rose to €161.50 (target €160.00)",
+        "GOOGL fell to 129.00 CHF (target 130.00 CHF)"]
@@ -0,0 +1,90 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from analytics import MIN_OBSERVATIONS, analyze, portfolio_risk, risk_metrics
+
+
+def test_short_series_is_not_annualized():
+    metrics = risk_metrics(np.array([0.02, 0.015]))
+    assert metrics['observations'] == 2
+    assert metrics['annual_return'] is None
+    assert metrics['volatility'] is None
+    assert metrics['sharpe'] is None
+    assert metrics['sortino'] is None
+
+
+def test_series_of_minimum_length_is_measured():
+    returns = np.resize([0.01, -0.005, 0.002, -0.001], MIN_OBSERVATIONS)
+    metrics = risk_metrics(returns)
+    assert metrics['observations'] == MIN_OBSERVATIONS
+    assert metrics['volatility'] > 0
+    assert metrics['sharpe'] is not None
+
+
+def _data(snapshots, price_days):
+    """Portfolio 1 holding asset 7 only, with snapshots on the first days;
+    the benchmark moves half as much as asset 7"""
+    days = np.arange(738000, 738000 + price_days)
+    moves = np.resize([0.01, -0.008, 0.004, 0.002, -0.003], price_days)
+    closes = 100 * np.cumprod(1 + moves)
+    return {
+        'performance': {
+            'portfolio_id': np.ones(snapshots, dtype=np.int64),
+            'day': days[:snapshots],
+            'value': np.linspace(1000, 1100, snapshots),
+            'benchmark': np.full(snapshots, np.nan)
+        },
+        'flows': {'portfolio_id': np.empty(0, np.int64), 'day': np.empty(0, np.int64),
+                  'amount': np.empty(0)},
+        'holdings': {'portfolio_id': np.array([1]), 'asset_id': np.array([7]),
+                     'symbol': {7: 'ABC'}, 'value': np.array([1100.0])},
+        'prices': {'asset_id': np.full(price_days, 7), 'day': days, 'close': closes},
+        'benchmark': {'day': days, 'close': 100 * np.cumprod(1 + moves / 2)}
+    }
+
+
+def test_short_history_falls_back_to_holdings():
+    metrics = analyze(_data(3, 300))['portfolios'][1]
+    assert metrics['source'] == 'holdings'
+    assert metrics['observations'] == 299
+
+
+def test_long_history_is_used():
+    metrics = analyze(_data(MIN_OBSERVATIONS + 1, 300))['portfolios'][1]
+    assert metrics['source'] == 'history'
+    assert metrics['observations'] == MIN_OBSERVATIONS
+
+
+def test_short_history_without_prices_reports_nothing():
+    metrics = analyze(_data(3, 0))['portfolios'][1]
+    assert metrics['source'] == 'history'
+    assert metrics['annual_return'] is None
+
+
+def test_holdings_beta_is_measured_against_benchmark_prices():
+    metrics = analyze(_data(3, 300))['portfolios'][1]
+    assert metrics['source'] == 'holdings'
+    assert abs(metrics['beta'] - 2.0) < 1e-9
+
+
+def test_beta_needs_benchmark_prices():
+    data = _data(3, 300)
+    data['benchmark'] = {'day': np.empty(0, np.int64), 'close': np.empty(0)}
+    assert analyze(data)['portfolios'][1]['beta'] is None
+
+
+def test_history_beta_is_measured_against_recorded_benchmark(db):
+    moves = np.resize([0.01, -0.008, 0.004, 0.002, -0.003], 30)
+    values = 1000 * np.cumprod(1 + moves)
+    start = date.today() - timedelta(days=len(values))
+    for i, value in enumerate(values):
+        db("""INSERT INTO Performance_Metrics (portfolio_id, metric_date, total_value,
+              benchmark_return) VALUES (1, %s, %s, %s)""",
+           (start + timedelta(days=i), round(float(value), 2),
+            round(float(moves[i]) * 50, 4) if i else None), fetch=False)
+
+    metrics = portfolio_risk(1)['portfolios'][1]
+
+    assert metrics['source'] == 'history'
+    assert abs(metrics['beta'] - 2.0) < 0.01
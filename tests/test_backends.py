@@ -0,0 +1,130 @@
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from mysql.connector import errors
+
+import queries
+from backends import SQLITE_SCHEMA_VERSION, translate
+from database import DatabaseConnection
+
+
+def test_translate_placeholders_keep_string_literals():
+    query, _ = translate("SELECT '%s', x %% 2 FROM T WHERE a = %s")
+    assert query == "SELECT '%s', x % 2 FROM T WHERE a = ?"
+
+
+def test_translate_upsert_and_insert_ignore():
+    query, _ = translate("INSERT INTO T (a, b) VALUES (%s, %s) "
+                         "ON DUPLICATE KEY UPDATE b = VALUES(b)")
+    assert query == "INSERT INTO T (a, b) VALUES (?, ?) ON CONFLICT DO UPDATE SET b = excluded.b"
+    query, _ = translate("INSERT IGNORE INTO T VALUES (%s)")
+    assert query == "INSERT OR IGNORE INTO T VALUES (?)"
+
+
+def test_translate_like_escape_and_for_update():
+    assert translate("SELECT 1 FROM T WHERE a LIKE %s")[0] == \
+        "SELECT 1 FROM T WHERE a LIKE ? ESCAPE '\\'"
+    assert translate("SELECT 1 FROM T WHERE a = %s FOR UPDATE")[0] == \
+        "SELECT 1 FROM T WHERE a = ?"
+
+
+def test_translate_fulltext_search_parameter():
+    query, convert = translate("SELECT * FROM Assets WHERE asset_id > %s AND "
+                               "MATCH(asset_name) AGAINST (%s IN BOOLEAN MODE)")
+    assert "Assets_fts MATCH ?" in query
+    assert convert((0, '+app* +inc')) == [0, '"app"* AND "inc"']
+
+
+def test_asset_search_by_symbol_prefix_and_name(db):
+    db("UPDATE Assets SET asset_name = 'Alphabet Inc' WHERE asset_id = 2", fetch=False)
+    query, params = queries.asset_search('alpha', 10)
+    assert [row['asset_symbol'] for row in db(query, params)] == ['GOOGL']
+    query, params = queries.asset_search('AA', 10)
+    assert [row['asset_symbol'] for row in db(query, params)] == ['AAPL']
+
+
+def test_like_pattern_escapes_with_a_backslash(db):
+    query = "SELECT asset_symbol FROM Assets WHERE asset_symbol LIKE %s"
+    assert db(query, ('A\\_%',)) == []
+    assert db(query, ('AA%',)) == [{'asset_symbol': 'AAPL'}]
+
+
+def test_values_come_back_as_mysql_types(db):
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit, transaction_date, notes)
+          VALUES (1, 1, 'buy', 10, 150.25, '2024-06-03 10:30:00', '2024-06-03')""",
+       fetch=False)
+    row = db("""SELECT transaction_date, DATE(transaction_date) AS day, quantity,
+                price_per_unit, notes, MAX(notes) AS last_note FROM Transactions""")[0]
+    assert row['transaction_date'] == datetime(2024, 6, 3, 10, 30)
+    assert row['day'] == date(2024, 6, 3)
+    assert row['price_per_unit'] == Decimal('150.25')
+    # SQLite stores a whole DECIMAL as an integer
+    assert type(row['quantity']) is Decimal
+    # Free text that looks like a date is still text
+    assert row['notes'] == '2024-06-03' and type(row['notes']) is str
+    assert type(row['last_note']) is date
+
+
+def test_date_column_holding_a_time_reads_as_a_date(db):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 1, 100, '2024-01-15 09:00:00')""", fetch=False)
+    assert db("SELECT purchase_date FROM Portfolio_Holdings")[0]['purchase_date'] == \
+        date(2024, 1, 15)
+
+
+def test_sqlite_errors_are_mysql_errors(db):
+    with pytest.raises(errors.IntegrityError):
+        db("INSERT INTO Users (user_id, first_name, last_name, email) "
+           "VALUES (2, 'A', 'B', 'test@example.com')", fetch=False)
+
+
+def downgrade(path):
+    """Make the file as an old release left it: migrations 001-005, no
+    user_version, a portfolio without a currency"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    for kind, name in conn.execute("SELECT type, name FROM sqlite_master "
+                                   "WHERE type IN ('view', 'trigger')").fetchall():
+        conn.execute(f"DROP {kind} {name}")
+    for table in ('Tax_Lot_Selections', 'Realized_Gains', 'Tax_Lots', 'Tax_Lot_Checkpoints',
+                  'Performance_Returns', 'FX_Rates', 'Rebalance_Trades'):
+        conn.execute(f"DROP TABLE {table}")
+    for index in ('idx_user_status', 'idx_portfolios_user_updated',
+                  'idx_holdings_portfolio_updated', 'idx_metrics_portfolio_updated',
+                  'idx_watchlist_user_updated'):
+        conn.execute(f"DROP INDEX {index}")
+    conn.execute("CREATE INDEX idx_user_id ON Portfolios (user_id)")
+    for table in ('Portfolios', 'Portfolio_Holdings', 'Performance_Metrics', 'Watchlist'):
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN last_updated")
+    conn.execute("ALTER TABLE Assets DROP COLUMN currency")
+    conn.execute("ALTER TABLE Portfolios DROP COLUMN currency")
+    conn.execute("ALTER TABLE Portfolios ADD COLUMN currency VARCHAR(3)")
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+
+
+def test_old_file_is_upgraded_keeping_its_rows(db, tmp_path):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15')""", fetch=False)
+    DatabaseConnection.close_pool()
+    path = tmp_path / 'test.db'
+    downgrade(str(path))
+
+    DatabaseConnection.configure(f"sqlite:{path}")
+
+    assert db("PRAGMA user_version")[0]['user_version'] == SQLITE_SCHEMA_VERSION
+    row = db("SELECT * FROM Portfolios")[0]
+    assert (row['portfolio_name'], row['currency']) == ('Core', 'USD')
+    assert isinstance(row['last_updated'], datetime)
+    assert db("SELECT quantity, current_value FROM Portfolio_Holdings")[0] == \
+        {'quantity': 10, 'current_value': 1000}
+    assert db("SELECT currency FROM v_user_portfolios")[0]['currency'] == 'USD'
+    assert db("SELECT COUNT(*) AS n FROM FX_Rates")[0]['n'] == 0
+    indexes = {row['name'] for row in db("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_user_status' in indexes and 'idx_user_id' not in indexes
+    # The triggers keeping the name index are back
+    db("UPDATE Assets SET asset_name = 'Apple Inc' WHERE asset_id = 1", fetch=False)
+    query, params = queries.asset_search('apple', 10)
+    assert [row['asset_symbol'] for row in db(query, params)] == ['AAPL']
@@ -0,0 +1,125 @@
+import pytest
+
+import cache
+from cache import QueryCache, read_tables, written_tables
+from database import DatabaseConnection
+
+ASSETS = "SELECT asset_id FROM Assets"
+HOLDINGS = "SELECT * FROM Portfolio_Holdings ph JOIN Assets a ON ph.asset_id = a.asset_id"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic() of the cache, moved on by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def key(query, *params):
+    return QueryCache.make_key(query, params)
+
+
+def test_written_tables():
+    assert written_tables("INSERT INTO Transactions (a) VALUES (%s)") == {'transactions'}
+    assert written_tables("  insert ignore into `Watchlist` VALUES (1)") == {'watchlist'}
+    assert written_tables("UPDATE Assets SET current_price = 1") == {'assets'}
+    assert written_tables("DELETE FROM Portfolio_Holdings WHERE 1") == {'portfolio_holdings'}
+    assert written_tables("REPLACE INTO FX_Rates VALUES (1)") == {'fx_rates'}
+    assert written_tables("TRUNCATE TABLE Alerts") == {'alerts'}
+    assert written_tables("CALL sp_add_transaction(1, 2)") == {'transactions',
+                                                               'portfolio_holdings'}
+    assert written_tables("ALTER TABLE Assets ADD x INT") is None
+
+
+def test_read_tables_expand_views():
+    assert read_tables(HOLDINGS) == {'portfolio_holdings', 'assets'}
+    assert read_tables("SELECT * FROM v_user_portfolios") == {'users', 'portfolios',
+                                                              'performance_metrics'}
+
+
+def test_entry_expires_after_ttl(clock):
+    results = QueryCache()
+    results.put(key(ASSETS), [1], ttl=60)
+    clock[0] += 59
+    assert results.get(key(ASSETS)) == (True, [1])
+    clock[0] += 2
+    assert results.get(key(ASSETS)) == (False, None)
+    assert results.stats()['expired'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    results = QueryCache(max_entries=2)
+    results.put(key(ASSETS, 1), [1], ttl=60)
+    results.put(key(ASSETS, 2), [2], ttl=60)
+    results.get(key(ASSETS, 1))
+    results.put(key(ASSETS, 3), [3], ttl=60)
+
+    assert results.get(key(ASSETS, 1)) == (True, [1])
+    assert results.get(key(ASSETS, 2)) == (False, None)
+    assert results.get(key(ASSETS, 3)) == (True, [3])
+    assert results.stats()['evictions'] == 1
+
+
+def test_memory_cap_evicts_and_refuses_oversized_results():
+    row = {'name': 'x' * 1000}
+    results = QueryCache(max_bytes=cache.estimate_size([row] * 3))
+    results.put(key(ASSETS, 1), [row], ttl=60)
+    results.put(key(ASSETS, 2), [row], ttl=60)
+    results.put(key(ASSETS, 3), [row], ttl=60)
+    results.put(key(ASSETS, 4), [row] * 2, ttl=60)
+
+    stats = results.stats()
+    assert stats['oversized'] == 1
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= results.max_bytes
+    assert results.get(key(ASSETS, 1)) == (False, None)
+
+
+def test_write_drops_entries_reading_its_table():
+    results = QueryCache()
+    results.put(key(ASSETS), [1], ttl=60)
+    results.put(key("SELECT * FROM Watchlist"), [2], ttl=60)
+
+    results.invalidate_for_write("UPDATE Assets SET current_price = 2 WHERE asset_id = 1")
+
+    assert results.get(key(ASSETS)) == (False, None)
+    assert results.get(key("SELECT * FROM Watchlist")) == (True, [2])
+
+
+def test_result_read_across_an_invalidation_is_not_stored():
+    results = QueryCache()
+    generation = results.generation()
+    results.invalidate(['Assets'])
+    results.put(key(HOLDINGS), ['before the write'], 60, generation)
+    results.put(key("SELECT * FROM Watchlist"), [2], 60, generation)
+
+    assert results.get(key(HOLDINGS)) == (False, None)
+    assert results.get(key("SELECT * FROM Watchlist")) == (True, [2])
+    assert results.stats()['superseded'] == 1
+
+
+def test_result_read_across_a_full_invalidation_is_not_stored():
+    results = QueryCache()
+    generation = results.generation()
+    results.invalidate()
+    results.put(key(ASSETS), [1], 60, generation)
+    assert results.get(key(ASSETS)) == (False, None)
+
+
+def test_run_query_does_not_cache_rows_a_write_overtook(db, monkeypatch):
+    run = DatabaseConnection._run
+
+    def write_meanwhile(query, params, fetch):
+        rows = run(query, params, fetch)
+        # Lands after the read, before its result is stored
+        with DatabaseConnection.transaction(['Assets']) as cursor:
+            cursor.execute("UPDATE Assets SET current_price = 200 WHERE asset_id = 1")
+        return rows
+
+    query = "SELECT current_price FROM Assets WHERE asset_id = 1"
+    monkeypatch.setattr(DatabaseConnection, '_run', staticmethod(write_meanwhile))
+    assert db(query, cache_ttl=60)[0]['current_price'] == 150
+    monkeypatch.setattr(DatabaseConnection, '_run', staticmethod(run))
+
+    assert db(query, cache_ttl=60)[0]['current_price'] == 200
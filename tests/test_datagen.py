@@ -0,0 +1,102 @@
+import argparse
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import bench
+import database
+import datagen
+from database import DatabaseConnection
+
+ROWS = 3000
+
+
+@pytest.fixture
+def generated(tmp_path, monkeypatch):
+    """A SQLite file filled by datagen; returns the row counts"""
+    monkeypatch.setitem(database.STORAGE_CONFIG, 'analytics', '')
+    DatabaseConnection.configure(f"sqlite:{tmp_path / 'bench.db'}")
+    yield datagen.generate(ROWS, progress=None)
+    DatabaseConnection.close_pool()
+
+
+def test_parse_size():
+    assert datagen.parse_size('250000') == 250000
+    assert datagen.parse_size('250k') == 250000
+    assert datagen.parse_size('1.5M') == 1500000
+    with pytest.raises(argparse.ArgumentTypeError):
+        datagen.parse_size('lots')
+
+
+def test_symbols_are_unique():
+    symbols = [datagen.symbol(n) for n in range(20000)]
+    assert symbols[:2] == ['AAA', 'AAB']
+    assert len(set(symbols)) == len(symbols)
+
+
+def test_plan_adds_up_to_the_size():
+    for rows in (1000, 100000, 10000000):
+        assert abs(sum(datagen.plan(rows).values()) - rows) < rows * 0.05
+
+
+def test_same_seed_same_rows():
+    def rows(seed):
+        generator = datagen.Generator(ROWS, seed, today=date(2024, 6, 3))
+        return generator.reference_data(), list(generator.chunks(users_per_chunk=3))
+
+    assert rows(7) == rows(7)
+    assert rows(7) != rows(8)
+
+
+def test_generated_data_set_is_about_the_size_asked(generated):
+    # FX_Rates is reference data, the same at any size
+    assert abs(sum(generated.values()) - generated['FX_Rates'] - ROWS) < ROWS * 0.1
+    assert generated['Transactions'] > ROWS / 2
+
+
+def test_holdings_are_the_replayed_transactions(generated):
+    run = DatabaseConnection.run_query
+    held = defaultdict(Decimal)
+    for row in run("""SELECT portfolio_id, asset_id, transaction_type, quantity
+                      FROM Transactions ORDER BY transaction_date, transaction_id"""):
+        key = (row['portfolio_id'], row['asset_id'])
+        if row['transaction_type'] == 'buy':
+            held[key] += row['quantity']
+        elif row['transaction_type'] == 'sell':
+            held[key] -= row['quantity']
+    holdings = {(row['portfolio_id'], row['asset_id']): row['quantity']
+                for row in run("SELECT portfolio_id, asset_id, quantity FROM Portfolio_Holdings")}
+
+    assert holdings
+    # Closed positions have no row; quantities are rounded to 6 places
+    for key in set(held) | set(holdings):
+        assert abs(holdings.get(key, 0) - held[key]) < Decimal('0.0001'), key
+
+
+def test_latest_snapshot_is_the_portfolio_value(generated):
+    rows = DatabaseConnection.run_query("""
+        SELECT p.total_value, pm.total_value AS snapshot_value
+        FROM Portfolios p
+        JOIN Performance_Metrics pm ON pm.portfolio_id = p.portfolio_id
+        WHERE pm.metric_date = (SELECT MAX(metric_date) FROM Performance_Metrics
+                                WHERE portfolio_id = p.portfolio_id)""")
+    assert rows
+    assert all(row['total_value'] == row['snapshot_value'] for row in rows)
+
+
+def test_bench_times_every_path(generated, capsys):
+    result = bench.run(iterations=3, warmup=1)
+
+    assert result['meta']['backend'] == 'sqlite'
+    assert result['meta']['rows'] == generated
+    assert set(result['results']) == set(bench.Bench().paths())
+    for timing in result['results'].values():
+        assert timing['iterations'] >= 3
+        assert timing['min_ms'] <= timing['p50_ms'] <= timing['max_ms']
+        assert timing['round_trips'] >= 0
+
+    bench.report(result, baseline=result)
+    out = capsys.readouterr().out
+    assert 'dashboard' in out and '1.00' in out
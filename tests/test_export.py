@@ -0,0 +1,117 @@
+import csv
+import os
+import zipfile
+from decimal import Decimal
+from xml.etree import ElementTree
+
+import pytest
+
+import export
+
+NS = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+@pytest.fixture
+def history(db):
+    """Five transactions of portfolio 1, the last with a note"""
+    for day in range(1, 6):
+        db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+              price_per_unit, transaction_date, notes) VALUES (1, 1, 'buy', %s, 150.5, %s, %s)""",
+           (day, f'2024-06-0{day} 10:00:00', 'last\x01 <one>' if day == 5 else None),
+           fetch=False)
+    return db
+
+
+def sheet_rows(workbook, n):
+    root = ElementTree.fromstring(workbook.read(f'xl/worksheets/sheet{n}.xml'))
+    return root.findall('.//x:row', NS)
+
+
+def test_csv_export(history, tmp_path):
+    path = str(tmp_path / 'history.csv')
+    result = export.export_report('transactions', 1, path)
+
+    assert (result['total'], result['written'], result['cancelled']) == (5, 5, False)
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['Quantity'] for row in rows] == ['1', '2', '3', '4', '5']
+    assert rows[0]['Date'] == '2024-06-01 10:00:00'
+    assert (rows[1]['Total'], rows[0]['Notes'], rows[4]['Notes']) == ('301', '', 'last\x01 <one>')
+    assert not os.path.exists(path + '.part')
+
+
+def test_xlsx_starts_a_new_sheet_when_one_is_full(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'SHEET_ROWS', 2)
+    path = str(tmp_path / 'history.xlsx')
+
+    export.export_report('transactions', 1, path)
+
+    with zipfile.ZipFile(path) as workbook:
+        names = [sheet.get('name') for sheet in ElementTree.fromstring(
+            workbook.read('xl/workbook.xml')).findall('.//x:sheet', NS)]
+        assert names == ['Transactions', 'Transactions 2', 'Transactions 3']
+        # A header row on every sheet, then at most SHEET_ROWS rows
+        assert [len(sheet_rows(workbook, n)) - 1 for n in (1, 2, 3)] == [2, 2, 1]
+        header = sheet_rows(workbook, 2)[0]
+        assert header.find('.//x:t', NS).text == 'Transaction ID'
+        assert b'sheet3.xml' in workbook.read('[Content_Types].xml')
+
+
+def test_xlsx_cells(history, tmp_path):
+    path = str(tmp_path / 'history.xlsx')
+    export.export_report('transactions', 1, path)
+
+    with zipfile.ZipFile(path) as workbook:
+        columns = [field for field, _, _ in export.REPORTS['transactions'][1]]
+        rows = sheet_rows(workbook, 1)[1:]
+        # Control characters are not allowed in XML, even escaped
+        note = rows[4].findall('x:c', NS)[columns.index('notes')]
+        assert note.find('.//x:t', NS).text == 'last <one>'
+        # 2024-06-01 10:00 in days since 1899-12-30, styled as a date and time
+        moment = rows[0].findall('x:c', NS)[columns.index('transaction_date')]
+        assert moment.get('s') == '2'
+        assert float(moment.find('x:v', NS).text) == pytest.approx(45444 + 10 / 24)
+
+
+def test_cancelled_export_leaves_no_file(history, tmp_path):
+    path = str(tmp_path / 'history.xlsx')
+    progress = []
+
+    result = export.export_report('transactions', 1, path, chunk=2,
+                                  progress=lambda fraction, _: progress.append(fraction),
+                                  cancelled=lambda: True)
+
+    assert result['cancelled'] and result['written'] == 2
+    assert progress == [0.4]
+    assert not any(name.startswith('history') for name in os.listdir(tmp_path))
+
+
+def test_failed_export_removes_the_partial_file(history, tmp_path):
+    path = str(tmp_path / 'history.csv')
+
+    def fail(fraction, result):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        export.export_report('transactions', 1, path, chunk=2, progress=fail)
+    assert not any(name.startswith('history') for name in os.listdir(tmp_path))
+
+
+def test_unknown_report_or_format(db, tmp_path):
+    with pytest.raises(export.ExportError):
+        export.export_report('secrets', 1, str(tmp_path / 'x.csv'))
+    with pytest.raises(export.ExportError):
+        export.export_report('holdings', 1, str(tmp_path / 'x.pdf'))
+    assert export.format_for('x.PQ') == 'parquet'
+
+
+def test_parquet_decimals_keep_their_scale(history, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'history.parquet')
+
+    export.export_report('transactions', 1, path)
+
+    table = parquet.read_table(path)
+    assert table.num_rows == 5
+    assert str(table.schema.field('price_per_unit').type) == 'decimal128(12, 4)'
+    assert Decimal('150.5000') in table.column('price_per_unit').to_pylist()
@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+import importer
+import queries
+from database import DatabaseConnection
+
+
+def holdings(run):
+    return [(row['asset_id'], row['quantity']) for row in run(
+        "SELECT asset_id, quantity FROM Portfolio_Holdings ORDER BY asset_id")]
+
+
+def write(tmp_path, lines):
+    path = tmp_path / 'import.csv'
+    path.write_text("Date,Symbol,Type,Quantity,Price\n" + "\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_holding_without_transactions_survives_import(db, tmp_path):
+    # As the sample data enters holdings: no transactions behind them
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 2, 75, 120, '2024-01-15')""", fetch=False)
+
+    result = importer.import_file(write(tmp_path, ["2024-06-03,AAPL,buy,10,180"]), 1, 1)
+
+    assert result['imported'] == 1
+    assert holdings(db) == [(1, Decimal(10)), (2, Decimal(75))]
+
+
+def test_import_applies_to_existing_position(db, tmp_path):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 20, 100, '2024-01-15')""", fetch=False)
+
+    importer.import_file(write(tmp_path, ["2024-06-03,AAPL,buy,20,200",
+                                          "2024-06-04,AAPL,sell,10,210"]), 1, 1)
+
+    row = db("SELECT quantity, purchase_price, purchase_date FROM Portfolio_Holdings")
+    assert len(row) == 1
+    assert row[0]['quantity'] == 30
+    assert row[0]['purchase_price'] == 150
+    assert str(row[0]['purchase_date']) == '2024-01-15'
+
+
+def test_import_selling_everything_closes_position(db, tmp_path):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 5, 100, '2024-01-15')""", fetch=False)
+
+    importer.import_file(write(tmp_path, ["2024-06-03,AAPL,sell,5,180"]), 1, 1)
+
+    assert holdings(db) == []
+
+
+def add_transaction(asset_id, quantity, price):
+    """What sp_add_transaction does for a buy of a held asset"""
+    with DatabaseConnection.transaction() as cursor:
+        cursor.execute("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type,
+                          quantity, price_per_unit) VALUES (1, %s, 'buy', %s, %s)""",
+                       (asset_id, quantity, price))
+        cursor.execute("""UPDATE Portfolio_Holdings SET quantity = quantity + %s
+                          WHERE portfolio_id = 1 AND asset_id = %s""", (quantity, asset_id))
+
+
+def test_transaction_added_during_import_is_not_applied_twice(db, tmp_path):
+    for asset_id in (1, 2):
+        db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+              purchase_date) VALUES (1, %s, 10, 100, '2024-01-15')""", (asset_id,), fetch=False)
+    added = []
+
+    def progress(fraction, result):
+        # Between the import's batches, as another user's trade would land
+        if not added:
+            add_transaction(1, 5, 100)
+            add_transaction(2, 7, 100)
+            added.append(True)
+
+    result = importer.import_file(write(tmp_path, ["2024-06-03,AAPL,buy,10,100",
+                                                   "2024-06-04,AAPL,buy,10,100"]),
+                                  1, 1, batch_size=1, progress=progress)
+
+    assert result['imported'] == 2
+    assert holdings(db) == [(1, Decimal(35)), (2, Decimal(17))]
+
+
+def test_insert_many_returns_the_new_ids(db):
+    rows = [(1, 1, 'buy', 1, 100, '2024-06-03', 0, None)] * 3
+    first, last = DatabaseConnection.insert_many(queries.INSERT_TRANSACTION, rows)
+    ids = [row['transaction_id'] for row in db(
+        "SELECT transaction_id FROM Transactions ORDER BY transaction_id")]
+    assert (first, last) == (ids[0], ids[-1])
+    assert last - first == 2
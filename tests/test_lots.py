@@ -0,0 +1,115 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import lots
+from lots import LotBook, long_term
+
+
+def trade(transaction_id, kind, quantity, price, day, asset_id=1, fees=0):
+    return {'portfolio_id': 1, 'asset_id': asset_id, 'transaction_id': transaction_id,
+            'transaction_type': kind, 'quantity': Decimal(quantity),
+            'price_per_unit': Decimal(price), 'fees': Decimal(fees),
+            'transaction_date': datetime.fromisoformat(day)}
+
+
+# Three buys at 10, 30 and 20, then a sale of 15 units
+BUYS = [trade(1, 'buy', 10, 10, '2023-01-02'), trade(2, 'buy', 10, 30, '2023-02-01'),
+        trade(3, 'buy', 10, 20, '2023-03-01')]
+SALE = trade(4, 'sell', 15, 40, '2023-06-01')
+
+
+def relieved(method, selections=None):
+    """(lot_id, quantity) of each realized gain of SALE"""
+    book = LotBook(method, selections)
+    for row in BUYS + [SALE]:
+        book.apply(row)
+    return [(gain[3], gain[7]) for gain in book.realized]
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('fifo', [(1, 10), (2, 5)]),
+    ('lifo', [(3, 10), (2, 5)]),
+    ('hifo', [(2, 10), (3, 5)]),
+])
+def test_relief_order(method, expected):
+    assert relieved(method) == expected
+
+
+def test_specific_lots_then_oldest_first():
+    assert relieved('specific', {4: [(3, Decimal(8))]}) == [(3, 8), (1, 7)]
+
+
+def test_gains_split_proceeds_and_fees():
+    book = LotBook('fifo')
+    for row in [trade(1, 'buy', 10, 10, '2023-01-02', fees=5),
+                trade(2, 'sell', 4, 20, '2023-06-01', fees=2)]:
+        book.apply(row)
+    (gain,) = book.realized
+    # Proceeds 80 - 2; cost 4 units at (100 + 5) / 10
+    assert gain[8:11] == (Decimal('78.00'), Decimal('42.00'), Decimal('36.00'))
+
+
+def test_sale_beyond_open_lots_is_unmatched():
+    book = LotBook('fifo')
+    for row in [trade(1, 'buy', 5, 10, '2023-01-02'), trade(2, 'sell', 8, 20, '2023-06-01')]:
+        book.apply(row)
+    assert book.unmatched == 1
+    assert [(gain[3], gain[7]) for gain in book.realized] == [(1, 5), (None, 3)]
+
+
+@pytest.mark.parametrize('acquired, sold, expected', [
+    (date(2023, 3, 1), date(2024, 3, 1), False),
+    (date(2023, 3, 1), date(2024, 3, 2), True),
+    # Bought on 29 February: a year later is 28 February
+    (date(2024, 2, 29), date(2025, 2, 28), False),
+    (date(2024, 2, 29), date(2025, 3, 1), True),
+    (datetime(2024, 2, 29, 15, 30), datetime(2025, 3, 1, 9, 0), True),
+])
+def test_long_term_boundary(acquired, sold, expected):
+    assert long_term(acquired, sold) is expected
+
+
+# Incremental updates against a full rebuild
+
+def _insert(db, kind, quantity, price, day, asset_id=1):
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit, transaction_date) VALUES (1, %s, %s, %s, %s, %s)""",
+       (asset_id, kind, quantity, price, day), fetch=False)
+
+
+def _state(db, method):
+    lot_rows = db("""SELECT lot_id, asset_id, acquired_date, quantity, unit_cost
+                     FROM Tax_Lots WHERE method = %s ORDER BY lot_id""", (method,))
+    gains = db("""SELECT sell_transaction_id, lot_id, asset_id, acquired_date, sold_date,
+                  quantity, proceeds, cost_basis, gain, long_term
+                  FROM Realized_Gains WHERE method = %s
+                  ORDER BY sell_transaction_id, lot_id""", (method,))
+    return lot_rows, gains
+
+
+@pytest.mark.parametrize('method', lots.METHODS)
+def test_incremental_update_matches_rebuild(db, method):
+    _insert(db, 'buy', 10, 10, '2023-01-02 10:00:00')
+    _insert(db, 'buy', 10, 30, '2023-02-01 10:00:00')
+    _insert(db, 'sell', 5, 25, '2023-04-01 10:00:00')
+    assert lots.update([1], method)['replayed'] == 1
+
+    # Later trades are applied to the saved lots
+    _insert(db, 'buy', 10, 20, '2023-05-01 10:00:00', asset_id=2)
+    _insert(db, 'sell', 8, 40, '2023-06-01 10:00:00')
+    summary = lots.update([1], method)
+    assert (summary['replayed'], summary['transactions']) == (0, 2)
+    incremental = _state(db, method)
+    lots.update([1], method, rebuild=True)
+    assert _state(db, method) == incremental
+
+    # A back-dated buy changes which lots the earlier sales relieved
+    _insert(db, 'buy', 10, 5, '2022-12-01 10:00:00')
+    assert lots.update([1], method)['replayed'] == 1
+    incremental = _state(db, method)
+
+    lots.update([1], method, rebuild=True)
+    assert _state(db, method) == incremental
+    assert incremental[1]
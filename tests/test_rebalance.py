@@ -0,0 +1,111 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import queries
+import rebalance
+import service
+from database import DatabaseConnection
+
+
+def holding(db, asset_id, quantity, asset_type='stock', price=None, portfolio_id=1):
+    """A holding of asset_id, made first (category 1) if it is new"""
+    if price is not None:
+        db("""INSERT INTO Assets (asset_id, category_id, asset_symbol, asset_name, asset_type,
+              current_price) VALUES (%s, 1, %s, %s, %s, %s)""",
+           (asset_id, f"A{asset_id}", f"Asset {asset_id}", asset_type, price), fetch=False)
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (%s, %s, %s, 100, '2024-01-15')""",
+       (portfolio_id, asset_id, quantity), fetch=False)
+
+
+def planned(db, first=1, last=1):
+    result = rebalance.plan(db(*queries.rebalance_positions(first, last)))
+    return result, rebalance.trades(result, None)
+
+
+@pytest.fixture
+def drifted(db):
+    """Portfolio 1 (moderate) far overweight in stocks"""
+    holding(db, 1, 100)                                 # 15,000 of stock
+    holding(db, 3, 20, 'bond', 97.3)                    # 1,946
+    holding(db, 4, 50, 'mutual_fund', 12.3456)          # 617
+    return db
+
+
+def test_trades_are_whole_lots(drifted):
+    _, trades = planned(drifted)
+    sides = {asset_id: (side, quantity) for _, asset_id, side, quantity, *_ in trades}
+
+    assert sides[1][0] == 'sell' and sides[3][0] == 'buy' and sides[4][0] == 'buy'
+    assert sides[1][1] == int(sides[1][1])
+    assert sides[3][1] == int(sides[3][1])
+    # Mutual funds trade in thousandths
+    assert sides[4][1] == pytest.approx(round(sides[4][1], 3), abs=1e-9)
+    assert sides[4][1] != int(sides[4][1])
+
+
+def test_buys_spend_no_more_than_the_sales_raise(drifted):
+    _, trades = planned(drifted)
+    raised = sum(amount - fee for _, _, side, _, _, amount, fee, _ in trades if side == 'sell')
+    spent = sum(amount + fee for _, _, side, _, _, amount, fee, _ in trades if side == 'buy')
+    assert 0 < spent <= raised
+
+
+def test_amounts_and_fees_follow_the_quantities(drifted):
+    _, trades = planned(drifted)
+    for _, _, _, quantity, price, amount, fee, _ in trades:
+        assert amount == pytest.approx(quantity * price, abs=0.01)
+        assert fee == pytest.approx(rebalance.TRADE_FEE + rebalance.FEE_RATE * amount, abs=0.01)
+
+
+def test_trades_not_worth_their_fee_are_dropped(db):
+    # Drifted, but every trade would be far below the fee cutoff
+    holding(db, 1, 1)                                   # 150 of stock
+    holding(db, 3, 1, 'bond', 10)
+
+    result, trades = planned(db)
+
+    stock = result['classes'].index('stock')
+    assert result['weights'][0, stock] > 0.9
+    assert trades == []
+
+
+def test_portfolio_within_the_band_is_left_alone(db):
+    # 4:3 stock to bond, as the moderate targets spread over the two
+    holding(db, 1, 40)                                  # 6,000
+    holding(db, 3, 45, 'bond', 100)                     # 4,500
+    assert planned(db)[1] == []
+
+
+def test_class_without_a_target_is_sold_to_the_last_unit(db):
+    db("UPDATE Portfolios SET portfolio_type = 'conservative'", fetch=False)
+    holding(db, 3, 50, 'bond', 100)
+    holding(db, 5, 0.12345, 'crypto', 30000)            # Not a whole lot of 0.0001
+
+    _, trades = planned(db)
+
+    crypto = [trade for trade in trades if trade[1] == 5]
+    assert crypto and crypto[0][2] == 'sell' and crypto[0][3] == 0.12345
+
+
+def test_rebalance_all_replaces_the_saved_plan(drifted):
+    spec = str(DatabaseConnection.get_backend())
+    count = rebalance.rebalance_all(spec, workers=1)
+    assert count == len(planned(drifted)[1]) > 0
+    rebalance.rebalance_all(spec, workers=1)
+    assert drifted("SELECT COUNT(*) AS n FROM Rebalance_Trades")[0]['n'] == count
+
+
+def test_service_plan_names_the_trades(drifted):
+    plan = service.rebalance_plan(1, 1)
+
+    assert plan['currency'] == 'USD'
+    assert {row['class'] for row in plan['allocation'] if row['weight']} == \
+        {'stock', 'bond', 'mutual_fund'}
+    assert {(trade['asset_symbol'], trade['transaction_type']) for trade in plan['trades']} == \
+        {('AAPL', 'sell'), ('A3', 'buy'), ('A4', 'buy')}
+    with pytest.raises(service.InvalidRequest):
+        service.rebalance_plan(1, 1, 'sector')
+    with pytest.raises(service.NotFound):
+        service.rebalance_plan(1, 2)
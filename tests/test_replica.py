@@ -0,0 +1,130 @@
+import sqlite3
+
+import pytest
+
+import service
+from replica import Replica
+
+
+@pytest.fixture
+def replica(db, tmp_path):
+    """A replica of the db fixture's database, the 'server'"""
+    local = Replica(str(tmp_path / 'replica.db'))
+    yield local
+    local.close()
+
+
+def add_holding(db, asset_id, quantity):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, %s, %s, 100, '2024-01-15')""", (asset_id, quantity),
+       fetch=False)
+
+
+def add_transaction(db, asset_id):
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit) VALUES (1, %s, 'buy', 1, 100)""", (asset_id,), fetch=False)
+
+
+def count(local, table):
+    return local.run_query(f"SELECT COUNT(*) AS n FROM {table}")[0]['n']
+
+
+def test_first_sync_copies_the_users_data(db, replica):
+    add_holding(db, 1, 10)
+    add_transaction(db, 1)
+    db("INSERT INTO Watchlist (user_id, asset_id, target_price) VALUES (1, 2, 120)", fetch=False)
+
+    changes = replica.sync(1)
+
+    assert changes == {'Asset_Categories': 1, 'Assets': 2, 'Users': 1, 'Portfolios': 1,
+                       'Portfolio_Holdings': 1, 'Transactions': 1, 'Watchlist': 1}
+    assert replica.synced_at(1) is not None
+    assert replica.read(service.holdings, 1, 1)[0]['quantity'] == 10
+
+
+def test_unchanged_rows_are_not_pulled_again(db, replica):
+    add_holding(db, 1, 10)
+    add_transaction(db, 1)
+    replica.sync(1)
+
+    # The overlap pulls recent rows again; they match and are skipped
+    assert replica.sync(1) == {}
+
+
+def test_sync_pulls_only_what_changed(db, replica):
+    add_holding(db, 1, 10)
+    add_transaction(db, 1)
+    replica.sync(1)
+
+    db("UPDATE Assets SET current_price = 155 WHERE asset_id = 1", fetch=False)
+    add_transaction(db, 2)
+    add_holding(db, 2, 5)
+
+    assert replica.sync(1) == {'Assets': 1, 'Transactions': 1, 'Portfolio_Holdings': 1}
+    assert count(replica, 'Transactions') == 2
+    price = replica.run_query("SELECT current_price FROM Assets WHERE asset_id = 1")
+    assert price[0]['current_price'] == 155
+
+
+def test_rows_deleted_on_the_server_are_dropped(db, replica):
+    add_holding(db, 1, 10)
+    add_holding(db, 2, 5)
+    db("INSERT INTO Watchlist (user_id, asset_id) VALUES (1, 2)", fetch=False)
+    replica.sync(1)
+
+    db("DELETE FROM Portfolio_Holdings WHERE asset_id = 1", fetch=False)
+    db("DELETE FROM Watchlist", fetch=False)
+
+    assert replica.sync(1) == {'Portfolio_Holdings': 1, 'Watchlist': 1}
+    assert [row['asset_id'] for row in replica.run_query(
+        "SELECT asset_id FROM Portfolio_Holdings")] == [2]
+
+
+def test_closed_out_portfolio_goes_with_its_rows(db, replica):
+    add_holding(db, 1, 10)
+    add_transaction(db, 1)
+    replica.sync(1)
+
+    db("DELETE FROM Transactions", fetch=False)
+    db("DELETE FROM Portfolios WHERE portfolio_id = 1", fetch=False)
+
+    changes = replica.sync(1)
+    assert changes['Portfolios'] == 1
+    assert count(replica, 'Portfolio_Holdings') == 0
+    assert count(replica, 'Transactions') == 0
+
+
+def test_reads_see_the_last_sync_until_the_next(db, replica):
+    add_holding(db, 1, 10)
+    replica.sync(1)
+    db("UPDATE Portfolio_Holdings SET quantity = 20", fetch=False)
+
+    assert replica.read(service.holdings, 1, 1)[0]['quantity'] == 10
+    assert replica.refresh(1, service.holdings, 1, 1)[0]['quantity'] == 20
+
+
+def test_other_users_are_not_copied(db, replica):
+    db("""INSERT INTO Users (user_id, first_name, last_name, email)
+          VALUES (2, 'Other', 'User', 'other@example.com')""", fetch=False)
+    db("""INSERT INTO Portfolios (portfolio_id, user_id, portfolio_name, portfolio_type)
+          VALUES (2, 2, 'Theirs', 'moderate')""", fetch=False)
+
+    replica.sync(1)
+
+    assert [row['user_id'] for row in replica.run_query("SELECT user_id FROM Users")] == [1]
+    assert count(replica, 'Portfolios') == 1
+
+
+def test_replica_of_an_older_schema_starts_over(db, tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Leftover (x)")
+    conn.execute("PRAGMA user_version = 5")
+    conn.close()
+
+    local = Replica(path)
+    try:
+        assert local.run_query("SELECT name FROM sqlite_master WHERE name = 'Leftover'") == []
+        assert local.sync(1)['Users'] == 1
+    finally:
+        local.close()
@@ -0,0 +1,62 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from returns import time_weighted, xirr
+
+
+def test_xirr_one_year():
+    days = [date(2024, 1, 1).toordinal(), date(2025, 1, 1).toordinal()]
+    # 366 days at 365 a year: slightly under 10%
+    assert xirr(days, [-100, 110]) == pytest.approx(1.1 ** (365 / 366) - 1, abs=1e-9)
+    assert xirr(days, [-100, 110]) == pytest.approx(0.0997, abs=1e-4)
+
+
+def test_xirr_with_intermediate_flows():
+    start = date(2023, 1, 1).toordinal()
+    days = [start, start + 182, start + 365]
+    rate = xirr(days, [-1000, -500, 1700])
+    years = (np.array(days) - start) / 365
+    npv = np.sum(np.array([-1000, -500, 1700]) * (1 + rate) ** -years)
+    assert npv == pytest.approx(0, abs=1e-6)
+    assert 0.1 < rate < 0.2
+
+
+def test_xirr_needs_flows_both_ways():
+    assert xirr([1, 2], [-100, -50]) is None
+    assert xirr([1, 2], [100, 50]) is None
+
+
+def test_xirr_total_loss_stays_above_minus_100_percent():
+    start = date(2023, 1, 1).toordinal()
+    rate = xirr([start, start + 365], [-100, 1])
+    assert rate == pytest.approx(-0.99, abs=1e-6)
+
+
+def column(*values):
+    return np.array(values, dtype=float)[:, None]
+
+
+def test_time_weighted_without_flows_is_growth():
+    twr = time_weighted(column(100, 110, 121), column(0, 0, 0), column(0, 0, 0))
+    assert twr[0] == pytest.approx(0.21)
+
+
+def test_time_weighted_ignores_money_put_in():
+    # 100 grows 10%, 50 more is bought at that close, then everything grows 10%
+    values = column(100, 160, 176)
+    inflows = column(0, 50, 0)
+    twr = time_weighted(values, inflows, column(0, 0, 0))
+    assert twr[0] == pytest.approx(1.1 * 1.1 - 1)
+
+
+def test_time_weighted_buy_into_empty_position_counts_from_the_day():
+    # Bought for 100 during day 1, worth 105 at its close
+    twr = time_weighted(column(0, 105, 110.25), column(0, 100, 0), column(0, 0, 0))
+    assert twr[0] == pytest.approx(0.1025)
+
+
+def test_time_weighted_never_held_is_nan():
+    twr = time_weighted(column(0, 0, 0), column(0, 0, 0), column(0, 0, 0))
+    assert np.isnan(twr[0])
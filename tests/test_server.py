@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+from server import APIServer
+
+
+class Client:
+    """HTTP/1.1 over one keep-alive connection to the server"""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self.token = None
+
+    async def request(self, method, path, body=None, headers=()):
+        data = b'' if body is None else json.dumps(body).encode()
+        lines = [f"{method} {path} HTTP/1.1", "Host: test", f"Content-Length: {len(data)}"]
+        if self.token:
+            lines.append(f"Authorization: Bearer {self.token}")
+        lines.extend(headers)
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+        await self.writer.drain()
+
+        head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split(' ')[1])
+        fields = dict(line.lower().split(': ', 1) for line in head[1:] if line)
+        payload = await self.reader.readexactly(int(fields['content-length']))
+        if fields['content-type'] == 'application/json':
+            payload = json.loads(payload)
+        return status, payload
+
+
+@pytest.fixture
+def api(db):
+    """run(scenario): runs async scenario(client) against a server on a free port"""
+    def run(scenario):
+        async def main():
+            server = APIServer(workers=2)
+            listener = await server.start('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            try:
+                return await scenario(Client(reader, writer))
+            finally:
+                writer.close()
+                listener.close()
+                await listener.wait_closed()
+                server.close()
+        return asyncio.run(main())
+    return run
+
+
+async def login(client):
+    status, body = await client.request('POST', '/login', {'email': 'test@example.com'})
+    assert status == 200
+    client.token = body['token']
+    return body
+
+
+def test_login_and_portfolios(db, api):
+    async def scenario(client):
+        assert (await client.request('GET', '/portfolios'))[0] == 401
+        body = await login(client)
+        assert body['user']['user_id'] == 1
+        status, rows = await client.request('GET', '/portfolios')
+        assert status == 200
+        assert [row['portfolio_name'] for row in rows] == ['Core']
+        await client.request('POST', '/logout')
+        assert (await client.request('GET', '/portfolios'))[0] == 401
+    api(scenario)
+
+
+def test_unknown_user_cannot_log_in(db, api):
+    async def scenario(client):
+        status, body = await client.request('POST', '/login', {'email': 'nobody@example.com'})
+        assert status == 401
+        assert (await client.request('POST', '/login', {}))[0] == 400
+    api(scenario)
+
+
+def test_service_errors_map_to_statuses(db, api):
+    async def scenario(client):
+        await login(client)
+        status, body = await client.request('POST', '/portfolios', {'portfolio_name': ''})
+        assert (status, body) == (400, {'error': "Portfolio name is required"})
+        assert (await client.request('GET', '/portfolios/99/holdings'))[0] == 404
+        assert (await client.request('GET', '/transactions?transaction_type=gift'))[0] == 400
+        assert (await client.request('GET', '/nowhere'))[0] == 404
+        assert (await client.request('DELETE', '/portfolios'))[0] == 405
+    api(scenario)
+
+
+def test_registering_a_taken_email_conflicts(db, api):
+    async def scenario(client):
+        user = {'first_name': 'New', 'last_name': 'User', 'email': 'new@example.com'}
+        assert (await client.request('POST', '/users', user))[0] == 201
+        assert (await client.request('POST', '/users', user))[0] == 409
+    api(scenario)
+
+
+def test_transactions_page_and_next_cursor(db, api):
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit, transaction_date) VALUES (1, 1, 'buy', 2, 100, '2024-06-03 10:00:00')""",
+       fetch=False)
+
+    async def scenario(client):
+        await login(client)
+        status, body = await client.request('GET', '/transactions?portfolio_id=1')
+        assert status == 200
+        # Decimals travel as strings
+        assert [(row['asset_symbol'], row['quantity']) for row in body['rows']] == \
+            [('AAPL', '2')]
+        assert body['rows'][0]['transaction_date'] == '2024-06-03T10:00:00'
+        assert body['next'] is None
+        assert (await client.request('GET', '/transactions?after_date=soon'))[0] == 400
+    api(scenario)
+
+
+def test_metrics_are_plain_text(db, api):
+    async def scenario(client):
+        status, body = await client.request('GET', '/metrics')
+        assert status == 200 and isinstance(body, bytes)
+        status, body = await client.request('GET', '/health')
+        assert status == 200 and body['status'] == 'ok'
+    api(scenario)
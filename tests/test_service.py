@@ -0,0 +1,100 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import service
+
+
+def add_transaction(db, transaction_id, asset_id, when, kind='buy'):
+    db("""INSERT INTO Transactions (transaction_id, portfolio_id, asset_id, transaction_type,
+          quantity, price_per_unit, transaction_date) VALUES (%s, 1, %s, %s, 1, 100, %s)""",
+       (transaction_id, asset_id, kind, when), fetch=False)
+
+
+def add_user(db, user_id, email):
+    db("""INSERT INTO Users (user_id, first_name, last_name, email)
+          VALUES (%s, 'Other', 'User', %s)""", (user_id, email), fetch=False)
+
+
+def test_login_finds_active_users_only(db):
+    assert service.login(' test@example.com ')['user_id'] == 1
+    assert service.login('nobody@example.com') is None
+    db("UPDATE Users SET status = 'suspended' WHERE user_id = 1", fetch=False)
+    assert service.login('test@example.com') is None
+
+
+def test_register_validates_input(db):
+    with pytest.raises(service.InvalidRequest):
+        service.register('New', '', 'new@example.com')
+    with pytest.raises(service.InvalidRequest):
+        service.register('New', 'User', 'new@example.com', date_of_birth='01/02/1990')
+    service.register('New', 'User', 'new@example.com', date_of_birth='1990-02-01')
+    assert service.login('new@example.com')['first_name'] == 'New'
+
+
+def test_create_portfolio_shows_on_the_dashboard(db):
+    with pytest.raises(service.InvalidRequest):
+        service.create_portfolio(1, '  ')
+    with pytest.raises(service.InvalidRequest):
+        service.create_portfolio(1, 'Growth', 'reckless')
+    with pytest.raises(service.InvalidRequest):
+        service.create_portfolio(1, 'Growth', 'aggressive', 'lots')
+
+    service.create_portfolio(1, 'Growth', 'aggressive', '1000')
+
+    names = sorted(p['portfolio_name'] for p in service.portfolio_choices(1))
+    assert names == ['Core', 'Growth']
+
+
+def test_holdings_of_another_users_portfolio_are_not_found(db):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15')""", fetch=False)
+    add_user(db, 2, 'other@example.com')
+
+    rows = service.holdings(1, 1)
+    assert [(row['asset_symbol'], row['quantity']) for row in rows] == [('AAPL', 10)]
+    with pytest.raises(service.NotFound):
+        service.holdings(2, 1)
+
+
+def test_transaction_page_filters_and_continues_after_a_row(db):
+    add_transaction(db, 1, 1, '2024-06-01 10:00:00')
+    add_transaction(db, 2, 2, '2024-06-02 10:00:00')
+    add_transaction(db, 3, 1, '2024-06-03 10:00:00', 'sell')
+
+    page = service.transaction_page(1)
+    assert [row['transaction_id'] for row in page['rows']] == [3, 2, 1]
+    page = service.transaction_page(1, after=(datetime(2024, 6, 3, 10), 3))
+    assert [row['transaction_id'] for row in page['rows']] == [2, 1]
+    page = service.transaction_page(1, {'portfolio_id': 1, 'asset_symbol': 'AAPL',
+                                        'transaction_type': 'buy'})
+    assert [row['transaction_id'] for row in page['rows']] == [1]
+    # Another user sees none of them
+    add_user(db, 2, 'other@example.com')
+    assert service.transaction_page(2)['rows'] == []
+
+
+def test_search_assets(db):
+    assert [row['asset_symbol'] for row in service.search_assets('goo')] == ['GOOGL']
+    assert len(service.search_assets('', limit=1)) == 1
+
+
+def test_reports_total_the_active_portfolios(db):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15')""", fetch=False)
+
+    data = service.reports(1)
+
+    assert [row['portfolio_id'] for row in data['performance']] == [1]
+    assert data['totals']['current_value'] == Decimal('1500.00')
+    assert data['totals']['cost_basis'] == Decimal('1000.00')
+    assert data['portfolio_count'] == [{'count': 1}]
+    assert data['asset_count'] == [{'count': 1}]
+
+
+def test_parse_date():
+    assert service.parse_date(' 2024-06-03 ') == date(2024, 6, 3)
+    assert service.parse_date(date(2024, 6, 3)) == date(2024, 6, 3)
+    with pytest.raises(service.InvalidRequest, match='start date'):
+        service.parse_date('June', 'start date')
@@ -0,0 +1,113 @@
+import math
+import os
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import simulation
+
+
+def add_history(db, asset_id, volatility, days=250, seed=1):
+    """Daily closes of a random walk ending yesterday"""
+    rng = np.random.default_rng(seed)
+    price = 100.0
+    for days_ago in range(days, 0, -1):
+        price *= math.exp(rng.normal(0, volatility))
+        db("""INSERT INTO Asset_Price_History (asset_id, price_date, close_price)
+              VALUES (%s, %s, %s)""",
+           (asset_id, date.today() - timedelta(days=days_ago), round(price, 4)), fetch=False)
+
+
+def shared_segments():
+    """Names of the shared memory segments (not the pool's semaphores)"""
+    if not os.path.isdir('/dev/shm'):
+        return set()
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+
+def test_tail_risk_of_known_losses():
+    pnl = -np.arange(1.0, 101.0)[:, None]       # Losses of 1 to 100
+    var, cvar = simulation.tail_risk(pnl, 0.95)
+    assert var[0] == pytest.approx(95.05)
+    assert cvar[0] == pytest.approx(98.0)       # The mean of 96 to 100
+
+
+def test_covariance_factor_reproduces_the_covariance():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0, 0.01, (100, 4))
+    factor = simulation.covariance_factor(returns)
+    assert np.allclose(factor @ factor.T, np.cov(returns, rowvar=False))
+
+
+def test_covariance_factor_with_more_assets_than_days():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0, 0.01, (10, 30))
+    factor = simulation.covariance_factor(returns)
+    # Rank at most days - 1: fewer random draws per path than assets
+    assert factor.shape == (30, 9)
+    assert np.allclose(factor @ factor.T, np.cov(returns, rowvar=False))
+
+
+def test_monte_carlo_var_matches_the_normal_quantile():
+    factor = np.array([[0.01]])                 # One asset, 1% daily volatility
+    exposure = np.array([[1000.0]])
+    pnl = simulation.monte_carlo(factor, exposure, (1, 10), paths=200_000, workers=1)
+    for horizon, outcome in zip((1, 10), pnl):
+        var, _ = simulation.tail_risk(outcome, 0.99)
+        expected = -1000 * math.expm1(-2.3263 * 0.01 * math.sqrt(horizon))
+        assert var[0] == pytest.approx(expected, rel=0.03)
+
+
+def test_shared_memory_workers_give_the_same_paths(monkeypatch):
+    rng = np.random.default_rng(0)
+    factor = simulation.covariance_factor(rng.normal(0, 0.01, (60, 8)))
+    exposure = rng.uniform(100, 1000, (8, 3))
+    monkeypatch.setattr(simulation, 'BLOCK_VALUES', 8 * 1024)   # Several blocks
+    serial = simulation.monte_carlo(factor, exposure, paths=5000, workers=1)
+
+    monkeypatch.setattr(simulation, 'PARALLEL_WORK', 0)
+    before = shared_segments()
+    parallel = simulation.monte_carlo(factor, exposure, paths=5000, workers=2)
+
+    assert np.array_equal(parallel, serial)
+    # Every segment is unlinked once the profit and loss is copied out
+    assert shared_segments() <= before
+
+
+def test_historical_windows_and_short_history():
+    returns = np.full((30, 1), 0.01)
+    one_day, ten_days = simulation.historical(returns, np.array([[100.0]]), (1, 10))
+    assert one_day.shape == (30, 1) and ten_days.shape == (21, 1)
+    assert ten_days[0, 0] == pytest.approx(100 * math.expm1(0.1))
+    assert simulation.historical(returns, np.array([[100.0]]), (15,)) == [None]
+
+
+def test_portfolio_var_of_the_users_holdings(db):
+    add_history(db, 1, 0.02, seed=1)
+    add_history(db, 2, 0.01, seed=2)
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15'), (1, 2, 10, 100, '2024-01-15')""",
+       fetch=False)
+
+    risk = simulation.portfolio_var(1, paths=20_000, workers=1)
+
+    assert risk['observations'] == 249
+    portfolio = risk['portfolios'][1]
+    assert (portfolio['currency'], portfolio['value'], portfolio['measured']) == \
+        ('USD', 2900.0, 1.0)
+    assert risk['total']['value'] == 2900.0
+    for method in ('monte_carlo', 'historical'):
+        levels = {(row['horizon'], row['confidence']): row for row in portfolio[method]}
+        assert set(levels) == {(h, c) for h in simulation.HORIZONS
+                               for c in simulation.CONFIDENCE}
+        for row in levels.values():
+            assert 0 < row['var'] <= row['cvar'] < 2900
+        assert levels[10, 0.99]['var'] > levels[1, 0.99]['var']
+
+
+def test_no_history_no_var(db):
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15')""", fetch=False)
+    assert simulation.portfolio_var(1, paths=1000, workers=1) is None
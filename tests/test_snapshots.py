@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import service
+import snapshots
+
+
+def add_benchmark(run, close, current):
+    """SPY, with a close on 3 June 2024 and a current price"""
+    run("""INSERT INTO Assets (asset_id, category_id, asset_symbol, asset_name, asset_type,
+           current_price) VALUES (3, 1, %s, 'Benchmark', 'etf', %s)""",
+        (snapshots.BENCHMARK, current), fetch=False)
+    run("""INSERT INTO Asset_Price_History (asset_id, price_date, close_price)
+           VALUES (3, '2024-06-03', %s)""", (close,), fetch=False)
+
+
+def snapshot(run, day):
+    rows = run("""SELECT total_value, daily_return, benchmark_return FROM Performance_Metrics
+                  WHERE portfolio_id = 1 AND metric_date = %s""", (day,))
+    return rows[0] if rows else None
+
+
+def test_refresh_records_benchmark_return(db):
+    add_benchmark(db, 400, 404)
+    db("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+          purchase_date) VALUES (1, 1, 10, 100, '2024-01-15')""", fetch=False)
+    db("""INSERT INTO Performance_Metrics (portfolio_id, metric_date, total_value)
+          VALUES (1, '2024-06-03', 1000)""", fetch=False)
+
+    snapshots.refresh([1], date(2024, 6, 4))
+
+    row = snapshot(db, date(2024, 6, 4))
+    assert row['total_value'] == Decimal(1500)
+    assert row['daily_return'] == Decimal(50)
+    assert row['benchmark_return'] == Decimal(1)
+
+
+def test_benchmark_return_starts_at_last_close(db):
+    # No close on the previous snapshot's day: the last one before it counts
+    add_benchmark(db, 400, 380)
+    db("""INSERT INTO Performance_Metrics (portfolio_id, metric_date, total_value)
+          VALUES (1, '2024-06-09', 1000)""", fetch=False)
+
+    snapshots.refresh([1], date(2024, 6, 10))
+
+    assert snapshot(db, date(2024, 6, 10))['benchmark_return'] == Decimal(-5)
+
+
+def test_first_snapshot_has_no_benchmark_return(db):
+    add_benchmark(db, 400, 404)
+
+    snapshots.refresh([1], date(2024, 6, 4))
+
+    assert snapshot(db, date(2024, 6, 4))['benchmark_return'] is None
+
+
+def add_snapshot(run, day, updated):
+    run("""INSERT INTO Performance_Metrics (portfolio_id, metric_date, total_value,
+           market_value, holdings_count, last_updated) VALUES (1, %s, 1000, 1000, 1, %s)""",
+        (day, updated), fetch=False)
+
+
+def add_holding(run, quantity, updated='2000-01-01 00:00:00'):
+    run("""INSERT INTO Portfolio_Holdings (portfolio_id, asset_id, quantity, purchase_price,
+           purchase_date, last_updated) VALUES (1, 1, %s, 100, '2024-01-15', %s)""",
+        (quantity, updated), fetch=False)
+
+
+def test_dashboard_snapshots_portfolio_without_one(db):
+    add_holding(db, 10)
+
+    row = service.dashboard(1)[0]
+
+    assert row['metric_date'] == date.today()
+    assert row['current_value'] == Decimal(1500)
+    assert not row['snapshot_stale']
+
+
+def test_dashboard_refreshes_snapshot_older_than_a_transaction(db):
+    add_holding(db, 10)
+    add_snapshot(db, date.today(), '2000-01-01 00:00:00')
+    # As sp_add_transaction records a buy: the holding changes with it
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit) VALUES (1, 1, 'buy', 10, 150)""", fetch=False)
+    db("UPDATE Portfolio_Holdings SET quantity = 20 WHERE portfolio_id = 1", fetch=False)
+
+    row = service.dashboard(1)[0]
+
+    assert row['current_value'] == Decimal(3000)
+    assert row['total_holdings'] == 1
+
+
+def test_dashboard_refreshes_snapshot_from_an_earlier_day(db):
+    add_holding(db, 10)
+    add_snapshot(db, date.today() - timedelta(days=1), '2000-01-01 00:00:00')
+
+    row = service.dashboard(1)[0]
+
+    assert row['metric_date'] == date.today()
+    assert row['current_value'] == Decimal(1500)
+
+
+def test_dashboard_keeps_fresh_snapshot(db):
+    add_holding(db, 10)
+    add_snapshot(db, date.today(), '2999-01-01 00:00:00')
+
+    row = service.dashboard(1)[0]
+
+    assert row['current_value'] == Decimal(1000)
+    assert str(db("SELECT last_updated FROM Performance_Metrics")[0]['last_updated']) \
+        == '2999-01-01 00:00:00'
+
+
+def test_price_change_refreshes_holders(db):
+    add_holding(db, 10)
+    snapshots.refresh([1])
+    db("UPDATE Assets SET current_price = 200 WHERE asset_id = 1", fetch=False)
+
+    assert snapshots.on_price_change([1, 2]) == 1
+    assert snapshot(db, date.today())['total_value'] == Decimal(2000)
+
+
+def test_dashboard_refreshes_snapshot_older_than_a_dividend(db):
+    # No holding changes: only the transaction shows the snapshot is stale
+    add_holding(db, 10)
+    add_snapshot(db, date.today(), '2000-01-01 00:00:00')
+    db("""INSERT INTO Transactions (portfolio_id, asset_id, transaction_type, quantity,
+          price_per_unit) VALUES (1, 1, 'dividend', 1, 5)""", fetch=False)
+
+    service.dashboard(1)
+
+    updated = db("SELECT last_updated FROM Performance_Metrics")[0]['last_updated']
+    assert updated.year > 2000
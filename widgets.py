@@ -0,0 +1,230 @@
+"""
+Reusable widgets for the Portfolio Management System
+"""
+
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from instrumentation import call_site, metrics
+
+# Fixed row height lets the table work out how many rows fit on screen
+ROW_HEIGHT = 22
+
+
+class VirtualTable(ttk.Frame):
+    """Treeview that only materializes the rows currently on screen.
+
+    The full result set stays in a plain list of records. The Treeview
+    holds just enough items to fill the visible window, and records are
+    formatted into display values only when they scroll into view.
+    Scrolling reuses those items in place, and set_rows() on refresh
+    only rewrites items whose values actually changed.
+    """
+
+    def __init__(self, parent, columns, formatter, widths=None, key=None,
+                 height=15, on_scroll_end=None, scroll_end_margin=20):
+        super().__init__(parent)
+        self.columns = columns
+        self.formatter = formatter
+        self.key = key
+        self.on_scroll_end = on_scroll_end
+        self.scroll_end_margin = scroll_end_margin
+
+        self.rows = []
+        self.offset = 0
+        self.visible = height
+        self.selected_index = None
+        self._slots = []        # Treeview item ids, top to bottom
+        self._shown = []        # Values currently displayed in each slot
+        self._message = False   # Showing a single status row instead of data
+
+        style = ttk.Style(self)
+        style.configure('Virtual.Treeview', rowheight=ROW_HEIGHT)
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height,
+                                 selectmode='browse', style='Virtual.Treeview')
+        for i, col in enumerate(columns):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=widths[i] if widths else 100)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self._scroll_by(-3))
+        self.tree.bind('<Button-5>', lambda e: self._scroll_by(3))
+        self.tree.bind('<Up>', lambda e: self._move_selection(-1))
+        self.tree.bind('<Down>', lambda e: self._move_selection(1))
+        self.tree.bind('<Prior>', lambda e: self._scroll_by(-self.visible))
+        self.tree.bind('<Next>', lambda e: self._scroll_by(self.visible))
+        self.tree.bind('<Home>', lambda e: self._scroll_to(0))
+        self.tree.bind('<End>', lambda e: self._scroll_to(len(self.rows)))
+        self.tree.bind('<<TreeviewSelect>>', self._on_select)
+
+    # Data
+
+    def set_rows(self, rows):
+        """Replace the data, keeping the top visible record in place if it survives"""
+        top_key = None
+        if self.key is not None and self.rows and self.offset < len(self.rows):
+            top_key = self.key(self.rows[self.offset])
+        selected_key = None
+        if self.key is not None and self.selected_index is not None \
+                and self.selected_index < len(self.rows):
+            selected_key = self.key(self.rows[self.selected_index])
+
+        self.rows = list(rows)
+        self.offset = 0
+        self.selected_index = None
+        if top_key is not None or selected_key is not None:
+            for i, row in enumerate(self.rows):
+                k = self.key(row)
+                if k == top_key:
+                    self.offset = i
+                if k == selected_key:
+                    self.selected_index = i
+
+        self._render()
+
+    def append_rows(self, rows):
+        """Add rows at the end, e.g. the next page of a paginated query"""
+        self.rows.extend(rows)
+        self._render()
+
+    def clear(self):
+        self.rows = []
+        self.offset = 0
+        self.selected_index = None
+        self._reset_slots()
+        self._update_scrollbar()
+
+    def show_message(self, text):
+        """Replace the contents with a single status row such as 'Loading...'"""
+        self.clear()
+        self.tree.insert('', tk.END, values=(text,))
+        self._message = True
+
+    def selected_row(self):
+        if self.selected_index is None or self.selected_index >= len(self.rows):
+            return None
+        return self.rows[self.selected_index]
+
+    # Rendering
+
+    def _reset_slots(self):
+        self.tree.delete(*self.tree.get_children())
+        self._slots = []
+        self._shown = []
+        self._message = False
+
+    def _render(self):
+        started = time.perf_counter()
+        if self._message:
+            self._reset_slots()
+
+        total = len(self.rows)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        window = self.rows[self.offset:self.offset + self.visible]
+
+        # Grow or shrink the pool of Treeview items to the window size
+        while len(self._slots) < len(window):
+            self._slots.append(self.tree.insert('', tk.END, values=()))
+            self._shown.append(None)
+        if len(self._slots) > len(window):
+            self.tree.delete(*self._slots[len(window):])
+            del self._slots[len(window):]
+            del self._shown[len(window):]
+
+        # Only rewrite the items whose values changed
+        for i, row in enumerate(window):
+            values = tuple(self.formatter(row))
+            if values != self._shown[i]:
+                self.tree.item(self._slots[i], values=values)
+                self._shown[i] = values
+
+        selected = None
+        if self.selected_index is not None:
+            slot = self.selected_index - self.offset
+            if 0 <= slot < len(self._slots):
+                selected = self._slots[slot]
+        current = self.tree.selection()
+        if selected is None and current:
+            self.tree.selection_remove(*current)
+        elif selected is not None and current != (selected,):
+            self.tree.selection_set(selected)
+
+        self.tree.yview_moveto(0)
+        self._update_scrollbar()
+        # Attributed to the call site whose result is being shown
+        metrics.observe('render_seconds', time.perf_counter() - started)
+
+        if self.on_scroll_end is not None and total \
+                and self.offset + self.visible >= total - self.scroll_end_margin:
+            self.on_scroll_end()
+
+    def _update_scrollbar(self):
+        total = len(self.rows)
+        if total <= self.visible:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.visible) / total)
+
+    # Scrolling
+
+    def _scroll_to(self, offset):
+        if self._message or not self.rows:
+            return 'break'
+        new_offset = max(0, min(offset, len(self.rows) - self.visible))
+        if new_offset != self.offset:
+            self.offset = new_offset
+            with call_site('table_scroll'):
+                self._render()
+        elif self.on_scroll_end is not None and offset >= len(self.rows) - self.visible:
+            # Already at the bottom: the user wants more rows
+            self.on_scroll_end()
+        return 'break'
+
+    def _scroll_by(self, delta):
+        return self._scroll_to(self.offset + delta)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(int(float(amount) * len(self.rows)))
+        elif action == 'scroll':
+            step = self.visible if unit == 'pages' else 1
+            self._scroll_by(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        return self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_resize(self, event):
+        # One row's worth of height goes to the column headings
+        visible = max(1, event.height // ROW_HEIGHT - 1)
+        if visible != self.visible:
+            self.visible = visible
+            if not self._message:
+                self._render()
+
+    def _move_selection(self, delta):
+        if self._message or not self.rows:
+            return 'break'
+        index = self.offset if self.selected_index is None else self.selected_index + delta
+        index = max(0, min(index, len(self.rows) - 1))
+        self.selected_index = index
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.visible:
+            self.offset = index - self.visible + 1
+        self._render()
+        return 'break'
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if selection and selection[0] in self._slots:
+            self.selected_index = self.offset + self._slots.index(selection[0])